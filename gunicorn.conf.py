@@ -11,5 +11,43 @@ loglevel = 'info'
 bind = '0.0.0.0:5000'
 workers = 2 # multiprocessing.cpu_count() * 2 + 1
 timeout = 30  # timeout 30 seconds
+# Each worker serves requests from a pool of threads, so the progress streams of running cases (see progress.py) do
+# not hold a whole worker
+worker_class = "gthread"
+threads = 8
 keepalive = 60 * 60  # keep connections alive for 1 hour
 capture_output = True
+
+# Load the app and the BASHer reference data in the master process, forked workers share them copy-on-write so the
+# first request to each worker (including workers restarted by gunicorn) does not pay for loading them
+preload_app = True
+
+
+def when_ready(server):
+    import warmup
+
+    warmup.warm_up_reference_data()
+
+
+def post_worker_init(worker):
+    # The logging queue's listener thread is not copied when the worker is forked, so is started in each worker
+    import logging_setup
+
+    logging_setup.configure_logging()
+
+    # As is the janitor thread, see janitor.py
+    import janitor
+
+    janitor.start_janitor(
+        worker.wsgi.config["UPLOAD_FOLDER"], worker.wsgi.extensions["basher_store"]
+    )
+
+    # Kaleido's renderer is a subprocess so must be started in each worker
+    import warmup
+
+    warmup.warm_up_kaleido()
+
+    # As is the fork server which starts each case's process with the reference data loaded, see memory_limit.py
+    import memory_limit
+
+    memory_limit.start_process_server()
@@ -1,46 +1,72 @@
 from argparse import Namespace
-from datetime import datetime
+from blob_store import BlobStore
+from datetime import datetime, timedelta
+from chunked_upload import ChunkedUpload
 from excel_parser import parse_excel_input
+from exceptions import (
+    ArrayUploadError,
+    CaseBudgetError,
+    CaseParameterError,
+    ChunkChecksumError,
+    ChunkOffsetError,
+    JobNotFoundError,
+    ResultBundleError,
+)
 from flask import (
     Flask,
     render_template,
     Response,
-    send_file,
+    abort,
+    current_app,
     jsonify,
     request,
+    send_file,
     session,
     Blueprint,
 )
 from flask_wtf import FlaskForm
-from flask_session import Session
+from flask.sessions import SessionInterface
 from flask_cors import CORS, cross_origin
 from io import BytesIO
-import merge_array_files
+import array_io
+import artefact_store
+import case_api
+import config as config
+import janitor
+import job_manager
+import json
 import os
 from openpyxl import load_workbook
 from openpyxl.utils.exceptions import InvalidFileException
-import pdfkit
 import time
+import profiling
+import progress
 import random
+import report_archive
+import result_bundle
 import snp_haplotype
-import tempfile
+import warmup
 from wtforms import (
     FileField,
+    HiddenField,
     SubmitField,
     MultipleFileField,
+    SelectMultipleField,
     ValidationError,
+    widgets,
 )
-from werkzeug.utils import secure_filename
+from werkzeug.utils import safe_join, secure_filename
 import zipfile
 
 
 import logging
+import logging_setup
 
-log_format = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
 logger = logging.getLogger("BASHer_logger")
 
-# To override the default severity of logging
-logger.setLevel("DEBUG")
+# Log through a queue written by a single thread, gunicorn workers forked from a preloaded app reconfigure this in
+# post_worker_init
+logging_setup.configure_logging()
 
 
 # Create a new Flask web server instance
@@ -49,13 +75,16 @@ app = Flask(__name__)
 # Define the folder where uploaded files will be stored. The folder location is retrieved from an environment variable
 app.config["UPLOAD_FOLDER"] = os.environ["UPLOAD_FOLDER"]
 app.config["SECRET_KEY"] = "catchmeifyoucan"
-app.config["SESSION_TYPE"] = "filesystem"
 app.config[
     "SESSION_PERMANENT"
 ] = True  # Set the session lifetime. If True, the session is permanent until the browser is closed.
 app.config["SESSION_FILE_DIR"] = os.environ[
     "SESSION_FILE_DIR"
-]  # Define the directory where session files will be stored.
+]  # Define the directory where the database of sessions & API jobs will be stored.
+# Sessions only refer to the reports of the case, so they expire with the reports
+app.config["PERMANENT_SESSION_LIFETIME"] = timedelta(
+    days=report_archive.report_retention_days
+)
 app.config["UPLOAD_EXTENSIONS"] = [
     ".txt",
     ".csv",
@@ -72,7 +101,46 @@ app.config.from_object(__name__)
 
 # Create a Blueprint object named "basher" that represents the "basher" component of the application. The URL prefix "/basher" is added to all routes defined in this blueprint.
 basher_bp = Blueprint("basher", __name__, url_prefix="/basher")
-Session(app)
+# The JSON API for submitting cases & fetching their results without the web form, it does not use the session
+api_bp = Blueprint("basher_api", __name__, url_prefix="/basher/api/v1")
+# Sessions & the status of the API's jobs are saved in an SQLite database rather than a file each, see artefact_store.py
+store = artefact_store.ArtefactStore(
+    os.path.join(app.config["SESSION_FILE_DIR"], config.artefact_store_file_name)
+)
+app.extensions["basher_store"] = store
+app.session_interface = artefact_store.StoreSessionInterface(store)
+# Expired sessions, jobs, uploads & reports are removed in the background, gunicorn workers forked from a preloaded
+# app restart the janitor in post_worker_init
+janitor.start_janitor(app.config["UPLOAD_FOLDER"], store)
+# Uploaded SNP array files are stored once, and the tables parsed from them are cached, in the blob store
+array_io.parsed_array_cache_folder = BlobStore(
+    app.config["UPLOAD_FOLDER"]
+).derived_folder("parsed")
+
+
+class ApiSessionInterface(SessionInterface):
+    # Requests to the API are given a null session, so no session file or cookie is saved for them
+    def __init__(self, session_interface):
+        self.session_interface = session_interface
+
+    def open_session(self, app, request):
+        if request.path.startswith(api_bp.url_prefix):
+            return self.make_null_session(app)
+        return self.session_interface.open_session(app, request)
+
+    def save_session(self, app, session, response):
+        return self.session_interface.save_session(app, session, response)
+
+
+app.session_interface = ApiSessionInterface(app.session_interface)
+
+
+@app.before_request
+def tag_request_logs():
+    # Records are tagged with the case of the API request, other requests are tagged once their case is created
+    logging_setup.set_case_id((request.view_args or {}).get("case_id", "-"))
+
+
 CORS(
     app, supports_credentials=True
 )  # Enable handling of cross-origin requests - required to run react components
@@ -93,19 +161,42 @@ def call_excel_parser(sample_sheet, snp_array_file):
     return [basher_input_namespace, error_dictionary, input_ok_flag]
 
 
-def call_basher(basher_input_namespace):
-    (
-        mode_of_inheritance,
-        sample_id,
-        number_snps_imported,
-        summary_snps_by_region,
-        informative_snps_by_region,
-        embryo_count_data_df,
-        html_string,
-        pdf_string,
-    ) = snp_haplotype.main(basher_input_namespace)
+def run_form_case(case_id, jobs, basher_input_namespace, report_path):
+    """Run a case submitted with the web form in the background, saving its reports for download
+    The case is run in its own process with the memory ceiling of each case, see JobManager.run_case_process().
+    Args:
+        case_id (string): The case's upload folder, session["timestr"], which its progress is recorded for
+        jobs (JobManager): The job manager of this worker
+        basher_input_namespace (Namespace): The arguments of the case
+        report_path (string): The path of the reports without an extension
+    """
+    progress.report("running", "Started the analysis")
+    # The machine-readable results are always produced so that they are included in the download
+    report_formats = set(basher_input_namespace.formats) | {"json"}
+    args = case_api.CaseSpec.from_args(basher_input_namespace).to_args(
+        basher_input_namespace.input_file,
+        [
+            report_format
+            for report_format in snp_haplotype.report_formats
+            if report_format in report_formats
+        ],
+    )
+    try:
+        case_run = jobs.run_case_process(case_id, args, report_path)
+    except Exception as error:
+        logger.exception(f"Case {case_id} failed")
+        progress.report("failed", job_manager.error_message(error))
+        return
+    logger.info(
+        f"Saved the {', '.join(case_run['output_paths'])} reports for {args.output_prefix} at {report_path}"
+    )
+    progress.report("complete", "The reports are ready to download")
+
 
-    return sample_id, html_string, pdf_string
+class MultiCheckboxField(SelectMultipleField):
+    # Displays the choices as a list of checkboxes rather than a multiple select box
+    widget = widgets.ListWidget(prefix_label=False)
+    option_widget = widgets.CheckboxInput()
 
 
 class ChangeForm(FlaskForm):
@@ -119,7 +210,19 @@ class ChangeForm(FlaskForm):
         "SNP Array Files:",
         validators=[],
         id="snp_array_files",
-        render_kw={"accept": ".txt, .csv"},
+        render_kw={
+            "accept": ", ".join(
+                f".{extension}" for extension in array_io.array_file_extensions
+            )
+        },
+    )
+    # The IDs of SNP array files uploaded in chunks by the browser, which are then not sent with the form
+    uploaded_array_files = HiddenField(id="uploaded_array_files")
+    report_formats = MultiCheckboxField(
+        "Report Formats:",
+        choices=[("html", "HTML"), ("pdf", "PDF"), ("json", "JSON")],
+        default=snp_haplotype.default_report_formats,
+        id="report_formats",
     )
     submit = SubmitField("Run BASHer")
 
@@ -209,19 +312,28 @@ class ChangeForm(FlaskForm):
                 )
 
     def validate_snp_array_files(form, field):
-        allowed_extensions = ["txt", "csv"]
+        if form.uploaded_array_files.data:
+            # Uploaded in chunks, see chunked_upload.py
+            for upload_id in form.uploaded_array_files.data.split(","):
+                try:
+                    upload = ChunkedUpload(app.config["UPLOAD_FOLDER"], upload_id)
+                except ArrayUploadError as error:
+                    raise ValidationError(str(error))
+                if upload.offset != upload.size:
+                    raise ValidationError(
+                        f"The upload of SNP array file '{upload.file_name}' is incomplete."
+                    )
+            return
         files = field.data
         if not files:
             raise ValidationError("No snp array file provided.")
         for file in files:
             if not file.filename:
                 raise ValidationError("No snp array file selected.")
-            if not (
-                "." in file.filename
-                and file.filename.rsplit(".", 1)[1].lower() in allowed_extensions
-            ):
+            if not array_io.has_array_file_extension(file.filename):
                 raise ValidationError(
-                    f"Invalid file type for SNP array file '{file.filename}'. Allowed types are: txt, csv"
+                    f"Invalid file type for SNP array file '{file.filename}'. Allowed types are: "
+                    f"{', '.join(array_io.array_file_extensions)}"
                 )
 
 
@@ -256,16 +368,10 @@ def form(basher_state="initial"):
                 file_errors=chgForm.errors,
             )
 
-        # Use FileHandler() to log to a file
-
         session["timestr"] = datetime.now().strftime("%Y%m%d-%H%M%S")
         os.mkdir(os.path.join(app.config["UPLOAD_FOLDER"], session["timestr"]))
-        file_handler = logging.FileHandler(f"/var/local/basher/logs/basher_error.log")
-        formatter = logging.Formatter(log_format)
-        file_handler.setFormatter(formatter)
-
-        # Don't forget to add the file handler
-        logger.addHandler(file_handler)
+        # The records logged for the rest of the request are tagged with the case
+        logging_setup.set_case_id(session["timestr"])
 
         # Saved with the session details to avoid duplicate files from other users/sessions
         # temporary files are saved so that they can be passed to the backend.
@@ -273,8 +379,23 @@ def form(basher_state="initial"):
         input_sheet = SampleSheetUp.upload(sample_sheet)
         chgDetail["sample_sheet"] = input_sheet
 
-        snp_array_files = chgForm.snp_array_files.data
-        input_files = SnpArrayUp.upload(snp_array_files)
+        if chgForm.uploaded_array_files.data:
+            # Move the files uploaded in chunks into the folder for this case
+            uploads = [
+                ChunkedUpload(app.config["UPLOAD_FOLDER"], upload_id)
+                for upload_id in chgForm.uploaded_array_files.data.split(",")
+            ]
+            snp_array_file_names = [upload.file_name for upload in uploads]
+            input_files = [
+                upload.move_to(
+                    os.path.join(app.config["UPLOAD_FOLDER"], session["timestr"])
+                )
+                for upload in uploads
+            ]
+        else:
+            snp_array_files = chgForm.snp_array_files.data
+            snp_array_file_names = [x.filename for x in snp_array_files]
+            input_files = SnpArrayUp.upload(snp_array_files)
         # If multiple files are uploaded merge them into a single file, else just use the single file
         if len(input_files) > 1:
             # use removesuffix to remove .txt from the end of the file names in the list
@@ -290,12 +411,11 @@ def form(basher_state="initial"):
                 )
                 + "_merged.txt"
             )
-            df = merge_array_files.main(input_files)
-            df.to_csv(
+            BlobStore(app.config["UPLOAD_FOLDER"]).merge(
+                input_files,
                 os.path.join(
                     app.config["UPLOAD_FOLDER"], session["timestr"], merged_file_name
                 ),
-                sep="\t",
             )
             input_file = merged_file_name
         else:
@@ -330,36 +450,64 @@ def form(basher_state="initial"):
                 file_errors=chgForm.errors,
             )
         else:
-            sample_id, html_report, pdf_report = call_basher(basher_input_namespace)
+            # Only the requested outputs are produced, if none are selected the HTML & PDF reports are produced
+            report_formats = (
+                chgForm.report_formats.data or snp_haplotype.default_report_formats
+            )
+            basher_input_namespace.formats = report_formats
+            # The case is run in the background, the page streams its progress & shows the download once it is complete
+            jobs = get_job_manager()
+            try:
+                _, prediction = jobs.admit(
+                    basher_input_namespace, [basher_input_namespace.input_file]
+                )
+            except CaseBudgetError as error:
+                return render_template(
+                    "index.html",
+                    form=chgForm,
+                    basher_state="initial",
+                    errors=[str(error)],
+                    file_errors=chgForm.errors,
+                )
+            sample_id = case_api.CaseSpec.from_args(basher_input_namespace).sample_id
 
             session["report_name"] = f'{sample_id}_{session["timestr"]}'
             session["report_path"] = os.path.join(
                 app.config["UPLOAD_FOLDER"],
                 session["report_name"],
             )
-            with open(
-                f'{session["report_path"]}.html',
-                "w",
-            ) as f:
-                f.write(html_report)
-            logger.info(
-                f"Saved HTML report for {sample_id} at {session['report_path']}.html"
+            # The JSON results are saved with the reports even if they were not requested
+            session["report_formats"] = report_formats + (
+                ["json"] if "json" not in report_formats else []
             )
-
-            # Convert HTML report to PDF
-            pdfkit.from_string(
-                pdf_report,
-                f'{session["report_path"]}.pdf',
+            progress.store_reporter(store, session["timestr"])(
+                {
+                    "stage": "queued",
+                    "message": f"Queued, expected to take {prediction.seconds:.0f} seconds",
+                }
+            )
+            progress.claim_case(store, session["timestr"])
+            jobs.scheduler.submit(
+                prediction,
+                jobs.run_with_progress,
+                session["timestr"],
+                run_form_case,
+                jobs,
+                basher_input_namespace,
+                session["report_path"],
             )
-            logger.info(f"Saved PDF report for {sample_id}")
 
             return render_template(
                 "index.html",
                 form=chgForm,
                 basher_state=basher_state,
+                case_id=session["timestr"],
                 sample_sheet_name=sample_sheet.filename,
-                snp_array_file_names=", ".join([x.filename for x in snp_array_files]),
-                report_name=f'{session["report_name"]}.html',
+                snp_array_file_names=", ".join(snp_array_file_names),
+                report_name=", ".join(
+                    f'{session["report_name"]}.{report_format}'
+                    for report_format in session["report_formats"]
+                ),
                 file_errors=chgForm.errors,
             )
 
@@ -398,6 +546,8 @@ class SampleSheetUpload:
 
 class SnpArrayUpload:
     def upload(self, files):
+        # The files are saved once in the blob store & linked into the folder for this case
+        blob_store = BlobStore(app.config["UPLOAD_FOLDER"])
         file_names = []
 
         for file in files:
@@ -407,12 +557,13 @@ class SnpArrayUpload:
 
             else:
                 secure_file_name = secure_filename(file_name)
-                file.save(
+                blob_store.link(
+                    blob_store.add_stream(file.stream),
                     os.path.join(
                         app.config["UPLOAD_FOLDER"],
                         session["timestr"],
                         secure_file_name,
-                    )
+                    ),
                 )
                 file_names.append(
                     str(
@@ -433,41 +584,431 @@ def download():
     """
     This function handles both GET and POST requests to the "/download" route of the "basher" blueprint.
 
-    Initiated by a button click in the HTML, it creates a zip file containing the HTML and PDF reports stored in the session.
-    The function then removes the original HTML and PDF reports and sends the zip file to the client as a file download.
+    Initiated by a button click in the HTML, it streams a zip file containing the reports (HTML and/or PDF) and the JSON
+    results stored in the session to the client as a file download. The zip file is compressed as it is sent, so it is
+    never written to disk, and the reports are kept until they are purged after the retention period (see
+    report_archive.py) so they can be downloaded again without rerunning the analysis.
+
+    Returns:
+    A streamed file download response containing the zip file with the reports, 409 if the case is still running, or
+    404 if the case failed or the reports have been purged.
+    """
+    if "report_path" not in session:
+        abort(404, description="No BASHer reports have been produced in this session")
+    report_formats = session.get("report_formats", snp_haplotype.default_report_formats)
+    report_files = [
+        (
+            f'{session["report_path"]}.{report_format}',
+            f'{session["report_name"]}.{report_format}',
+        )
+        for report_format in report_formats
+    ]
+    if not all(os.path.exists(path) for path, name in report_files):
+        if progress.is_running(store, session["timestr"]):
+            abort(
+                409,
+                description=f"The BASHer reports for {session['report_name']} are still being produced",
+            )
+        abort(
+            404,
+            description=f"The BASHer reports for {session['report_name']} have been deleted after "
+            f"{report_archive.report_retention_days:g} days, please rerun the analysis",
+        )
+
+    logger.info(f"Streaming zipped reports for {session['report_name']}")
+
+    return Response(
+        report_archive.stream_zip(report_files),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{session["report_name"]}.zip"'
+        },
+        direct_passthrough=True,
+    )
+
+
+@basher_bp.route("/upload", methods=["POST"])
+@cross_origin(supports_credentials=True)
+def start_upload():
+    """
+    This function handles POST requests to the "/upload" route of the "basher" blueprint.
+
+    Starts a chunked upload of a SNP array file, which can be larger than MAX_CONTENT_LENGTH and in any of the formats
+    read by array_io.py. The request is JSON with the "file_name" and "size" in bytes of the file. The chunks are then
+    sent to "/upload/<upload_id>" (see chunked_upload.py).
+
+    Returns:
+    A JSON response with the status of the new upload, including its upload_id and the chunk_size to send, with status
+    code 201, or 400 with the error if the file is not a SNP array file.
+    """
+    details = request.get_json(force=True)
+    try:
+        upload = ChunkedUpload.start(
+            app.config["UPLOAD_FOLDER"],
+            secure_filename(str(details.get("file_name", ""))),
+            int(details.get("size", 0)),
+        )
+    except (ArrayUploadError, ValueError) as error:
+        return jsonify({"error": str(error)}), 400
+    return jsonify(upload.status()), 201
+
+
+@basher_bp.route("/upload/<upload_id>", methods=["GET", "PUT"])
+@cross_origin(supports_credentials=True)
+def upload_chunk(upload_id):
+    """
+    This function handles GET and PUT requests to the "/upload/<upload_id>" route of the "basher" blueprint.
+
+    For GET requests, it returns the status of the upload, which the browser uses to resume an interrupted upload from
+    the offset received.
+
+    For PUT requests, the body is the chunk of the file starting at the "offset" query parameter, with its hex SHA-256
+    checksum in the X-Chunk-SHA256 header. The chunk is only saved if the checksum matches and it follows the data
+    received so far.
+
+    Returns:
+    A JSON response with the status of the upload, with status code 200, 409 if the chunk does not start at the offset
+    received, 400 with the error if the checksum does not match or the file is invalid, or 404 if there is no upload.
+    """
+    try:
+        upload = ChunkedUpload(app.config["UPLOAD_FOLDER"], upload_id)
+    except ArrayUploadError as error:
+        return jsonify({"error": str(error)}), 404
+    if request.method == "PUT":
+        try:
+            upload.write_chunk(
+                request.args.get("offset", type=int),
+                request.get_data(cache=False),
+                request.headers.get("X-Chunk-SHA256", ""),
+            )
+        except ChunkOffsetError as error:
+            return jsonify({"error": str(error), "offset": error.offset}), 409
+        except ChunkChecksumError as error:
+            # The chunk was corrupted in transit, so can be resent
+            return jsonify({"error": str(error), "retry": True}), 400
+        except ArrayUploadError as error:
+            logger.warning(str(error))
+            return jsonify({"error": str(error)}), 400
+    return jsonify(upload.status()), 200
+
+
+@basher_bp.route("/ready", methods=["GET"])
+def ready():
+    """
+    This function handles GET requests to the "/ready" route of the "basher" blueprint.
+
+    Reports whether the worker handling the request has completed its warm-up (see warmup.py and gunicorn.conf.py),
+    for use as a readiness check after deploys and worker restarts.
+
+    Returns:
+    A JSON response with the status of each warm-up step, with status code 200 if warm-up is complete or 503 if not.
+    """
+    return jsonify(warmup.warmup_status), 200 if warmup.is_ready() else 503
+
+
+@basher_bp.route("/metrics", methods=["GET"])
+def metrics():
+    """
+    This function handles GET requests to the "/metrics" route of the "basher" blueprint.
+
+    Returns:
+    A JSON response with the janitor's totals (e.g. janitor_reclaimed_bytes, the space reclaimed from the upload
+    folder), the size of the upload folder when it last ran, the number of active sessions, the number of API jobs
+    with each status, the expected runtime of the jobs queued in this worker and the coefficients & error of the cost
+    model, with status code 200.
+    """
+    jobs = get_job_manager()
+    return (
+        jsonify(
+            store.metrics()
+            | {
+                "active_sessions": store.count_sessions(),
+                "jobs": store.job_counts(),
+                "queued_job_seconds": jobs.scheduler.queued_seconds(),
+                "cost_model": jobs.cost_model().summary(),
+            }
+        ),
+        200,
+    )
+
+
+def get_job_manager():
+    # Each worker process runs the cases submitted to it, see job_manager.py
+    if "basher_jobs" not in current_app.extensions:
+        current_app.extensions["basher_jobs"] = job_manager.JobManager(
+            current_app.config["UPLOAD_FOLDER"], current_app.extensions["basher_store"]
+        )
+    return current_app.extensions["basher_jobs"]
+
+
+def case_links(case_id):
+    # The API URLs of a case
+    return {
+        "status": f"{api_bp.url_prefix}/cases/{case_id}",
+        "tables": f"{api_bp.url_prefix}/cases/{case_id}/tables",
+        "reports": {
+            report_format: f"{api_bp.url_prefix}/cases/{case_id}/reports/{report_format}"
+            for report_format in snp_haplotype.report_formats
+        },
+    }
+
+
+@api_bp.errorhandler(JobNotFoundError)
+def job_not_found(error):
+    return jsonify({"error": str(error)}), 404
+
+
+@api_bp.route("/cases", methods=["POST"])
+def submit_case():
+    """
+    This function handles POST requests to the "/cases" route of the "basher_api" blueprint.
+
+    Submits a case to be run in the background. The SNP array files are first uploaded with the chunked upload
+    ("/basher/upload"), then the case is submitted either as JSON with the "parameters" of snp_haplotype.py, or as a
+    multipart form with the "sample_sheet" file. Both take the "array_files", a list of upload IDs which are merged if
+    there is more than one, and the report "formats" to produce with the case. The tables are always saved, reports
+    which are not requested can be fetched later. Admins can also set "profile" to save a profile of the case in its
+    result bundle, with the X-BASHer-Admin-Token header.
+
+    Returns:
+    A JSON response with the status of the case, including its case_id, its expected runtime & memory and the links to
+    poll, with status code 202, 400 with the error if the case is invalid, or 422 with the error & the expected runtime
+    & memory if the case is over the web server's time or memory budget.
+    """
+    if request.is_json:
+        details = request.get_json()
+        upload_ids = details.get("array_files", [])
+        formats = details.get("formats", [])
+    else:
+        details = request.form
+        upload_ids = details.getlist("array_files")
+        formats = details.getlist("formats")
+    if not upload_ids:
+        return jsonify({"error": "No array_files uploads were provided."}), 400
+    if not set(formats) <= set(snp_haplotype.report_formats):
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid report formats, allowed formats are: {', '.join(snp_haplotype.report_formats)}"
+                }
+            ),
+            400,
+        )
+    jobs = get_job_manager()
+    case_id, case_folder = jobs.create_job()
+    logging_setup.set_case_id(case_id)
+    try:
+        uploads = [
+            ChunkedUpload(app.config["UPLOAD_FOLDER"], upload_id)
+            for upload_id in upload_ids
+        ]
+        # The uploads are only moved into the case's folder once the parameters are valid, so they can be resubmitted
+        if len(uploads) > 1:
+            input_file = os.path.join(case_folder, "merged_array_files.txt")
+        else:
+            input_file = os.path.join(case_folder, os.path.basename(uploads[0].path))
+
+        if request.is_json:
+            args = job_manager.parameters_to_args(
+                details.get("parameters", {}), input_file
+            )
+        else:
+            sample_sheet = request.files.get("sample_sheet")
+            if sample_sheet is None:
+                raise CaseParameterError(
+                    "Submit the case parameters as JSON or a sample_sheet file."
+                )
+            sample_sheet_path = os.path.join(
+                case_folder,
+                secure_filename(sample_sheet.filename) or "sample_sheet.xlsm",
+            )
+            sample_sheet.save(sample_sheet_path)
+            args, input_errors, input_ok_flag = parse_excel_input(
+                sample_sheet_path, input_file
+            )
+            if not input_ok_flag:
+                raise CaseParameterError(json.dumps(input_errors))
+
+        # Cases are only profiled for admins, as profiling slows the case down
+        if str(details.get("profile", "")).lower() in ["true", "1"]:
+            if not job_manager.is_admin(request.headers.get("X-BASHer-Admin-Token")):
+                raise CaseParameterError(
+                    "Cases can only be profiled with the X-BASHer-Admin-Token header."
+                )
+            args.profile = True
+        # Cases which are over the web server's budgets are rejected before the uploads are moved, so that they can be
+        # resubmitted with fewer embryos or reports
+        args.formats = formats
+        admitted = jobs.admit(args, [upload.path for upload in uploads])
+        input_files = [upload.move_to(case_folder) for upload in uploads]
+        if len(input_files) > 1:
+            BlobStore(current_app.config["UPLOAD_FOLDER"]).merge(
+                input_files, input_file
+            )
+    except (ArrayUploadError, CaseParameterError) as error:
+        jobs.delete_job(case_id)
+        return jsonify({"error": str(error)}), 400
+    except CaseBudgetError as error:
+        jobs.delete_job(case_id)
+        return jsonify({"error": str(error), "prediction": error.prediction}), 422
+    job = jobs.submit(case_id, args, admitted)
+    return jsonify(job | {"links": case_links(case_id)}), 202
+
+
+def progress_response(case_id):
+    # The progress of a case as Server-Sent Events, 204 tells the browser to stop reconnecting once it has received
+    # the event which finished the case
+    last_event_id = request.headers.get("Last-Event-ID", "0")
+    last_event_id = int(last_event_id) if last_event_id.isdigit() else 0
+    if last_event_id and progress.is_finished(store, case_id, last_event_id):
+        return Response(status=204)
+    return Response(
+        progress.event_stream(store, case_id, last_event_id),
+        mimetype="text/event-stream",
+        # Proxies must send each event as it is produced
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@basher_bp.route("/progress/<case_id>", methods=["GET"])
+def case_progress(case_id):
+    """
+    This function handles GET requests to the "/progress/<case_id>" route of the "basher" blueprint.
+
+    Streams the progress of the case submitted with the web form in this session as Server-Sent Events, from
+    "queued" through each stage of the analysis to "complete" or "failed". Each stream is closed after a few seconds and
+    the browser's EventSource reconnects with the Last-Event-ID it received, see progress.py.
+
+    Returns:
+    A text/event-stream response of the case's progress, 204 once the browser has received the event which finished
+    the case, or 404 if the case was not submitted in this session.
+    """
+    if session.get("timestr") != case_id:
+        abort(404, description="No BASHer case has been submitted in this session")
+    return progress_response(case_id)
+
+
+@api_bp.route("/cases/<case_id>/events", methods=["GET"])
+def case_events(case_id):
+    """
+    This function handles GET requests to the "/cases/<case_id>/events" route of the "basher_api" blueprint.
+
+    Returns:
+    A text/event-stream response of the case's progress as Server-Sent Events, see case_progress(), or 404 if there is
+    no case.
+    """
+    get_job_manager().status(case_id)
+    return progress_response(case_id)
+
+
+@api_bp.route("/cases/<case_id>", methods=["GET"])
+def case_status(case_id):
+    """
+    This function handles GET requests to the "/cases/<case_id>" route of the "basher_api" blueprint.
+
+    Returns:
+    A JSON response with the status of the case ("queued", "running", "complete" or "failed"), its parameters, the
+    time taken by each stage, the expected & actual runtime and the outputs saved, with status code 200, or 404 if
+    there is no case.
+    """
+    job = get_job_manager().status(case_id)
+    return jsonify(job | {"links": case_links(case_id)}), 200
+
+
+@api_bp.route("/cases/<case_id>/tables", methods=["GET"])
+def case_tables(case_id):
+    """
+    This function handles GET requests to the "/cases/<case_id>/tables" route of the "basher_api" blueprint.
+
+    Returns:
+    A JSON response with the manifest of the case's result bundle (see result_bundle.py), listing the tables with their
+    number of rows, with status code 200, or 404 if the case is not complete.
+    """
+    bundle_path, manifest = get_job_manager().result_bundle(case_id)
+    return jsonify(manifest), 200
+
+
+@api_bp.route("/cases/<case_id>/tables/<table_name>", methods=["GET"])
+def case_table(case_id, table_name):
+    """
+    This function handles GET requests to the "/cases/<case_id>/tables/<table_name>" route of the "basher_api"
+    blueprint.
+
+    The table is returned as JSON records, or as an Arrow IPC stream if the "format" query parameter is "arrow" or the
+    Accept header is application/vnd.apache.arrow.stream.
+
+    Returns:
+    The table with status code 200, or 404 if the case is not complete or has no such table.
+    """
+    try:
+        table_df = get_job_manager().table(case_id, table_name)
+    except ResultBundleError as error:
+        logger.error(str(error))
+        return jsonify({"error": str(error)}), 500
+    if request.args.get("format") == "arrow" or (
+        request.accept_mimetypes.best == "application/vnd.apache.arrow.stream"
+    ):
+        return Response(
+            result_bundle.arrow_ipc_stream(table_df),
+            mimetype="application/vnd.apache.arrow.stream",
+        )
+    return Response(table_df.to_json(orient="records"), mimetype="application/json")
+
+
+@api_bp.route("/cases/<case_id>/profile/<file_name>", methods=["GET"])
+def case_profile(case_id, file_name):
+    """
+    This function handles GET requests to the "/cases/<case_id>/profile/<file_name>" route of the "basher_api"
+    blueprint.
+
+    Fetches a file of the profile of a case submitted with "profile" (see profiling.py), e.g. "flamegraph.svg",
+    "collapsed_stacks.txt", "top_functions.txt" or "stages.json". Requires the X-BASHer-Admin-Token header.
+
+    Returns:
+    The file with status code 200, 403 without the admin token, or 404 if the case is not complete or was not profiled.
+    """
+    if not job_manager.is_admin(request.headers.get("X-BASHer-Admin-Token")):
+        return (
+            jsonify({"error": "The profile of a case requires the admin token."}),
+            403,
+        )
+    bundle_path, manifest = get_job_manager().result_bundle(case_id)
+    if file_name not in manifest.get("profile", {}):
+        return jsonify({"error": f"Case {case_id} has no profile {file_name}."}), 404
+    return send_file(safe_join(bundle_path, profiling.profile_folder_name, file_name))
+
+
+@api_bp.route("/cases/<case_id>/reports/<report_format>", methods=["GET"])
+def case_report(case_id, report_format):
+    """
+    This function handles GET requests to the "/cases/<case_id>/reports/<report_format>" route of the "basher_api"
+    blueprint.
+
+    Reports which were not requested when the case was submitted are produced the first time they are fetched.
 
     Returns:
-    A file download response containing the zip file with the HTML and PDF reports.
+    The report with status code 200, 202 with the status of the report while it is produced, or 404 if the case is not
+    complete or the format is not a report format.
     """
-    html_file_name = f'{session["report_name"]}.html'
-    pdf_file_name = f'{session["report_name"]}.pdf'
-
-    # Create a temporary directory
-    with tempfile.TemporaryDirectory() as tempdir:
-        # Create a zip file with the html and pdf reports
-        zip_path = os.path.join(tempdir, f'{session["report_name"]}.zip')
-        with zipfile.ZipFile(zip_path, "w") as zipObj:
-            zipObj.write(f'{session["report_path"]}.html', html_file_name)
-            zipObj.write(f'{session["report_path"]}.pdf', pdf_file_name)
-
-        logger.info(f"Saved zipped reports to {zip_path}")
-
-        # Delete the html and pdf reports
-        os.remove(f'{session["report_path"]}.html')
-        os.remove(f'{session["report_path"]}.pdf')
-
-        logger.info(f"Attempting to download {zip_path}")
-
-        return send_file(
-            zip_path,
-            download_name=f'{session["report_name"]}.zip',
-            mimetype="application/zip",
-            as_attachment=True,
+    if report_format not in snp_haplotype.report_formats:
+        abort(404)
+    jobs = get_job_manager()
+    job = jobs.status(case_id)
+    if job["status"] != "complete":
+        return jsonify({"error": f"Case {case_id} is {job['status']}."}), 404
+    file_name = jobs.request_report(case_id, report_format)
+    if file_name is None:
+        job = jobs.status(case_id)
+        return (
+            jsonify({"report": report_format, "status": job["reports"][report_format]}),
+            202,
         )
+    return send_file(safe_join(jobs.job_folder(case_id), file_name))
 
 
 # Register the blueprint with your Flask application
 app.register_blueprint(basher_bp)
+app.register_blueprint(api_bp)
 
 if __name__ == "__main__":
     app.run(debug=True)
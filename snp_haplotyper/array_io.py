@@ -0,0 +1,286 @@
+import gzip
+import hashlib
+import os
+import sys
+import tempfile
+
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+# SNP array files can be tab separated text, optionally gzip or zstd compressed, or a Parquet or Feather (Arrow IPC)
+# file with the same columns. The format is detected from the first bytes of the file rather than its extension.
+# Reading zstd files requires zstandard and reading Parquet or Feather files requires pyarrow.
+
+# Folder the tables parsed from text SNP array files are cached in as Feather files, named by the SHA-256 of the file,
+# so a file which has already been imported is not parsed again and each case only reads the columns it uses. Parquet &
+# Feather files are not cached, as they are not parsed. The web app caches tables in its blob store (see
+# blob_store.py), None to not cache tables
+parsed_array_cache_folder = None
+
+# The number of probes read at a time by iter_array_file(), so a file can be filtered as it is read
+array_chunk_probes = 100000
+
+# The first bytes of each format other than plain text
+array_file_signatures = {
+    b"\x1f\x8b": "gzip",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"PAR1": "parquet",
+    b"ARROW1": "feather",
+}
+
+# The extensions accepted for SNP array files
+array_file_extensions = [
+    "txt",
+    "csv",
+    "txt.gz",
+    "csv.gz",
+    "txt.zst",
+    "csv.zst",
+    "parquet",
+    "feather",
+    "arrow",
+]
+
+# The probeset ID column of an export from the array software, or of a file merged by merge_array_files.py
+probeset_id_columns = ["Probeset ID", "probeset_id"]
+
+
+def file_sha256(path):
+    """The hex SHA-256 hash of a file, which is read in blocks"""
+    file_hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(1024 * 1024):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def has_array_file_extension(file_name):
+    """True if the file name has one of the array_file_extensions"""
+    return any(
+        file_name.lower().endswith(f".{extension}")
+        for extension in array_file_extensions
+    )
+
+
+def detect_array_format(header_bytes):
+    """Detect the format of a SNP array file from its first bytes
+    Args:
+        header_bytes (bytes): At least the first 8 bytes of the file
+    Returns:
+        string: "gzip", "zstd", "parquet", "feather" or "text"
+    """
+    for signature, array_format in array_file_signatures.items():
+        if header_bytes.startswith(signature):
+            return array_format
+    return "text"
+
+
+def array_file_format(path):
+    """Detect the format of a SNP array file, see detect_array_format()"""
+    with open(path, "rb") as f:
+        return detect_array_format(f.read(8))
+
+
+def count_probes(path):
+    """Count the probes in a SNP array file without importing it
+    Args:
+        path (string): The path to the SNP array file
+    Returns:
+        int: The number of probes, None if the file's format needs a package which is not installed
+    """
+    array_format = array_file_format(path)
+    if array_format in ["parquet", "feather"]:
+        try:
+            import pyarrow.dataset
+        except ImportError:
+            return None
+        return pyarrow.dataset.dataset(path, format=array_format).count_rows()
+    if array_format == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        open_file = lambda: zstandard.open(path, "rb")
+    elif array_format == "gzip":
+        open_file = lambda: gzip.open(path, "rb")
+    else:
+        open_file = lambda: open(path, "rb")
+    lines = 0
+    last_byte = b"\n"
+    with open_file() as f:
+        while block := f.read(1024 * 1024):
+            lines += block.count(b"\n")
+            last_byte = block[-1:]
+    # The last line may not end with a newline, the first line is the header
+    return max(lines + (last_byte != b"\n") - 1, 0)
+
+
+def case_columns(args):
+    """The columns of the SNP array file used to analyse a case, other samples on the array are not imported
+    Args:
+        args (Namespace): The arguments passed to snp_haplotype.main()
+    Returns:
+        list: The probeset ID, chromosome, position, trio & embryo columns
+    """
+    return (
+        probeset_id_columns
+        + [
+            "Chr",
+            "Position",
+            args.male_partner,
+            args.female_partner,
+            args.reference,
+        ]
+        + list(getattr(args, "embryo_ids", None) or [])
+    )
+
+
+def parsed_table_name(sha256):
+    """The name of the table parsed from the SNP array file with the hash in the parsed_array_cache_folder"""
+    return f"{sha256}.feather"
+
+
+def array_file_sha256(path):
+    """The hash of a SNP array file, looked up from the blob store if the file is linked to a stored file (see
+    BlobStore.sha256_of()) rather than hashing the file again"""
+    # blob_store imports this module, so is only imported when the parsed tables are cached in the blob store
+    from blob_store import BlobStore, blob_folder_name
+
+    blob_folder = os.path.dirname(os.path.abspath(parsed_array_cache_folder))
+    if os.path.basename(blob_folder) == blob_folder_name:
+        return BlobStore(os.path.dirname(blob_folder)).sha256_of(path)
+    return file_sha256(path)
+
+
+def cache_array_file(path, array_format):
+    """Parse a text SNP array file into the parsed_array_cache_folder if it has not been imported before
+    The table is cached as a Feather file with all the columns, so each case only reads the columns it uses.
+    Args:
+        path (string): The path to the SNP array file
+        array_format (string): "text", "gzip" or "zstd"
+    Returns:
+        string: The path of the cached table, None if the table cannot be cached
+    """
+    try:
+        import pyarrow
+    except ImportError:
+        return None
+    cache_path = os.path.join(
+        parsed_array_cache_folder, parsed_table_name(array_file_sha256(path))
+    )
+    try:
+        # The table is kept for the retention period after it was last used
+        os.utime(cache_path)
+        logger.info(f"Using the table parsed from {path} by an earlier case")
+        return cache_path
+    except FileNotFoundError:
+        pass
+    # The whole file is parsed at once so each column has one type, which Feather requires
+    df = pd.read_csv(
+        path,
+        delimiter="\t",
+        compression=None if array_format == "text" else array_format,
+        low_memory=False,
+    )
+    # The table is written to a temporary file first, so other workers never read a partly written table
+    os.makedirs(parsed_array_cache_folder, exist_ok=True)
+    file_descriptor, temp_path = tempfile.mkstemp(dir=parsed_array_cache_folder)
+    os.close(file_descriptor)
+    try:
+        df.to_feather(temp_path)
+    except (pyarrow.ArrowException, ValueError):
+        os.remove(temp_path)
+        logger.warning(f"The table parsed from {path} cannot be cached")
+        return None
+    os.replace(temp_path, cache_path)
+    return cache_path
+
+
+def read_arrow_file(path, array_format, columns=None):
+    """Import a Parquet or Feather file, only the requested columns are read from disk"""
+    try:
+        import pyarrow.dataset
+    except ImportError as error:
+        raise ImportError(
+            f"pyarrow is required to import the {array_format} SNP array file {path}"
+        ) from error
+    dataset = pyarrow.dataset.dataset(path, format=array_format)
+    if columns is not None:
+        columns = [column for column in dataset.schema.names if column in columns]
+    return dataset.to_table(columns=columns).to_pandas()
+
+
+def read_array_file(path, columns=None):
+    """Import a SNP array file in any of the supported formats
+    Args:
+        path (string): The path to the SNP array file
+        columns (list): The columns to import, columns which are not in the file are ignored. All columns are imported
+            if None. Parquet & Feather files, and text files which are cached (see parsed_array_cache_folder), only
+            read the requested columns from disk.
+    Returns:
+        dataframe: The SNP array data
+    """
+    array_format = array_file_format(path)
+    cache_path = None
+    if array_format not in ["parquet", "feather"] and parsed_array_cache_folder:
+        cache_path = cache_array_file(path, array_format)
+    if array_format in ["parquet", "feather"]:
+        df = read_arrow_file(path, array_format, columns)
+    elif cache_path is not None:
+        df = read_arrow_file(cache_path, "feather", columns)
+    else:
+        df = pd.read_csv(
+            path,
+            delimiter="\t",
+            compression=None if array_format == "text" else array_format,
+            usecols=None if columns is None else lambda column: column in columns,
+        )
+    logger.info(f"Imported {array_format} SNP array file {path}")
+    return df
+
+
+def iter_array_file(path, columns=None, chunk_probes=array_chunk_probes):
+    """Import a SNP array file in any of the supported formats in chunks of probes, without the parsed table cache
+    Used in low memory mode, so the probes can be filtered as they are read rather than holding the whole table.
+    Args:
+        path (string): The path to the SNP array file
+        columns (list): The columns to import, columns which are not in the file are ignored. All columns are imported
+            if None.
+        chunk_probes (int): The number of probes in each chunk
+    Yields:
+        dataframe: Each chunk of the SNP array data, indexed by the position of its probes in the file
+    """
+    array_format = array_file_format(path)
+    if array_format in ["parquet", "feather"]:
+        try:
+            import pyarrow.dataset
+        except ImportError as error:
+            raise ImportError(
+                f"pyarrow is required to import the {array_format} SNP array file {path}"
+            ) from error
+        dataset = pyarrow.dataset.dataset(path, format=array_format)
+        if columns is not None:
+            columns = [column for column in dataset.schema.names if column in columns]
+        start = 0
+        for batch in dataset.to_batches(columns=columns, batch_size=chunk_probes):
+            df = batch.to_pandas()
+            df.index = pd.RangeIndex(start, start + len(df))
+            start += len(df)
+            yield df
+    else:
+        # The chunks of a text file are indexed by their position in the file
+        with pd.read_csv(
+            path,
+            delimiter="\t",
+            compression=None if array_format == "text" else array_format,
+            usecols=None if columns is None else lambda column: column in columns,
+            chunksize=chunk_probes,
+        ) as reader:
+            yield from reader
+    logger.info(f"Imported {array_format} SNP array file {path} in chunks")
@@ -0,0 +1,401 @@
+import contextlib
+import json
+import os
+import secrets
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+# The web app's sessions, the status of the cases submitted through the API, the progress of running cases (see
+# progress.py) & the workers running them, and the janitor's metrics are kept in a single SQLite database shared by the web server workers. The database is in WAL mode so that requests reading
+# sessions & statuses are not blocked by the writes of other workers, and each session & job has an indexed expiry
+# time so the janitor (see janitor.py) can remove them without scanning folders.
+
+schema = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    job TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_expires ON jobs (expires);
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS progress (
+    event_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    case_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS progress_case ON progress (case_id, event_id);
+CREATE INDEX IF NOT EXISTS progress_expires ON progress (expires);
+CREATE TABLE IF NOT EXISTS case_owners (
+    case_id TEXT PRIMARY KEY,
+    owner TEXT NOT NULL
+);
+"""
+
+
+class ArtefactStore:
+    """The SQLite database of the web app's sessions, job statuses & metrics
+    Args:
+        path (string): The path of the database, created if it does not exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Each thread has its own connection, connections are not reused by processes forked from this one
+        self.local = threading.local()
+        # executescript() commits each statement itself, the tables are only created if they do not exist
+        self.connection().executescript(schema)
+
+    def connection(self):
+        """The connection of the current thread"""
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """A write transaction, other workers wait for it to be committed rather than reading a partial update"""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def load_session(self, session_id):
+        """The serialised data of a session, None if there is no such session or it has expired"""
+        row = (
+            self.connection()
+            .execute(
+                "SELECT data FROM sessions WHERE session_id = ? AND expires > ?",
+                (session_id, time.time()),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def save_session(self, session_id, data, expires):
+        """Save the serialised data of a session until its expiry time"""
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, expires) VALUES (?, ?, ?)",
+                (session_id, data, expires),
+            )
+
+    def delete_session(self, session_id):
+        with self.transaction() as connection:
+            connection.execute(
+                "DELETE FROM sessions WHERE session_id = ?", (session_id,)
+            )
+
+    def delete_expired_sessions(self):
+        """Delete the sessions which have expired
+        Returns:
+            int: The number of sessions deleted
+        """
+        with self.transaction() as connection:
+            return connection.execute(
+                "DELETE FROM sessions WHERE expires <= ?", (time.time(),)
+            ).rowcount
+
+    def count_sessions(self):
+        """The number of sessions which have not expired"""
+        return (
+            self.connection()
+            .execute("SELECT COUNT(*) FROM sessions WHERE expires > ?", (time.time(),))
+            .fetchone()[0]
+        )
+
+    def load_job(self, job_id):
+        """The status of a job, None if there is no such job"""
+        row = (
+            self.connection()
+            .execute("SELECT job FROM jobs WHERE job_id = ?", (job_id,))
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def update_job(self, job_id, expires, **changes):
+        """Update the status of a job, creating it if it does not exist
+        Args:
+            job_id (string): The ID of the job
+            expires (float): The time after which the job is deleted by the janitor
+            **changes: The fields of the status to update
+        Returns:
+            dict: The updated status
+        """
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT job FROM jobs WHERE job_id = ?", (job_id,)
+            ).fetchone()
+            job = json.loads(row[0]) if row else {"case_id": job_id}
+            job.update(changes)
+            connection.execute(
+                "INSERT OR REPLACE INTO jobs (job_id, status, job, expires) VALUES (?, ?, ?, ?)",
+                (job_id, job.get("status", "created"), json.dumps(job), expires),
+            )
+        return job
+
+    def expired_jobs(self):
+        """The IDs of the jobs which have expired"""
+        return [
+            row[0]
+            for row in self.connection().execute(
+                "SELECT job_id FROM jobs WHERE expires <= ?", (time.time(),)
+            )
+        ]
+
+    def active_jobs(self):
+        """The IDs of the jobs which are queued or running"""
+        return [
+            row[0]
+            for row in self.connection().execute(
+                "SELECT job_id FROM jobs WHERE status IN ('created', 'queued', 'running')"
+            )
+        ]
+
+    def completed_jobs(self, limit):
+        """The statuses of the most recently completed jobs, which the cost model is fitted to"""
+        return [
+            json.loads(row[0])
+            for row in self.connection().execute(
+                "SELECT job FROM jobs WHERE status = 'complete' ORDER BY rowid DESC LIMIT ?",
+                (limit,),
+            )
+        ]
+
+    def delete_jobs(self, job_ids):
+        with self.transaction() as connection:
+            connection.executemany(
+                "DELETE FROM jobs WHERE job_id = ?", [(job_id,) for job_id in job_ids]
+            )
+
+    def job_counts(self):
+        """The number of jobs with each status"""
+        return dict(
+            self.connection().execute(
+                "SELECT status, COUNT(*) FROM jobs GROUP BY status"
+            )
+        )
+
+    def add_progress(self, case_id, event, expires):
+        """Record the progress of a case, see progress.py
+        Args:
+            case_id (string): The ID of the case
+            event (dict): The stage, message & details of the progress
+            expires (float): The time after which the event is deleted by the janitor
+        """
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT INTO progress (case_id, event, expires) VALUES (?, ?, ?)",
+                (case_id, json.dumps(event), expires),
+            )
+
+    def progress_events(self, case_id, after_event_id=0):
+        """The progress of a case recorded since an event
+        Args:
+            case_id (string): The ID of the case
+            after_event_id (int): The ID of the last event already received, 0 for all the case's events
+        Returns:
+            list: The ID & event of each later event, in order
+        """
+        return [
+            (event_id, json.loads(event))
+            for event_id, event in self.connection().execute(
+                "SELECT event_id, event FROM progress WHERE case_id = ? AND event_id > ? ORDER BY event_id",
+                (case_id, after_event_id),
+            )
+        ]
+
+    def delete_expired_progress(self):
+        """Delete the progress events which have expired
+        Returns:
+            int: The number of events deleted
+        """
+        with self.transaction() as connection:
+            return connection.execute(
+                "DELETE FROM progress WHERE expires <= ?", (time.time(),)
+            ).rowcount
+
+    def set_case_owner(self, case_id, owner):
+        """Record the web server worker which queued a case & runs it, see progress.claim_case()"""
+        with self.transaction() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO case_owners (case_id, owner) VALUES (?, ?)",
+                (case_id, owner),
+            )
+
+    def delete_case_owner(self, case_id):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM case_owners WHERE case_id = ?", (case_id,))
+
+    def case_owner(self, case_id):
+        """The worker running a case, None if the case is not queued or running"""
+        row = (
+            self.connection()
+            .execute("SELECT owner FROM case_owners WHERE case_id = ?", (case_id,))
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def case_owners(self):
+        """The worker running each case which is queued or running"""
+        return dict(self.connection().execute("SELECT case_id, owner FROM case_owners"))
+
+    def add_metrics(self, **increments):
+        """Add to the metrics which are totals, e.g. the space reclaimed by the janitor"""
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT INTO metrics (name, value) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + excluded.value",
+                increments.items(),
+            )
+
+    def set_metrics(self, **values):
+        """Set the metrics which are the latest value, e.g. the size of the upload folder"""
+        with self.transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO metrics (name, value) VALUES (?, ?)",
+                values.items(),
+            )
+
+    def metrics(self):
+        return dict(self.connection().execute("SELECT name, value FROM metrics"))
+
+    def acquire_lease(self, name, holder, seconds):
+        """Take a lease which is held by one worker at a time, e.g. to run the janitor
+        Args:
+            name (string): The name of the lease
+            holder (string): The worker taking the lease
+            seconds (float): How long the lease is held for
+        Returns:
+            bool: True if the lease was taken, False if it is held by another worker
+        """
+        now = time.time()
+        with self.transaction() as connection:
+            row = connection.execute(
+                "SELECT holder, expires FROM leases WHERE name = ?", (name,)
+            ).fetchone()
+            if row and row[0] != holder and row[1] > now:
+                return False
+            connection.execute(
+                "INSERT OR REPLACE INTO leases (name, holder, expires) VALUES (?, ?, ?)",
+                (name, holder, now + seconds),
+            )
+        return True
+
+    def lease_is_held(self, name):
+        """True if a lease has been taken & has not expired"""
+        return (
+            self.connection()
+            .execute(
+                "SELECT 1 FROM leases WHERE name = ? AND expires > ?",
+                (name, time.time()),
+            )
+            .fetchone()
+            is not None
+        )
+
+    def delete_expired_leases(self):
+        """Delete the leases which have expired, e.g. of workers which have stopped"""
+        with self.transaction() as connection:
+            return connection.execute(
+                "DELETE FROM leases WHERE expires <= ?", (time.time(),)
+            ).rowcount
+
+
+class StoreSession(CallbackDict, SessionMixin):
+    """A session saved in the ArtefactStore, the cookie only holds its random ID"""
+
+    def __init__(self, initial=None, session_id=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.session_id = session_id
+        self.new = new
+        self.modified = False
+
+
+class StoreSessionInterface(SessionInterface):
+    """Saves the web app's sessions in the ArtefactStore, until PERMANENT_SESSION_LIFETIME after they were last changed
+    Sessions are only saved when they are changed. The CSRF token of the form is kept in the session, so every visit
+    which renders the form creates a session, which the janitor removes once it expires.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if session_id:
+            data = self.store.load_session(session_id)
+            if data is not None:
+                return StoreSession(self.serializer.loads(data), session_id=session_id)
+        return StoreSession(session_id=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            if session.modified:
+                self.store.delete_session(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if not session.modified:
+            return
+        expires = time.time() + app.permanent_session_lifetime.total_seconds()
+        self.store.save_session(
+            session.session_id, self.serializer.dumps(dict(session)), expires
+        )
+        response.set_cookie(
+            name,
+            session.session_id,
+            # Without SESSION_PERMANENT the cookie is removed when the browser is closed
+            expires=datetime.fromtimestamp(expires, timezone.utc)
+            if app.config.get("SESSION_PERMANENT", True)
+            else None,
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
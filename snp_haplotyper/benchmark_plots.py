@@ -0,0 +1,116 @@
+import argparse
+import copy
+import os
+import sys
+import time
+
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+# Compares the size & render time of the interactive plots produced by each plot mode for a case. The render time is
+# measured by exporting each figure with Kaleido, which draws the plot with plotly.js in a headless browser, so is a
+# proxy for the time taken by the browser displaying the HTML report.
+
+# Import command line arguments, any other arguments are passed to snp_haplotype.py to describe the case
+parser = argparse.ArgumentParser(
+    description="Benchmark the interactive plots for a case, takes the same arguments as snp_haplotype.py in addition to those below"
+)
+parser.add_argument(
+    "--benchmark_flanking_region_sizes",
+    type=str,
+    nargs="+",
+    default=["2mb", "10mb"],
+    help="The flanking region sizes to benchmark",
+)
+parser.add_argument(
+    "--benchmark_plot_modes",
+    type=str,
+    nargs="+",
+    default=["standard", "scalable"],
+    help="The plot modes to benchmark",
+)
+
+
+def benchmark_plots(args, flanking_region_size, plot_mode):
+    """Build, serialise & render the interactive plot for each embryo in a case
+    Args:
+        args (Namespace): The snp_haplotype.py arguments for the case
+        flanking_region_size (string): The flanking region size to plot, "2mb" to "10mb"
+        plot_mode (string): The plot mode, "standard" or "scalable"
+    Returns:
+        dict: The number of SNPs plotted, the HTML size and the time taken to build & render the plots
+    """
+    import snp_haplotype
+    import snp_plot
+
+    args = copy.copy(args)
+    args.flanking_region_size = flanking_region_size
+    args.plot_mode = plot_mode
+    args.formats = ["html"]
+    case = snp_haplotype.BasherCase(args)
+    df = case.embryo_category_df
+
+    build_time = 0
+    render_time = 0
+    html_size = 0
+    traces = 0
+    for embryo, embryo_sex in zip(case.embryo_ids, case.embryo_sex):
+        start = time.perf_counter()
+        fig = snp_plot.embryo_figure(
+            df,
+            embryo,
+            embryo_sex,
+            case.gene_start,
+            case.gene_end,
+            args.mode_of_inheritance,
+            case.embryo_count_data_df,
+            snp_haplotype.flanking_region_size_to_bp(flanking_region_size),
+            plot_mode,
+        )
+        html = fig.to_html(full_html=False, include_plotlyjs="cdn")
+        build_time += time.perf_counter() - start
+        start = time.perf_counter()
+        fig.to_image(format="png")
+        render_time += time.perf_counter() - start
+        html_size += len(html)
+        traces += len(fig.data)
+
+    return {
+        "flanking_region_size": flanking_region_size,
+        "plot_mode": plot_mode,
+        "snps": len(df),
+        "embryos": len(case.embryo_ids),
+        "traces": traces,
+        "html_kb": round(html_size / 1024),
+        "build_seconds": round(build_time, 2),
+        "render_seconds": round(render_time, 2),
+    }
+
+
+def main(argv=None):
+    import plotly.graph_objects as go
+    import snp_haplotype
+
+    argv = sys.argv[1:] if argv is None else argv
+    benchmark_args, remaining_argv = parser.parse_known_args(argv)
+    args = snp_haplotype.build_parser().parse_args(remaining_argv)
+    # Start Kaleido before timing so that its start up is not included in the first render
+    go.Figure(go.Scatter(x=[0, 1], y=[0, 1])).to_image(format="png")
+    return pd.DataFrame(
+        [
+            benchmark_plots(args, flanking_region_size, plot_mode)
+            for flanking_region_size in benchmark_args.benchmark_flanking_region_sizes
+            for plot_mode in benchmark_args.benchmark_plot_modes
+        ]
+    )
+
+
+# run the script
+if __name__ == "__main__":
+    print(main().to_string(index=False))
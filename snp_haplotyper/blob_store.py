@@ -0,0 +1,281 @@
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import array_io
+
+# The same SNP array export is often uploaded for several biopsies & reruns of a case. Uploaded files are stored once,
+# named by the SHA-256 of their contents, and each case's folder holds a hard link to the stored file, so the case's
+# files keep the names the sample sheet refers to. Files merged from several exports & the parsed SNP array tables
+# (see array_io.py) are keyed by the hashes of the exports, so an export which has been seen before is not stored,
+# merged or parsed again. A stored file is removed by the janitor (see janitor.py) once no case links to it.
+
+# The blob store is a folder within the upload folder, so that case folders can hard link to its files
+blob_folder_name = "blobs"
+
+# Size of the blocks files are copied & hashed in
+blob_block_size = 1024 * 1024
+
+# Files in the store are not removed until they are this old, so a file which has just been stored is not removed
+# before it is linked into a case's folder
+blob_grace_seconds = 60 * 60
+
+
+class BlobStore:
+    """The content-addressed store of the SNP array files uploaded to the web app
+    Args:
+        upload_folder (string): The web app's upload folder, the store is kept in its blobs folder
+    """
+
+    # The hashes of the stored files this process has added or linked, keyed by inode, see sha256_of()
+    known_hashes = {}
+
+    def __init__(self, upload_folder):
+        self.folder = os.path.join(upload_folder, blob_folder_name)
+
+    def object_path(self, sha256):
+        """The path of the stored file with the hash"""
+        return os.path.join(self.folder, "objects", sha256[:2], sha256)
+
+    def derived_folder(self, kind):
+        """The folder of the files derived from stored files, e.g. "merged" files & "parsed" tables"""
+        return os.path.join(self.folder, kind)
+
+    def temp_file(self):
+        """A new temporary file in the store, so it can be moved into the store without copying"""
+        os.makedirs(os.path.join(self.folder, "tmp"), exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(
+            dir=os.path.join(self.folder, "tmp")
+        )
+        os.close(file_descriptor)
+        return temp_path
+
+    def add_file(self, path, sha256=None):
+        """Move a file into the store, if the store already has a file with the same contents the file is removed
+        Args:
+            path (string): The file, which must be in the upload folder
+            sha256 (string): The hex SHA-256 of the file if it was hashed as it was saved, otherwise it is hashed
+        Returns:
+            string: The hash the file is stored under
+        """
+        sha256 = sha256 or array_io.file_sha256(path)
+        object_path = self.object_path(sha256)
+        if os.path.exists(object_path):
+            os.remove(path)
+            logger.info(f"SNP array file {sha256} is already stored")
+        else:
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Stored files are shared by cases, so are read only
+            os.chmod(path, 0o444)
+            os.replace(path, object_path)
+        self.remember(object_path, sha256)
+        return sha256
+
+    def add_stream(self, stream):
+        """Store a file as it is read from a stream, hashing it as it is written
+        Args:
+            stream (file): The file uploaded with the web form
+        Returns:
+            string: The hash the file is stored under
+        """
+        temp_path = self.temp_file()
+        sha256 = hashlib.sha256()
+        with open(temp_path, "wb") as f:
+            while block := stream.read(blob_block_size):
+                sha256.update(block)
+                f.write(block)
+        return self.add_file(temp_path, sha256.hexdigest())
+
+    def link(self, sha256, destination):
+        """Link a stored file into a case's folder
+        Args:
+            sha256 (string): The hash of the stored file
+            destination (string): The path of the file in the case's folder
+        Returns:
+            string: The destination
+        """
+        try:
+            os.link(self.object_path(sha256), destination)
+        except OSError:
+            # The upload folder does not support hard links, so the case has its own copy
+            shutil.copyfile(self.object_path(sha256), destination)
+        return destination
+
+    def remember(self, path, sha256):
+        stat = os.stat(path)
+        self.known_hashes[(stat.st_dev, stat.st_ino)] = sha256
+
+    def sha256_of(self, path):
+        """The hash of a file in a case's folder, looked up if it is linked to a stored file rather than hashing the
+        file again"""
+        stat = os.stat(path)
+        sha256 = self.known_hashes.get((stat.st_dev, stat.st_ino))
+        # Stored files are named by their contents, so a file which is the stored file has its hash
+        if sha256 is not None and os.path.exists(self.object_path(sha256)):
+            if os.path.samefile(path, self.object_path(sha256)):
+                return sha256
+        if stat.st_nlink > 1:
+            # The file was stored by another process, e.g. another web server worker or a case's process
+            sha256 = self.find_object(stat)
+            if sha256 is not None:
+                return sha256
+        return array_io.file_sha256(path)
+
+    def find_object(self, stat):
+        """The hash of the stored file with the inode of a file, None if it is not a stored file"""
+        objects_folder = os.path.join(self.folder, "objects")
+        if not os.path.isdir(objects_folder):
+            return None
+        with os.scandir(objects_folder) as prefixes:
+            for prefix in prefixes:
+                with os.scandir(prefix.path) as entries:
+                    for entry in entries:
+                        if entry.inode() != stat.st_ino:
+                            continue
+                        if os.stat(entry.path).st_dev == stat.st_dev:
+                            self.remember(entry.path, entry.name)
+                            return entry.name
+        return None
+
+    def merge(self, input_files, destination):
+        """Merge SNP array files into a case's folder, see merge_array_files.py
+        The merged file is stored & keyed by the hashes of the input files, so the same files are only merged once.
+        Args:
+            input_files (list): The SNP array files in the case's folder, in the order they are merged
+            destination (string): The path of the merged file in the case's folder
+        Returns:
+            string: The destination
+        """
+        # merge_array_files is only imported when files are merged
+        import merge_array_files
+
+        key = hashlib.sha256(
+            "\n".join(
+                ["merged"] + [self.sha256_of(input_file) for input_file in input_files]
+            ).encode()
+        ).hexdigest()
+        merged_path = os.path.join(self.derived_folder("merged"), key)
+        if os.path.exists(merged_path):
+            logger.info(f"Using SNP array files merged by an earlier case {key}")
+            # The merged file is kept for the retention period after it was last used
+            os.utime(merged_path)
+        else:
+            temp_path = self.temp_file()
+            merge_array_files.main(input_files).to_csv(temp_path, sep="\t")
+            sha256 = self.add_file(temp_path)
+            os.makedirs(self.derived_folder("merged"), exist_ok=True)
+            try:
+                os.link(self.object_path(sha256), merged_path)
+            except FileExistsError:
+                # Merged at the same time by another worker
+                pass
+        try:
+            os.link(merged_path, destination)
+        except OSError:
+            shutil.copyfile(merged_path, destination)
+        return destination
+
+    def scan(self):
+        """The stored & derived files
+        Returns:
+            list: The path, size, modified time & number of links of each file
+        """
+        files = []
+        for root, folders, file_names in os.walk(self.folder):
+            for file_name in file_names:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((path, stat.st_size, stat.st_mtime, stat.st_nlink))
+        return files
+
+    def size(self):
+        """The total size of the store in bytes, the merged files are links to stored files so are not counted"""
+        merged_folder = self.derived_folder("merged")
+        return sum(
+            size
+            for path, size, mtime, links in self.scan()
+            if not path.startswith(merged_folder)
+        )
+
+    def reclaimable_objects(self):
+        """The stored files which collect_garbage() removes once the cases linking to them are removed, i.e. those past
+        their grace period which no merged file links to
+        Returns:
+            dict: The size, including the file's parsed table, & the number of case links of each stored file, keyed
+            by its (device, inode)
+        """
+        merged_files = set()
+        objects = {}
+        for path, size, mtime, links in self.scan():
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if path.startswith(self.derived_folder("merged")):
+                merged_files.add((stat.st_dev, stat.st_ino))
+            elif path.startswith(os.path.join(self.folder, "objects")) and (
+                mtime < time.time() - blob_grace_seconds
+            ):
+                parsed_path = os.path.join(
+                    self.derived_folder("parsed"),
+                    array_io.parsed_table_name(os.path.basename(path)),
+                )
+                if os.path.exists(parsed_path):
+                    size += os.path.getsize(parsed_path)
+                # Every other link to a stored file is in a case's folder
+                objects[(stat.st_dev, stat.st_ino)] = (size, links - 1)
+        return {
+            inode: details
+            for inode, details in objects.items()
+            if inode not in merged_files
+        }
+
+    def collect_garbage(self, retention_days):
+        """Remove the stored files which no case links to, and the merged files & parsed tables which have not been
+        used for the retention period
+        Args:
+            retention_days (float): The number of days to keep merged files & parsed tables for after they were used
+        Returns:
+            int: The bytes reclaimed
+        """
+        now = time.time()
+        retention_cutoff = now - retention_days * 24 * 60 * 60
+        grace_cutoff = now - blob_grace_seconds
+        objects_folder = os.path.join(self.folder, "objects")
+        reclaimed = 0
+        # Merged files are links to stored files, so they are removed first & the stored files once they are unlinked
+        for path, size, mtime, links in self.scan():
+            if path.startswith(objects_folder):
+                continue
+            if mtime < retention_cutoff or (
+                path.startswith(os.path.join(self.folder, "tmp"))
+                and mtime < grace_cutoff
+            ):
+                os.remove(path)
+                reclaimed += size if links == 1 else 0
+        parsed_folder = self.derived_folder("parsed")
+        for path, size, mtime, links in self.scan():
+            if path.startswith(objects_folder) and links == 1 and mtime < grace_cutoff:
+                os.remove(path)
+                reclaimed += size
+                # The parsed table of a removed file is no longer needed
+                parsed_path = os.path.join(
+                    parsed_folder, array_io.parsed_table_name(os.path.basename(path))
+                )
+                if os.path.exists(parsed_path):
+                    reclaimed += os.path.getsize(parsed_path)
+                    os.remove(parsed_path)
+        return reclaimed
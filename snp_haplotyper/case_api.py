@@ -0,0 +1,274 @@
+import os
+import sys
+import tempfile
+from argparse import Namespace
+from dataclasses import asdict, dataclass, field, fields
+from typing import Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import merge_array_files
+import progress
+import snp_haplotype
+from check_inputs import check_input
+from exceptions import CaseParameterError
+
+# A library API for running BASHer cases in-process, for long-lived services & notebooks. Cases are described by a
+# CaseSpec rather than an argparse Namespace and run_case() returns the results as a CaseResult. Nothing is shared
+# between cases other than read-only tables which are loaded once per process (see snp_haplotype.read_rsid_table()),
+# so cases can be run at the same time from different threads.
+
+
+@dataclass(frozen=True)
+class CaseSpec:
+    """The parameters of a BASHer case, named as the snp_haplotype.py command line options
+    Args:
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive" or "x_linked"
+        male_partner, female_partner, reference (string): The trio's columns in the SNP array file
+        male_partner_status, female_partner_status, reference_status (string): "affected", "unaffected" or "carrier"
+        reference_relationship (string): The reference's relationship to the couple, e.g. "grandparent" or "child"
+        gene_symbol (string): The gene of interest
+        gene_start, gene_end (int): The gene's co-ordinates
+        chr (string): The gene's chromosome, "1" to "22", "x" or "y"
+        embryo_ids (tuple): The embryos' columns in the SNP array file, empty for a trio only case
+        embryo_sex (tuple): The sex of each embryo, "male", "female" or "unknown"
+        flanking_region_size (string): The flanking region either side of the gene, "2mb" to "10mb"
+        consanguineous (bool): Whether the couple are consanguineous
+        sample_id (string): The name of the case, used as the output prefix
+        header_info (string): The report header fields, see snp_haplotype.header_to_dict()
+        plot_mode (string): "standard" or "scalable"
+        embryo_plots (bool): Whether to plot each embryo as well as the overview plot
+        flank_sensitivity (bool): Whether to tabulate the informative SNPs for each flanking region size
+        incremental (bool): Whether to reuse & update the trio cache, see trio_cache.py
+    """
+
+    mode_of_inheritance: str
+    male_partner: str
+    male_partner_status: str
+    female_partner: str
+    female_partner_status: str
+    reference: str
+    reference_status: str
+    reference_relationship: str
+    gene_symbol: str
+    gene_start: int
+    gene_end: int
+    chr: str
+    embryo_ids: Tuple[str, ...] = ()
+    embryo_sex: Tuple[str, ...] = ()
+    flanking_region_size: str = "2mb"
+    consanguineous: bool = False
+    sample_id: Optional[str] = None
+    header_info: Optional[str] = None
+    plot_mode: str = "standard"
+    embryo_plots: bool = True
+    flank_sensitivity: bool = False
+    incremental: bool = False
+
+    def __post_init__(self):
+        # Lists are stored as tuples so that the spec can be shared between threads & used as a key
+        object.__setattr__(self, "embryo_ids", tuple(self.embryo_ids))
+        object.__setattr__(self, "embryo_sex", tuple(self.embryo_sex))
+        object.__setattr__(self, "chr", str(self.chr).lower())
+
+    @property
+    def trio_only(self):
+        """True if the case has no embryos"""
+        return not self.embryo_ids
+
+    def to_args(self, input_file, formats=()):
+        """The arguments of snp_haplotype.py for the case
+        Args:
+            input_file (string): The path of the SNP array file
+            formats (list): The report formats to produce
+        Returns:
+            Namespace: The arguments, as produced by snp_haplotype.build_parser()
+        """
+        parameters = asdict(self)
+        parameters["output_prefix"] = parameters.pop("sample_id")
+        parameters["embryo_ids"] = list(self.embryo_ids)
+        parameters["embryo_sex"] = list(self.embryo_sex)
+        return Namespace(
+            **parameters,
+            trio_only=self.trio_only,
+            input_file=input_file,
+            output_folder=None,
+            formats=list(formats),
+            result_bundle=False,
+        )
+
+    @classmethod
+    def from_args(cls, args):
+        """The spec of a case from the arguments of snp_haplotype.py, e.g. those produced by
+        excel_parser.parse_excel_input()
+        Args:
+            args (Namespace): The arguments of the case
+        Returns:
+            CaseSpec: The case
+        """
+        parameters = {
+            spec_field.name: getattr(args, spec_field.name)
+            for spec_field in fields(cls)
+            if hasattr(args, spec_field.name)
+        }
+        parameters["sample_id"] = getattr(args, "output_prefix", None)
+        if getattr(args, "trio_only", False):
+            parameters["embryo_ids"] = ()
+            parameters["embryo_sex"] = ()
+        return cls(**parameters)
+
+    @classmethod
+    def from_sample_sheet(cls, sample_sheet, input_file=None):
+        """The spec of a case from a sample sheet, see excel_parser.py
+        Args:
+            sample_sheet (string): The path of the sample sheet
+            input_file (string): The path of the SNP array file, if it is not named in the sample sheet
+        Returns:
+            CaseSpec: The case
+        Raises:
+            CaseParameterError: If the sample sheet is invalid
+        """
+        # excel_parser is only imported when a sample sheet is read
+        from excel_parser import parse_excel_input
+
+        args, error_dictionary, input_ok_flag = parse_excel_input(
+            sample_sheet, input_file
+        )
+        if not input_ok_flag:
+            raise CaseParameterError(
+                "; ".join(
+                    f"{field}: {error}" for field, error in error_dictionary.items()
+                )
+            )
+        return cls.from_args(args)
+
+
+@dataclass(frozen=True)
+class CaseResult:
+    """The results of a case run by run_case()
+    Args:
+        spec (CaseSpec): The case
+        number_snps_imported (int): The number of SNPs in the SNP array file
+        summary_snps_by_region (dataframe): The informative SNPs in each region, see summarised_snps_by_region()
+        informative_snps_by_region (dataframe): The informative SNPs by region & risk, see snps_by_region()
+        qc (dataframe): The NoCall percentages of each sample
+        embryo_count_data (dataframe): The risk SNPs of each embryo by region, None for a trio only case
+        embryo_categories (dataframe): The risk category of each SNP in each embryo, None for a trio only case
+        flank_sensitivity (dataframe): The informative SNPs by flanking region size, None unless requested
+        json (string): The JSON results, None unless requested
+        html (string): The HTML report, None unless requested
+        pdf (bytes): The PDF report, None unless requested
+        output_paths (dict): The path of each output saved by run_case(), keyed by format
+        stage_seconds (dict): The time taken by each stage of the analysis
+    """
+
+    spec: CaseSpec
+    number_snps_imported: int
+    summary_snps_by_region: pd.DataFrame
+    informative_snps_by_region: pd.DataFrame
+    qc: pd.DataFrame
+    embryo_count_data: Optional[pd.DataFrame] = None
+    embryo_categories: Optional[pd.DataFrame] = None
+    flank_sensitivity: Optional[pd.DataFrame] = None
+    json: Optional[str] = None
+    html: Optional[str] = None
+    pdf: Optional[bytes] = None
+    output_paths: Dict[str, str] = field(default_factory=dict)
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+
+
+def case_result(spec, case, output_paths=None, pdf=None):
+    """Collect the results of a BasherCase whose requested outputs have been produced"""
+    return CaseResult(
+        spec=spec,
+        number_snps_imported=int(case.number_snps_imported),
+        summary_snps_by_region=case.summary_snps_by_region,
+        informative_snps_by_region=case.informative_snps_by_region,
+        qc=case.qc_df,
+        embryo_count_data=case.embryo_count_data_df,
+        embryo_categories=case.embryo_category_df,
+        flank_sensitivity=case.sensitivity_df,
+        json=case.json_string,
+        html=case.html_string,
+        pdf=pdf,
+        output_paths=output_paths or {},
+        stage_seconds=dict(case.stage_seconds),
+    )
+
+
+def run_case(
+    spec: CaseSpec,
+    inputs: Union[str, List[str]],
+    formats=("json",),
+    output_path: Optional[str] = None,
+    result_bundle: bool = False,
+) -> CaseResult:
+    """Run a BASHer case in this process
+    Args:
+        spec (CaseSpec): The case
+        inputs (string or list): The path of the SNP array file, or a list of SNP array files which are merged
+        formats (list): The outputs to produce, any of "json", "html" & "pdf"
+        output_path (string): If given, the outputs are also saved to this path, with their extensions added, as by
+            snp_haplotype.save_outputs()
+        result_bundle (bool): Whether to save the result bundle, only if output_path is given
+    Returns:
+        CaseResult: The results of the case
+    Raises:
+        CaseParameterError: If the spec or formats fail the checks in check_inputs.py
+    """
+    if not set(formats) <= set(snp_haplotype.report_formats):
+        raise CaseParameterError(
+            f"Invalid report formats, allowed formats are: {', '.join(snp_haplotype.report_formats)}"
+        )
+    if isinstance(inputs, (list, tuple)):
+        # The merged file is only needed while the case is run
+        with tempfile.TemporaryDirectory() as merge_folder:
+            input_file = os.path.join(merge_folder, "merged_array_files.txt")
+            merge_array_files.main(list(inputs)).to_csv(input_file, sep="\t")
+            return run_case(spec, input_file, formats, output_path, result_bundle)
+
+    args = spec.to_args(inputs, formats)
+    error_dictionary, input_ok_flag = check_input(args, inputs)
+    if not input_ok_flag:
+        raise CaseParameterError(
+            "; ".join(f"{field}: {error}" for field, error in error_dictionary.items())
+        )
+    case = snp_haplotype.BasherCase(args)
+    if case.incremental:
+        case.update_trio_cache()
+
+    if output_path is not None:
+        case.result_bundle = result_bundle
+        output_paths = snp_haplotype.save_outputs(case, output_path)
+        pdf = None
+        if "pdf" in output_paths:
+            with open(output_paths["pdf"], "rb") as f:
+                pdf = f.read()
+        return case_result(spec, case, output_paths, pdf)
+
+    for stage in [
+        "imported_df",
+        "results_df",
+        "embryo_category_df",
+        "qc_df",
+        "json_string",
+        "html_string",
+        "pdf_string",
+    ]:
+        case.timed_stage(stage)
+    pdf = None
+    if "pdf" in formats:
+        # pdfkit is only imported when a PDF is produced, the PDF is returned rather than saved
+        import pdfkit
+
+        progress.report("pdf", "Rendering the PDF report")
+        with case.stage_context("pdf_conversion"):
+            pdf = pdfkit.from_string(case.pdf_string, False)
+    return case_result(spec, case, pdf=pdf)
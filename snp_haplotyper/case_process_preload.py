@@ -0,0 +1,19 @@
+import os
+import sys
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import warmup
+
+# Imported by the fork server which starts the process of each case (see memory_limit.py), so every case's process is
+# forked with the reference data & libraries already loaded rather than loading them itself. The fork server stops if
+# this module raises anything other than ImportError, so a failed warm-up only means each case loads the data itself.
+try:
+    warmup.warm_up_reference_data()
+except Exception:
+    logger.exception("Could not load the BASHer reference data in the case fork server")
@@ -1,37 +1,29 @@
+import array_io
 import logging
 import re
 
+from logging_setup import collect_errors
 
-# Custom error handler which saves errors to a dictionary for feedback to user
-class DictErrorHandler(logging.Handler):
-    def __init__(self, error_dict):
-        super().__init__()
-        self.error_dict = error_dict
-
-    def emit(self, record):
-        if record.levelno == logging.ERROR:
-            error_msg = self.format(record)
-            if error_msg not in self.error_dict:
-                self.error_dict[error_msg] = 0
-            self.error_dict[error_msg] += 1
-
+logger = logging.getLogger("BASHer_logger")
 
-# TODO I originally had this script called using os - I now have it imported as a module  - so this code is not used to set the error_dict which is now done in app.py
-# I'll keep this code for present as I need to check what the commandline version uses.  Remove as appropriate.
 
-# Create an error dictionary
-error_dict = {}
+def check_input(input_namespace, input_file):
+    """Check the input arguments for the script, see check_arguments().
 
-# Initialize the custom error handler
-dict_error_handler = DictErrorHandler(error_dict)
+    Args:
+        input_namespace (argparse.Namespace): Input arguments.
+        input_file (str): The SNP array file.
 
-# Configure the logger to use the custom handler
-logger = logging.getLogger("BASHer_logger")
-logger.setLevel(logging.ERROR)
-logger.addHandler(dict_error_handler)
+    Returns:
+        tuple: The count of each error logged by the checks & True if input arguments are valid, False otherwise.
+    """
+    # Only the errors logged by this call are returned, so errors are not shared between requests to the web app
+    with collect_errors() as error_dict:
+        input_ok_flag = check_arguments(input_namespace, input_file)
+    return error_dict, input_ok_flag
 
 
-def check_input(input_namespace, input_file):
+def check_arguments(input_namespace, input_file):
     """Check the input arguments for the script.
 
     Args:
@@ -120,16 +112,14 @@ def check_input(input_namespace, input_file):
         logger.error("Invalid gene_symbol: must be a non-empty string.")
         input_ok_flag = False
 
-    # Check if input_file is a non-empty string and ends with csv or txt
+    # Check if input_file is a non-empty string and ends with one of the SNP array file extensions
     if not input_namespace.input_file or input_namespace.input_file.strip() == "":
         logger.error("Invalid input_file: must be a non-empty string.")
         input_ok_flag = False
-    elif not (
-        input_namespace.input_file.endswith(".csv")
-        or input_namespace.input_file.endswith(".txt")
-    ):
+    elif not array_io.has_array_file_extension(input_namespace.input_file):
         logger.error(
-            "Invalid input_file: must have a file extension of '.csv' or '.txt'."
+            f"Invalid input_file: must have one of the file extensions "
+            f"{', '.join(f'.{extension}' for extension in array_io.array_file_extensions)}."
         )
         input_ok_flag = False
 
@@ -292,4 +282,4 @@ def check_input(input_namespace, input_file):
             "In autosomal_dominant cases, both partners cannot be 'unaffected'."
         )
 
-    return error_dict, input_ok_flag
+    return input_ok_flag
@@ -0,0 +1,390 @@
+import contextlib
+import hashlib
+import json
+import os
+import re
+import secrets
+import shutil
+import sys
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import array_io
+from blob_store import BlobStore
+from exceptions import ArrayUploadError, ChunkChecksumError, ChunkOffsetError
+
+# Large SNP array exports are uploaded in chunks, each of which is small enough to be sent within the web app's
+# MAX_CONTENT_LENGTH. Chunks are appended to the upload's folder as they arrive and an interrupted upload is resumed
+# from the last chunk received. Gzip compressed exports are decompressed as they arrive, other formats read by
+# array_io.py are saved as they are uploaded. The saved file is hashed as it is written, and once the upload is used
+# by a case it is moved into the blob store (see blob_store.py) and linked into the case's folder.
+
+# Size of the chunks the browser is asked to send, must be less than the web app's MAX_CONTENT_LENGTH
+upload_chunk_size = 1024 * 1024
+
+# Each upload is saved in its own folder within the upload folder, so that it is purged with the reports
+upload_folder_prefix = "upload-"
+upload_id_pattern = re.compile(r"[0-9a-f]{32}")
+
+# The scanner of an upload which has not received a chunk in this process for this long is closed, see
+# evict_scanners(). The upload may have been abandoned or continued by another web server worker, and is rebuilt from
+# the data on disk if it receives another chunk here.
+scanner_idle_seconds = 10 * 60
+
+# The scanner for each upload this process has received chunks for, so chunks are parsed as they arrive. Chunks of
+# different uploads are received by several threads, so the dictionary is only used while holding its lock
+_scanners = {}
+_scanners_lock = threading.Lock()
+
+
+def stored_file_name(file_name):
+    """The name an uploaded SNP array file is saved as, gzip compressed files are saved decompressed
+    Args:
+        file_name (string): The name of the file being uploaded, already passed through secure_filename()
+    Returns:
+        string: The file name without any .gz extension
+    Raises:
+        ArrayUploadError: If the file is not a SNP array export
+    """
+    if not array_io.has_array_file_extension(file_name):
+        raise ArrayUploadError(
+            f"Invalid file type for SNP array file '{file_name}'. Allowed types are: "
+            f"{', '.join(array_io.array_file_extensions)}"
+        )
+    return file_name.removesuffix(".gz")
+
+
+def evict_scanners(max_idle_seconds=scanner_idle_seconds):
+    """Close the scanners of the uploads which have been idle in this process or whose folder has been removed, so
+    the files they are writing are closed & the space of purged uploads is freed. Called by the janitor thread of each
+    web server worker, as the chunks of an upload may have been received by any of them.
+    Args:
+        max_idle_seconds (float): The time since a scanner was last used after which it is closed
+    Returns:
+        int: The number of scanners closed
+    """
+    idle_since = time.monotonic() - max_idle_seconds
+    with _scanners_lock:
+        evicted = [
+            _scanners.pop(upload_id)
+            for upload_id, scanner in list(_scanners.items())
+            if scanner.last_used <= idle_since
+            or not os.path.exists(os.path.dirname(scanner.output_path))
+        ]
+    for scanner in evicted:
+        scanner.close()
+    return len(evicted)
+
+
+class ArrayFileScanner:
+    """Decompresses an upload as it arrives, writing the SNP array text to disk and parsing the header & probe rows
+    Parsing the header from the first chunk means a file which is not a SNP array export is rejected at the start of
+    the upload rather than when the analysis is run. The format is detected from the first chunk, files which are not
+    text or gzip compressed text are saved without being parsed.
+    Args:
+        output_path (string): Where to write the decompressed SNP array file
+    """
+
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.output = open(output_path, "wb")
+        # When the scanner was last used, see evict_scanners()
+        self.last_used = time.monotonic()
+        self.array_format = None
+        self.decompressor = None
+        self.bytes_received = 0
+        self.partial_line = b""
+        self.columns = None
+        self.probe_rows = 0
+        # The SHA-256 of the file saved, which it is stored under in the blob store
+        self.sha256 = hashlib.sha256()
+
+    def feed(self, chunk):
+        """Decompress, save & parse the next chunk of the upload"""
+        self.last_used = time.monotonic()
+        if self.array_format is None:
+            self.array_format = array_io.detect_array_format(chunk)
+            if self.array_format == "gzip":
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            elif self.array_format != "text":
+                # The probes are only counted in text files
+                self.probe_rows = None
+        self.bytes_received += len(chunk)
+        if self.array_format not in ["text", "gzip"]:
+            self.write(chunk)
+            return
+        if self.decompressor is None:
+            data = chunk
+        else:
+            data = self.decompressor.decompress(chunk)
+            # A gzip file can have several members, each of which needs a new decompressor
+            while self.decompressor.eof and self.decompressor.unused_data:
+                unused_data = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                data += self.decompressor.decompress(unused_data)
+        self.write(data)
+        lines = (self.partial_line + data).split(b"\n")
+        self.partial_line = lines.pop()
+        for line in lines:
+            self.parse_line(line)
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.output.write(data)
+
+    def parse_line(self, line):
+        """Read the column names from the first line, each later line is a probe"""
+        line = line.rstrip(b"\r")
+        if not line:
+            return
+        if self.columns is not None:
+            self.probe_rows += 1
+            return
+        self.columns = line.decode("utf-8", errors="replace").split("\t")
+        if not any(column in self.columns for column in array_io.probeset_id_columns):
+            raise ArrayUploadError(
+                f"The uploaded file is not a tab separated SNP array export, its first line has no "
+                f"'{array_io.probeset_id_columns[0]}' column."
+            )
+
+    def finish(self):
+        """Parse the last line & close the SNP array file once the whole upload has been received"""
+        if self.decompressor is not None and not self.decompressor.eof:
+            self.close()
+            raise ArrayUploadError("The uploaded gzip file is truncated or corrupt.")
+        self.parse_line(self.partial_line)
+        self.partial_line = b""
+        self.close()
+
+    def close(self):
+        self.output.close()
+
+
+class ChunkedUpload:
+    """A SNP array file uploaded in chunks, which is saved in its own folder within the upload folder
+    The chunks received are appended to a .part file, whose size is the offset the next chunk must start at, so that
+    an upload interrupted by a dropped connection, or continued by another web server worker, is resumed from the data
+    saved on disk.
+    Args:
+        upload_folder (string): The web app's upload folder
+        upload_id (string): The ID returned by ChunkedUpload.start()
+    Raises:
+        ArrayUploadError: If there is no upload with the ID
+    """
+
+    def __init__(self, upload_folder, upload_id):
+        if not upload_id_pattern.fullmatch(upload_id):
+            raise ArrayUploadError(f"Unknown upload {upload_id}.")
+        self.upload_id = upload_id
+        self.upload_folder = upload_folder
+        self.folder = os.path.join(upload_folder, f"{upload_folder_prefix}{upload_id}")
+        try:
+            with open(os.path.join(self.folder, "upload.json")) as f:
+                details = json.load(f)
+        except FileNotFoundError:
+            raise ArrayUploadError(
+                f"Unknown upload {upload_id}, it may have been purged."
+            )
+        self.file_name = details["file_name"]
+        self.size = details["size"]
+        # The header & number of probes, saved once the upload is complete
+        self.columns = details.get("columns")
+        self.probe_rows = details.get("probe_rows")
+        self.sha256 = details.get("sha256")
+        self.part_path = os.path.join(self.folder, f"{self.file_name}.part")
+        self.path = os.path.join(self.folder, stored_file_name(self.file_name))
+
+    @classmethod
+    def start(cls, upload_folder, file_name, size):
+        """Create the folder for a new upload
+        Args:
+            upload_folder (string): The web app's upload folder
+            file_name (string): The name of the file being uploaded, already passed through secure_filename()
+            size (int): The size of the file in bytes
+        Returns:
+            ChunkedUpload: The new upload
+        """
+        stored_file_name(file_name)
+        if size <= 0:
+            raise ArrayUploadError(f"The SNP array file '{file_name}' is empty.")
+        upload_id = secrets.token_hex(16)
+        folder = os.path.join(upload_folder, f"{upload_folder_prefix}{upload_id}")
+        os.mkdir(folder)
+        with open(os.path.join(folder, "upload.json"), "w") as f:
+            json.dump({"file_name": file_name, "size": size}, f)
+        open(os.path.join(folder, f"{file_name}.part"), "wb").close()
+        logger.info(f"Started upload {upload_id} of {file_name}, {size} bytes")
+        return cls(upload_folder, upload_id)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Hold the upload's lock, so its chunks are checked, parsed & saved by one thread or web server worker at a
+        time. The lock is an flock of the .part file, which is only supported on Linux & macOS.
+        Raises:
+            ArrayUploadError: If the upload was deleted, e.g. by a chunk received at the same time
+        """
+        try:
+            lock_file = open(self.part_path, "ab")
+        except FileNotFoundError:
+            raise ArrayUploadError(
+                f"Unknown upload {self.upload_id}, it may have been purged."
+            )
+        with lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            if not os.path.exists(self.part_path):
+                raise ArrayUploadError(
+                    f"Unknown upload {self.upload_id}, it may have been purged."
+                )
+            yield
+
+    @property
+    def offset(self):
+        """The number of bytes received so far"""
+        return os.path.getsize(self.part_path)
+
+    def scanner(self):
+        """The scanner for this upload, rebuilt from the data on disk if the chunks so far were received by another
+        process, this process has restarted or the scanner was closed while idle. Only called while holding the
+        upload's lock."""
+        offset = self.offset
+        with _scanners_lock:
+            scanner = _scanners.get(self.upload_id)
+            if scanner is not None:
+                scanner.last_used = time.monotonic()
+        if scanner is None or scanner.bytes_received != offset:
+            if scanner is not None:
+                # Chunks were received by another worker since the scanner was last used, so it is out of date
+                with _scanners_lock:
+                    _scanners.pop(self.upload_id, None)
+                scanner.close()
+            scanner = ArrayFileScanner(self.path)
+            with open(self.part_path, "rb") as f:
+                while chunk := f.read(upload_chunk_size):
+                    scanner.feed(chunk)
+            with _scanners_lock:
+                _scanners[self.upload_id] = scanner
+        return scanner
+
+    def write_chunk(self, offset, chunk, sha256):
+        """Verify & save the next chunk of the upload
+        Args:
+            offset (int): The position of the chunk in the file
+            chunk (bytes): The chunk
+            sha256 (string): The hex SHA-256 checksum of the chunk
+        Raises:
+            ChunkChecksumError: If the checksum does not match the chunk, which is not saved
+            ChunkOffsetError: If the chunk does not start at the end of the data received so far
+            ArrayUploadError: If the chunk would make the file larger than its size or the file is not a SNP array
+                export. The upload is deleted, as it cannot be resumed.
+        """
+        if hashlib.sha256(chunk).hexdigest() != sha256.lower():
+            raise ChunkChecksumError(
+                f"The checksum of the chunk at {offset} of upload {self.upload_id} does not match."
+            )
+        # A chunk resent by the browser can arrive while the first copy is still being saved, by another thread or
+        # worker, so the offset is checked & the chunk saved while holding the upload's lock
+        with self.lock():
+            self.save_chunk(offset, chunk)
+
+    def save_chunk(self, offset, chunk):
+        """Save a verified chunk of the upload, see write_chunk(). Only called while holding the upload's lock."""
+        if offset != self.offset:
+            raise ChunkOffsetError(
+                f"The chunk at {offset} of upload {self.upload_id} does not follow the {self.offset} bytes received.",
+                self.offset,
+            )
+        if offset + len(chunk) > self.size:
+            self.delete()
+            raise ArrayUploadError(
+                f"Upload {self.upload_id} is larger than the {self.size} bytes expected."
+            )
+        scanner = self.scanner()
+        try:
+            scanner.feed(chunk)
+            with open(self.part_path, "ab") as f:
+                f.write(chunk)
+            if offset + len(chunk) == self.size:
+                with _scanners_lock:
+                    del _scanners[self.upload_id]
+                scanner.finish()
+                self.columns = scanner.columns
+                self.probe_rows = scanner.probe_rows
+                self.sha256 = scanner.sha256.hexdigest()
+                with open(os.path.join(self.folder, "upload.json"), "w") as f:
+                    json.dump(
+                        {
+                            "file_name": self.file_name,
+                            "size": self.size,
+                            "columns": self.columns,
+                            "probe_rows": self.probe_rows,
+                            "sha256": self.sha256,
+                        },
+                        f,
+                    )
+                logger.info(
+                    f"Received upload {self.upload_id} of {self.file_name}, {scanner.probe_rows} probes"
+                )
+        except (ArrayUploadError, zlib.error) as error:
+            self.delete()
+            raise ArrayUploadError(
+                f"Upload of '{self.file_name}' failed: {error}"
+            ) from error
+
+    def status(self):
+        """The progress of the upload & the header parsed so far, which the browser uses to resume the upload
+        Returns:
+            dict: The upload ID, file name, size, offset & whether it is complete, the SNP array columns & the number
+            of probe rows received
+        """
+        with self.lock():
+            offset = self.offset
+            scanner = self.scanner() if offset < self.size else None
+        return {
+            "upload_id": self.upload_id,
+            "file_name": self.file_name,
+            "size": self.size,
+            "offset": offset,
+            "chunk_size": upload_chunk_size,
+            "complete": offset == self.size,
+            "columns": scanner.columns if scanner else self.columns,
+            "probe_rows": scanner.probe_rows if scanner else self.probe_rows,
+        }
+
+    def move_to(self, folder):
+        """Move the received SNP array file into the blob store & link it into a case's folder
+        Args:
+            folder (string): The folder the case's input files are saved in
+        Returns:
+            string: The path of the SNP array file
+        """
+        if self.offset != self.size:
+            raise ArrayUploadError(
+                f"The upload of '{self.file_name}' is incomplete, {self.offset} of {self.size} bytes received."
+            )
+        path = os.path.join(folder, os.path.basename(self.path))
+        blob_store = BlobStore(self.upload_folder)
+        blob_store.link(blob_store.add_file(self.path, self.sha256), path)
+        self.delete()
+        return path
+
+    def delete(self):
+        """Remove the upload's folder"""
+        with _scanners_lock:
+            scanner = _scanners.pop(self.upload_id, None)
+        if scanner is not None:
+            scanner.close()
+        shutil.rmtree(self.folder, ignore_errors=True)
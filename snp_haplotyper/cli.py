@@ -0,0 +1,171 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import os
+import sys
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+# Each subcommand only imports the modules it needs when it is run, so that starting the command line tool (and
+# every process started by the batch subcommand) does not pay for the plotting, PDF & templating libraries
+
+# Import command line arguments
+parser = argparse.ArgumentParser(
+    description="BASHer command line tool, use 'cli.py <subcommand> --help' for the options of each subcommand"
+)
+subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+subparsers.add_parser(
+    "run",
+    add_help=False,
+    help="Run BASHer for a single case, takes the same arguments as snp_haplotype.py",
+)
+subparsers.add_parser(
+    "merge",
+    add_help=False,
+    help="Merge SNP array files, takes the same arguments as merge_array_files.py",
+)
+subparsers.add_parser(
+    "parse-sheet",
+    add_help=False,
+    help="Parse a sample sheet and run BASHer, takes the same arguments as excel_parser.py",
+)
+subparsers.add_parser(
+    "prescreen",
+    add_help=False,
+    help="Pre-screen a trio across a panel of genes, takes the same arguments as trio_prescreen.py",
+)
+subparsers.add_parser(
+    "replay",
+    add_help=False,
+    help="Replay archived cases and compare them with their result bundles, takes the same arguments as replay_cases.py",
+)
+batch_parser = subparsers.add_parser(
+    "batch", help="Parse a list of sample sheets and run BASHer for each case"
+)
+batch_parser.add_argument(
+    "input_spreadsheets",
+    type=str,
+    nargs="+",
+    help="Excel files containing SNP Array meta data",
+)
+batch_parser.add_argument(
+    "--formats",
+    type=str,
+    nargs="+",
+    choices=["json", "html", "pdf"],
+    default=["html", "pdf"],
+    help="The outputs to produce for each case",
+)
+batch_parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=1,
+    help="Number of cases to run in parallel",
+)
+
+
+def run(argv):
+    import snp_haplotype
+
+    snp_haplotype.run(snp_haplotype.build_parser().parse_args(argv))
+
+
+def merge(argv):
+    import merge_array_files
+
+    args = merge_array_files.parser.parse_args(argv)
+    merge_array_files.write_merged_file(merge_array_files.main(args.input), args.output)
+
+
+def parse_sheet(argv):
+    import excel_parser
+
+    excel_parser.main(excel_parser.parser.parse_args(argv))
+
+
+def prescreen(argv):
+    import trio_prescreen
+
+    args = trio_prescreen.parser.parse_args(argv)
+    prescreen_df = trio_prescreen.main(args)
+    if args.output_file is None:
+        print(prescreen_df.to_string(index=False))
+    else:
+        prescreen_df.to_csv(args.output_file, sep="\t", index=False)
+
+
+def replay(argv):
+    import replay_cases
+
+    summary = replay_cases.main(replay_cases.parser.parse_args(argv))
+    print(summary["statuses"])
+    return 0 if replay_cases.replay_passed(summary) else 1
+
+
+def run_sample_sheet(input_spreadsheet, formats):
+    """Parse a sample sheet and run BASHer for the case
+    Args:
+        input_spreadsheet (string): Path to the Excel file containing the SNP Array meta data
+        formats (list): The outputs to produce
+    Returns:
+        tuple: The path to the sample sheet and a dictionary of any input errors
+    """
+    import excel_parser
+
+    args, error_dictionary, input_ok_flag = excel_parser.main(
+        argparse.Namespace(
+            input_spreadsheet=input_spreadsheet,
+            snp_array_file=None,
+            run_basher=True,
+            formats=formats,
+        )
+    )
+    return input_spreadsheet, {} if input_ok_flag else error_dictionary
+
+
+def batch(args):
+    failed_cases = 0
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        futures = [
+            executor.submit(run_sample_sheet, input_spreadsheet, args.formats)
+            for input_spreadsheet in args.input_spreadsheets
+        ]
+        for future in futures:
+            input_spreadsheet, error_dictionary = future.result()
+            if error_dictionary != {}:
+                failed_cases += 1
+                logger.error(
+                    f"{input_spreadsheet} failed input checks: {error_dictionary}"
+                )
+    return failed_cases
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args, remaining_argv = parser.parse_known_args(argv)
+    if args.subcommand == "run":
+        run(remaining_argv)
+    elif args.subcommand == "merge":
+        merge(remaining_argv)
+    elif args.subcommand == "parse-sheet":
+        parse_sheet(remaining_argv)
+    elif args.subcommand == "prescreen":
+        prescreen(remaining_argv)
+    elif args.subcommand == "replay":
+        return replay(remaining_argv)
+    elif args.subcommand == "batch":
+        # The batch subcommand has its own arguments so none should remain
+        parser.parse_args(argv)
+        return 1 if batch(args) > 0 else 0
+    return 0
+
+
+# run the script
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,3 +24,48 @@ released_to_production = False
 output_folder = "/home/graeme/Desktop/SNP_haplotyper/output"
 
 input_folder = "/home/graeme/Desktop/SNP_haplotyper/"
+
+# Folder used by trio_cache.py to cache trio classifications for incremental analysis, can be overridden by the
+# TRIO_CACHE_FOLDER environment variable
+trio_cache_folder = "/home/graeme/Desktop/SNP_haplotyper/trio_cache"
+
+# Renderer used for the static plots in the PDF report, "svg" writes the plots directly with svg_plot.py while
+# "kaleido" exports the Plotly figures used in the HTML report with Kaleido
+static_plot_renderer = "svg"
+
+# Number of days the web app keeps uploads & reports for, so that reports can be downloaded again, before they are
+# purged. Can be overridden by the REPORT_RETENTION_DAYS environment variable
+report_retention_days = 30
+
+# Number of cases submitted through the API which each web server worker runs at the same time, further cases are
+# queued
+api_job_workers = 1
+
+# Log file of the web service, written by a single thread in each web server worker, see logging_setup.py
+log_file = "/var/local/basher/logs/basher_error.log"
+
+# Maximum total size in GB of the uploads & reports the web app keeps, the oldest cases are removed before the
+# retention period if it is exceeded. Can be overridden by the UPLOAD_QUOTA_GB environment variable
+upload_quota_gb = 50
+
+# Minutes between the clean ups of expired sessions, jobs, uploads & reports by the web app, see janitor.py
+janitor_interval_minutes = 10
+
+# The database of the web app's sessions, job statuses & metrics, created in SESSION_FILE_DIR, see artefact_store.py
+artefact_store_file_name = "basher_store.sqlite3"
+
+# Cases submitted through the API which are expected to take longer than this are rejected, see cost_model.py
+job_time_budget_minutes = 60
+
+# Memory in GB available to the cases run at the same time by each web server worker. Cases expected to need more are
+# rejected, and queued cases wait until there is enough memory for them
+job_memory_budget_gb = 8
+
+# Seconds taken off the expected runtime of a queued case for each second it has waited, so long cases are not
+# starved by a stream of shorter ones, see job_scheduler.py
+job_aging_factor = 1.0
+
+# Memory in GB each case run by the web app can use. Each case is run in its own process with this limit, a case which
+# exceeds it is run again in low memory mode, see memory_limit.py. Can be overridden by the JOB_MEMORY_CEILING_GB
+# environment variable, 0 runs cases without a limit
+job_memory_ceiling_gb = 4
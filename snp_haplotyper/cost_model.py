@@ -0,0 +1,194 @@
+import os
+import sys
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+
+# The runtime of a case is estimated from the number of probes on the array, the number of embryos, the flanking region,
+# the mode of inheritance & the reports requested, so the API can run quick cases (e.g. trio only pre-screens) before
+# long ones & reject cases which would exceed the web server's time or memory budgets. The model is a linear
+# regression of the runtime of the cases completed by the API, which starts from the prior_coefficients below and is
+# refitted as cases complete. The memory needed is estimated from the size of the imported SNP array table.
+
+# The number of probes assumed for an array file which cannot be counted, the size of an Axiom PGT array
+typical_array_probes = 800000
+
+# The seconds each term of the model adds to the runtime, before any cases have been recorded
+prior_coefficients = {
+    "intercept": 5.0,
+    "million_probes": 10.0,
+    "million_probe_embryos": 5.0,
+    "flank_mb": 1.0,
+    "x_linked_million_probes": 5.0,
+    "autosomal_recessive_million_probes": 5.0,
+    "json": 1.0,
+    "html": 15.0,
+    "pdf": 30.0,
+}
+
+# The weight of the prior coefficients in the fit, as a number of cases, so a few unusual cases do not swing the model
+prior_weight = 5.0
+
+# The bytes of memory used for each probe & sample column of the imported SNP array table, including the copies made
+# by the analysis, and the memory used by every case
+memory_bytes_per_probe_sample = 600
+base_memory_bytes = 300 * 1024 * 1024
+
+# Cases predicted to take longer than this, or to need more memory than job_memory_budget_gb, are rejected by the API
+job_time_budget_seconds = config.job_time_budget_minutes * 60
+job_memory_budget_bytes = config.job_memory_budget_gb * 1024 * 1024 * 1024
+
+
+@dataclass
+class CaseFeatures:
+    """The properties of a case which its runtime is estimated from"""
+
+    probes: int
+    embryos: int
+    flank_mb: float
+    mode_of_inheritance: str
+    formats: list
+
+    @classmethod
+    def from_args(cls, args, probes):
+        """The features of a case
+        Args:
+            args (Namespace): The arguments of the case
+            probes (int): The number of probes in the case's SNP array file, None if they could not be counted
+        """
+        # snp_haplotype is only imported when a case is submitted
+        import snp_haplotype
+
+        return cls(
+            probes=typical_array_probes if probes is None else probes,
+            embryos=0 if args.trio_only else len(args.embryo_ids or []),
+            flank_mb=snp_haplotype.flanking_region_size_to_bp(
+                args.flanking_region_size or "2mb"
+            )
+            / 1e6,
+            mode_of_inheritance=args.mode_of_inheritance,
+            formats=sorted(args.formats or []),
+        )
+
+    def terms(self):
+        """The value of each term of the model for the case"""
+        import snp_haplotype
+
+        million_probes = self.probes / 1e6
+        return {
+            "intercept": 1.0,
+            "million_probes": million_probes,
+            "million_probe_embryos": million_probes * self.embryos,
+            "flank_mb": self.flank_mb,
+            "x_linked_million_probes": million_probes
+            * (self.mode_of_inheritance == "x_linked"),
+            "autosomal_recessive_million_probes": million_probes
+            * (self.mode_of_inheritance == "autosomal_recessive"),
+        } | {
+            report_format: float(report_format in self.formats)
+            for report_format in snp_haplotype.report_formats
+        }
+
+    def memory_bytes(self):
+        """The memory needed to run the case, the trio & embryo columns of the imported table"""
+        return int(
+            base_memory_bytes
+            + self.probes * (3 + self.embryos) * memory_bytes_per_probe_sample
+        )
+
+
+@dataclass
+class CostPrediction:
+    """The estimated runtime & memory of a case"""
+
+    seconds: float
+    memory_bytes: int
+
+    def to_dict(self):
+        return asdict(self)
+
+
+class CostModel:
+    """Estimates the runtime of cases from the features & runtimes of the cases recorded so far
+    Args:
+        cases (list): The features (CaseFeatures) & runtime in seconds of each recorded case
+    """
+
+    def __init__(self, cases=()):
+        self.cases = list(cases)
+        prior = np.array(list(prior_coefficients.values()))
+        if self.cases:
+            x = np.array(
+                [list(features.terms().values()) for features, seconds in self.cases]
+            )
+            y = np.array([seconds for features, seconds in self.cases])
+            # Ridge regression towards the prior, so terms which do not vary between the recorded cases keep their
+            # prior coefficient
+            penalty = prior_weight * np.identity(len(prior))
+            coefficients = np.linalg.solve(x.T @ x + penalty, x.T @ y + penalty @ prior)
+            # No term makes a case quicker, a negative coefficient is noise in the recorded runtimes
+            coefficients = np.maximum(coefficients, 0)
+        else:
+            coefficients = prior
+        self.coefficients = dict(zip(prior_coefficients, coefficients))
+
+    def predict(self, features):
+        """The estimated runtime & memory of a case
+        Args:
+            features (CaseFeatures): The features of the case
+        Returns:
+            CostPrediction: The estimate, a case is never estimated to take less than a second
+        """
+        seconds = sum(
+            self.coefficients[term] * value for term, value in features.terms().items()
+        )
+        return CostPrediction(
+            seconds=round(max(seconds, 1.0), 1), memory_bytes=features.memory_bytes()
+        )
+
+    def summary(self):
+        """The coefficients of the model & its mean absolute error on the recorded cases"""
+        errors = [
+            abs(self.predict(features).seconds - seconds)
+            for features, seconds in self.cases
+        ]
+        return {
+            "cases": len(self.cases),
+            "coefficients": {
+                term: round(coefficient, 3)
+                for term, coefficient in self.coefficients.items()
+            },
+            "mean_absolute_error_seconds": round(float(np.mean(errors)), 1)
+            if errors
+            else None,
+        }
+
+
+def budget_errors(prediction):
+    """The budgets a case would exceed
+    Args:
+        prediction (CostPrediction): The estimated runtime & memory of the case
+    Returns:
+        list: A message for each budget exceeded, empty if the case can be run
+    """
+    errors = []
+    if prediction.seconds > job_time_budget_seconds:
+        errors.append(
+            f"The case is expected to take {prediction.seconds / 60:.0f} minutes, more than the "
+            f"{job_time_budget_seconds / 60:.0f} minute limit."
+        )
+    if prediction.memory_bytes > job_memory_budget_bytes:
+        errors.append(
+            f"The case is expected to need {prediction.memory_bytes / 1024 ** 3:.1f}GB of memory, more than the "
+            f"{job_memory_budget_bytes / 1024 ** 3:.1f}GB limit."
+        )
+    return errors
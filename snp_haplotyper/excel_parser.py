@@ -10,33 +10,10 @@ import os
 import subprocess
 import sys
 import config as config
-import snp_haplotype
+from logging_setup import collect_errors
 
 
-# Custom error handler which saves errors to a dictionary for feedback to user
-class DictErrorHandler(logging.Handler):
-    def __init__(self, error_dict):
-        super().__init__()
-        self.error_dict = error_dict
-
-    def emit(self, record):
-        if record.levelno == logging.ERROR:
-            error_msg = self.format(record)
-            if error_msg not in self.error_dict:
-                self.error_dict[error_msg] = 0
-            self.error_dict[error_msg] += 1
-
-
-# Create an error dictionary
-error_dict_parser = {}
-
-# Initialize the custom error handler
-dict_error_handler = DictErrorHandler(error_dict_parser)
-
-# Configure the logger to use the custom handler
 logger = logging.getLogger("BASHer_logger")
-logger.setLevel(logging.ERROR)
-logger.addHandler(dict_error_handler)
 
 
 # Add the directory containing this script to the PYTHOPATH
@@ -92,7 +69,7 @@ def load_workbook_range(range_string, worksheet):
     return pd.DataFrame(data_rows, columns=get_column_interval(col_start, col_end))
 
 
-def parse_excel_input(input_spreadsheet, snp_array_file=None):
+def read_excel_input(input_spreadsheet, snp_array_file=None):
     """
     Imports the following defined cells/ranges from the provided excel file:
         biopsy_number
@@ -150,6 +127,9 @@ def parse_excel_input(input_spreadsheet, snp_array_file=None):
         ref_seq
         ref_status
         template_version
+
+    Returns:
+        tuple: The arguments of the case & the path of its SNP array file
     """
     wb = load_workbook(
         filename=input_spreadsheet,
@@ -159,7 +139,6 @@ def parse_excel_input(input_spreadsheet, snp_array_file=None):
     )
 
     argument_dict = {}
-    error_dict_parser = {}
 
     # Get list of defined ranges from provided excel sheet
     defined_ranges = wb.defined_names
@@ -237,7 +216,7 @@ def parse_excel_input(input_spreadsheet, snp_array_file=None):
         if "embryo_sex" in embryo_data_df.columns:
             embryo_data_df["embryo_sex"] = embryo_data_df["embryo_sex"].str.lower()
         else:
-            logging.error('Key "embryo_sex" is missing from the DataFrame')
+            logger.error('Key "embryo_sex" is missing from the DataFrame')
 
         # If data has been passed in for the embryo data sheet, check that the selected biopsy number is in the sheet
         if (
@@ -500,6 +479,21 @@ def parse_excel_input(input_spreadsheet, snp_array_file=None):
         f"PRU={pru};Hospital No={female_partner_hosp_num};Biopsy No={biopsy_number}"
     )
 
+    return args, input_filepath
+
+
+def parse_excel_input(input_spreadsheet, snp_array_file=None):
+    """
+    Reads the case from the provided excel file, see read_excel_input(), & checks that it is valid.
+
+    Returns:
+        tuple: The arguments of the case, the count of each error & whether the input is valid
+    """
+    # Errors logged while the sample sheet is read are collected for this call only, so they are not reported to other
+    # users of the web app
+    with collect_errors() as error_dict_parser:
+        args, input_filepath = read_excel_input(input_spreadsheet, snp_array_file)
+
     # Use check_inputs.py module to ensure the input data is valid
     error_dictionary, input_ok_flag = check_input(args, input_filepath)
 
@@ -518,13 +512,23 @@ def parse_excel_input(input_spreadsheet, snp_array_file=None):
 def main(excel_parser_args):
     # If the user has specified the run_basher flag, then parse the excel input and run snp_haplotyper
     if excel_parser_args.run_basher:
+        # snp_haplotype is only imported when BASHer is run
+        import snp_haplotype
+
         if excel_parser_args.snp_array_file is None:
-            excel_import = parse_excel_input(excel_parser_args.input_spreadsheet)
+            args, error_dictionary, input_ok_flag = parse_excel_input(
+                excel_parser_args.input_spreadsheet
+            )
         else:
-            excel_import = parse_excel_input(
+            args, error_dictionary, input_ok_flag = parse_excel_input(
                 excel_parser_args.input_spreadsheet, excel_parser_args.snp_array_file
             )
-        snp_haplotype.main(excel_import)
+        if input_ok_flag:
+            args.formats = getattr(
+                excel_parser_args, "formats", snp_haplotype.default_report_formats
+            )
+            snp_haplotype.run(args)
+        return args, error_dictionary, input_ok_flag
     # If the user has not specified the run_basher flag, then just parse the excel input
     else:
         excel_import = parse_excel_input(excel_parser_args.input_spreadsheet)
@@ -15,3 +15,63 @@ class InvalidParameterSelectedError(Error):
     """The config.py has a flag prohibiting the script from running with the selected parameters.  This is to prevent the user from running the script for options which have not yet been validated."""
 
     pass
+
+
+class ArrayUploadError(Error):
+    """Raised when a chunked SNP array upload is invalid, for example an unknown upload, a file which is not a SNP array export or a corrupt gzip file"""
+
+    pass
+
+
+class ChunkChecksumError(ArrayUploadError):
+    """Raised when the SHA-256 checksum of an uploaded chunk does not match the checksum sent with it, the chunk should be resent"""
+
+    pass
+
+
+class ChunkOffsetError(ArrayUploadError):
+    """Raised when an uploaded chunk does not start where the data received so far ends, the upload should be resumed from the offset received"""
+
+    def __init__(self, message, offset):
+        super().__init__(message)
+        self.offset = offset
+
+
+class ResultBundleError(Error):
+    """Raised when a result bundle cannot be loaded, for example it was written by a newer version of BASHer or a table does not match the hash in its manifest"""
+
+    pass
+
+
+class JobNotFoundError(Error):
+    """Raised when a case submitted through the API cannot be found, it may have been purged after the retention period"""
+
+    pass
+
+
+class CaseParameterError(Error):
+    """Raised when the parameters of a case submitted through the API are invalid"""
+
+    pass
+
+
+class CaseBudgetError(Error):
+    """Raised when a case submitted through the API is expected to exceed the time or memory budget of the web server, see cost_model.py"""
+
+    def __init__(self, message, prediction):
+        super().__init__(message)
+        self.prediction = prediction
+
+
+class CaseMemoryError(Error):
+    """Raised when a case run in its own process exceeds the memory ceiling of each case, or the process is killed, see memory_limit.py"""
+
+    pass
+
+
+class CaseProcessError(Error):
+    """Raised when a case run in its own process fails, with the type of the error raised in that process"""
+
+    def __init__(self, message, error_type):
+        super().__init__(message)
+        self.error_type = error_type
@@ -0,0 +1,278 @@
+import os
+import shutil
+import socket
+import sys
+import threading
+import time
+from collections import Counter
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import chunked_upload
+import config as config
+import progress
+import report_archive
+import trio_cache
+from blob_store import BlobStore, blob_folder_name
+
+# The janitor fails the cases whose worker has stopped (see progress.claim_case()), removes expired sessions, jobs &
+# progress events from the ArtefactStore (see artefact_store.py) and the uploads & reports in the upload folder which
+# are past the retention period, or the oldest of them if the folder is over its size quota. It runs in a background
+# thread of each web server worker, which also renews the worker's heartbeat & closes the worker's idle upload scanners
+# (see chunked_upload.evict_scanners()), and a lease in the store ensures only one worker cleans up in each interval.
+# The space reclaimed is added to the store's metrics. The SNP array files in the blob store (see blob_store.py) are
+# removed once no case links to them, and the trio classifications cached for incremental analysis (see trio_cache.py)
+# once they have not been used for the retention period.
+
+# The total size of the upload folder, the oldest cases are removed before the retention period if it is exceeded
+upload_quota_bytes = (
+    float(os.getenv("UPLOAD_QUOTA_GB", config.upload_quota_gb)) * 1024 * 1024 * 1024
+)
+
+# Cases are not removed to meet the quota until they are this old, so uploads & analyses in progress are kept
+quota_grace_seconds = 60 * 60
+
+# The janitor thread of this process, see start_janitor()
+janitor_thread = {"pid": None, "janitor": None}
+
+
+def path_usage(path):
+    """The total size in bytes of a file, or of the files in a folder, and the files in it linked from the blob store
+    Linked files are not counted in the size, as removing them only reclaims space once no case links to them.
+    Returns:
+        tuple: The size & a Counter of the links to each stored file, keyed by its (device, inode)
+    """
+    if os.path.isdir(path):
+        paths = [
+            os.path.join(root, file_name)
+            for root, folders, files in os.walk(path)
+            for file_name in files
+        ]
+    else:
+        paths = [path]
+    size = 0
+    links = Counter()
+    for file_path in paths:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            continue
+        if stat.st_nlink == 1:
+            size += stat.st_size
+        else:
+            links[(stat.st_dev, stat.st_ino)] += 1
+    return size, links
+
+
+def remove_path(path):
+    """Remove a file or folder which may already have been removed by another worker"""
+    try:
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def job_id_of(path):
+    """The ID of the API job whose folder is at the path, None if it is not a job folder"""
+    # job_manager is only imported to identify job folders
+    from job_manager import job_folder_prefix
+
+    name = os.path.basename(path)
+    return (
+        name[len(job_folder_prefix) :] if name.startswith(job_folder_prefix) else None
+    )
+
+
+class Janitor:
+    """Cleans up the web app's sessions, jobs, uploads & reports
+    Args:
+        upload_folder (string): The web app's upload folder
+        store (ArtefactStore): The store of the web app's sessions & jobs
+        retention_days (float): The number of days to keep uploads & reports for
+        quota_bytes (float): The maximum total size of the upload folder
+        interval_seconds (float): The time between clean ups
+    """
+
+    def __init__(
+        self,
+        upload_folder,
+        store,
+        retention_days=report_archive.report_retention_days,
+        quota_bytes=upload_quota_bytes,
+        interval_seconds=config.janitor_interval_minutes * 60,
+    ):
+        self.upload_folder = upload_folder
+        self.store = store
+        self.retention_days = retention_days
+        self.quota_bytes = quota_bytes
+        self.interval_seconds = interval_seconds
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.stopped = threading.Event()
+
+    def clean(self):
+        """Fail the cases whose worker has stopped, remove the expired sessions, jobs, uploads & reports, and the
+        oldest cases if the quota is exceeded, then the SNP array files no remaining case links to
+        Returns:
+            dict: The number of sessions, jobs & files removed and the bytes reclaimed
+        """
+        # job_manager is only imported to fail the cases whose worker has stopped
+        from job_manager import fail_orphaned_cases
+
+        start = time.perf_counter()
+        expired_sessions = self.store.delete_expired_sessions()
+        self.store.delete_expired_progress()
+        # The cases are failed before the quota is enforced, so the folders of orphaned jobs are no longer kept
+        orphaned_cases = fail_orphaned_cases(self.store)
+        self.store.delete_expired_leases()
+
+        # The size of each case's uploads & reports is measured before they are removed
+        sizes = {}
+        with os.scandir(self.upload_folder) as entries:
+            for entry in entries:
+                if entry.name == blob_folder_name:
+                    continue
+                try:
+                    sizes[entry.path] = (
+                        entry.stat(follow_symlinks=False).st_mtime,
+                        *path_usage(entry.path),
+                    )
+                except FileNotFoundError:
+                    continue
+        removed = {path: "age" for path in self.expired_job_folders(sizes)}
+        for path in removed:
+            remove_path(path)
+        # The blob store is shared by every case, its files are removed by BlobStore.collect_garbage() below
+        for path in report_archive.purge_expired_reports(
+            self.upload_folder, self.retention_days, exclude=[blob_folder_name]
+        ):
+            removed[path] = "age"
+
+        # The oldest cases are removed until the folder is within its quota, cases which are running or were recently
+        # uploaded are kept. The stored SNP array files count towards the quota, but are only removed with the cases.
+        # Each stored file is charged to the case holding its last link, as it is removed by
+        # BlobStore.collect_garbage() below once that case is removed.
+        blob_store = BlobStore(self.upload_folder)
+        reclaimable_blobs = blob_store.reclaimable_objects()
+        active_jobs = set(self.store.active_jobs())
+        kept = sorted(
+            (mtime, path)
+            for path, (mtime, size, links) in sizes.items()
+            if path not in removed
+        )
+        used_bytes = blob_store.size() + sum(sizes[path][1] for mtime, path in kept)
+        for mtime, path in kept:
+            if used_bytes <= self.quota_bytes:
+                break
+            if (
+                mtime > time.time() - quota_grace_seconds
+                or job_id_of(path) in active_jobs
+            ):
+                continue
+            remove_path(path)
+            removed[path] = "quota"
+            used_bytes -= sizes[path][1]
+            for blob, links in sizes[path][2].items():
+                if blob in reclaimable_blobs:
+                    size, remaining_links = reclaimable_blobs[blob]
+                    reclaimable_blobs[blob] = (size, remaining_links - links)
+                    if remaining_links - links == 0:
+                        used_bytes -= size
+
+        reclaimed_blob_bytes = blob_store.collect_garbage(self.retention_days)
+        used_bytes = blob_store.size() + sum(
+            sizes[path][1] for mtime, path in kept if path not in removed
+        )
+        reclaimed_trio_cache_bytes = trio_cache.purge_expired_cases(self.retention_days)
+
+        removed_jobs = {job_id_of(path) for path in removed} - {None}
+        self.store.delete_jobs(set(self.store.expired_jobs()) | removed_jobs)
+        # Files created since the folder was scanned have no size & are counted as 0 bytes
+        reclaimed = {
+            reason: sum(
+                sizes.get(path, (0, 0, None))[1]
+                for path in removed
+                if removed[path] == reason
+            )
+            for reason in ["age", "quota"]
+        }
+        reclaimed["blobs"] = reclaimed_blob_bytes
+        reclaimed["trio_cache"] = reclaimed_trio_cache_bytes
+        self.store.add_metrics(
+            janitor_runs=1,
+            janitor_expired_sessions=expired_sessions,
+            janitor_removed_jobs=len(removed_jobs),
+            janitor_orphaned_cases=len(orphaned_cases),
+            janitor_removed_files=len(removed),
+            janitor_reclaimed_bytes=sum(reclaimed.values()),
+            janitor_reclaimed_bytes_age=reclaimed["age"],
+            janitor_reclaimed_bytes_quota=reclaimed["quota"],
+            janitor_reclaimed_bytes_blobs=reclaimed["blobs"],
+            janitor_reclaimed_bytes_trio_cache=reclaimed["trio_cache"],
+        )
+        self.store.set_metrics(
+            janitor_last_run=time.time(),
+            janitor_last_run_seconds=time.perf_counter() - start,
+            upload_folder_bytes=used_bytes,
+        )
+        if removed or expired_sessions:
+            logger.info(
+                f"Janitor removed {expired_sessions} sessions & {len(removed)} cases, reclaiming "
+                f"{sum(reclaimed.values()) / 1024 / 1024:.1f}MB"
+            )
+        return {
+            "expired_sessions": expired_sessions,
+            "removed_jobs": len(removed_jobs),
+            "orphaned_cases": len(orphaned_cases),
+            "removed_files": len(removed),
+            "reclaimed_bytes": reclaimed,
+            "upload_folder_bytes": used_bytes,
+        }
+
+    def expired_job_folders(self, sizes):
+        """The folders of the expired jobs, which may be newer than the retention period if they were updated"""
+        expired_jobs = set(self.store.expired_jobs())
+        return [path for path in sizes if job_id_of(path) in expired_jobs]
+
+    def run(self):
+        """Renew this worker's heartbeat, close its idle upload scanners & clean up every interval until stopped, if no
+        other worker holds the lease"""
+        try:
+            progress.heartbeat(self.store)
+        except Exception:
+            logger.exception("Janitor failed to renew the worker's heartbeat")
+        while not self.stopped.wait(self.interval_seconds):
+            try:
+                progress.heartbeat(self.store)
+                if self.store.acquire_lease(
+                    "janitor", self.holder, self.interval_seconds * 0.9
+                ):
+                    self.clean()
+                # Each worker closes its own scanners, including those of the uploads removed by another worker
+                chunked_upload.evict_scanners()
+            except Exception:
+                # The janitor keeps running, the clean up is retried in the next interval
+                logger.exception("Janitor failed to clean up")
+
+    def start(self):
+        thread = threading.Thread(target=self.run, name="basher-janitor", daemon=True)
+        thread.start()
+        return thread
+
+
+def start_janitor(upload_folder, store):
+    """Start the janitor thread of this process, threads are not copied to forked gunicorn workers so this is called
+    again in each worker"""
+    if janitor_thread["pid"] == os.getpid():
+        return janitor_thread["janitor"]
+    janitor = Janitor(upload_folder, store)
+    janitor.start()
+    janitor_thread.update(pid=os.getpid(), janitor=janitor)
+    return janitor
@@ -0,0 +1,546 @@
+import contextlib
+import io
+import json
+import os
+import secrets
+import shutil
+import sys
+import threading
+import time
+from argparse import Namespace
+from datetime import datetime
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import array_io
+import config as config
+import cost_model
+import logging_setup
+import memory_limit
+import progress
+import report_archive
+import result_bundle
+from artefact_store import ArtefactStore
+from check_inputs import check_input
+from exceptions import (
+    CaseBudgetError,
+    CaseMemoryError,
+    CaseParameterError,
+    JobNotFoundError,
+)
+from job_scheduler import JobScheduler
+
+# Cases submitted through the API are run as jobs in a background thread of the web server worker which received
+# them. Each job has its own folder within the upload folder, so it is purged with the reports, holding the SNP array
+# file & the outputs. The job's status is saved in the ArtefactStore (see artefact_store.py) so it can be polled from
+# any worker, it expires with the job's folder after the retention period. Jobs are run shortest expected job first
+# (see job_scheduler.py), each job's status records the runtime & memory expected by the cost model (see
+# cost_model.py) and, once complete, its actual runtime which the cost model is refitted to. Each case is run in its own
+# process with a memory ceiling (see memory_limit.py), and is rerun in low memory mode if it exceeds it. A job whose
+# worker stopped before it finished is failed by fail_orphaned_cases().
+
+# Each job is saved in its own folder within the upload folder
+job_folder_prefix = "job-"
+
+# The statuses of a job, in order
+job_statuses = ["queued", "running", "complete", "failed"]
+
+# The path of the outputs in each job's folder, see snp_haplotype.save_outputs()
+job_output_name = "case"
+
+# Parameters which are set by the API rather than the submitted case
+api_parameters = ["input_file", "output_folder", "formats", "profile"]
+
+# Cases submitted with "profile" are only profiled (see profiling.py) if the request has this token in its
+# X-BASHer-Admin-Token header, set by the BASHER_ADMIN_TOKEN environment variable. Profiling is disabled if it is not set
+admin_token = os.getenv("BASHER_ADMIN_TOKEN")
+
+# The number of the most recently completed cases the cost model is fitted to, and how often it is refitted
+cost_model_cases = 500
+cost_model_refit_seconds = 60
+
+
+def parameters_to_args(parameters, input_file):
+    """Convert the parameters of a case submitted as JSON into the arguments of snp_haplotype.py
+    The parameters are passed through snp_haplotype.build_parser(), so they have the same names, choices & defaults as
+    the command line options. Booleans are passed as --option/--no-option and lists as several values.
+    Args:
+        parameters (dict): The command line options of snp_haplotype.py, without the leading "--"
+        input_file (string): The path of the case's SNP array file
+    Returns:
+        Namespace: The arguments of the case
+    Raises:
+        CaseParameterError: If the parameters are not valid options or fail the checks in check_inputs.py
+    """
+    # snp_haplotype is only imported when a case is submitted
+    import snp_haplotype
+
+    argv = ["--input_file", input_file]
+    for parameter, value in parameters.items():
+        if parameter in api_parameters:
+            raise CaseParameterError(f"The {parameter} parameter is set by the API.")
+        if value is None:
+            continue
+        if isinstance(value, bool):
+            argv.append(f"--{parameter}" if value else f"--no-{parameter}")
+        elif isinstance(value, list):
+            argv += [f"--{parameter}"] + [str(item) for item in value]
+        else:
+            argv += [f"--{parameter}", str(value)]
+    parser_errors = io.StringIO()
+    try:
+        with contextlib.redirect_stderr(parser_errors):
+            args = snp_haplotype.build_parser().parse_args(argv)
+    except SystemExit:
+        # The last line of argparse's usage message is "<prog>: error: <message>"
+        raise CaseParameterError(
+            parser_errors.getvalue().strip().splitlines()[-1].split(": error: ")[-1]
+        )
+    error_dictionary, input_ok_flag = check_input(args, input_file)
+    if not input_ok_flag:
+        raise CaseParameterError(
+            "; ".join(f"{field}: {error}" for field, error in error_dictionary.items())
+        )
+    return args
+
+
+def run_case(case_id, args, output_path, store_path, parsed_array_cache_folder):
+    """Run a case & save its outputs, in the process started for it by JobManager.run_case_process()
+    Args:
+        case_id (string): The ID of the case, which its logs & progress are recorded for
+        args (Namespace): The arguments of the case
+        output_path (string): The path of the outputs, see snp_haplotype.save_outputs()
+        store_path (string): The ArtefactStore the case's progress is recorded in, None to not record its progress
+        parsed_array_cache_folder (string): The web app's cache of parsed SNP array files, see array_io.py
+    Returns:
+        dict: The paths of the outputs, the time taken & peak memory of each stage, and whether the case was run in low
+            memory mode
+    """
+    # snp_haplotype is only imported when a case is run
+    import snp_haplotype
+
+    # The process does not inherit the logging & cache folder set up by the web app
+    logging_setup.configure_logging()
+    array_io.parsed_array_cache_folder = parsed_array_cache_folder
+    reporter = (
+        None
+        if store_path is None
+        else progress.store_reporter(ArtefactStore(store_path), case_id)
+    )
+    with logging_setup.case_context(case_id), progress.progress_context(reporter):
+        case = snp_haplotype.BasherCase(args)
+        if case.incremental:
+            case.update_trio_cache()
+        output_paths = snp_haplotype.save_outputs(case, output_path)
+    return {
+        "output_paths": output_paths,
+        "stage_seconds": case.stage_seconds,
+        "stage_peak_memory_bytes": case.stage_peak_memory_bytes,
+        "low_memory": case.low_memory,
+    }
+
+
+def fail_orphaned_cases(store):
+    """Fail the cases & reports whose worker stopped before they finished, e.g. when the web server was restarted, so
+    they are not shown as queued or running forever, see progress.claim_case()
+    Args:
+        store (ArtefactStore): The store of the web app
+    Returns:
+        list: The IDs of the cases which were failed
+    """
+    error = "The web server worker running the case stopped before it finished, please submit it again."
+    failed = []
+    for case_id, owner in store.case_owners().items():
+        if not progress.is_owner_gone(store, owner):
+            continue
+        if not progress.is_finished(store, case_id):
+            progress.store_reporter(store, case_id)(
+                {"stage": "failed", "message": error}
+            )
+            failed.append(case_id)
+        job = store.load_job(case_id)
+        if job is not None:
+            changes = {
+                "reports": {
+                    report_format: "failed"
+                    if report_status in ["queued", "running"]
+                    else report_status
+                    for report_format, report_status in job.get("reports", {}).items()
+                }
+            }
+            if job["status"] not in ["complete", "failed"]:
+                changes |= {
+                    "status": "failed",
+                    "finished": datetime.now().isoformat(timespec="seconds"),
+                    "error": error,
+                }
+            store.update_job(
+                case_id,
+                time.time() + report_archive.report_retention_days * 24 * 60 * 60,
+                **changes,
+            )
+        progress.release_case(store, case_id)
+    if failed:
+        logger.warning(f"Failed {len(failed)} cases whose worker stopped: {failed}")
+    return failed
+
+
+def error_message(error):
+    """The message recorded for a failed case, with the type of the error raised in the case's process"""
+    return f"{getattr(error, 'error_type', type(error).__name__)}: {error}"
+
+
+def is_admin(token):
+    """True if the token is the admin_token, compared in constant time"""
+    return bool(admin_token) and secrets.compare_digest(
+        (token or "").encode(), admin_token.encode()
+    )
+
+
+class JobManager:
+    """Runs the cases submitted through the API & records their status
+    Args:
+        upload_folder (string): The web app's upload folder, which the job folders are created in
+        store (ArtefactStore): The store the status of each job is saved in
+        max_workers (int): The number of cases run at the same time by this process
+    """
+
+    def __init__(self, upload_folder, store, max_workers=config.api_job_workers):
+        self.upload_folder = upload_folder
+        self.store = store
+        # Serialises the reports requested by the request & job threads of this process
+        self.lock = threading.RLock()
+        self.scheduler = JobScheduler(max_workers=max_workers)
+        self.model = None
+        self.model_fitted = 0
+        # The cases left queued or running when a worker was restarted are failed as the new worker starts
+        fail_orphaned_cases(store)
+
+    def cost_model(self):
+        """The cost model fitted to the runtimes of the most recently completed cases, refitted at most once every
+        cost_model_refit_seconds"""
+        if (
+            self.model is None
+            or time.monotonic() - self.model_fitted > cost_model_refit_seconds
+        ):
+            self.model = cost_model.CostModel(
+                (cost_model.CaseFeatures(**job["features"]), job["runtime_seconds"])
+                for job in self.store.completed_jobs(cost_model_cases)
+                if "features" in job and "runtime_seconds" in job
+            )
+            self.model_fitted = time.monotonic()
+        return self.model
+
+    def admit(self, args, input_files):
+        """Estimate the cost of a case & check it is within the web server's budgets
+        Args:
+            args (Namespace): The arguments of the case
+            input_files (list): The SNP array files of the case, which are merged if there is more than one
+        Returns:
+            tuple: The CaseFeatures & CostPrediction of the case
+        Raises:
+            CaseBudgetError: If the case is expected to take longer or need more memory than the budgets allow
+        """
+        try:
+            probes = [array_io.count_probes(input_file) for input_file in input_files]
+        except OSError:
+            # The file cannot be read, the case fails when it is run
+            probes = [None]
+        features = cost_model.CaseFeatures.from_args(
+            args, None if None in probes else max(probes)
+        )
+        prediction = self.cost_model().predict(features)
+        budget_errors = cost_model.budget_errors(prediction)
+        if budget_errors:
+            raise CaseBudgetError(" ".join(budget_errors), prediction.to_dict())
+        return features, prediction
+
+    def job_folder(self, job_id):
+        """The folder of a job
+        Raises:
+            JobNotFoundError: If there is no job with the ID
+        """
+        folder = os.path.join(self.upload_folder, f"{job_folder_prefix}{job_id}")
+        if not job_id.isalnum() or not os.path.isdir(folder):
+            raise JobNotFoundError(f"Unknown case {job_id}, it may have been purged.")
+        return folder
+
+    def create_job(self):
+        """Create the folder for a new job, its inputs are saved to the folder before it is started with submit()
+        Returns:
+            tuple: The job ID & folder
+        """
+        job_id = secrets.token_hex(16)
+        folder = os.path.join(self.upload_folder, f"{job_folder_prefix}{job_id}")
+        os.mkdir(folder)
+        return job_id, folder
+
+    def delete_job(self, job_id):
+        """Remove a job which could not be submitted"""
+        shutil.rmtree(self.job_folder(job_id), ignore_errors=True)
+
+    def status(self, job_id):
+        """The status of a job
+        Returns:
+            dict: The job's status, the times it was submitted, started & finished, its parameters, error & outputs
+        """
+        self.job_folder(job_id)
+        job = self.store.load_job(job_id)
+        if job is None:
+            raise JobNotFoundError(f"Case {job_id} has not been submitted.")
+        return job
+
+    def update_status(self, job_id, **changes):
+        """Update the status of a job, in a transaction so that a partially updated status is never read"""
+        self.job_folder(job_id)
+        return self.store.update_job(
+            job_id,
+            time.time() + report_archive.report_retention_days * 24 * 60 * 60,
+            **changes,
+        )
+
+    def submit(self, job_id, args, admitted=None):
+        """Queue a case to be run
+        Args:
+            job_id (string): The ID returned by create_job(), the case's inputs must already be saved in its folder
+            args (Namespace): The arguments of the case, the outputs are saved to the job's folder
+            admitted (tuple): The features & prediction returned by admit(), the case is admitted if None
+        Returns:
+            dict: The job's status
+        Raises:
+            CaseBudgetError: If the case was not already admitted & is over the web server's budgets
+        """
+        features, prediction = admitted or self.admit(args, [args.input_file])
+        args.output_folder = self.job_folder(job_id)
+        # The tables are always saved, so they can be fetched from the API
+        args.result_bundle = True
+        job = self.update_status(
+            job_id,
+            status="queued",
+            submitted=datetime.now().isoformat(timespec="seconds"),
+            parameters=result_bundle.jsonable_parameters(args),
+            outputs={},
+            reports={},
+            features=features.__dict__,
+            prediction=prediction.to_dict(),
+        )
+        progress.store_reporter(self.store, job_id)(
+            {
+                "stage": "queued",
+                "message": f"Queued, expected to take {prediction.seconds:.0f} seconds",
+            }
+        )
+        progress.claim_case(self.store, job_id)
+        self.scheduler.submit(
+            prediction, self.run_with_progress, job_id, self.run_job, args
+        )
+        logger.info(f"Queued case {job_id}, expected to take {prediction.seconds}s")
+        return job
+
+    def run_in_case_context(self, job_id, function, *args):
+        """Run a job's function in an executor thread, tagging the records it logs with the job's ID"""
+        with logging_setup.case_context(job_id):
+            return function(job_id, *args)
+
+    def run_with_progress(self, job_id, function, *args):
+        """Run a case in an executor thread, recording its progress in the store so it can be streamed"""
+        try:
+            with progress.progress_context(progress.store_reporter(self.store, job_id)):
+                return self.run_in_case_context(job_id, function, *args)
+        finally:
+            progress.release_case(self.store, job_id)
+
+    def run_case_process(self, case_id, args, output_path, report_progress=True):
+        """Run a case in its own process with the memory ceiling, rerunning it in low memory mode if it exceeds it
+        Args:
+            case_id (string): The ID of the case
+            args (Namespace): The arguments of the case
+            output_path (string): The path of the outputs, see snp_haplotype.save_outputs()
+            report_progress (bool): Whether to record the progress of the case in the store
+        Returns:
+            dict: The outputs, the time taken & peak memory of each stage, and whether low memory mode was used, see
+                run_case()
+        Raises:
+            CaseMemoryError: If the case exceeds the memory ceiling in low memory mode
+            CaseProcessError: If the case fails
+        """
+        process_args = (
+            output_path,
+            self.store.path if report_progress else None,
+            array_io.parsed_array_cache_folder,
+        )
+        try:
+            return memory_limit.run_in_process(
+                run_case,
+                case_id,
+                args,
+                *process_args,
+                ceiling_bytes=memory_limit.job_memory_ceiling_bytes,
+            )
+        except CaseMemoryError as error:
+            if getattr(args, "low_memory", False):
+                raise
+            logger.warning(f"{error} Rerunning case {case_id} in low memory mode.")
+        self.store.add_metrics(low_memory_reruns=1)
+        progress.report(
+            "low_memory",
+            "The case needs more memory than is available, rerunning it in low memory mode",
+        )
+        low_memory_args = Namespace(**vars(args) | {"low_memory": True})
+        try:
+            return memory_limit.run_in_process(
+                run_case,
+                case_id,
+                low_memory_args,
+                *process_args,
+                ceiling_bytes=memory_limit.job_memory_ceiling_bytes,
+            )
+        except CaseMemoryError as error:
+            raise CaseMemoryError(
+                f"Even in low memory mode: {error} It can be run with fewer embryos or a smaller flanking region."
+            ) from error
+
+    def run_job(self, job_id, args):
+        """Run a case, saving its outputs & result bundle to the job's folder"""
+        start = time.perf_counter()
+        self.update_status(
+            job_id,
+            status="running",
+            started=datetime.now().isoformat(timespec="seconds"),
+        )
+        progress.report("running", "Started the analysis")
+        try:
+            case_run = self.run_case_process(
+                job_id, args, os.path.join(args.output_folder, job_output_name)
+            )
+        except Exception as error:
+            logger.exception(f"Case {job_id} failed")
+            self.update_status(
+                job_id,
+                status="failed",
+                finished=datetime.now().isoformat(timespec="seconds"),
+                error=error_message(error),
+            )
+            progress.report("failed", error_message(error))
+            return
+        runtime_seconds = time.perf_counter() - start
+        job = self.update_status(
+            job_id,
+            status="complete",
+            finished=datetime.now().isoformat(timespec="seconds"),
+            outputs={
+                output: os.path.basename(path)
+                for output, path in case_run["output_paths"].items()
+            },
+            stage_seconds={
+                stage: round(seconds, 3)
+                for stage, seconds in case_run["stage_seconds"].items()
+            },
+            stage_peak_memory_bytes=case_run["stage_peak_memory_bytes"],
+            low_memory=case_run["low_memory"],
+            runtime_seconds=round(runtime_seconds, 3),
+        )
+        logger.info(
+            f"Completed case {job_id} in {runtime_seconds:.1f}s, expected {job['prediction']['seconds']}s"
+        )
+        progress.report("complete", f"Completed in {runtime_seconds:.0f} seconds")
+
+    def result_bundle(self, job_id):
+        """The result bundle of a complete job
+        Returns:
+            tuple: The path & manifest of the bundle
+        Raises:
+            JobNotFoundError: If there is no job with the ID or it is not complete
+        """
+        job = self.status(job_id)
+        if job["status"] != "complete":
+            raise JobNotFoundError(f"Case {job_id} is {job['status']}, not complete.")
+        bundle_path = os.path.join(self.job_folder(job_id), job["outputs"]["bundle"])
+        with open(os.path.join(bundle_path, "manifest.json")) as f:
+            return bundle_path, json.load(f)
+
+    def table(self, job_id, table_name):
+        """A table of the result bundle of a complete job, see result_bundle.bundle_tables
+        Raises:
+            JobNotFoundError: If the job is not complete or the table was not saved for the case
+        """
+        bundle_path, manifest = self.result_bundle(job_id)
+        if table_name not in manifest["tables"]:
+            raise JobNotFoundError(f"Case {job_id} has no {table_name} table.")
+        return result_bundle.load_bundle_table(bundle_path, manifest, table_name)
+
+    def request_report(self, job_id, report_format):
+        """Queue a report for a complete case which was not requested when the case was submitted
+        Args:
+            job_id (string): The ID of a complete job
+            report_format (string): "json", "html" or "pdf"
+        Returns:
+            string: The file name of the report in the job's folder if it has been produced, otherwise None
+        """
+        with self.lock:
+            job = self.status(job_id)
+            if report_format in job["outputs"]:
+                return job["outputs"][report_format]
+            if job["reports"].get(report_format) not in ["queued", "running"]:
+                self.update_status(
+                    job_id, reports=job["reports"] | {report_format: "queued"}
+                )
+                progress.claim_case(self.store, job_id)
+                # The case is rerun with only the requested report
+                features = cost_model.CaseFeatures.from_args(
+                    Namespace(**job["parameters"] | {"formats": [report_format]}),
+                    job.get("features", {}).get("probes"),
+                )
+                self.scheduler.submit(
+                    self.cost_model().predict(features),
+                    self.run_in_case_context,
+                    job_id,
+                    self.render_report,
+                    report_format,
+                )
+        return None
+
+    def render_report(self, job_id, report_format):
+        """Produce a report requested by request_report()
+        The case is rerun from its saved parameters & SNP array file with only the requested report.
+        """
+        self.update_report(job_id, report_format, "running")
+        try:
+            args = Namespace(**self.status(job_id)["parameters"])
+            args.formats = [report_format]
+            args.result_bundle = False
+            args.incremental = False
+            # A profiled case forces its result bundle on, so the profile is not repeated for each extra report
+            args.profile = False
+            output_paths = self.run_case_process(
+                job_id,
+                args,
+                os.path.join(args.output_folder, job_output_name),
+                report_progress=False,
+            )["output_paths"]
+        except Exception:
+            logger.exception(f"The {report_format} report of case {job_id} failed")
+            self.update_report(job_id, report_format, "failed")
+            return
+        self.update_report(
+            job_id,
+            report_format,
+            "complete",
+            os.path.basename(output_paths[report_format]),
+        )
+
+    def update_report(self, job_id, report_format, report_status, file_name=None):
+        """Record the status of a report requested with request_report(), & its file name once produced"""
+        with self.lock:
+            job = self.status(job_id)
+            changes = {"reports": job["reports"] | {report_format: report_status}}
+            if file_name is not None:
+                changes["outputs"] = job["outputs"] | {report_format: file_name}
+            job = self.update_status(job_id, **changes)
+            if not set(job["reports"].values()) & {"queued", "running"}:
+                progress.release_case(self.store, job_id)
@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+import time
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+import cost_model
+
+# The cases & reports queued by the API are run shortest expected job first, using the runtime estimated by
+# cost_model.py, so quick cases are not held up behind long ones. A queued job's expected runtime is reduced by
+# job_aging_factor for each second it waits, so a long job runs once it has waited as long as the shorter jobs
+# submitted after it are expected to take. A job only starts if the memory it is expected to need fits within the
+# memory budget alongside the jobs already running.
+
+
+class QueuedJob:
+    """A function queued to run in the scheduler's threads, with its expected cost"""
+
+    def __init__(self, prediction, function, args):
+        self.prediction = prediction
+        self.function = function
+        self.args = args
+        self.queued = time.monotonic()
+
+    def priority(self, now, aging_factor):
+        """The expected runtime less the aging credit, lower priorities are run first"""
+        return self.prediction.seconds - aging_factor * (now - self.queued)
+
+
+class JobScheduler:
+    """Runs queued jobs shortest expected job first, within a memory budget
+    Args:
+        max_workers (int): The number of jobs run at the same time
+        memory_budget_bytes (int): The memory available to the jobs run at the same time
+        aging_factor (float): Seconds taken off the expected runtime of a queued job for each second it has waited
+    """
+
+    def __init__(
+        self,
+        max_workers=config.api_job_workers,
+        memory_budget_bytes=cost_model.job_memory_budget_bytes,
+        aging_factor=config.job_aging_factor,
+    ):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.aging_factor = aging_factor
+        self.condition = threading.Condition()
+        self.queue = []
+        self.running = []
+        self.stopped = False
+        self.threads = [
+            threading.Thread(target=self.work, name=f"basher-job_{number}", daemon=True)
+            for number in range(max_workers)
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, prediction, function, *args):
+        """Queue a function to be run with the arguments
+        Args:
+            prediction (CostPrediction): The expected runtime & memory of the job
+            function (callable): The function to run
+        """
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("The job scheduler has been shut down.")
+            self.queue.append(QueuedJob(prediction, function, args))
+            self.condition.notify_all()
+
+    def next_job(self):
+        """Wait for the queued job with the lowest priority which fits in the memory left, None once shut down"""
+        with self.condition:
+            while True:
+                if not self.queue and self.stopped:
+                    return None
+                memory_used = sum(job.prediction.memory_bytes for job in self.running)
+                now = time.monotonic()
+                # A job is always run if nothing else is running, so a job larger than the budget is not stuck
+                runnable = [
+                    job
+                    for job in self.queue
+                    if not self.running
+                    or memory_used + job.prediction.memory_bytes
+                    <= self.memory_budget_bytes
+                ]
+                if runnable:
+                    job = min(
+                        runnable, key=lambda job: job.priority(now, self.aging_factor)
+                    )
+                    self.queue.remove(job)
+                    self.running.append(job)
+                    return job
+                self.condition.wait()
+
+    def work(self):
+        """Run queued jobs until the scheduler is shut down"""
+        while (job := self.next_job()) is not None:
+            try:
+                job.function(*job.args)
+            except Exception:
+                logger.exception("Queued job failed")
+            finally:
+                with self.condition:
+                    self.running.remove(job)
+                    self.condition.notify_all()
+
+    def queued_seconds(self):
+        """The total expected runtime of the queued & running jobs"""
+        with self.condition:
+            return sum(job.prediction.seconds for job in self.queue + self.running)
+
+    def shutdown(self, wait=True):
+        """Stop once the queued jobs have been run
+        Args:
+            wait (bool): Wait for the queued jobs to finish
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        if wait:
+            for thread in self.threads:
+                thread.join()
@@ -0,0 +1,138 @@
+import atexit
+import contextlib
+import contextvars
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+
+# The web service logs through a queue, so request & job threads only put records on the queue and a single listener
+# thread per process writes them to the log file. Each record is tagged with the ID of the case or job being run by
+# the thread which logged it. Errors reported to the user (e.g. invalid sample sheets) are collected per request by
+# collect_errors() rather than by handlers shared between requests.
+
+log_format = "%(asctime)s - %(name)s - %(levelname)s - %(case_id)s - %(message)s"
+
+# The ID of the case or job being run by the current thread or request, "-" outside of a case
+current_case_id = contextvars.ContextVar("current_case_id", default="-")
+
+# The errors collected by collect_errors() for the current thread or request, None if errors are not being collected
+current_errors = contextvars.ContextVar("current_errors", default=None)
+
+# The queue handler & listener of this process, see configure_logging()
+queue_logging = {"pid": None, "handler": None, "listener": None}
+
+
+class CaseIdFilter(logging.Filter):
+    """Tags each record with the ID of the case or job being run, see case_context()"""
+
+    def filter(self, record):
+        record.case_id = current_case_id.get()
+        return True
+
+
+class DictErrorHandler(logging.Handler):
+    """Saves errors to the dictionary of the current collect_errors() block for feedback to the user, counting
+    how many times each error was logged"""
+
+    def emit(self, record):
+        error_dict = current_errors.get()
+        if error_dict is not None and record.levelno == logging.ERROR:
+            error_msg = self.format(record)
+            error_dict[error_msg] = error_dict.get(error_msg, 0) + 1
+
+
+# Errors are collected in the thread which logged them, so this handler is attached directly rather than via the queue.
+# It is named so that it is only attached once if this module is imported more than once (e.g. as a package module)
+dict_error_handler = DictErrorHandler()
+dict_error_handler.set_name("basher_dict_errors")
+if dict_error_handler.name not in [handler.name for handler in logger.handlers]:
+    logger.addHandler(dict_error_handler)
+
+
+@contextlib.contextmanager
+def collect_errors():
+    """Collect the errors logged by the current thread or request within the block
+    Blocks can be nested, the errors of an inner block are also added to the outer block.
+    Returns:
+        dict: The count of each error message, filled in as errors are logged
+    """
+    outer_errors = current_errors.get()
+    error_dict = {}
+    token = current_errors.set(error_dict)
+    try:
+        yield error_dict
+    finally:
+        current_errors.reset(token)
+        if outer_errors is not None:
+            for error_msg, count in error_dict.items():
+                outer_errors[error_msg] = outer_errors.get(error_msg, 0) + count
+
+
+@contextlib.contextmanager
+def case_context(case_id):
+    """Tag the records logged by the current thread or request within the block with a case or job ID"""
+    token = current_case_id.set(str(case_id))
+    try:
+        yield
+    finally:
+        current_case_id.reset(token)
+
+
+def set_case_id(case_id):
+    """Tag the records logged by the current thread or request from now on with a case or job ID, used by the web app
+    which sets the ID at the start of each request"""
+    current_case_id.set(str(case_id))
+
+
+def log_handler(log_file):
+    """The handler which the listener writes records to, the log file or stderr if its folder does not exist"""
+    if log_file is not None and os.path.isdir(os.path.dirname(log_file)):
+        handler = logging.FileHandler(log_file)
+    else:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(log_format))
+    return handler
+
+
+def configure_logging(log_file=config.log_file, level="DEBUG"):
+    """Log the BASHer_logger records through a queue to the log file, once per process
+    Safe to call repeatedly, the handler is only replaced in a process forked after it was configured (e.g. gunicorn
+    workers of an app preloaded in the master) whose listener thread was not copied by the fork.
+    Args:
+        log_file (string): The path of the log file
+        level (string): The level of the records logged
+    """
+    if queue_logging["pid"] == os.getpid():
+        return
+    if queue_logging["handler"] is not None:
+        logger.removeHandler(queue_logging["handler"])
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    # The case ID is read in the thread which logged the record, before it is queued
+    handler.addFilter(CaseIdFilter())
+    listener = QueueListener(log_queue, log_handler(log_file))
+    listener.start()
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    queue_logging.update(pid=os.getpid(), handler=handler, listener=listener)
+
+
+def stop_logging():
+    """Write the records left on the queue & stop this process's listener, called at exit"""
+    if queue_logging["pid"] == os.getpid():
+        queue_logging["listener"].stop()
+        logger.removeHandler(queue_logging["handler"])
+        queue_logging.update(pid=None, handler=None, listener=None)
+
+
+atexit.register(stop_logging)
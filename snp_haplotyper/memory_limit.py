@@ -0,0 +1,220 @@
+import contextlib
+import errno
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+from exceptions import CaseMemoryError, CaseProcessError
+
+# The web app runs each case in its own process with a memory ceiling, so a case which needs more memory than expected
+# fails with a MemoryError in that process rather than the kernel killing the web server worker. The ceiling limits
+# the writable memory of the process (RLIMIT_DATA), which is close to its resident memory and, unlike the address
+# space, is not used up by memory reserved but not used, e.g. by the PDF renderer. A case which exceeds the ceiling,
+# or whose process is killed by the kernel, is run again in low memory mode (see BasherCase.low_memory). The ceiling
+# needs the resource module so is only applied on Linux & macOS.
+
+# Time between the samples of the resident memory taken while each stage of a case runs, see stage_peak_memory()
+memory_sample_interval_seconds = 0.01
+
+# The memory ceiling of each case, None for no ceiling
+job_memory_ceiling_bytes = (
+    int(
+        float(os.getenv("JOB_MEMORY_CEILING_GB", config.job_memory_ceiling_gb))
+        * 1024**3
+    )
+    or None
+)
+
+# Processes are forked from a fork server rather than from the web server worker, which has threads that a fork does
+# not copy. The fork server of each worker loads the reference data & libraries shared by every case once (see
+# case_process_preload.py), so each case's process starts with them loaded. Platforms without a fork server start each
+# process fresh.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    process_context = multiprocessing.get_context("forkserver")
+    process_context.set_forkserver_preload(["case_process_preload"])
+else:
+    process_context = multiprocessing.get_context("spawn")
+
+
+def start_process_server():
+    """Start this process's fork server if it is not running, so the reference data is loaded before the first case
+    rather than by it. The fork server is not shared with processes forked from this one, so this is called in each web
+    server worker.
+    """
+    if process_context.get_start_method() != "forkserver":
+        return
+    from multiprocessing import forkserver
+
+    # The fork server imports case_process_preload before it is given the sys.path of this process, so the folder of
+    # the modules is added to the PYTHONPATH it inherits
+    module_folder = os.path.dirname(os.path.abspath(__file__))
+    python_path = os.environ.get("PYTHONPATH", "")
+    if module_folder not in python_path.split(os.pathsep):
+        os.environ["PYTHONPATH"] = os.pathsep.join(
+            folder for folder in [python_path, module_folder] if folder
+        )
+    forkserver.ensure_running()
+
+
+def limit_memory(ceiling_bytes):
+    """Limit the memory of this process & the processes it starts, allocations beyond it raise MemoryError
+    Args:
+        ceiling_bytes (int): The memory ceiling
+    """
+    try:
+        import resource
+    except ImportError:
+        logger.warning("The memory ceiling of cases is not supported on this platform")
+        return
+    soft_limit, hard_limit = resource.getrlimit(resource.RLIMIT_DATA)
+    if hard_limit != resource.RLIM_INFINITY:
+        ceiling_bytes = min(ceiling_bytes, hard_limit)
+    resource.setrlimit(resource.RLIMIT_DATA, (ceiling_bytes, hard_limit))
+
+
+def peak_memory_bytes():
+    """The peak resident memory of this process so far, None if it cannot be measured on this platform"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes & macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def resident_memory_bytes():
+    """The resident memory of this process now, None if it cannot be measured on this platform"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+@contextlib.contextmanager
+def stage_peak_memory():
+    """Measure the peak resident memory of this process while a block runs, e.g. a stage of a case
+    The peak of the process so far only tells which stage needed the most memory, so the resident memory is sampled in
+    a background thread while the block runs. If the block raised the peak of the process, that exact peak is used.
+    On platforms where the resident memory cannot be sampled the peak of the process so far is recorded.
+    Yields:
+        dict: Its "peak_bytes" is set once the block has finished, None if memory cannot be measured on this platform
+    """
+    measurement = {"peak_bytes": None}
+    process_peak = peak_memory_bytes()
+    resident = resident_memory_bytes()
+    if resident is None:
+        yield measurement
+        measurement["peak_bytes"] = peak_memory_bytes()
+        return
+    peak = [resident]
+    stopped = threading.Event()
+
+    def sample():
+        while not stopped.wait(memory_sample_interval_seconds):
+            peak[0] = max(peak[0], resident_memory_bytes() or 0)
+
+    thread = threading.Thread(target=sample, name="basher-memory-sampler", daemon=True)
+    thread.start()
+    try:
+        yield measurement
+    finally:
+        stopped.set()
+        thread.join()
+        peak[0] = max(peak[0], resident_memory_bytes() or 0)
+        if process_peak is not None and peak_memory_bytes() > process_peak:
+            # The peak of the process was reached in the block, which may have been between samples
+            peak[0] = max(peak[0], peak_memory_bytes())
+        measurement["peak_bytes"] = peak[0]
+
+
+def is_out_of_memory(error):
+    """True if an error was raised because memory could not be allocated"""
+    # Memory for files & subprocesses raises OSError, and the C parser of pandas raises ParserError, rather than
+    # MemoryError
+    return (
+        isinstance(error, MemoryError)
+        or (isinstance(error, OSError) and error.errno == errno.ENOMEM)
+        or "out of memory" in str(error).lower()
+    )
+
+
+def process_main(connection, ceiling_bytes, function, args):
+    """Run a function in a process started by run_in_process(), sending its outcome to the parent"""
+    # The ceiling is applied to the case's process, not the fork server it was forked from
+    if ceiling_bytes:
+        limit_memory(ceiling_bytes)
+    try:
+        outcome = ("complete", function(*args), None)
+    except Exception as error:
+        if is_out_of_memory(error):
+            outcome = ("memory", None, None)
+        else:
+            logger.exception("Case process failed")
+            # The error is sent as text, as not every error can be pickled
+            outcome = ("failed", str(error), type(error).__name__)
+    connection.send(outcome)
+    connection.close()
+
+
+def run_in_process(function, *args, ceiling_bytes=None):
+    """Run a function in its own process with a memory ceiling
+    Args:
+        function (callable): A module level function, which is imported by the new process
+        *args: The arguments of the function, which are pickled
+        ceiling_bytes (int): The memory ceiling of the process, None for no ceiling
+    Returns:
+        The value returned by the function, which is pickled
+    Raises:
+        CaseMemoryError: If the function exceeds the memory ceiling or the process is killed by SIGKILL, as the
+            kernel's out of memory killer does
+        CaseProcessError: If the function raises any other error or the process stops without sending its outcome
+    """
+    start_process_server()
+    receiver, sender = process_context.Pipe(duplex=False)
+    process = process_context.Process(
+        target=process_main,
+        args=(sender, ceiling_bytes, function, args),
+        name="basher-case",
+        daemon=True,
+    )
+    process.start()
+    sender.close()
+    try:
+        status, value, error_type = receiver.recv()
+    except EOFError:
+        # The process ended without sending its outcome, e.g. killed by the kernel when out of memory
+        status, value, error_type = "stopped", None, None
+    finally:
+        receiver.close()
+        process.join()
+    if status == "complete":
+        return value
+    if status == "failed":
+        raise CaseProcessError(value, error_type)
+    if status == "memory" and ceiling_bytes:
+        raise CaseMemoryError(
+            f"The case needed more than the memory ceiling of {ceiling_bytes / 1024**3:.1f}GB."
+        )
+    if status == "memory":
+        raise CaseMemoryError("The case ran out of memory.")
+    if process.exitcode == -signal.SIGKILL:
+        raise CaseMemoryError(
+            "The case's process was killed, it most likely ran out of memory."
+        )
+    # e.g. a crash in a compiled library, which running the case in low memory mode would not fix
+    raise CaseProcessError(
+        f"The case's process stopped unexpectedly with exit code {process.exitcode}.",
+        "ProcessExit",
+    )
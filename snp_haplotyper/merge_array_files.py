@@ -2,6 +2,7 @@ import argparse
 import collections
 import numpy as np
 import pandas as pd
+import array_io
 
 
 import logging
@@ -29,10 +30,10 @@ parser.add_argument(
 
 
 def read_csv_files(file_paths: List[str]) -> list[pd.DataFrame]:
-    """Reads multiple SNP array CSV files into a list of dataframes.
+    """Reads multiple SNP array files into a list of dataframes.
 
     Args:
-        file_paths (List[str]): List of paths to SNP array CSV files.
+        file_paths (List[str]): List of paths to SNP array files, in any format read by array_io.read_array_file().
 
     Returns:
         list[pd.DataFrame]: List of dataframes containing SNP array data.
@@ -40,7 +41,7 @@ def read_csv_files(file_paths: List[str]) -> list[pd.DataFrame]:
 
     dfs = []
     for file_path in file_paths:
-        df = pd.read_csv(file_path, sep="\t")
+        df = array_io.read_array_file(file_path)
         dfs.append(df)
     return dfs
 
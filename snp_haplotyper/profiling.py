@@ -0,0 +1,277 @@
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+import zlib
+from collections import Counter
+from xml.sax.saxutils import escape
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+# A case run with --profile (or submitted through the API with "profile" by an admin) is profiled stage by stage, see
+# BasherCase.stage_context(). The thread running each stage is sampled to build collapsed stacks & a flamegraph, the
+# stage is run under cProfile for a table of the functions with the highest cumulative time, and tracemalloc
+# snapshots taken before & after the stage record the lines which allocated the most memory. The profile is saved in
+# the result bundle's profile folder using only the standard library, so it works offline on production cases.
+
+# Time between the samples of the case's stack
+sample_interval_seconds = 0.005
+
+# The number of functions & allocations recorded for each stage
+top_functions_count = 30
+top_allocations_count = 20
+
+# The folder of the result bundle the profile is saved in
+profile_folder_name = "profile"
+
+# Flamegraph layout
+flamegraph_width = 1200
+flamegraph_frame_height = 16
+flamegraph_font_size = 11
+
+
+def frame_name(code):
+    """The name of a function in a collapsed stack, semicolons separate the frames so are removed"""
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(
+        ";", ":"
+    )
+
+
+class StackSampler:
+    """Samples the stack of a thread in a background thread until stopped
+    Args:
+        thread_id (int): The ident of the thread to sample
+        interval (float): Seconds between samples
+    """
+
+    def __init__(self, thread_id, interval=sample_interval_seconds):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="basher-profile-sampler", daemon=True
+        )
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+def top_functions(profile, count=top_functions_count):
+    """The functions with the highest cumulative time in a cProfile profile
+    Returns:
+        list: The function, number of calls, time in the function itself & cumulative time of each function
+    """
+    stats = pstats.Stats(profile).sort_stats(pstats.SortKey.CUMULATIVE)
+    functions = []
+    for function in stats.fcn_list[:count]:
+        file_name, line, name = function
+        (
+            primitive_calls,
+            calls,
+            total_seconds,
+            cumulative_seconds,
+            callers,
+        ) = stats.stats[function]
+        functions.append(
+            {
+                "function": f"{name} ({os.path.basename(file_name)}:{line})",
+                "calls": calls,
+                "total_seconds": round(total_seconds, 4),
+                "cumulative_seconds": round(cumulative_seconds, 4),
+            }
+        )
+    return functions
+
+
+def top_allocations(before, after, count=top_allocations_count):
+    """The lines which allocated the most memory between two tracemalloc snapshots
+    Returns:
+        list: The location, change in size & number of blocks, and size at the end of the stage of each line
+    """
+    # The allocations of the profilers themselves are not recorded
+    ignored = [
+        tracemalloc.Filter(False, module.__file__)
+        for module in [tracemalloc, cProfile, pstats]
+    ]
+    differences = after.filter_traces(ignored).compare_to(
+        before.filter_traces(ignored), "lineno"
+    )
+    return [
+        {
+            "location": f"{os.path.basename(difference.traceback[0].filename)}:{difference.traceback[0].lineno}",
+            "size_diff_bytes": difference.size_diff,
+            "count_diff": difference.count_diff,
+            "size_bytes": difference.size,
+        }
+        for difference in differences[:count]
+    ]
+
+
+class CaseProfiler:
+    """Profiles each stage of a case, see profiling.py"""
+
+    def __init__(self):
+        self.stacks = Counter()
+        self.stages = {}
+        self.active_stage = None
+        self.started_tracing = False
+
+    @contextlib.contextmanager
+    def stage(self, stage):
+        """Profile a stage of the case run by the current thread
+        Stages calculated while another stage is being profiled are part of the outer stage's profile.
+        Args:
+            stage (string): The name of the stage
+        """
+        if self.active_stage is not None:
+            yield
+            return
+        self.active_stage = stage
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+        tracemalloc.reset_peak()
+        before = tracemalloc.take_snapshot()
+        sampler = StackSampler(threading.get_ident())
+        profile = cProfile.Profile()
+        sampler.start()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            sampler.stop()
+            after = tracemalloc.take_snapshot()
+            self.stages[stage] = {
+                "peak_traced_bytes": tracemalloc.get_traced_memory()[1],
+                "functions": top_functions(profile),
+                "allocations": top_allocations(before, after),
+            }
+            for stack, samples in sampler.stacks.items():
+                self.stacks[f"{stage};{stack}"] += samples
+            self.active_stage = None
+
+    def stop(self):
+        """Stop tracing memory allocations once the case has been profiled, unless they were already being traced"""
+        if self.started_tracing:
+            tracemalloc.stop()
+            self.started_tracing = False
+
+    def collapsed_stacks(self):
+        """The samples as collapsed stacks, one "frame;frame;frame count" line per stack as read by flamegraph tools"""
+        return "".join(
+            f"{stack} {samples}\n" for stack, samples in sorted(self.stacks.items())
+        )
+
+    def function_table(self):
+        """The functions with the highest cumulative time in each stage as a text table"""
+        lines = []
+        for stage, profile in self.stages.items():
+            lines.append(f"{stage}\n")
+            lines.append(
+                f"{'cumulative_s':>12} {'total_s':>10} {'calls':>10}  function\n"
+            )
+            for function in profile["functions"]:
+                lines.append(
+                    f"{function['cumulative_seconds']:>12.4f} {function['total_seconds']:>10.4f} "
+                    f"{function['calls']:>10}  {function['function']}\n"
+                )
+            lines.append("\n")
+        return "".join(lines)
+
+    def flamegraph(self):
+        """The samples as a flamegraph SVG, the width of each frame is the share of the samples it was on the stack"""
+        # Build the tree of frames, each node is [samples, children]
+        root = [0, {}]
+        for stack, samples in self.stacks.items():
+            root[0] += samples
+            node = root
+            for frame in stack.split(";"):
+                node = node[1].setdefault(frame, [0, {}])
+                node[0] += samples
+        rectangles = []
+        depth = [0]
+
+        def add_frames(node, x, level):
+            depth[0] = max(depth[0], level)
+            for frame, child in sorted(node[1].items()):
+                width = flamegraph_width * child[0] / root[0]
+                if width >= 0.5:
+                    rectangles.append((frame, child[0], x, level, width))
+                    add_frames(child, x, level + 1)
+                x += width
+
+        if root[0]:
+            add_frames(root, 0.0, 0)
+        height = (depth[0] + 1) * flamegraph_frame_height
+        elements = []
+        for frame, samples, x, level, width in rectangles:
+            # Frames are coloured by their name, so the same function has the same colour in each stack
+            hue = zlib.crc32(frame.encode()) % 40 + 10
+            y = height - (level + 1) * flamegraph_frame_height
+            label = escape(frame)
+            characters = int(width / (flamegraph_font_size * 0.6))
+            text = (
+                f'<text x="{x + 2:.1f}" y="{y + flamegraph_frame_height - 4}">'
+                f"{escape(frame[:characters])}</text>"
+                if characters >= 3
+                else ""
+            )
+            elements.append(
+                f"<g><title>{label} ({samples} samples, {100 * samples / root[0]:.1f}%)</title>"
+                f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" height="{flamegraph_frame_height - 1}" '
+                f'fill="hsl({hue}, 90%, 60%)"/>{text}</g>'
+            )
+        return (
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{flamegraph_width}" height="{height}" '
+            f'font-family="monospace" font-size="{flamegraph_font_size}">'
+            + "".join(elements)
+            + "</svg>"
+        )
+
+    def save(self, folder):
+        """Save the collapsed stacks, flamegraph, function table & allocations of each stage
+        Args:
+            folder (string): The folder to save the profile in, created if it does not exist
+        Returns:
+            list: The paths of the files saved
+        """
+        os.makedirs(folder, exist_ok=True)
+        contents = {
+            "collapsed_stacks.txt": self.collapsed_stacks(),
+            "flamegraph.svg": self.flamegraph(),
+            "top_functions.txt": self.function_table(),
+            "stages.json": json.dumps(self.stages, indent=4),
+        }
+        paths = []
+        for file_name, content in contents.items():
+            path = os.path.join(folder, file_name)
+            with open(path, "w") as f:
+                f.write(content)
+            paths.append(path)
+        logger.info(f"Saved the profile of {len(self.stages)} stages to {folder}")
+        return paths
@@ -0,0 +1,208 @@
+import contextlib
+import contextvars
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+import report_archive
+
+# A case running in the background reports its progress through the stages of the analysis (e.g. the number of probes
+# imported & each embryo plotted), so the web app can stream it to the browser while the case runs, see the progress
+# routes in app.py. The stages report progress with report() whether or not anything is listening, the reporter of
+# the current thread is set by progress_context(). The web app records each case's progress in the ArtefactStore
+# (see artefact_store.py) so it can be streamed by any worker.
+#
+# A queued case only runs in the worker which queued it, so the worker is recorded as the case's owner with
+# claim_case(). If the worker stops before the case finishes, e.g. when the web server is restarted, the case is failed
+# by the janitor (see job_manager.fail_orphaned_cases()) rather than being shown as queued or running forever. A worker
+# on this host is stopped if its process has exited, a worker on another host (e.g. a container which has been
+# replaced) if it has not renewed its heartbeat lease, see heartbeat().
+
+# The stages which end a case, the progress stream is closed once one has been sent
+final_stages = ["complete", "failed"]
+
+# Each progress stream is closed after this many seconds, and the browser reconnects from the last event it received,
+# so a stream does not hold a web server thread for the whole analysis
+progress_stream_seconds = 25
+
+# How often a progress stream checks the store for new events, and how long the browser waits before reconnecting
+progress_poll_seconds = 0.5
+progress_retry_milliseconds = 1000
+
+# Each worker renews its heartbeat lease in the janitor's thread every janitor_interval_minutes, the lease lasts for
+# several intervals so a busy worker is not mistaken for a stopped one
+owner_heartbeat_seconds = config.janitor_interval_minutes * 60 * 3
+
+# The reporter of the case being run by the current thread, None if progress is not being reported
+current_reporter = contextvars.ContextVar("current_progress_reporter", default=None)
+
+
+def report(stage, message, **details):
+    """Report the progress of the case being run by the current thread
+    Args:
+        stage (string): The stage of the analysis, e.g. "imported" or "plotting"
+        message (string): A description of the progress for the user
+        **details: Values the browser can show, e.g. the number of embryos plotted "done" of "total"
+    """
+    reporter = current_reporter.get()
+    if reporter is not None:
+        reporter({"stage": stage, "message": message} | details)
+
+
+def counted(items, stage, message, total):
+    """Report progress as each item is used, e.g. as each embryo is plotted
+    Args:
+        items (iterable): The items
+        stage (string): The stage of the analysis
+        message (string): A description of the progress, formatted with the number of items "done" & the "total"
+        total (int): The number of items
+    Yields:
+        The items
+    """
+    for done, item in enumerate(items, start=1):
+        yield item
+        report(stage, message.format(done=done, total=total), done=done, total=total)
+
+
+@contextlib.contextmanager
+def progress_context(reporter):
+    """Report the progress of the case run by the current thread within the block to the reporter
+    Args:
+        reporter (callable): Called with a dictionary of the stage, message & details of each report
+    """
+    token = current_reporter.set(reporter)
+    try:
+        yield
+    finally:
+        current_reporter.reset(token)
+
+
+def store_reporter(store, case_id):
+    """A reporter which records the progress of a case in the ArtefactStore until the end of the retention period
+    Args:
+        store (ArtefactStore): The store of the web app
+        case_id (string): The ID of the case, the API job ID or the upload folder of a case from the web form
+    Returns:
+        callable: The reporter
+    """
+
+    def record(event):
+        try:
+            store.add_progress(
+                case_id,
+                event | {"time": time.time()},
+                time.time() + report_archive.report_retention_days * 24 * 60 * 60,
+            )
+        except sqlite3.Error:
+            # The case is not failed because its progress could not be recorded
+            logger.warning(f"Could not record the progress of case {case_id}")
+
+    return record
+
+
+def process_start_time(pid):
+    """When a process started, in clock ticks since the host booted, so a process is not mistaken for an earlier
+    process with the same ID. None if it cannot be read on this platform."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The fields are counted from the end of the command name, which can contain spaces
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def process_owner():
+    """The owner recorded for the cases queued by this worker, its host, process ID & when the process started"""
+    started = process_start_time(os.getpid())
+    return f"{socket.gethostname()}:{os.getpid()}:{'' if started is None else started}"
+
+
+def heartbeat(store):
+    """Renew this worker's heartbeat lease, which shows the cases it owns are still running"""
+    owner = process_owner()
+    store.acquire_lease(f"worker:{owner}", owner, owner_heartbeat_seconds)
+
+
+def is_owner_gone(store, owner):
+    """True if the worker which owns a case has stopped, see claim_case()
+    Args:
+        store (ArtefactStore): The store of the web app
+        owner (string): The owner recorded for the case, None if the case is not owned by a worker
+    """
+    if owner is None:
+        return False
+    host, pid, started = owner.rsplit(":", 2)
+    if host != socket.gethostname() or sys.platform == "win32":
+        return not store.lease_is_held(f"worker:{owner}")
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except PermissionError:
+        # The process exists but belongs to another user
+        pass
+    # The process ID may have been reused since the worker stopped
+    return bool(started) and str(process_start_time(int(pid))) != started
+
+
+def claim_case(store, case_id):
+    """Record this worker as the owner of a case it has queued, until release_case() is called once it has finished"""
+    store.set_case_owner(case_id, process_owner())
+
+
+def release_case(store, case_id):
+    """Remove the owner of a case which has finished"""
+    store.delete_case_owner(case_id)
+
+
+def is_finished(store, case_id, last_event_id=None):
+    """True if a case has finished, and the browser has received the event which finished it if last_event_id is given"""
+    return any(
+        event["stage"] in final_stages
+        and (last_event_id is None or event_id <= last_event_id)
+        for event_id, event in store.progress_events(case_id)
+    )
+
+
+def is_running(store, case_id):
+    """True if a case has reported its progress but has not finished, and the worker running it has not stopped"""
+    stages = [event["stage"] for event_id, event in store.progress_events(case_id)]
+    return (
+        bool(stages)
+        and not set(stages) & set(final_stages)
+        and not is_owner_gone(store, store.case_owner(case_id))
+    )
+
+
+def event_stream(store, case_id, last_event_id=0):
+    """Stream the progress of a case as Server-Sent Events, until it finishes or the stream has been open for
+    progress_stream_seconds
+    Args:
+        store (ArtefactStore): The store the case's progress is recorded in
+        case_id (string): The ID of the case
+        last_event_id (int): The ID of the last event the browser received, from its Last-Event-ID header
+    Yields:
+        string: Each event, with its ID so the browser can resume the stream
+    """
+    deadline = time.monotonic() + progress_stream_seconds
+    yield f"retry: {progress_retry_milliseconds}\n\n"
+    while True:
+        for event_id, event in store.progress_events(case_id, last_event_id):
+            last_event_id = event_id
+            yield f"id: {event_id}\nevent: progress\ndata: {json.dumps(event)}\n\n"
+            if event["stage"] in final_stages:
+                return
+        if time.monotonic() > deadline:
+            return
+        time.sleep(progress_poll_seconds)
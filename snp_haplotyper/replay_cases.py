@@ -0,0 +1,413 @@
+import argparse
+from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import json
+import numpy as np
+import os
+import pandas as pd
+import sys
+import time
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+import result_bundle
+from exceptions import ResultBundleError
+
+# Replays an archive of cases through this version of BASHer & compares every table with the result bundles saved by
+# an earlier version. The cases are run in parallel processes and the differences are written as a JSON & HTML report.
+
+# The classification of the differences between two versions of a table, from least to most significant. Tables which
+# only differ in their dtypes, the order of their rows or by floating point rounding are equivalent.
+table_classifications = [
+    "identical",
+    "dtype",
+    "row_order",
+    "tolerance",
+    "changed",
+    "shape",
+    "added",
+    "missing",
+]
+equivalent_classifications = ["identical", "dtype", "row_order", "tolerance"]
+
+# The status of each replayed case
+case_statuses = [
+    "match",
+    "equivalent",
+    "changed",
+    "error",
+    "input_missing",
+    "invalid_bundle",
+]
+
+# The number of differing cells included in the report for each table
+max_examples = 5
+
+# Import command line arguments
+parser = argparse.ArgumentParser(
+    description="Replay archived cases through this version of BASHer and compare the results with their result bundles"
+)
+
+parser.add_argument(
+    "archive",
+    type=str,
+    nargs="+",
+    help="Result bundles, or folders which are searched for result bundles, saved by the earlier version",
+)
+
+parser.add_argument(
+    "-a",
+    "--array_folders",
+    type=str,
+    nargs="+",
+    default=[],
+    help="Folders containing the SNP array files, used if a file is no longer at the path in the bundle's manifest",
+)
+
+parser.add_argument(
+    "-o",
+    "--output_prefix",
+    type=str,
+    default="replay",
+    help="Prefix of the JSON & HTML diff reports",
+)
+
+parser.add_argument(
+    "-j",
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    help="Number of cases to replay in parallel",
+)
+
+parser.add_argument(
+    "--rtol",
+    type=float,
+    default=1e-9,
+    help="Relative tolerance within which floating point values are considered equivalent",
+)
+
+
+def find_bundles(archive):
+    """Find the result bundles in an archive
+    Args:
+        archive (list): Result bundles, or folders which are searched for result bundles
+    Returns:
+        list: The paths of the result bundles, sorted
+    """
+    bundle_paths = []
+    for path in archive:
+        if os.path.isfile(os.path.join(path, "manifest.json")):
+            bundle_paths.append(path)
+            continue
+        for folder, subfolders, files in os.walk(path):
+            if "manifest.json" in files:
+                bundle_paths.append(folder)
+                # A bundle does not contain other bundles
+                subfolders.clear()
+    return sorted(bundle_paths)
+
+
+def find_input_file(manifest, array_folders):
+    """Find the SNP array file a bundle was produced from, checking that it is unchanged
+    Args:
+        manifest (dict): The bundle's manifest
+        array_folders (list): Folders to search for the file by name
+    Returns:
+        string: The path of the file, None if it cannot be found
+    """
+    input_file = manifest["input_file"]
+    candidates = [manifest["parameters"]["input_file"]] + [
+        os.path.join(folder, input_file["file"]) for folder in array_folders
+    ]
+    for candidate in candidates:
+        if (
+            os.path.isfile(candidate)
+            and result_bundle.file_sha256(candidate) == input_file["sha256"]
+        ):
+            return candidate
+    return None
+
+
+def jsonable(value):
+    """A value of a table as a JSON serialisable value"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return str(value)
+
+
+def diff_table(old_df, new_df, rtol=1e-9):
+    """Compare the old & new versions of a table, all cells are compared at once
+    Args:
+        old_df (dataframe): The table from the earlier version's result bundle, None if it was not saved
+        new_df (dataframe): The table produced by this version, None if it was not produced
+        rtol (float): Relative tolerance within which floating point values are considered equivalent
+    Returns:
+        dict: The classification (see table_classifications), the number of rows & cells which differ and examples of
+        the differing cells
+    """
+    if old_df is None and new_df is None:
+        return {"classification": "identical"}
+    if old_df is None:
+        return {"classification": "added", "rows": len(new_df)}
+    if new_df is None:
+        return {"classification": "missing", "rows": len(old_df)}
+    if set(old_df.columns) != set(new_df.columns) or len(old_df) != len(new_df):
+        return {
+            "classification": "shape",
+            "old_rows": len(old_df),
+            "new_rows": len(new_df),
+            "removed_columns": [
+                str(c) for c in old_df.columns.difference(new_df.columns)
+            ],
+            "added_columns": [
+                str(c) for c in new_df.columns.difference(old_df.columns)
+            ],
+        }
+    # The index is not compared, rows are compared by position
+    old_df = old_df.reset_index(drop=True)
+    new_df = new_df[old_df.columns].reset_index(drop=True)
+
+    # Compared as objects so that columns whose dtypes have changed, e.g. to or from categorical, can be compared
+    equal = (old_df.astype(object) == new_df.astype(object)) | (
+        old_df.isna() & new_df.isna()
+    )
+    if equal.all(axis=None):
+        return {
+            "classification": "identical"
+            if old_df.dtypes.equals(new_df.dtypes)
+            else "dtype"
+        }
+
+    # Rows may have been produced in a different order
+    old_sorted = old_df.astype(str).sort_values(list(old_df.columns), ignore_index=True)
+    new_sorted = new_df.astype(str).sort_values(list(old_df.columns), ignore_index=True)
+    if old_sorted.equals(new_sorted):
+        return {"classification": "row_order"}
+
+    # Numeric cells which differ only by floating point rounding
+    numeric_columns = [
+        column
+        for column in old_df.columns
+        if pd.api.types.is_numeric_dtype(old_df[column])
+        and pd.api.types.is_numeric_dtype(new_df[column])
+    ]
+    close = equal.copy()
+    if numeric_columns:
+        close[numeric_columns] = close[numeric_columns] | np.isclose(
+            old_df[numeric_columns].to_numpy(dtype=float),
+            new_df[numeric_columns].to_numpy(dtype=float),
+            rtol=rtol,
+            atol=0,
+            equal_nan=True,
+        )
+    classification = "tolerance" if close.all(axis=None) else "changed"
+    differing = ~(close if classification == "changed" else equal)
+
+    rows, columns = np.nonzero(differing.to_numpy())
+    return {
+        "classification": classification,
+        "differing_rows": int(differing.any(axis=1).sum()),
+        "differing_cells": int(len(rows)),
+        "examples": [
+            {
+                "row": int(row),
+                "column": str(old_df.columns[column]),
+                "old": jsonable(old_df.iat[row, column]),
+                "new": jsonable(new_df.iat[row, column]),
+            }
+            for row, column in zip(rows[:max_examples], columns[:max_examples])
+        ],
+    }
+
+
+def case_status(table_diffs):
+    """The status of a replayed case from the classification of each of its tables"""
+    classifications = [diff["classification"] for diff in table_diffs.values()]
+    if all(classification == "identical" for classification in classifications):
+        return "match"
+    if all(
+        classification in equivalent_classifications
+        for classification in classifications
+    ):
+        return "equivalent"
+    return "changed"
+
+
+def replay_case(bundle_path, array_folders=(), rtol=1e-9):
+    """Replay a case through this version of BASHer & compare the results with its result bundle
+    Args:
+        bundle_path (string): The result bundle saved by the earlier version
+        array_folders (list): Folders to search for the SNP array file by name
+        rtol (float): Relative tolerance within which floating point values are considered equivalent
+    Returns:
+        dict: The case's status (see case_statuses), its sample ID, versions, time taken & the diff of each table
+    """
+    # case_api is only imported in the processes which replay the cases
+    import case_api
+
+    replay = {"bundle": bundle_path}
+    start = time.perf_counter()
+    try:
+        manifest, old_tables = result_bundle.load_result_bundle(bundle_path)
+    except (ResultBundleError, OSError, ValueError, KeyError) as error:
+        return replay | {"status": "invalid_bundle", "error": str(error)}
+    replay |= {
+        "sample_id": manifest["parameters"].get("output_prefix"),
+        "old_version": manifest["basher_version"],
+        "new_version": config.basher_version,
+    }
+    input_file = find_input_file(manifest, array_folders)
+    if input_file is None:
+        return replay | {
+            "status": "input_missing",
+            "error": f"{manifest['input_file']['file']} with SHA-256 {manifest['input_file']['sha256']} was not found",
+        }
+
+    # The case is run on its own, not merged with the embryos of other cases in the trio cache
+    args = Namespace(**manifest["parameters"])
+    args.incremental = False
+    try:
+        result = case_api.run_case(
+            case_api.CaseSpec.from_args(args), input_file, formats=[]
+        )
+    except Exception as error:
+        logger.exception(f"Replaying {bundle_path} failed")
+        return replay | {"status": "error", "error": f"{type(error).__name__}: {error}"}
+
+    table_diffs = {
+        table_name: diff_table(
+            old_tables.get(table_name), getattr(result, table_name), rtol
+        )
+        for table_name in result_bundle.bundle_tables
+    }
+    return replay | {
+        "status": case_status(table_diffs),
+        "seconds": round(time.perf_counter() - start, 3),
+        "tables": table_diffs,
+    }
+
+
+def replay_cases(bundle_paths, array_folders=(), rtol=1e-9, jobs=1):
+    """Replay cases in parallel
+    Args:
+        bundle_paths (list): The result bundles saved by the earlier version
+        array_folders (list): Folders to search for the SNP array files by name
+        rtol (float): Relative tolerance within which floating point values are considered equivalent
+        jobs (int): Number of cases to replay in parallel
+    Returns:
+        list: The replay of each case, see replay_case(), in the order of bundle_paths
+    """
+    replays = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(replay_case, bundle_path, array_folders, rtol): bundle_path
+            for bundle_path in bundle_paths
+        }
+        for future in as_completed(futures):
+            replay = future.result()
+            replays[futures[future]] = replay
+            logger.info(
+                f"Replayed {len(replays)} of {len(bundle_paths)} cases, {replay['bundle']}: {replay['status']}"
+            )
+    return [replays[bundle_path] for bundle_path in bundle_paths]
+
+
+def replay_summary(replays, seconds):
+    """Count the cases with each status & table classification"""
+    return {
+        "cases": len(replays),
+        "seconds": round(seconds, 1),
+        "cases_per_hour": round(len(replays) / seconds * 3600) if seconds else None,
+        "statuses": {
+            status: sum(replay["status"] == status for replay in replays)
+            for status in case_statuses
+        },
+        "tables": {
+            table_name: {
+                classification: count
+                for classification in table_classifications
+                if (
+                    count := sum(
+                        replay["tables"][table_name]["classification"] == classification
+                        for replay in replays
+                        if "tables" in replay
+                    )
+                )
+            }
+            for table_name in result_bundle.bundle_tables
+        },
+    }
+
+
+def write_replay_report(replays, summary, output_prefix):
+    """Write the replay as a JSON report & a compact HTML report of the cases which do not match
+    Args:
+        replays (list): The replay of each case, see replay_case()
+        summary (dict): The summary produced by replay_summary()
+        output_prefix (string): The path of the reports without their extensions
+    """
+    # jinja2 is only imported when the report is written
+    from jinja2 import Environment, PackageLoader
+
+    report = {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "basher_version": config.basher_version,
+        "summary": summary,
+        "cases": replays,
+    }
+    with open(output_prefix + ".json", "w") as f:
+        json.dump(report, f, indent=4)
+
+    env = Environment(
+        loader=PackageLoader("snp_haplotype", "templates"), autoescape=True
+    )
+    with open(output_prefix + ".html", "w") as f:
+        f.write(
+            env.get_template("replay_report.html").render(
+                report,
+                case_statuses=case_statuses,
+                unmatched_cases=[
+                    replay for replay in replays if replay["status"] != "match"
+                ],
+            )
+        )
+    logger.info(f"Saved replay reports to {output_prefix}.json & .html")
+
+
+def replay_passed(summary):
+    """True if every case matches, or is equivalent to, its result bundle"""
+    return (
+        summary["statuses"]["match"] + summary["statuses"]["equivalent"]
+        == summary["cases"]
+    )
+
+
+def main(args):
+    """Replay the archived cases & write the diff reports
+    Returns:
+        dict: The summary of the replay, see replay_summary()
+    """
+    bundle_paths = find_bundles(args.archive)
+    logger.info(f"Replaying {len(bundle_paths)} cases with {args.jobs} processes")
+    start = time.perf_counter()
+    replays = replay_cases(bundle_paths, args.array_folders, args.rtol, args.jobs)
+    summary = replay_summary(replays, time.perf_counter() - start)
+    write_replay_report(replays, summary, args.output_prefix)
+    return summary
+
+
+# run the script
+if __name__ == "__main__":
+    summary = main(parser.parse_args())
+    print(json.dumps(summary["statuses"]))
+    sys.exit(0 if replay_passed(summary) else 1)
@@ -0,0 +1,101 @@
+import os
+import shutil
+import sys
+import time
+import zipfile
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+
+# Reports produced by the web app are kept in the upload folder so that they can be downloaded more than once, they
+# are purged once they are older than the retention period. The period can be set in the environment.
+report_retention_days = float(
+    os.getenv("REPORT_RETENTION_DAYS", config.report_retention_days)
+)
+
+# Size of the blocks read from each report & written to the response while the zip is streamed
+zip_chunk_size = 64 * 1024
+
+
+class _ZipStream:
+    """A write only file object which buffers the output of zipfile so it can be yielded in chunks
+    It has no tell() or seek(), so zipfile writes each member's size after its data rather than seeking back.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def write(self, data):
+        self.buffer += data
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return & clear the buffered output"""
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        return chunk
+
+
+def stream_zip(files):
+    """Compress files into a zip archive which is yielded in chunks as it is written
+    Only one chunk of each file is held in memory at a time, so the archive can be streamed to a response without
+    being written to disk.
+    Args:
+        files (list): A (path, name) tuple for each file, where name is the name of the file within the archive
+    Yields:
+        bytes: The next chunk of the zip archive
+    """
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for path, name in files:
+            with open(path, "rb") as source, zip_file.open(name, "w") as member:
+                while block := source.read(zip_chunk_size):
+                    member.write(block)
+                    if stream.buffer:
+                        yield stream.take()
+            # Closing each member writes its size & checksum
+            yield stream.take()
+    # Closing the archive writes the central directory
+    yield stream.take()
+
+
+def purge_expired_reports(folder, retention_days=report_retention_days, exclude=()):
+    """Delete the reports & uploads in a folder which are older than the retention period
+    Args:
+        folder (string): The folder the web app saves uploads & reports in
+        retention_days (float): The number of days to keep files for
+        exclude (list): The names of files & folders in the folder which are never deleted
+    Returns:
+        list: The paths which were deleted
+    """
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+    purged = []
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.name in exclude:
+                continue
+            try:
+                if entry.stat(follow_symlinks=False).st_mtime >= cutoff:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Already purged by another worker
+                continue
+            purged.append(entry.path)
+    if purged:
+        logger.info(
+            f"Purged {len(purged)} files older than {retention_days} days from {folder}"
+        )
+    return purged
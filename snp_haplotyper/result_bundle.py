@@ -0,0 +1,195 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+import profiling
+from array_io import file_sha256
+from exceptions import ResultBundleError
+
+# Each run writes its results as a bundle, a folder with a Parquet file for each table and a manifest.json file
+# recording the parameters, timings and SHA-256 hashes of the input, tables & reports. Bundles can be loaded to audit,
+# re-render or compare cases without re-running the analysis. Writing & loading bundles requires pyarrow.
+
+# Incremented when the tables or manifest change in a way which older versions of BASHer cannot load
+bundle_version = 1
+
+# The BasherCase stage saved as each table of the bundle, tables which are None for a case are not saved
+bundle_tables = {
+    "summary_snps_by_region": "summary_snps_by_region",
+    "informative_snps_by_region": "informative_snps_by_region",
+    "qc": "qc_df",
+    "embryo_count_data": "embryo_count_data_df",
+    "embryo_categories": "embryo_category_df",
+    "flank_sensitivity": "sensitivity_df",
+}
+
+
+def jsonable_parameters(args):
+    """The arguments of a case as a JSON serialisable dictionary, from which the Namespace can be rebuilt"""
+    return {
+        parameter: value
+        if isinstance(value, (str, int, float, bool, list, type(None)))
+        else str(value)
+        for parameter, value in vars(args).items()
+    }
+
+
+def replace_folder(source_path, destination_path):
+    """Move a folder into place, replacing the folder already there
+    A folder cannot be renamed over one which is not empty, so the old folder is first moved aside & only removed once
+    the new folder is in place. It is moved back if the new folder cannot be moved into place.
+    Args:
+        source_path (string): The folder to move
+        destination_path (string): The folder to replace, which need not exist
+    """
+    if not os.path.isdir(destination_path):
+        os.replace(source_path, destination_path)
+        return
+    old_path = f"{source_path}.old"
+    os.replace(destination_path, old_path)
+    try:
+        os.replace(source_path, destination_path)
+    except BaseException:
+        os.replace(old_path, destination_path)
+        raise
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def write_result_bundle(case, bundle_path, stage_seconds=None, report_paths=()):
+    """Write the results of a case as a bundle of Parquet tables & a JSON manifest
+    The bundle is written to a temporary folder which is then moved into place, so a partially written bundle is never
+    loaded. A bundle already at the path, e.g. from an earlier run of the case, is replaced.
+    Args:
+        case (BasherCase): The case, any stages which have not been calculated are calculated
+        bundle_path (string): The folder to write the bundle to
+        stage_seconds (dict): The time taken for each stage of the analysis, recorded in the manifest
+        report_paths (list): The reports written for the case, whose hashes are recorded in the manifest
+    Returns:
+        dict: The manifest
+    """
+    parent_folder = os.path.dirname(os.path.abspath(bundle_path))
+    temp_path = tempfile.mkdtemp(dir=parent_folder, suffix=".tmp")
+    try:
+        tables = {}
+        for table_name, stage in bundle_tables.items():
+            table_df = getattr(case, stage)
+            if table_df is None:
+                continue
+            file_name = f"{table_name}.parquet"
+            table_df.to_parquet(os.path.join(temp_path, file_name))
+            tables[table_name] = {
+                "file": file_name,
+                "rows": len(table_df),
+                "sha256": file_sha256(os.path.join(temp_path, file_name)),
+            }
+        manifest = {
+            "bundle_version": bundle_version,
+            "basher_version": config.basher_version,
+            "genome_build": config.genome_build,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "parameters": jsonable_parameters(case.args),
+            "input_file": {
+                "file": os.path.basename(case.args.input_file),
+                "sha256": file_sha256(case.args.input_file),
+                "number_snps_imported": int(case.number_snps_imported),
+            },
+            "embryo_ids": None if case.args.trio_only else list(case.embryo_ids),
+            "stage_seconds": {
+                stage: round(seconds, 3)
+                for stage, seconds in (stage_seconds or {}).items()
+            },
+            "stage_peak_memory_bytes": dict(case.stage_peak_memory_bytes),
+            "tables": tables,
+            "reports": {
+                os.path.basename(report_path): file_sha256(report_path)
+                for report_path in report_paths
+            },
+        }
+        if case.profiler is not None:
+            # The profile of a case run with --profile, see profiling.py
+            profile_paths = case.profiler.save(
+                os.path.join(temp_path, profiling.profile_folder_name)
+            )
+            manifest["profile"] = {
+                os.path.basename(path): file_sha256(path) for path in profile_paths
+            }
+        with open(os.path.join(temp_path, "manifest.json"), "w") as f:
+            json.dump(manifest, f, indent=4)
+        replace_folder(temp_path, bundle_path)
+    except BaseException:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        raise
+    logger.info(f"Saved result bundle to {bundle_path}")
+    return manifest
+
+
+def load_result_bundle(bundle_path):
+    """Load a bundle written by write_result_bundle()
+    Args:
+        bundle_path (string): The bundle's folder
+    Returns:
+        tuple: The manifest (dict) and the tables (dict of dataframes, keyed by the table names in bundle_tables)
+    Raises:
+        ResultBundleError: If the bundle was written by a newer version of BASHer or a table does not match its hash
+    """
+    with open(os.path.join(bundle_path, "manifest.json")) as f:
+        manifest = json.load(f)
+    if manifest["bundle_version"] > bundle_version:
+        raise ResultBundleError(
+            f"The result bundle {bundle_path} is version {manifest['bundle_version']}, this version of BASHer can "
+            f"only load bundles up to version {bundle_version}"
+        )
+    tables = {
+        table_name: load_bundle_table(bundle_path, manifest, table_name)
+        for table_name in manifest["tables"]
+    }
+    return manifest, tables
+
+
+def load_bundle_table(bundle_path, manifest, table_name):
+    """Load a single table of a bundle written by write_result_bundle()
+    Args:
+        bundle_path (string): The bundle's folder
+        manifest (dict): The bundle's manifest
+        table_name (string): One of the table names in the manifest
+    Returns:
+        dataframe: The table
+    Raises:
+        ResultBundleError: If the table does not match its hash
+    """
+    table = manifest["tables"][table_name]
+    table_path = os.path.join(bundle_path, table["file"])
+    if file_sha256(table_path) != table["sha256"]:
+        raise ResultBundleError(
+            f"The {table_name} table of the result bundle {bundle_path} does not match the hash in its manifest"
+        )
+    return pd.read_parquet(table_path)
+
+
+def arrow_ipc_stream(table_df):
+    """Serialise a table as an Arrow IPC stream, the format of the application/vnd.apache.arrow.stream media type
+    Args:
+        table_df (dataframe): A table of a result bundle
+    Returns:
+        bytes: The Arrow IPC stream
+    """
+    import pyarrow
+
+    table = pyarrow.Table.from_pandas(table_df)
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
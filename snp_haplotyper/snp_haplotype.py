@@ -1,15 +1,16 @@
 import argparse
+import contextlib
 from io import IOBase
-from jinja2 import Environment, PackageLoader
 import json
 import os
 import pandas as pd
 from pathlib import Path
-import pdfkit
 import numpy as np
 from datetime import datetime
+from functools import lru_cache
 
 import sys
+import time
 
 import logging
 
@@ -28,7 +29,12 @@ import config as config
 # allow_x_linked_cases,allow_consanguineous_cases, basher_version, released_to_production
 
 from x_linked_logic import x_linked_analysis
-from snp_plot import plot_results
+import array_io
+import memory_limit
+import profiling
+import progress
+import result_bundle
+import trio_cache
 
 from exceptions import ArgumentInputError, InvalidParameterSelectedError
 
@@ -40,202 +46,299 @@ from exceptions import ArgumentInputError, InvalidParameterSelectedError
 # Import environment variables set by docker-compose
 UPLOAD_FOLDER = os.getenv("UPLOAD_FOLDER")
 
-# Import command line arguments (these can be automatically generated from the sample sheet using sample_sheet_reader.py)
-parser = argparse.ArgumentParser(description="SNP Haplotying from SNP Array data")
-
-# File input/output data
-parser.add_argument(
-    "-i",
-    "--input_file",
-    type=str,
-    help="Input txt file containing SNP Array output",
-)
-
-parser.add_argument(
-    "-o",
-    "--output_prefix",
-    type=str,
-    help="Output filename prefix",
-)
-
-parser.add_argument(
-    "-f",
-    "--output_folder",
-    type=str,
-    help="Output folder path",
-)
-
-# Patient data
-parser.add_argument(
-    "-m",
-    "--mode_of_inheritance",
-    type=str,
-    choices=["autosomal_dominant", "autosomal_recessive", "x_linked"],
-    help="The mode of inheritance",
-)
-
-parser.add_argument(
-    "-mp",
-    "--male_partner",
-    type=str,
-    help="ID in input table for male_partner",
-)
-
-parser.add_argument(
-    "-mps",
-    "--male_partner_status",
-    type=str,
-    choices=["affected", "unaffected", "carrier"],
-    help="Status of male_partner",
-)
-
-parser.add_argument(
-    "-fp",
-    "--female_partner",
-    type=str,
-    help="ID in input table for male_partner",
-)
-
-parser.add_argument(
-    "-fps",
-    "--female_partner_status",
-    choices=["affected", "unaffected", "carrier"],
-    type=str,
-    help="ID in input table for female_partner",
-)
-
-parser.add_argument(
-    "-consang",
-    "--consanguineous",
-    action=argparse.BooleanOptionalAction,
-    default=False,
-    help="Flag to indicate that partners are consanguineous",
-)
-
-parser.add_argument(
-    "-r",
-    "--reference",
-    type=str,
-    help="ID in input table for reference sample",
-)
-
-parser.add_argument(
-    "-rs",
-    "--reference_status",
-    type=str,
-    choices=["affected", "unaffected", "carrier"],
-    help="Status of Reference",
-)
-
-parser.add_argument(
-    "-rr",
-    "--reference_relationship",
-    type=str,
-    choices=[
-        "grandparent",
-        "child",
-    ],
-    help="Reference relationship to pro-band",
-)
-
-parser.add_argument(
-    "-e",
-    "--embryo_ids",
-    nargs="+",
-    type=str,
-    help="IDs of embryos in the input table",
-)
-
-parser.add_argument(
-    "-es",
-    "--embryo_sex",
-    nargs="+",
-    type=str,
-    choices=[
-        "male",
-        "female",
-        "unknown",
-    ],
-    help="Embryo sex - must be in same order as embryo_ids (cannot be unknown for X-linked diseases)",
-)
-
-# Gene/ROI data
-parser.add_argument(
-    "-g",
-    "--gene_symbol",
-    type=str,
-    help="Gene Symbol",
-)
-
-parser.add_argument(
-    "-gs",
-    "--gene_start",
-    type=int,
-    help="Gene Start genomic co-ordinate (1-based referencing)",
-)
-
-parser.add_argument(
-    "-ge",
-    "--gene_end",
-    type=int,
-    help="Gene End genomic co-ordinate (1-based referencing)",
-)
-
-parser.add_argument(
-    "-c",
-    "--chr",
-    type=str,
-    choices=[
-        "1",
-        "2",
-        "3",
-        "4",
-        "5",
-        "6",
-        "7",
-        "8",
-        "9",
-        "10",
-        "11",
-        "12",
-        "13",
-        "14",
-        "15",
-        "16",
-        "17",
-        "18",
-        "19",
-        "20",
-        "21",
-        "22",
-        "x",
-        "y",
-    ],
-    help="Chromosome of ROI/gene",
-)
-
-parser.add_argument(
-    "--flanking_region_size",
-    type=str,
-    nargs="?",
-    choices=["2mb", "3mb", "4mb", "5mb", "6mb", "7mb", "8mb", "9mb", "10mb"],
-    const="2mb",
-    help="Size of the flanking region either side of the gene",
-)
-
-parser.add_argument(
-    "--trio_only",
-    action=argparse.BooleanOptionalAction,
-    default=False,
-    help="Flag to produce a preliminary report without looking at embryos, must be used if not embryo data is provided.",
-)
-
-parser.add_argument(
-    "--header_info",
-    type=str,
-    required=True,
-    help="Pass a string to populate the report header. A field will be created for each entry field_title=field_value separated by ';', for example 'PRU=1234;Hospital No=1234;Biopsy No=111' will produce 3 fields in the header with the titles PRU, Hospital No, and Biopsy No.",
-)
+# Flanking region sizes which can be analysed either side of the gene, in increasing size
+flanking_region_sizes = ["2mb", "3mb", "4mb", "5mb", "6mb", "7mb", "8mb", "9mb", "10mb"]
+
+# The outputs which can be produced for a case, the plots are only produced for the html & pdf reports
+report_formats = ["json", "html", "pdf"]
+default_report_formats = ["html", "pdf"]
+
+# The interactive plots either draw every SNP (standard) or draw the informative SNPs with WebGL and summarise the
+# uninformative & NoCall SNPs as density strips (scalable), which keeps large flanking regions responsive
+plot_modes = ["standard", "scalable"]
+
+# Risk categories in the order they are coded in the embryo category matrix used for the overview plot
+embryo_matrix_categories = [
+    "high_risk",
+    "low_risk",
+    "miscall",
+    "ADO",
+    "NoCall",
+    "uninformative",
+]
+
+
+def build_parser():
+    """Build the command line parser, only done when it is needed so that importing this module stays fast
+    Returns:
+        ArgumentParser: The parser for the snp_haplotype.py command line arguments
+    """
+    # Import command line arguments (these can be automatically generated from the sample sheet using sample_sheet_reader.py)
+    parser = argparse.ArgumentParser(description="SNP Haplotying from SNP Array data")
+
+    # File input/output data
+    parser.add_argument(
+        "-i",
+        "--input_file",
+        type=str,
+        help="Input txt file containing SNP Array output",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output_prefix",
+        type=str,
+        help="Output filename prefix",
+    )
+
+    parser.add_argument(
+        "-f",
+        "--output_folder",
+        type=str,
+        help="Output folder path",
+    )
+
+    parser.add_argument(
+        "--formats",
+        type=str,
+        nargs="+",
+        choices=report_formats,
+        default=default_report_formats,
+        help="The outputs to produce, json (summary tables only), html and/or pdf reports",
+    )
+
+    parser.add_argument(
+        "--plot_mode",
+        type=str,
+        choices=plot_modes,
+        default="standard",
+        help="Draw every SNP in the interactive plots (standard), or draw the informative SNPs with WebGL and the uninformative & NoCall SNPs as density strips (scalable) for large flanking regions",
+    )
+
+    # Patient data
+    parser.add_argument(
+        "-m",
+        "--mode_of_inheritance",
+        type=str,
+        choices=["autosomal_dominant", "autosomal_recessive", "x_linked"],
+        help="The mode of inheritance",
+    )
+
+    parser.add_argument(
+        "-mp",
+        "--male_partner",
+        type=str,
+        help="ID in input table for male_partner",
+    )
+
+    parser.add_argument(
+        "-mps",
+        "--male_partner_status",
+        type=str,
+        choices=["affected", "unaffected", "carrier"],
+        help="Status of male_partner",
+    )
+
+    parser.add_argument(
+        "-fp",
+        "--female_partner",
+        type=str,
+        help="ID in input table for male_partner",
+    )
+
+    parser.add_argument(
+        "-fps",
+        "--female_partner_status",
+        choices=["affected", "unaffected", "carrier"],
+        type=str,
+        help="ID in input table for female_partner",
+    )
+
+    parser.add_argument(
+        "-consang",
+        "--consanguineous",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Flag to indicate that partners are consanguineous",
+    )
+
+    parser.add_argument(
+        "-r",
+        "--reference",
+        type=str,
+        help="ID in input table for reference sample",
+    )
+
+    parser.add_argument(
+        "-rs",
+        "--reference_status",
+        type=str,
+        choices=["affected", "unaffected", "carrier"],
+        help="Status of Reference",
+    )
+
+    parser.add_argument(
+        "-rr",
+        "--reference_relationship",
+        type=str,
+        choices=[
+            "grandparent",
+            "child",
+        ],
+        help="Reference relationship to pro-band",
+    )
+
+    parser.add_argument(
+        "-e",
+        "--embryo_ids",
+        nargs="+",
+        type=str,
+        help="IDs of embryos in the input table",
+    )
+
+    parser.add_argument(
+        "-es",
+        "--embryo_sex",
+        nargs="+",
+        type=str,
+        choices=[
+            "male",
+            "female",
+            "unknown",
+        ],
+        help="Embryo sex - must be in same order as embryo_ids (cannot be unknown for X-linked diseases)",
+    )
+
+    # Gene/ROI data
+    parser.add_argument(
+        "-g",
+        "--gene_symbol",
+        type=str,
+        help="Gene Symbol",
+    )
+
+    parser.add_argument(
+        "-gs",
+        "--gene_start",
+        type=int,
+        help="Gene Start genomic co-ordinate (1-based referencing)",
+    )
+
+    parser.add_argument(
+        "-ge",
+        "--gene_end",
+        type=int,
+        help="Gene End genomic co-ordinate (1-based referencing)",
+    )
+
+    parser.add_argument(
+        "-c",
+        "--chr",
+        type=str,
+        choices=[
+            "1",
+            "2",
+            "3",
+            "4",
+            "5",
+            "6",
+            "7",
+            "8",
+            "9",
+            "10",
+            "11",
+            "12",
+            "13",
+            "14",
+            "15",
+            "16",
+            "17",
+            "18",
+            "19",
+            "20",
+            "21",
+            "22",
+            "x",
+            "y",
+        ],
+        help="Chromosome of ROI/gene",
+    )
+
+    parser.add_argument(
+        "--flanking_region_size",
+        type=str,
+        nargs="?",
+        choices=flanking_region_sizes,
+        const="2mb",
+        help="Size of the flanking region either side of the gene",
+    )
+
+    parser.add_argument(
+        "--flank_sensitivity",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Flag to add a table of the informative SNP counts for every flanking region size (2mb-10mb) to the report",
+    )
+
+    parser.add_argument(
+        "--embryo_plots",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Flag to plot each embryo in detail, the overview plot of all embryos is always included in the report. Use --no-embryo_plots to only include the overview plot",
+    )
+
+    parser.add_argument(
+        "--trio_only",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Flag to produce a preliminary report without looking at embryos, must be used if not embryo data is provided.",
+    )
+
+    parser.add_argument(
+        "--incremental",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Flag to reuse the cached trio classification and embryo results for this SNP array & trio, only embryos which have not been analysed before are categorised",
+    )
+
+    parser.add_argument(
+        "--result_bundle",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Flag to save the results tables as Parquet files with a JSON manifest of the parameters, timings & hashes in a folder next to the reports, which can be loaded with result_bundle.load_result_bundle(). Use --no-result_bundle to skip",
+    )
+
+    parser.add_argument(
+        "--low_memory",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Flag to analyse a case which needs more memory than is available. The SNP array file is read in chunks keeping only the SNPs in the analysed region, rather than importing every SNP, and the HTML report has static plots rather than interactive ones. The web app reruns a case in this mode if it exceeds its memory ceiling",
+    )
+
+    parser.add_argument(
+        "--profile",
+        action=argparse.BooleanOptionalAction,
+        default=False,
+        help="Flag to profile each stage of the analysis and save the collapsed stacks, a flamegraph SVG, the functions with the highest cumulative time and the largest memory allocations in the profile folder of the result bundle. Implies --result_bundle",
+    )
+
+    parser.add_argument(
+        "--header_info",
+        type=str,
+        required=True,
+        help="Pass a string to populate the report header. A field will be created for each entry field_title=field_value separated by ';', for example 'PRU=1234;Hospital No=1234;Biopsy No=111' will produce 3 fields in the header with the titles PRU, Hospital No, and Biopsy No.",
+    )
+
+    return parser
+
+
+def __getattr__(name):
+    # The parser is built the first time snp_haplotype.parser is accessed
+    if name == "parser":
+        globals()["parser"] = build_parser()
+        return globals()["parser"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # If no arguments are provided, print the help message
 # sys.argv includes a list of elements starting with the program
@@ -295,6 +398,16 @@ def export_json_data_as_csv(input_json, output_csv):
     df.to_csv(output_csv, index=False, encoding="utf-8")
 
 
+def flanking_region_size_to_bp(flanking_region_size):
+    """Converts a flanking region size in the format "2mb" into a number of base pairs
+    Args:
+        flanking_region_size (str): Size of flanking region either side of gene of interest "2mb" to "10mb"
+    Returns:
+        int: Size of the flanking region in base pairs
+    """
+    return int(flanking_region_size.lower().removesuffix("mb")) * 1000000
+
+
 # filter dataframe on region of interest
 def filter_dataframe(
     df, gene_start, gene_end, flanking_region_size
@@ -305,16 +418,13 @@ def filter_dataframe(
         df (pandas dataframe): Dataframe containing SNP data
         int(args.gene_start) (int): Start position of gene of interest
         args.gene_end (int): End position of gene of interest
-        args.flanking_region_size (str): Size of flanking region either side of gene of interest "2mb" or "3mb"
+        args.flanking_region_size (str): Size of flanking region either side of gene of interest "2mb" to "10mb"
     Returns:
         df (pandas dataframe): Dataframe containing only SNPs within the region of interest
     """
-    if flanking_region_size == "2mb":
-        region_start = int(gene_start) - 2000000
-        region_end = int(gene_end) + 2000000
-    elif flanking_region_size == "3mb":
-        region_start = int(gene_start) - 3000000
-        region_end = int(gene_end) + 3000000
+    flanking_region_bp = flanking_region_size_to_bp(flanking_region_size)
+    region_start = int(gene_start) - flanking_region_bp
+    region_end = int(gene_end) + flanking_region_bp
     df = df[df["Position"] >= region_start]
     df = df[df["Position"] <= region_end]
     return df
@@ -578,6 +688,168 @@ def detect_miscall_or_ado(
     return result
 
 
+def classify_trio(
+    df,
+    mode_of_inheritance,
+    male_partner,
+    male_partner_status,
+    female_partner,
+    female_partner_status,
+    reference,
+    reference_status,
+    reference_relationship,
+    consanguineous,
+):
+    """Categorise the SNPs of the reference trio using the logic for the mode of inheritance
+    The trio classification only depends on the partners and the reference, not on the embryos, so it can be
+    calculated once and reused for any number of embryos or regions of interest.
+    Args:
+        df (dataframe): A dataframe with the SNP array data, NoCalls for the trio should already be filtered out
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+        male_partner (string):  Column name representing the data for the male partner
+        male_partner_status (string): "affected", "unaffected", or "carrier"
+        female_partner (string):  Column name representing the data for the female partner
+        female_partner_status (string): "affected", "unaffected", or "carrier"
+        reference (string):  Column name representing the data for the reference
+        reference_status (string) : "affected", "unaffected", or "carrier"
+        reference_relationship (string) : "grandparent" or "child"
+        consanguineous (boolean): Boolean value indicating if the parents are consanguineous
+    Returns:
+        dataframe: Original dataframe, df, with the risk category column(s) for the mode of inheritance added
+    """
+    if mode_of_inheritance == "autosomal_dominant":
+        # Assign the correct partner to 'affected' and 'unaffected'
+        if male_partner_status == "affected":
+            affected_partner = male_partner
+            unaffected_partner = female_partner
+        elif female_partner_status == "affected":
+            affected_partner = female_partner
+            unaffected_partner = male_partner
+        results_df = autosomal_dominant_analysis(
+            df,
+            affected_partner,
+            unaffected_partner,
+            reference,
+            reference_status,
+            reference_relationship,
+        )
+    elif mode_of_inheritance == "autosomal_recessive":
+        results_df = autosomal_recessive_analysis(
+            df,
+            male_partner,
+            female_partner,
+            reference,
+            reference_status,
+            consanguineous,
+        )
+    elif mode_of_inheritance == "x_linked":
+        results_df = x_linked_analysis(
+            df,
+            female_partner,
+            male_partner,
+            reference,
+        )
+    return results_df
+
+
+def informative_snp_indicators(results_df, mode_of_inheritance):
+    """Flag the informative SNPs and their risk categories so that they can be counted with cumulative sums
+    Args:
+        results_df (dataframe): A dataframe produced by classify_trio()
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+    Returns:
+        dataframe: One integer (0/1) column, "informative_snps", flagging the informative SNPs followed by a column for
+        each high/low risk category (split by partner for AR, and by embryo genotype for XL), in the same row order as results_df
+    """
+    indicators = {}
+    if mode_of_inheritance == "autosomal_dominant":
+        risk_category = results_df["snp_risk_category"]
+        indicators["informative_snps"] = risk_category != "uninformative"
+        for risk in ["high_risk", "low_risk"]:
+            indicators[risk] = risk_category == risk
+    elif mode_of_inheritance == "autosomal_recessive":
+        risk_category = results_df["snp_risk_category"]
+        indicators["informative_snps"] = risk_category != "uninformative"
+        for partner in ["male_partner", "female_partner"]:
+            for risk in ["high_risk", "low_risk"]:
+                indicators[f"{partner}_{risk}"] = (risk_category == risk) & (
+                    results_df["snp_inherited_from"] == partner
+                )
+    elif mode_of_inheritance == "x_linked":
+        indicators["informative_snps"] = (
+            (results_df["female_AB_snp_risk_category"] != "uninformative")
+            & (results_df["male_AA_snp_risk_category"] != "uninformative")
+            & (results_df["male_BB_snp_risk_category"] != "uninformative")
+        )
+        for embryo_genotype in ["female_AB", "male_AA", "male_BB"]:
+            for risk in ["high_risk", "low_risk"]:
+                indicators[f"{embryo_genotype}_{risk}"] = (
+                    results_df[f"{embryo_genotype}_snp_risk_category"] == risk
+                )
+    return pd.DataFrame(indicators).astype(np.int64)
+
+
+def flank_sensitivity_table(
+    results_df,
+    embryo_category_df,
+    gene_start,
+    gene_end,
+    mode_of_inheritance,
+    embryo_ids=None,
+):
+    """Count the informative SNPs for every flanking region size in a single pass
+    The SNPs are sorted by their distance outward from the gene boundaries (SNPs within the gene have a distance of 0)
+    and cumulative sums taken of the informative SNPs and of each embryo's high/low risk SNPs. The counts for a
+    flanking region size are then the cumulative sums at the last SNP within that distance, so one analysis of the
+    largest window replaces a full run for each flanking region size.
+    Args:
+        results_df (dataframe): A dataframe produced by classify_trio() for the largest flanking region
+        embryo_category_df (dataframe): A dataframe produced by categorise_embryo_alleles() for the same SNPs, or None if
+            only a trio is being run
+        gene_start (int): The start coordinate of the gene (1-based)
+        gene_end (int): The end coordinate of the gene (1-based)
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+        embryo_ids (list): List of embryo_ids matching the columns names in embryo_category_df
+    Returns:
+        dataframe: One row per flanking region size with the number of informative SNPs and the number of
+        high_risk/low_risk SNPs for each embryo
+    """
+    gene_start = int(gene_start)
+    gene_end = int(gene_end)
+
+    counts_df = informative_snp_indicators(results_df, mode_of_inheritance)[
+        ["informative_snps"]
+    ]
+    if embryo_category_df is not None:
+        for embryo in embryo_ids:
+            for risk in ["high_risk", "low_risk"]:
+                counts_df[f"{embryo}_{risk}"] = (
+                    embryo_category_df[f"{embryo}_risk_category"] == risk
+                ).astype(np.int64)
+
+    # Distance of each SNP outward from the nearest gene boundary
+    position = results_df["Position"].to_numpy()
+    distance_from_gene = np.where(
+        position <= gene_start,
+        gene_start - position,
+        np.where(position > gene_end, position - gene_end, 0),
+    )
+    order = np.argsort(distance_from_gene, kind="stable")
+    cumulative_counts = np.zeros((len(order) + 1, counts_df.shape[1]), np.int64)
+    np.cumsum(counts_df.to_numpy()[order], axis=0, out=cumulative_counts[1:])
+
+    # Number of SNPs within each flanking region size (inclusive, as in filter_dataframe())
+    flanking_region_bp = [flanking_region_size_to_bp(x) for x in flanking_region_sizes]
+    cut_points = np.searchsorted(
+        distance_from_gene[order], flanking_region_bp, side="right"
+    )
+    sensitivity_df = pd.DataFrame(
+        cumulative_counts[cut_points], columns=counts_df.columns
+    )
+    sensitivity_df.insert(0, "flanking_region_size", flanking_region_sizes)
+    return sensitivity_df
+
+
 def snps_by_region(df, mode_of_inheritance):
     """Summarise the number of SNPs by regions around the gene of interest
     Takes a results_df dataframe produced from either autosomal_dominant_analysis(),
@@ -1206,253 +1478,709 @@ def dict2html(header_dictionary):
     return header_html
 
 
-def main(args):
-    # Check config.py file to see which paramters are currently supported.
-    # Typically this is used when the script has been validated for some modes of inheritance
-    # and we want to ensure that the script is not run for other, unvalidated, modes of inheritance.
-
-    logger.info(f"snp_haplotyper version: called successfully.")
-
+def check_analysis_allowed(mode_of_inheritance, chr, consanguineous, trio_only):
+    """Check the requested analysis is supported by this release and makes biological sense
+    The config.py file has flags which can be used to prevent unvalidated modes of inheritance, consanguineous
+    cases, or trio only analysis being run.
+    Args:
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+        chr (string): The chromsome the gene of interest is on
+        consanguineous (boolean): Boolean value indicating if the parents are consanguineous
+        trio_only (boolean): Boolean value indicating if only the trio is being analysed
+    Raises:
+        InvalidParameterSelectedError: If the config.py file prohibits the requested analysis
+        ArgumentInputError: If the chromosome is not valid for the mode of inheritance
+    """
     if (
         config.allow_autosomal_dominant_cases == False
-        and args.mode_of_inheritance == "autosomal_dominant"
+        and mode_of_inheritance == "autosomal_dominant"
     ):
         raise InvalidParameterSelectedError(
             "Please check the config.py file to see whether autosomal dominant samples are supported in the current release"
         )
     elif (
         config.allow_autosomal_recessive_cases == False
-        and args.mode_of_inheritance == "autosomal_recessive"
+        and mode_of_inheritance == "autosomal_recessive"
     ):
         raise InvalidParameterSelectedError(
             "As per the config.py file autosomal recessive samples are not supported in this release"
         )
-    elif (
-        config.allow_x_linked_cases == False and args.mode_of_inheritance == "x_linked"
-    ):
+    elif config.allow_x_linked_cases == False and mode_of_inheritance == "x_linked":
         raise InvalidParameterSelectedError(
             "As per the config.py file x-linked samples are not supported in this release"
         )
 
-    elif config.allow_consanguineous_cases == False and args.consanguineous == True:
+    elif config.allow_consanguineous_cases == False and consanguineous == True:
         raise InvalidParameterSelectedError(
             "As per the config.py file consanguineous samples are not supported in this release"
         )
-    elif config.allow_trio_only_analysis == False and args.trio_only == True:
+    elif config.allow_trio_only_analysis == False and trio_only == True:
         raise InvalidParameterSelectedError(
             "As per the config.py file trio only analysis are not supported in this release"
         )
 
     # Check input variables are valid
     if (
-        (args.mode_of_inheritance == "autosomal_dominant")
-        | (args.mode_of_inheritance == "autosomal_recessive")
-    ) and (args.chr == "x"):
+        (mode_of_inheritance == "autosomal_dominant")
+        | (mode_of_inheritance == "autosomal_recessive")
+    ) and (chr == "x"):
         raise ArgumentInputError(
             "Chromosome X is not a valid chromosome for autosomal dominant or recessive samples, please check input"
         )
-    elif (args.mode_of_inheritance == "x_linked") and (args.chr != "x"):
+    elif (mode_of_inheritance == "x_linked") and (chr != "x"):
         raise ArgumentInputError(
             "Chromosome X is the only valid chromosome for x-linked samples, please check input"
         )
 
-    # import haplotype data from text file
-    df = pd.read_csv(
-        args.input_file,
-        delimiter="\t",
+
+def embryo_category_matrix(embryo_category_df, embryo_ids, mode_of_inheritance):
+    """Codes the risk category of every embryo at every SNP as a single embryo x SNP matrix for the overview plot
+
+    Only SNPs which are not uninformative in every embryo are included. For AR the SNPs are split by the partner
+    they were inherited from, SNPs which could not be assigned to a partner are not included.
+
+    Args:
+        embryo_category_df (dataframe): Categorised SNPs with a Position & {embryo}_risk_category column, and
+            snp_inherited_from for AR
+        embryo_ids (list): The embryo IDs, in the order of the rows of the matrix
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+    Returns:
+        dict: For each group of rows in the overview plot (None for AD/XL, male_partner & female_partner for AR) a
+        tuple of the SNP positions, in increasing order, and the embryo x SNP matrix of category codes. Each code is
+        the index of the category in embryo_matrix_categories, or -1 if the category is missing
+    """
+    embryo_category_df = embryo_category_df.sort_values("Position", kind="stable")
+    positions = embryo_category_df["Position"].to_numpy()
+    category_codes = np.stack(
+        [
+            pd.Categorical(
+                embryo_category_df[f"{embryo}_risk_category"],
+                categories=embryo_matrix_categories,
+            ).codes
+            for embryo in embryo_ids
+        ]
     )
-    # Remove space from column titles and make lower case
-    df = df.rename(
-        columns={
-            "Probeset ID": "probeset_id",
+    informative_snps = (
+        category_codes != embryo_matrix_categories.index("uninformative")
+    ).any(axis=0)
+    if mode_of_inheritance == "autosomal_recessive":
+        inherited_from = embryo_category_df["snp_inherited_from"].to_numpy()
+        groups = {
+            partner: informative_snps & (inherited_from == partner)
+            for partner in ["male_partner", "female_partner"]
         }
-    )
+    else:
+        groups = {None: informative_snps}
+    return {
+        group: (positions[snps], category_codes[:, snps])
+        for group, snps in groups.items()
+    }
 
-    number_snps_imported = df.shape[0]
 
-    logger.info(
-        f"Number of SNPs imported from SNP Array File = {number_snps_imported}."
-    )
+class cached_property:
+    """Cache a stage of a BasherCase in the instance the first time it is accessed
+    Unlike functools.cached_property before Python 3.12, no lock shared by every instance is held while the stage is
+    calculated, so cases can be run at the same time in different threads. Each case must only be used by one thread.
+    """
 
-    # Import mapping of Affy IDs to dbSNP rs IDs
-    mod_path = Path(__file__).parent
-    rsid_data_path = (mod_path / "../test_data/AffyID2rsid.txt").resolve()
-    affy_2_rs_ids_df = pd.read_csv(rsid_data_path, delimiter="\t", low_memory=False)
-
-    # Assign the correct partner to 'affected' and 'unaffected'
-    if args.mode_of_inheritance == "autosomal_dominant":
-        if args.male_partner_status == "affected":
-            affected_partner = args.male_partner
-            affected_partner_sex = "male_partner"
-            unaffected_partner = args.female_partner
-            unaffected_partner_sex = "female_partner"
-        elif args.female_partner_status == "affected":
-            affected_partner = args.female_partner
-            affected_partner_sex = "female_partner"
-            unaffected_partner = args.male_partner
-            unaffected_partner_sex = "male_partner"
-
-    # Filter out any rows not in the region of interest #TODO Now marked in imported data
-    df = filter_dataframe(
-        df, int(args.gene_start), int(args.gene_end), args.flanking_region_size
-    )
+    def __init__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
 
-    # Add column describing how far the SNP is from the gene of interest #TODO Now done in object
-    df = annotate_distance_from_gene(
-        df, args.chr, int(args.gene_start), int(args.gene_end)
-    )
+    def __set_name__(self, owner, name):
+        self.attrname = name
 
-    # Add column of dbSNP rsIDs  #TODO Now done in object
-    df = add_rsid_column(df, affy_2_rs_ids_df)
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        # Once cached, the value in the instance's __dict__ is found before this descriptor
+        value = self.func(instance)
+        instance.__dict__[self.attrname] = value
+        return value
+
+
+class BasherCase:
+    """A BASHer case, each stage of the analysis is calculated the first time it is accessed and then reused
+    Stages only depend on the stages they access, so for example accessing summary_snps_by_region classifies the trio
+    but does not categorise the embryos, produce the plots or render the report.
+    Args:
+        args (Namespace): The arguments defined by the parser in this module
+    """
 
-    # Calculate qc metrics before filtering out Nocalls #TODO Now marked in imported data
-    if args.trio_only == True:
-        qc_df = calculate_qc_metrics(
-            df, args.male_partner, args.female_partner, args.reference, None
+    def __init__(self, args):
+        # Check config.py file to see which paramters are currently supported.
+        # Typically this is used when the script has been validated for some modes of inheritance
+        # and we want to ensure that the script is not run for other, unvalidated, modes of inheritance.
+        check_analysis_allowed(
+            args.mode_of_inheritance, args.chr, args.consanguineous, args.trio_only
         )
-    else:
-        qc_df = calculate_qc_metrics(
-            df, args.male_partner, args.female_partner, args.reference, args.embryo_ids
+        self.args = args
+        self.gene_start = int(args.gene_start)
+        self.gene_end = int(args.gene_end)
+        self.trio_ids = [args.male_partner, args.female_partner, args.reference]
+        self.incremental = getattr(args, "incremental", False)
+        self.formats = getattr(args, "formats", default_report_formats)
+        self.plot_mode = getattr(args, "plot_mode", "standard")
+        self.embryo_plots = getattr(args, "embryo_plots", True)
+        self.low_memory = getattr(args, "low_memory", False)
+        # A profiled case is always saved with a result bundle, which the profile is saved in
+        self.profiler = (
+            profiling.CaseProfiler() if getattr(args, "profile", False) else None
+        )
+        self.result_bundle = getattr(args, "result_bundle", True) or bool(self.profiler)
+        # The time taken to calculate each stage accessed with timed_stage()
+        self.stage_seconds = {}
+        # The peak resident memory sampled while each stage ran (see stage_peak_memory()), for capacity planning
+        self.stage_peak_memory_bytes = {}
+        # For the flank sensitivity table the largest flanking region is analysed, the requested region is
+        # then a subset of these SNPs
+        self.flank_sensitivity = getattr(args, "flank_sensitivity", False)
+        if self.flank_sensitivity:
+            self.analysed_flanking_region_size = flanking_region_sizes[-1]
+        else:
+            self.analysed_flanking_region_size = args.flanking_region_size
+
+    def timed_stage(self, stage):
+        """Access a stage, recording the time taken to calculate it in stage_seconds
+        Stages which were already calculated by an earlier stage are recorded as taking no time, so accessing the
+        stages in order records the time taken by each part of the analysis.
+        Args:
+            stage (string): The name of the stage
+        Returns:
+            The value of the stage
+        """
+        with self.stage_context(stage):
+            return getattr(self, stage)
+
+    @contextlib.contextmanager
+    def stage_context(self, stage):
+        """Record the time taken by the block in stage_seconds & the peak memory while it ran in
+        stage_peak_memory_bytes, profiling it if the case is profiled
+        Args:
+            stage (string): The name of the stage
+        """
+        start = time.perf_counter()
+        with memory_limit.stage_peak_memory() as memory, (
+            self.profiler.stage(stage) if self.profiler else contextlib.nullcontext()
+        ):
+            yield
+        self.stage_seconds[stage] = time.perf_counter() - start
+        self.stage_peak_memory_bytes[stage] = memory["peak_bytes"]
+
+    def filter_to_flanking_region(self, df):
+        """Filter a dataframe covering the analysed region to the requested flanking region
+        Args:
+            df (dataframe): A dataframe with a Position column covering analysed_flanking_region_size
+        Returns:
+            dataframe: The rows within the requested flanking region
+        """
+        if self.flank_sensitivity:
+            return filter_dataframe(
+                df, self.gene_start, self.gene_end, self.args.flanking_region_size
+            )
+        return df
+
+    @cached_property
+    def imported_df(self):
+        """The SNP array data imported from the input file, only the case's samples are imported. In low memory mode
+        only the SNPs in the analysed region are kept"""
+        # import haplotype data from the SNP array file, which can be compressed text, Parquet or Feather
+        if self.low_memory:
+            df, number_snps_imported = self.import_analysed_region()
+            # The SNPs outside the analysed region are counted but not kept
+            self.number_snps_imported = number_snps_imported
+        else:
+            df = array_io.read_array_file(
+                self.args.input_file, columns=array_io.case_columns(self.args)
+            )
+            number_snps_imported = df.shape[0]
+        # Remove space from column titles and make lower case
+        df = df.rename(
+            columns={
+                "Probeset ID": "probeset_id",
+            }
+        )
+        logger.info(
+            f"Number of SNPs imported from SNP Array File = {number_snps_imported}."
+        )
+        progress.report(
+            "imported",
+            f"Parsed {number_snps_imported} probes",
+            probes=int(number_snps_imported),
         )
+        return df
+
+    def import_analysed_region(self):
+        """Import the SNPs in the analysed region in low memory mode, reading the SNP array file in chunks so the
+        other SNPs are never held in memory
+        Returns:
+            tuple: The SNP array data in the analysed region (dataframe), indexed by the position of its SNPs in the
+                file, and the number of SNPs in the whole file (int)
+        """
+        chunks = []
+        number_snps_imported = 0
+        for chunk in array_io.iter_array_file(
+            self.args.input_file, columns=array_io.case_columns(self.args)
+        ):
+            number_snps_imported += chunk.shape[0]
+            chunks.append(
+                filter_dataframe(
+                    chunk,
+                    self.gene_start,
+                    self.gene_end,
+                    self.analysed_flanking_region_size,
+                )
+            )
+        return pd.concat(chunks), number_snps_imported
+
+    @cached_property
+    def number_snps_imported(self):
+        """Depends on imported_df, which sets it in low memory mode"""
+        return self.imported_df.shape[0]
+
+    @cached_property
+    def cache_key(self):
+        """Depends on imported_df"""
+        return trio_cache.trio_cache_key(self.imported_df, self.args)
+
+    @cached_property
+    def cached_case(self):
+        """The case cached by an earlier incremental run, None if there is not one. Depends on cache_key"""
+        if self.incremental:
+            return trio_cache.load_cached_case(self.cache_key)
+        return None
 
-    # Calculate NoCall percentages
+    @cached_property
+    def window_df(self):
+        """The imported data in the analysed region annotated with gene_distance & rsID. Depends on imported_df"""
+        # Filter out any rows not in the region of interest
+        df = filter_dataframe(
+            self.imported_df,
+            self.gene_start,
+            self.gene_end,
+            self.analysed_flanking_region_size,
+        )
+        # Add column describing how far the SNP is from the gene of interest
+        df = annotate_distance_from_gene(
+            df, self.args.chr, self.gene_start, self.gene_end
+        )
+        # Add column of dbSNP rsIDs
+        return add_rsid_column(df, read_rsid_table())
+
+    @cached_property
+    def region_df(self):
+        """The imported data in the requested flanking region. Depends on window_df"""
+        return self.filter_to_flanking_region(self.window_df)
+
+    @cached_property
+    def qc_df(self):
+        """Depends on region_df"""
+        # Calculate qc metrics before filtering out Nocalls
+        return calculate_qc_metrics(
+            self.region_df,
+            self.args.male_partner,
+            self.args.female_partner,
+            self.args.reference,
+            None if self.args.trio_only == True else self.args.embryo_ids,
+        )
 
-    nocall_percentages = calculate_nocall_percentages(
-        qc_df
-    )  # TODO Now done in QC calculation
+    @cached_property
+    def nocall_percentages(self):
+        """Depends on qc_df"""
+        return calculate_nocall_percentages(self.qc_df)
+
+    @cached_property
+    def input_embryo_hashes(self):
+        """The hash of the genotypes & sex of each embryo in the input file. Depends on imported_df"""
+        if self.args.trio_only == True:
+            return {}
+        return trio_cache.embryo_hashes(
+            self.imported_df, self.args.embryo_ids, self.args.embryo_sex
+        )
 
-    # Filter out any rows where the partners or reference have a NoCall as these cannot be used in the analysis
-    filtered_df = filter_out_nocalls(
-        df, args.male_partner, args.female_partner, args.reference
-    )
+    @cached_property
+    def input_embryo_ids(self):
+        """The embryos in the input file which have not been analysed in the cached case, or whose genotypes or sex
+        have changed since. Depends on cached_case & input_embryo_hashes"""
+        if self.args.trio_only == True:
+            return []
+        if self.cached_case is None:
+            return list(self.args.embryo_ids)
+        # Cases cached before the embryos were hashed have no hashes, so their embryos are analysed again
+        cached_hashes = self.cached_case.get("embryo_hashes", {})
+        return [
+            embryo_id
+            for embryo_id in self.args.embryo_ids
+            if cached_hashes.get(embryo_id) != self.input_embryo_hashes[embryo_id]
+        ]
 
-    if args.mode_of_inheritance == "autosomal_dominant":
-        results_df = autosomal_dominant_analysis(
-            filtered_df,
-            affected_partner,
-            unaffected_partner,
-            args.reference,
-            args.reference_status,
-            args.reference_relationship,
-        )
-    elif args.mode_of_inheritance == "autosomal_recessive":
-        results_df = autosomal_recessive_analysis(
-            filtered_df,
-            args.male_partner,
-            args.female_partner,
-            args.reference,
-            args.reference_status,
-            args.consanguineous,
+    @cached_property
+    def input_embryo_sex(self):
+        """The sex of each embryo in input_embryo_ids"""
+        if self.args.trio_only == True:
+            return []
+        embryo_sex_lookup = dict(zip(self.args.embryo_ids, self.args.embryo_sex))
+        return [embryo_sex_lookup[embryo_id] for embryo_id in self.input_embryo_ids]
+
+    @cached_property
+    def window_results_df(self):
+        """The trio classification of the SNPs in the analysed region. Depends on window_df & cached_case"""
+        if self.cached_case is not None:
+            # Embryos analysed in an earlier run are taken from the cache
+            return trio_cache.add_embryo_genotypes(
+                self.cached_case["results_df"], self.window_df, self.input_embryo_ids
+            )
+        # Filter out any rows where the partners or reference have a NoCall as these cannot be used in the analysis
+        filtered_df = filter_out_nocalls(
+            self.window_df,
+            self.args.male_partner,
+            self.args.female_partner,
+            self.args.reference,
         )
-    elif args.mode_of_inheritance == "x_linked":
-        results_df = x_linked_analysis(
+        return classify_trio(
             filtered_df,
-            args.female_partner,
-            args.male_partner,
-            args.reference,
+            self.args.mode_of_inheritance,
+            self.args.male_partner,
+            self.args.male_partner_status,
+            self.args.female_partner,
+            self.args.female_partner_status,
+            self.args.reference,
+            self.args.reference_status,
+            self.args.reference_relationship,
+            self.args.consanguineous,
         )
 
-    # Informative SNPs
-    informative_snps_by_region = snps_by_region(results_df, args.mode_of_inheritance)
-
-    # Get total of informative SNPs
-    summary_snps_by_region = summarised_snps_by_region(
-        informative_snps_by_region,
-        args.mode_of_inheritance,
-    )
+    @cached_property
+    def results_df(self):
+        """The trio classification of the SNPs in the requested flanking region. Depends on window_results_df"""
+        results_df = self.filter_to_flanking_region(self.window_results_df)
+        progress.report("classified", f"Classified {results_df.shape[0]} SNPs")
+        return results_df
+
+    @cached_property
+    def informative_snps_by_region(self):
+        """Depends on results_df"""
+        return snps_by_region(self.results_df, self.args.mode_of_inheritance)
+
+    @cached_property
+    def summary_snps_by_region(self):
+        """Depends on informative_snps_by_region"""
+        return summarised_snps_by_region(
+            self.informative_snps_by_region,
+            self.args.mode_of_inheritance,
+        )
 
-    # Do not calculate embryo results for pre-cases and trio_only analysis is required
-    if args.trio_only == False:
-        # Categorise embryo alleles
+    @cached_property
+    def merge_cached_embryos(self):
+        """True if the embryos in the cached case are merged with this case, a case cached by a trio_only run has
+        no embryos to merge. Depends on cached_case"""
+        return self.cached_case is not None and self.cached_case["embryo_ids"] != []
+
+    @cached_property
+    def window_embryo_category_df(self):
+        """The embryo categories of the SNPs in the analysed region. Depends on window_results_df & cached_case"""
+        if self.args.trio_only == True:
+            return None
+        if self.merge_cached_embryos and self.input_embryo_ids == []:
+            return self.cached_case["embryo_category_df"]
         embryo_category_df = categorise_embryo_alleles(
-            results_df,
-            args.male_partner,
-            args.female_partner,
-            args.embryo_ids,
-            args.embryo_sex,
-            args.mode_of_inheritance,
-            args.consanguineous,
+            self.window_results_df,
+            self.args.male_partner,
+            self.args.female_partner,
+            self.input_embryo_ids,
+            self.input_embryo_sex,
+            self.args.mode_of_inheritance,
+            self.args.consanguineous,
         )
-
-        embryo_count_data_df = summarise_snps_per_embryo_pretty(
-            embryo_category_df,
-            args.embryo_ids,
+        if self.merge_cached_embryos:
+            embryo_category_df = trio_cache.merge_embryo_categories(
+                self.cached_case["embryo_category_df"],
+                embryo_category_df,
+                self.input_embryo_ids,
+            )
+        return embryo_category_df
+
+    @cached_property
+    def embryo_ids(self):
+        """All the embryos in the case, including those carried over from the cached case"""
+        if self.merge_cached_embryos:
+            # Cached embryos which were analysed again keep their place
+            return self.cached_case["embryo_ids"] + [
+                embryo_id
+                for embryo_id in self.input_embryo_ids
+                if embryo_id not in self.cached_case["embryo_ids"]
+            ]
+        return self.input_embryo_ids
+
+    @cached_property
+    def embryo_sex(self):
+        """The sex of each embryo in embryo_ids"""
+        if self.merge_cached_embryos:
+            embryo_sex_lookup = dict(
+                zip(self.cached_case["embryo_ids"], self.cached_case["embryo_sex"])
+            )
+            embryo_sex_lookup.update(zip(self.input_embryo_ids, self.input_embryo_sex))
+            return [embryo_sex_lookup[embryo_id] for embryo_id in self.embryo_ids]
+        return self.input_embryo_sex
+
+    @cached_property
+    def embryo_category_df(self):
+        """The embryo categories of the SNPs in the requested flanking region. Depends on window_embryo_category_df"""
+        if self.args.trio_only == True:
+            return None
+        embryo_category_df = self.filter_to_flanking_region(
+            self.window_embryo_category_df
+        )
+        progress.report(
+            "categorised", f"Categorised the SNPs of {len(self.embryo_ids)} embryos"
+        )
+        return embryo_category_df
+
+    @cached_property
+    def embryo_count_data_df(self):
+        """Depends on embryo_category_df & cached_case"""
+        if self.args.trio_only == True:
+            return None
+        if self.merge_cached_embryos:
+            if self.input_embryo_ids == []:
+                return self.cached_case["embryo_count_data_df"]
+            return trio_cache.merge_embryo_counts(
+                self.cached_case["embryo_count_data_df"],
+                summarise_snps_per_embryo_pretty(
+                    self.embryo_category_df, self.input_embryo_ids
+                ),
+                self.input_embryo_ids,
+            )
+        return summarise_snps_per_embryo_pretty(
+            self.embryo_category_df,
+            self.embryo_ids,
         )
 
-        summary_embryo_df = embryo_count_data_df.groupby(by=["risk_category"]).sum(
+    @cached_property
+    def summary_embryo_df(self):
+        """Depends on embryo_count_data_df"""
+        return self.embryo_count_data_df.groupby(by=["risk_category"]).sum(
             numeric_only=True
         )
 
+    @cached_property
+    def summary_embryo_by_region_df(self):
+        """Depends on embryo_count_data_df"""
         # Group by risk category and SNP position (and snp_inherited_from for AR) and sum the counts
-        if args.mode_of_inheritance == "autosomal_recessive":
-            summary_embryo_by_region_df = embryo_count_data_df.groupby(
+        if self.args.mode_of_inheritance == "autosomal_recessive":
+            return self.embryo_count_data_df.groupby(
                 by=["snp_inherited_from", "risk_category", "gene_distance"]
             ).sum(numeric_only=True)
-        else:
-            summary_embryo_by_region_df = embryo_count_data_df.groupby(
-                by=["risk_category", "gene_distance"]
-            ).sum(numeric_only=True)
-    ##############################################################################
-
-    # Produce report
-    results_table_1 = produce_html_table(
-        results_df,
-        "results_table_1",
-    )
+        return self.embryo_count_data_df.groupby(
+            by=["risk_category", "gene_distance"]
+        ).sum(numeric_only=True)
 
-    nocall_table = produce_html_table(
-        qc_df,
-        "nocall_table",
-    )
+    @cached_property
+    def sensitivity_df(self):
+        """The flank sensitivity table, None unless requested. Depends on window_results_df & window_embryo_category_df"""
+        if not self.flank_sensitivity:
+            return None
+        if self.args.trio_only == True:
+            return flank_sensitivity_table(
+                self.window_results_df,
+                None,
+                self.args.gene_start,
+                self.args.gene_end,
+                self.args.mode_of_inheritance,
+            )
+        return flank_sensitivity_table(
+            self.window_results_df,
+            self.window_embryo_category_df,
+            self.args.gene_start,
+            self.args.gene_end,
+            self.args.mode_of_inheritance,
+            self.embryo_ids,
+        )
 
-    nocall_percentages_table = produce_html_table(
-        nocall_percentages,
-        "nocall_percentages_table",
-    )
+    def update_trio_cache(self):
+        """Cache the trio classification and embryo results of this case for later incremental runs"""
+        # A trio_only run does not replace a cached case which already has embryo results
+        if self.args.trio_only == True and self.cached_case is not None:
+            return
+        embryo_hashes = (
+            dict(self.cached_case.get("embryo_hashes", {}))
+            if self.merge_cached_embryos
+            else {}
+        )
+        embryo_hashes.update(self.input_embryo_hashes)
+        trio_cache.save_cached_case(
+            self.cache_key,
+            self.window_results_df,
+            self.trio_ids,
+            self.window_embryo_category_df,
+            self.embryo_count_data_df,
+            self.embryo_ids,
+            self.embryo_sex,
+            {embryo_id: embryo_hashes.get(embryo_id) for embryo_id in self.embryo_ids},
+        )
 
-    if args.mode_of_inheritance == "autosomal_dominant":
-        summary_snps_table = produce_html_table(
-            summary_snps_by_region,
-            "summary_snps_table",
+    @cached_property
+    def plots(self):
+        """The dynamic (HTML) and static (PDF) embryo plots, each only produced if the report format is requested.
+        Depends on embryo_category_df & embryo_count_data_df"""
+        if self.args.trio_only == True or not self.embryo_plots:
+            return [], []
+        plot_arguments = (
+            self.embryo_category_df,
+            self.embryo_ids,
+            self.embryo_sex,
+            self.gene_start,
+            self.gene_end,
+            self.args.mode_of_inheritance,
+            self.embryo_count_data_df,
+            self.args.flanking_region_size,
         )
-    elif args.mode_of_inheritance == "autosomal_recessive":
-        temp_df = annotate_snp_position(summary_snps_by_region)
-        temp_df = temp_df.groupby(
-            by=["snp_inherited_from", "snp_risk_category", "gene_distance"]
-        ).sum(numeric_only=True)
-        summary_snps_table = produce_html_table(
-            temp_df,
-            "summary_snps_table",
-            True,
+        if self.low_memory:
+            # The HTML report has the static SVG plots, which need far less memory than the interactive plots
+            import svg_plot
+
+            svg_plots = svg_plot.plot_results(*plot_arguments)
+            return (
+                svg_plots if "html" in self.formats else [],
+                svg_plots if "pdf" in self.formats else [],
+            )
+        # The static plots are written directly as SVG unless config.py selects Kaleido
+        svg_static_plots = (
+            "pdf" in self.formats and config.static_plot_renderer == "svg"
         )
-    elif args.mode_of_inheritance == "x_linked":
-        temp_df = pd.DataFrame().assign(
-            gene_distance=summary_snps_by_region["gene_distance"],
-            female_embryo_snp_count=summary_snps_by_region["female_AB_snp_count"],
-            male_snp_count=summary_snps_by_region["male_AA_snp_count"]
-            + summary_snps_by_region["male_BB_snp_count"],
+        kaleido_static_plots = "pdf" in self.formats and not svg_static_plots
+        plots_as_html, plots_as_pdf = [], []
+        if "html" in self.formats or kaleido_static_plots:
+            # Plotly & Kaleido are only imported when their plots are produced
+            from snp_plot import plot_results
+
+            plots_as_html, plots_as_pdf = plot_results(
+                *plot_arguments,
+                dynamic_plots="html" in self.formats,
+                static_plots=kaleido_static_plots,
+                plot_mode=self.plot_mode,
+            )
+        if svg_static_plots:
+            import svg_plot
+
+            plots_as_pdf = svg_plot.plot_results(*plot_arguments)
+        return plots_as_html, plots_as_pdf
+
+    @cached_property
+    def category_matrix(self):
+        """The embryo x SNP risk category matrix used for the overview plot. Depends on embryo_category_df"""
+        if self.args.trio_only == True:
+            return None
+        return embryo_category_matrix(
+            self.embryo_category_df, self.embryo_ids, self.args.mode_of_inheritance
         )
-        summary_snps_table = produce_html_table(
-            temp_df,
-            "summary_snps_table",
+
+    @cached_property
+    def overview_plots(self):
+        """The dynamic (HTML) and static (PDF) overview plot of all embryos, each None if the report format is not
+        requested. Depends on category_matrix"""
+        if self.args.trio_only == True:
+            return None, None
+        plot_arguments = (
+            self.category_matrix,
+            self.embryo_ids,
+            self.gene_start,
+            self.gene_end,
+            self.args.flanking_region_size,
         )
-    else:
-        pass  # TODO raise exception
+        if self.low_memory:
+            import svg_plot
 
-    # Do not produce plots for embryos if only a trio is being run
-    if (
-        args.trio_only == False
-    ):  # If only a trio is being run do not produce tables/plots for embryos
+            svg_overview = svg_plot.plot_overview(*plot_arguments)
+            return (
+                svg_overview if "html" in self.formats else None,
+                svg_overview if "pdf" in self.formats else None,
+            )
+        overview_as_html, overview_as_pdf = None, None
+        if "html" in self.formats or (
+            "pdf" in self.formats and config.static_plot_renderer == "kaleido"
+        ):
+            import plotly as plt
+            from snp_plot import plot_overview
+
+            fig = plot_overview(*plot_arguments)
+            if "html" in self.formats:
+                overview_as_html = fig.to_html(full_html=False, include_plotlyjs="cdn")
+            if "pdf" in self.formats and config.static_plot_renderer == "kaleido":
+                overview_as_pdf = plt.io.to_image(fig, format="svg").decode("utf-8")
+        if "pdf" in self.formats and config.static_plot_renderer == "svg":
+            import svg_plot
+
+            overview_as_pdf = svg_plot.plot_overview(*plot_arguments)
+        return overview_as_html, overview_as_pdf
+
+    @cached_property
+    def html_text_for_plots(self):
+        """Depends on plots"""
+        if self.args.trio_only == True or not self.embryo_plots:
+            return ""
+        return "<br><hr><br>" + "<br><hr><br>".join(self.plots[0])
+
+    @cached_property
+    def pdf_text_for_plots(self):
+        """Depends on plots"""
+        if self.args.trio_only == True or not self.embryo_plots:
+            return ""
+        return "<br><hr><br>" + "<br><hr><br>".join(self.plots[1])
+
+    @cached_property
+    def summary_snps_table(self):
+        """Depends on summary_snps_by_region"""
+        summary_snps_by_region = self.summary_snps_by_region
+        if self.args.mode_of_inheritance == "autosomal_dominant":
+            return produce_html_table(
+                summary_snps_by_region,
+                "summary_snps_table",
+            )
+        elif self.args.mode_of_inheritance == "autosomal_recessive":
+            # Annotate a copy so that summary_snps_by_region is the same whichever outputs are produced
+            temp_df = annotate_snp_position(summary_snps_by_region.copy())
+            temp_df = temp_df.groupby(
+                by=["snp_inherited_from", "snp_risk_category", "gene_distance"]
+            ).sum(numeric_only=True)
+            return produce_html_table(
+                temp_df,
+                "summary_snps_table",
+                True,
+            )
+        elif self.args.mode_of_inheritance == "x_linked":
+            temp_df = pd.DataFrame().assign(
+                gene_distance=summary_snps_by_region["gene_distance"],
+                female_embryo_snp_count=summary_snps_by_region["female_AB_snp_count"],
+                male_snp_count=summary_snps_by_region["male_AA_snp_count"]
+                + summary_snps_by_region["male_BB_snp_count"],
+            )
+            return produce_html_table(
+                temp_df,
+                "summary_snps_table",
+            )
+
+    @cached_property
+    def summary_embryo_table(self):
+        """Depends on summary_embryo_df"""
+        if self.args.trio_only == True:
+            return ""
         summary_embryo_table = produce_html_table(
-            summary_embryo_df,
+            self.summary_embryo_df,
             "summary_embryo_table",
             True,
         )
         # Annotate column names with the sex of the embryo
-        summary_embryo_table = add_embryo_sex_to_column_name(
-            summary_embryo_table, args.embryo_ids, args.embryo_sex
+        return add_embryo_sex_to_column_name(
+            summary_embryo_table, self.embryo_ids, self.embryo_sex
         )
 
+    @cached_property
+    def summary_embryo_by_region_table(self):
+        """Depends on summary_embryo_by_region_df"""
+        if self.args.trio_only == True:
+            return ""
+        summary_embryo_by_region_df = self.summary_embryo_by_region_df
         # Filter out any rows for NoCall, MisCall, ADO, or uninformative SNPs so as not to clutter the report tables with unnecessary detail as per user feedback
         concise_embryo_df = summary_embryo_by_region_df[
             np.in1d(
@@ -1461,7 +2189,7 @@ def main(args):
             )
         ]
 
-        if args.mode_of_inheritance == "autosomal_recessive":
+        if self.args.mode_of_inheritance == "autosomal_recessive":
             concise_embryo_df = concise_embryo_df[
                 np.in1d(
                     concise_embryo_df.index.get_level_values("snp_inherited_from"),
@@ -1477,126 +2205,263 @@ def main(args):
             True,
         )
         # Annotate column names with the sex of the embryo
-        summary_embryo_by_region_table = add_embryo_sex_to_column_name(
-            summary_embryo_by_region_table, args.embryo_ids, args.embryo_sex
+        return add_embryo_sex_to_column_name(
+            summary_embryo_by_region_table, self.embryo_ids, self.embryo_sex
         )
 
-        html_list_of_dynamic_plots, html_list_of_static_plots = plot_results(
-            embryo_category_df,
-            args.embryo_ids,
-            args.embryo_sex,
-            int(args.gene_start),
-            int(args.gene_end),
-            args.mode_of_inheritance,
-            embryo_count_data_df,
-            args.flanking_region_size,
+    @cached_property
+    def place_holder_values(self):
+        """The values used to render the report template, except for the plots. Depends on the results & QC tables"""
+        args = self.args
+        if type(args.header_info) is dict:
+            header_html = args.header_info
+        else:
+            header_html = dict2html(header_to_dict(args.header_info))
+
+        if config.released_to_production == True:
+            warning_text = ""
+        elif config.released_to_production == False:
+            warning_text = (
+                f"<h3 style='color:red'> This is a pre-release version of the BASHer tool. "
+                f"Please contact the BASHer team if you have any questions.</h3>"
+            )
+
+        return {
+            "header_html": header_html,
+            "mode_of_inheritance": args.mode_of_inheritance,
+            "gene_symbol": args.gene_symbol,
+            "chromsome": args.chr.upper(),
+            "gene_start": f"{self.gene_start:,}",  # Format with 1000s comma separator
+            "gene_end": f"{self.gene_end:,}",  # Format with 1000s comma separator
+            "genome_build": config.genome_build,  # Imported from config.py file
+            "basher_version": config.basher_version,  # Imported from config.py file
+            "input_file": args.input_file.name
+            if isinstance(args.input_file, IOBase)
+            else args.input_file,  # Check if input file is a file object or a string
+            "male_partner": args.male_partner,
+            "male_partner_status": args.male_partner_status,
+            "female_partner": args.female_partner,
+            "female_partner_status": args.female_partner_status,
+            "reference": args.reference,
+            "reference_status": args.reference_status,
+            "reference_relationship": args.reference_relationship,
+            "results_table_1": produce_html_table(
+                self.results_df,
+                "results_table_1",
+            ),
+            "nocall_table": produce_html_table(
+                self.qc_df,
+                "nocall_table",
+            ),
+            "nocall_percentages_table": produce_html_table(
+                self.nocall_percentages,
+                "nocall_percentages_table",
+            ),
+            "report_date": datetime.today().strftime("%Y-%m-%d %H:%M:%S"),
+            "summary_snps_table": self.summary_snps_table,
+            "flank_sensitivity_table": produce_html_table(
+                self.sensitivity_df,
+                "flank_sensitivity_table",
+            )
+            if self.flank_sensitivity
+            else "",
+            "summary_embryo_table": self.summary_embryo_table,
+            "summary_embryo_by_region_table": self.summary_embryo_by_region_table,
+            "warning": warning_text,  # Warning text, for example if the tool is not released to production
+        }
+
+    @cached_property
+    def html_string(self):
+        """The HTML report, None if not requested. Depends on place_holder_values, overview_plots &
+        html_text_for_plots"""
+        if "html" not in self.formats:
+            return None
+        return report_template().render(
+            self.place_holder_values,
+            overview_plot=self.overview_plots[0],
+            html_text_for_plots=self.html_text_for_plots,
         )
 
-        html_text_for_plots = "<br><hr><br>" + "<br><hr><br>".join(
-            html_list_of_dynamic_plots
+    @cached_property
+    def pdf_string(self):
+        """The HTML used to produce the PDF report, None if not requested. Depends on place_holder_values,
+        overview_plots & pdf_text_for_plots"""
+        if "pdf" not in self.formats:
+            return None
+        return report_template().render(
+            self.place_holder_values,
+            overview_plot=self.overview_plots[1],
+            html_text_for_plots=self.pdf_text_for_plots,
         )
-        pdf_text_for_plots = "<br><hr><br>" + "<br><hr><br>".join(
-            html_list_of_static_plots
+
+    @cached_property
+    def json_string(self):
+        """The summary tables as JSON, None if not requested. Depends on summary_snps_by_region,
+        informative_snps_by_region & embryo_count_data_df"""
+        if "json" not in self.formats:
+            return None
+        return results_to_json(
+            self.args.mode_of_inheritance,
+            self.args.output_prefix,
+            self.number_snps_imported,
+            self.summary_snps_by_region,
+            self.informative_snps_by_region,
+            self.embryo_count_data_df,
         )
 
-    elif args.trio_only == True:
-        html_text_for_plots = ""
-        pdf_text_for_plots = ""
-        embryo_count_data_df = None
+
+def results_to_json(
+    mode_of_inheritance,
+    sample_id,
+    number_snps_imported,
+    summary_snps_by_region,
+    informative_snps_by_region,
+    embryo_count_data_df,
+):
+    """Convert the summary tables returned by main() to JSON
+    Args:
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+        sample_id (string): The output prefix of the case
+        number_snps_imported (int): The number of SNPs in the SNP array file
+        summary_snps_by_region (dataframe): A dataframe produced by summarised_snps_by_region()
+        informative_snps_by_region (dataframe): A dataframe produced by snps_by_region()
+        embryo_count_data_df (dataframe): A dataframe produced by summarise_snps_per_embryo_pretty(), None for trio_only
+    Returns:
+        string: A JSON object with a list of records for each table
+    """
+    tables = {
+        "summary_snps_by_region": summary_snps_by_region,
+        "informative_snps_by_region": informative_snps_by_region,
+        "embryo_count_data": embryo_count_data_df,
+    }
+    return json.dumps(
+        {
+            "sample_id": sample_id,
+            "mode_of_inheritance": mode_of_inheritance,
+            "basher_version": config.basher_version,
+            "number_snps_imported": int(number_snps_imported),
+        }
+        | {
+            table_name: None
+            if table_df is None
+            else json.loads(table_df.to_json(orient="records"))
+            for table_name, table_df in tables.items()
+        },
+        indent=4,
+    )
+
+
+@lru_cache(maxsize=None)
+def read_rsid_table():
+    """Import mapping of Affy IDs to dbSNP rs IDs
+    The table is only read once per process and must not be modified, web server workers forked after it has been
+    read share it with the master process.
+    Returns:
+        dataframe: Dataframe mapping probeset IDs to rsIDs
+    """
+    mod_path = Path(__file__).parent
+    rsid_data_path = (mod_path / "../test_data/AffyID2rsid.txt").resolve()
+    return pd.read_csv(
+        rsid_data_path,
+        delimiter="\t",
+        usecols=["probeset_id", "rsID"],
+        low_memory=False,
+    )
+
+
+@lru_cache(maxsize=None)
+def report_template():
+    """Load the jinja2 template used for the HTML & PDF reports, the template is only compiled once per process"""
+    from jinja2 import Environment, PackageLoader
 
     env = Environment(loader=PackageLoader("snp_haplotype", "templates"))
+    return env.get_template("report_template.html")
 
-    if type(args.header_info) is dict:
-        header_html = args.header_info
-    else:
-        header_html = dict2html(header_to_dict(args.header_info))
-
-    if config.released_to_production == True:
-        warning_text = ""
-    elif config.released_to_production == False:
-        warning_text = (
-            f"<h3 style='color:red'> This is a pre-release version of the BASHer tool. "
-            f"Please contact the BASHer team if you have any questions.</h3>"
-        )
-
-    template = env.get_template("report_template.html")
-    place_holder_values = {
-        "header_html": header_html,
-        "mode_of_inheritance": args.mode_of_inheritance,
-        "gene_symbol": args.gene_symbol,
-        "chromsome": args.chr.upper(),
-        "gene_start": f"{int(args.gene_start):,}",  # Format with 1000s comma separator
-        "gene_end": f"{int(args.gene_end):,}",  # Format with 1000s comma separator
-        "genome_build": config.genome_build,  # Imported from config.py file
-        "basher_version": config.basher_version,  # Imported from config.py file
-        "input_file": args.input_file.name
-        if isinstance(args.input_file, IOBase)
-        else args.input_file,  # Check if input file is a file object or a string
-        "male_partner": args.male_partner,
-        "male_partner_status": args.male_partner_status,
-        "female_partner": args.female_partner,
-        "female_partner_status": args.female_partner_status,
-        "reference": args.reference,
-        "reference_status": args.reference_status,
-        "reference_relationship": args.reference_relationship,
-        "results_table_1": results_table_1,
-        "nocall_table": nocall_table,
-        "nocall_percentages_table": nocall_percentages_table,
-        "report_date": datetime.today().strftime("%Y-%m-%d %H:%M:%S"),
-        "summary_snps_table": summary_snps_table,
-        "summary_embryo_table": summary_embryo_table if args.trio_only == False else "",
-        "summary_embryo_by_region_table": summary_embryo_by_region_table
-        if args.trio_only == False
-        else "",
-        "html_text_for_plots": html_text_for_plots,
-        "warning": warning_text,  # Warning text, for example if the tool is not released to production
-    }
 
-    for file_type in ["html", "pdf"]:
-        if file_type == "html":
-            place_holder_values["html_text_for_plots"] = html_text_for_plots
-            html_string = template.render(place_holder_values)
-        elif file_type == "pdf":
-            place_holder_values["html_text_for_plots"] = pdf_text_for_plots
-            pdf_string = template.render(place_holder_values)
+def main(args):
+    logger.info(f"snp_haplotyper version: called successfully.")
+
+    case = BasherCase(args)
+    if case.incremental:
+        case.update_trio_cache()
 
     return (
         args.mode_of_inheritance,
         args.output_prefix,
-        number_snps_imported,
-        summary_snps_by_region,
-        informative_snps_by_region,
-        embryo_count_data_df,
-        html_string,
-        pdf_string,
+        case.number_snps_imported,
+        case.summary_snps_by_region,
+        case.informative_snps_by_region,
+        case.embryo_count_data_df,
+        case.html_string,
+        case.pdf_string,
     )
 
 
-# Code when running as a script
-if __name__ == "__main__":
-    args = parser.parse_args()
-    (
-        mode_of_inheritance,
-        sample_id,
-        number_snps_imported,
-        summary_snps_by_region,
-        informative_snps_by_region,
-        summary_embryo_df,
-        html_string,
-        pdf_string,
-    ) = main(args)
-
-    # Save HTML report to file in output folder, including timestamp in filename
+def save_outputs(case, output_path):
+    """Save the requested outputs of a case & its result bundle, timing each part of the analysis
+    Args:
+        case (BasherCase): The case
+        output_path (string): The path of the outputs without an extension, each output adds its own extension and the
+            result bundle is saved to the folder output_path + "_bundle"
+    Returns:
+        dict: The path of each output saved, keyed by format ("json", "html", "pdf" & "bundle")
+    """
+    # Time the main parts of the analysis, in order, for the result bundle
+    for stage in ["imported_df", "results_df", "embryo_category_df", "qc_df"]:
+        case.timed_stage(stage)
+
+    output_paths = {}
+    if "json" in case.formats:
+        with open(output_path + ".json", "w") as f:
+            f.write(case.timed_stage("json_string"))
+        output_paths["json"] = output_path + ".json"
+
+    if "html" in case.formats:
+        with open(output_path + ".html", "w") as f:
+            f.write(case.timed_stage("html_string"))
+        output_paths["html"] = output_path + ".html"
+
+    if "pdf" in case.formats:
+        # Convert HTML report to PDF, pdfkit is only imported when a PDF is produced
+        import pdfkit
+
+        pdf_string = case.timed_stage("pdf_string")
+        progress.report("pdf", "Rendering the PDF report")
+        with case.stage_context("pdf_conversion"):
+            pdfkit.from_string(pdf_string, output_path + ".pdf")
+        output_paths["pdf"] = output_path + ".pdf"
+
+    if case.result_bundle:
+        result_bundle.write_result_bundle(
+            case, output_path + "_bundle", case.stage_seconds, output_paths.values()
+        )
+        output_paths["bundle"] = output_path + "_bundle"
+    if case.profiler is not None:
+        case.profiler.stop()
+    return output_paths
 
+
+def run(args):
+    """Run BASHer for a case and save the requested outputs to the output folder
+    Args:
+        args (Namespace): The arguments defined by build_parser()
+    Returns:
+        BasherCase: The case which was run
+    """
+    logger.info(f"snp_haplotyper version: called successfully.")
+    case = BasherCase(args)
+    if case.incremental:
+        case.update_trio_cache()
+
+    # Save the requested outputs to the output folder, including timestamp in filename
     timestr = datetime.now().strftime("%Y%m%d-%H%M%S")
-    with open(
-        os.path.join(args.output_folder, args.output_prefix + "_" + timestr + ".html"),
-        "w",
-    ) as f:
-        f.write(html_string)
-
-    # Convert HTML report to PDF
-    pdfkit.from_string(
-        pdf_string,
-        os.path.join(args.output_folder, args.output_prefix + "_" + timestr + ".pdf"),
+    save_outputs(
+        case,
+        os.path.join(args.output_folder, args.output_prefix + "_" + timestr),
     )
+    return case
+
+
+# Code when running as a script
+if __name__ == "__main__":
+    run(build_parser().parse_args())
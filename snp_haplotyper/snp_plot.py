@@ -1,12 +1,48 @@
+import numpy as np
 import plotly.express as px
 import plotly.graph_objects as go
+from plotly.colors import hex_to_rgb
+from plotly.subplots import make_subplots
 import plotly as plt
 import pandas as pd
 
+from snp_haplotype import embryo_matrix_categories, flanking_region_size_to_bp
+import progress
+
 import logging
 
 logger = logging.getLogger("BASHer_logger")
 
+# Settings for the scalable plot mode, which matches the appearance of the standard plot
+risk_category_y = {
+    "high_risk": 2,
+    "low_risk": -2,
+    "NoCall": -1,
+    "uninformative": 0,
+    "miscall": 1,
+    "ADO": 1,
+}
+risk_category_colours = {
+    "high_risk": "#e60e0e",
+    "low_risk": "#0ee60e",
+    "NoCall": "#0818a6",
+    "miscall": "#f0690a",
+    "uninformative": "#52555e",
+    "ADO": "#00ccff",
+}
+risk_category_marker_size = {
+    "high_risk": 14,
+    "low_risk": 14,
+    "miscall": 5,
+    "ADO": 5,
+}
+# Order of the categories in the legend, any other categories follow in the order they appear in the data
+risk_category_order = ["high_risk", "low_risk", "miscall", "ADO", "NoCall"]
+# Categories summarised as the number of SNPs in each bin along the plot, rather than drawn individually
+density_categories = ["uninformative", "NoCall"]
+density_bins = 1000
+density_strip_height = 0.3
+
 
 def plot_results(
     df,
@@ -17,6 +53,9 @@ def plot_results(
     mode_of_inheritance,
     embryo_count_data_df,
     flanking_region_size,
+    dynamic_plots=True,
+    static_plots=True,
+    plot_mode="standard",
 ):
     """Plots SNP data
 
@@ -27,13 +66,15 @@ def plot_results(
         df:
         embryo_ids:
         mode_of_inheritance:
+        dynamic_plots (boolean): Produce the interactive plots used in the HTML report
+        static_plots (boolean): Produce the SVG plots used in the PDF report, exported with Kaleido
+        plot_mode (string): "standard" draws every SNP, "scalable" draws the informative SNPs with WebGL and
+            summarises the uninformative & NoCall SNPs as density strips
     Returns:
 
     """
-    if flanking_region_size == "2mb":
-        flanking_region_size = 2000000
-    elif flanking_region_size == "3mb":
-        flanking_region_size = 3000000
+    # Convert the flanking region size, "2mb" to "10mb", into base pairs
+    flanking_region_size = flanking_region_size_to_bp(flanking_region_size)
 
     # Ensure that the gene start and end are integers
     gene_start = int(gene_start)
@@ -43,11 +84,72 @@ def plot_results(
     plots_as_html = []
     plots_as_pdf = []
 
+    # No plots are required, for example if only the summary tables are output
+    if not dynamic_plots and not static_plots:
+        return plots_as_html, plots_as_pdf
+
     # Create lookup dictionary for embryo sex
     embryo_dict = dict(zip(embryo_ids, embryo_sex))
 
-    # preprocess dataframe for input to plotting function
-    for embryo in embryo_ids:
+    for embryo in progress.counted(
+        embryo_ids, "plotting", "Plotted embryo {done} of {total}", len(embryo_ids)
+    ):
+        fig = embryo_figure(
+            df,
+            embryo,
+            embryo_dict[embryo],
+            gene_start,
+            gene_end,
+            mode_of_inheritance,
+            embryo_count_data_df,
+            flanking_region_size,
+            plot_mode,
+        )
+
+        if static_plots:
+            plots_as_pdf.append(plt.io.to_image(fig, format="svg").decode("utf-8"))
+        if dynamic_plots:
+            plots_as_html.append(fig.to_html(full_html=False, include_plotlyjs="cdn"))
+
+    return plots_as_html, plots_as_pdf
+
+
+def embryo_figure(
+    df,
+    embryo,
+    embryo_sex,
+    gene_start,
+    gene_end,
+    mode_of_inheritance,
+    embryo_count_data_df,
+    flanking_region_size,
+    plot_mode="standard",
+):
+    """Plots the SNP data for a single embryo
+
+    Args:
+        df (dataframe): Categorised SNPs
+        embryo (string): The embryo ID
+        embryo_sex (string): The sex of the embryo, shown in the title
+        gene_start (int): Start of the gene of interest
+        gene_end (int): End of the gene of interest
+        mode_of_inheritance (string): The mode of inheritance, AR plots are faceted by the partner the SNP was
+            inherited from
+        embryo_count_data_df (dataframe): SNP counts per embryo
+        flanking_region_size (int): Size of the flanking region in base pairs
+        plot_mode (string): "standard" draws every SNP, "scalable" draws the informative SNPs with WebGL and
+            summarises the uninformative & NoCall SNPs as density strips
+    Returns:
+        Figure: The plotly figure
+    """
+    # Set reasonable axis size, nicely placing the annotation text within the plot
+    x_range = [
+        gene_start - (flanking_region_size + 100000),
+        gene_end + (flanking_region_size + 100000),
+    ]
+    if plot_mode == "scalable":
+        fig = scalable_scatter(df, embryo, mode_of_inheritance, x_range)
+    else:
         fig = px.scatter(
             df,
             x="Position",
@@ -128,187 +230,400 @@ def plot_results(
             },
         )
 
-        # Format facet plot labels
-        fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
-        fig.for_each_annotation(lambda a: a.update(xshift=-680))
-
-        # Highlight gene region
-        fig.add_vrect(
-            x0=gene_start,
-            x1=gene_end,
-            annotation_text="Gene",
-            annotation_position="outside top",
-            fillcolor="blue",
-            opacity=0.25,
-            line_width=0,
+    # Format facet plot labels
+    fig.for_each_annotation(lambda a: a.update(text=a.text.split("=")[-1]))
+    fig.for_each_annotation(lambda a: a.update(xshift=-680))
+
+    # Highlight gene region
+    fig.add_vrect(
+        x0=gene_start,
+        x1=gene_end,
+        annotation_text="Gene",
+        annotation_position="outside top",
+        fillcolor="blue",
+        opacity=0.25,
+        line_width=0,
+    )
+    # add downstream line for 2mb flanking region lines
+    fig.add_vline(
+        x=gene_start - flanking_region_size,
+        line_width=3,
+        line_dash="dash",
+        line_color="green",
+        annotation_text="2Mb from Gene Start",
+        annotation_position="left top",
+        annotation_textangle=90,
+    )
+    # add upstream line for 2mb flanking region lines
+    fig.add_vline(
+        x=gene_end + flanking_region_size,
+        line_width=3,
+        line_dash="dash",
+        line_color="green",
+        annotation_text="2Mb from Gene End",
+        annotation_position="right top",
+        annotation_textangle=90,
+    )
+    fig.update_xaxes(
+        range=x_range,
+        exponentformat="none",
+    )
+
+    # Functions to add SNP count annotations to plot
+    # add annotations to three different types of plots (and AR has three faceted plots)
+    def add_snp_count_annotation(
+        facet_row,
+        annotation_name_high_risk,
+        annotation_name_low_risk,
+        upstream_high_sum,
+        within_gene_high_sum,
+        downstream_high_sum,
+        upstream_low_sum,
+        within_gene_low_sum,
+        downstream_low_sum,
+        flanking_region_size,
+    ):
+        fig.add_trace(
+            go.Scatter(
+                name=annotation_name_high_risk,
+                x=[
+                    gene_start
+                    - (
+                        flanking_region_size - 100000
+                    ),  # nicely place the annotation text within the plot
+                    (gene_start + gene_end) / 2,
+                    gene_end
+                    + (
+                        flanking_region_size - 100000
+                    ),  # nicely place the annotation text within the plot
+                ],
+                y=[
+                    3,
+                    3,
+                    3,
+                ],
+                mode="text",
+                textfont_color="#e60e0e",
+                text=[
+                    upstream_high_sum,
+                    within_gene_high_sum,
+                    downstream_high_sum,
+                ],
+                textposition="top center",
+            ),
+            row=facet_row,  # The facet plot to anotate (1=bottom, 2=middle, 3=top)
+            col=1,
         )
-        # add downstream line for 2mb flanking region lines
-        fig.add_vline(
-            x=gene_start - flanking_region_size,
-            line_width=3,
-            line_dash="dash",
-            line_color="green",
-            annotation_text="2Mb from Gene Start",
-            annotation_position="left top",
-            annotation_textangle=90,
+
+        fig.add_trace(
+            go.Scatter(
+                name=annotation_name_low_risk,
+                x=[
+                    gene_start
+                    - (
+                        flanking_region_size - 100000
+                    ),  # nicely place the annotation text within the plot
+                    (gene_start + gene_end) / 2,
+                    gene_end
+                    + (
+                        flanking_region_size - 100000
+                    ),  # nicely place the annotation text within the plot
+                ],
+                y=[-3, -3, -3],
+                mode="text",
+                textfont_color="#0ee60e",
+                text=[
+                    upstream_low_sum,
+                    within_gene_low_sum,
+                    downstream_low_sum,
+                ],
+                textposition="bottom center",
+            ),
+            row=facet_row,  # The facet plot to anotate (1=bottom, 2=middle, 3=top)
+            col=1,
         )
-        # add upstream line for 2mb flanking region lines
-        fig.add_vline(
-            x=gene_end + flanking_region_size,
-            line_width=3,
-            line_dash="dash",
-            line_color="green",
-            annotation_text="2Mb from Gene End",
-            annotation_position="right top",
-            annotation_textangle=90,
+
+    if mode_of_inheritance == "x_linked" or mode_of_inheritance == "autosomal_dominant":
+        summary_df = embryo_count_data_df.groupby(
+            ["risk_category", "snp_position"]
+        ).sum()
+        add_snp_count_annotation(
+            1,
+            "High_risk count",
+            "Low_risk count",
+            summary_df.at[("high_risk", "upstream"), embryo],
+            summary_df.at[("high_risk", "within_gene"), embryo],
+            summary_df.at[("high_risk", "downstream"), embryo],
+            summary_df.at[("low_risk", "upstream"), embryo],
+            summary_df.at[("low_risk", "within_gene"), embryo],
+            summary_df.at[("low_risk", "downstream"), embryo],
+            flanking_region_size,
         )
-        # Set reasonable axis size
-        fig.update_xaxes(
-            range=[
-                gene_start
-                - (
-                    flanking_region_size + 100000
-                ),  # nicely place the annotation text within the plot
-                gene_end
-                + (
-                    flanking_region_size + 100000
-                ),  # nicely place the annotation text within the plot
-            ],
-            exponentformat="none",
+    # A faceted 3 plot figure is created for AR so that male and female SNPs can be separated out.
+    elif mode_of_inheritance == "autosomal_recessive":
+        summary_df = embryo_count_data_df.groupby(
+            ["risk_category", "snp_position", "snp_inherited_from"]
+        ).sum()
+        add_snp_count_annotation(  # Male plot
+            3,
+            "High_risk count male",
+            "Low_risk count male",
+            summary_df.at[("high_risk", "upstream", "male_partner"), embryo],
+            summary_df.at[("high_risk", "within_gene", "male_partner"), embryo],
+            summary_df.at[("high_risk", "downstream", "male_partner"), embryo],
+            summary_df.at[("low_risk", "upstream", "male_partner"), embryo],
+            summary_df.at[("low_risk", "within_gene", "male_partner"), embryo],
+            summary_df.at[("low_risk", "downstream", "male_partner"), embryo],
+            flanking_region_size,
         )
 
-        # Functions to add SNP count annotations to plot
-        # add annotations to three different types of plots (and AR has three faceted plots)
-        def add_snp_count_annotation(
-            facet_row,
-            annotation_name_high_risk,
-            annotation_name_low_risk,
-            upstream_high_sum,
-            within_gene_high_sum,
-            downstream_high_sum,
-            upstream_low_sum,
-            within_gene_low_sum,
-            downstream_low_sum,
+        add_snp_count_annotation(  # female plot
+            1,
+            "High_risk count female",
+            "Low_risk count female",
+            summary_df.at[("high_risk", "upstream", "female_partner"), embryo],
+            summary_df.at[("high_risk", "within_gene", "female_partner"), embryo],
+            summary_df.at[("high_risk", "downstream", "female_partner"), embryo],
+            summary_df.at[("low_risk", "upstream", "female_partner"), embryo],
+            summary_df.at[("low_risk", "within_gene", "female_partner"), embryo],
+            summary_df.at[("low_risk", "downstream", "female_partner"), embryo],
             flanking_region_size,
-        ):
-            fig.add_trace(
-                go.Scatter(
-                    name=annotation_name_high_risk,
-                    x=[
-                        gene_start
-                        - (
-                            flanking_region_size - 100000
-                        ),  # nicely place the annotation text within the plot
-                        (gene_start + gene_end) / 2,
-                        gene_end
-                        + (
-                            flanking_region_size - 100000
-                        ),  # nicely place the annotation text within the plot
-                    ],
-                    y=[
-                        3,
-                        3,
-                        3,
-                    ],
-                    mode="text",
-                    textfont_color="#e60e0e",
-                    text=[
-                        upstream_high_sum,
-                        within_gene_high_sum,
-                        downstream_high_sum,
-                    ],
-                    textposition="top center",
-                ),
-                row=facet_row,  # The facet plot to anotate (1=bottom, 2=middle, 3=top)
-                col=1,
-            )
+        )
 
-            fig.add_trace(
-                go.Scatter(
-                    name=annotation_name_low_risk,
-                    x=[
-                        gene_start
-                        - (
-                            flanking_region_size - 100000
-                        ),  # nicely place the annotation text within the plot
-                        (gene_start + gene_end) / 2,
-                        gene_end
-                        + (
-                            flanking_region_size - 100000
-                        ),  # nicely place the annotation text within the plot
-                    ],
-                    y=[-3, -3, -3],
-                    mode="text",
-                    textfont_color="#0ee60e",
-                    text=[
-                        upstream_low_sum,
-                        within_gene_low_sum,
-                        downstream_low_sum,
+    fig.update_yaxes(range=[-4, 4], showticklabels=False)
+    fig.update_layout(
+        height=540,
+        width=1700,
+        title_text=f"Results for {embryo} (Embryo Sex: {embryo_sex})",
+    )
+
+    return fig
+
+
+def scalable_scatter(df, embryo, mode_of_inheritance, x_range):
+    """Plots the SNPs for an embryo with a WebGL trace per risk category & density strips for uninformative SNPs
+
+    The informative SNPs (high_risk, low_risk, miscall & ADO) are drawn individually so that they can be hovered over,
+    while the far more numerous uninformative & NoCall SNPs are counted in bins along the plot and drawn as a strip
+    shaded by the number of SNPs in each bin. This keeps the size of the plot and the time taken to draw it
+    independent of the number of SNPs in large flanking regions.
+
+    Args:
+        df (dataframe): Categorised SNPs
+        embryo (string): The embryo ID
+        mode_of_inheritance (string): The mode of inheritance, AR plots are faceted by the partner the SNP was
+            inherited from
+        x_range (list): The start & end of the plotted region
+    Returns:
+        Figure: The plotly figure, without the gene, flanking region or SNP count annotations
+    """
+    risk_category = f"{embryo}_risk_category"
+    # Facets are listed from the bottom of the plot to the top, matching the rows of the standard AR plot
+    if mode_of_inheritance == "autosomal_recessive":
+        facets = ["female_partner", "uninformative", "male_partner"]
+        fig = make_subplots(
+            rows=len(facets),
+            cols=1,
+            shared_xaxes=True,
+            vertical_spacing=0.07,
+            start_cell="bottom-left",
+            subplot_titles=facets,
+        )
+        fig.update_annotations(font_size=12)
+    else:
+        facets = [None]
+        fig = make_subplots(rows=1, cols=1)
+
+    bin_edges = np.linspace(x_range[0], x_range[1], density_bins + 1)
+    bin_width = bin_edges[1] - bin_edges[0]
+    present_categories = list(df[risk_category].dropna().unique())
+    categories = [
+        category for category in risk_category_order if category in present_categories
+    ] + [
+        category
+        for category in present_categories
+        if category not in risk_category_order
+    ]
+    categories_in_legend = set()
+    for row, facet in enumerate(facets, start=1):
+        facet_df = df if facet is None else df[df["snp_inherited_from"] == facet]
+        for category in categories:
+            category_df = facet_df[facet_df[risk_category] == category]
+            if category_df.empty:
+                continue
+            if category in density_categories:
+                counts, _ = np.histogram(category_df["Position"], bins=bin_edges)
+                red, green, blue = hex_to_rgb(risk_category_colours[category])
+                trace = go.Heatmap(
+                    # The bins are evenly spaced so are described by the first bin & the bin width
+                    x0=bin_edges[0] + bin_width / 2,
+                    dx=bin_width,
+                    # A single row of bins, drawn as a narrow strip at the height of the category
+                    y0=risk_category_y[category],
+                    dy=density_strip_height,
+                    # Empty bins are left transparent, bins with a single SNP are drawn faintly
+                    z=[[int(count) if count > 0 else None for count in counts]],
+                    zmin=0,
+                    colorscale=[
+                        [0, f"rgba({red}, {green}, {blue}, 0.2)"],
+                        [1, f"rgba({red}, {green}, {blue}, 1)"],
                     ],
-                    textposition="bottom center",
-                ),
-                row=facet_row,  # The facet plot to anotate (1=bottom, 2=middle, 3=top)
-                col=1,
+                    showscale=False,
+                    hoverongaps=False,
+                    hovertemplate=f"{category}<br>Position=%{{x:,.0f}}<br>SNPs in bin=%{{z}}<extra></extra>",
+                )
+            else:
+                trace = go.Scattergl(
+                    x=category_df["Position"],
+                    y=np.full(
+                        len(category_df), risk_category_y.get(category, 0), dtype=int
+                    ),
+                    mode="markers",
+                    marker={
+                        "symbol": "line-ns-open",
+                        "color": risk_category_colours.get(category),
+                        "size": risk_category_marker_size.get(category, 5),
+                    },
+                    customdata=category_df[["probeset_id", "rsID"]],
+                    hovertemplate=f"{category}<br>Position=%{{x:.0f}}<br>probeset_id=%{{customdata[0]}}<br>"
+                    "rsID=%{customdata[1]}<extra></extra>",
+                )
+            trace.update(
+                name=category,
+                legendgroup=category,
+                showlegend=category not in categories_in_legend,
             )
+            categories_in_legend.add(category)
+            fig.add_trace(trace, row=row, col=1)
 
-        if (
-            mode_of_inheritance == "x_linked"
-            or mode_of_inheritance == "autosomal_dominant"
-        ):
-            summary_df = embryo_count_data_df.groupby(
-                ["risk_category", "snp_position"]
-            ).sum()
-            add_snp_count_annotation(
-                1,
-                "High_risk count",
-                "Low_risk count",
-                summary_df.at[("high_risk", "upstream"), embryo],
-                summary_df.at[("high_risk", "within_gene"), embryo],
-                summary_df.at[("high_risk", "downstream"), embryo],
-                summary_df.at[("low_risk", "upstream"), embryo],
-                summary_df.at[("low_risk", "within_gene"), embryo],
-                summary_df.at[("low_risk", "downstream"), embryo],
-                flanking_region_size,
-            )
-        # A faceted 3 plot figure is created for AR so that male and female SNPs can be separated out.
-        elif mode_of_inheritance == "autosomal_recessive":
-            summary_df = embryo_count_data_df.groupby(
-                ["risk_category", "snp_position", "snp_inherited_from"]
-            ).sum()
-            add_snp_count_annotation(  # Male plot
-                3,
-                "High_risk count male",
-                "Low_risk count male",
-                summary_df.at[("high_risk", "upstream", "male_partner"), embryo],
-                summary_df.at[("high_risk", "within_gene", "male_partner"), embryo],
-                summary_df.at[("high_risk", "downstream", "male_partner"), embryo],
-                summary_df.at[("low_risk", "upstream", "male_partner"), embryo],
-                summary_df.at[("low_risk", "within_gene", "male_partner"), embryo],
-                summary_df.at[("low_risk", "downstream", "male_partner"), embryo],
-                flanking_region_size,
-            )
+    fig.update_xaxes(title_text="Genomic coordinates", row=1, col=1)
+    fig.update_yaxes(title_text="SNP Category")
+    fig.update_layout(
+        legend_title_text=risk_category, legend_tracegroupgap=0, margin={"t": 60}
+    )
+    return fig
 
-            add_snp_count_annotation(  # female plot
-                1,
-                "High_risk count female",
-                "Low_risk count female",
-                summary_df.at[("high_risk", "upstream", "female_partner"), embryo],
-                summary_df.at[("high_risk", "within_gene", "female_partner"), embryo],
-                summary_df.at[("high_risk", "downstream", "female_partner"), embryo],
-                summary_df.at[("low_risk", "upstream", "female_partner"), embryo],
-                summary_df.at[("low_risk", "within_gene", "female_partner"), embryo],
-                summary_df.at[("low_risk", "downstream", "female_partner"), embryo],
-                flanking_region_size,
-            )
 
-        fig.update_yaxes(range=[-4, 4], showticklabels=False)
-        fig.update_layout(
-            height=540,
-            width=1700,
-            title_text=f"Results for {embryo} (Embryo Sex: {embryo_dict[embryo]})",
-        )
+def plot_overview(
+    category_matrix, embryo_ids, gene_start, gene_end, flanking_region_size
+):
+    """Plots every embryo on shared axes, a strip per embryo coloured by the risk category of each SNP
 
-        plots_as_pdf.append(plt.io.to_image(fig, format="svg").decode("utf-8"))
-        plots_as_html.append(fig.to_html(full_html=False, include_plotlyjs="cdn"))
+    Args:
+        category_matrix (dict): The matrix returned by snp_haplotype.embryo_category_matrix()
+        embryo_ids (list): The embryo IDs
+        gene_start (int): Start of the gene of interest
+        gene_end (int): End of the gene of interest
+        flanking_region_size (string): Size of the flanking region, "2mb" to "10mb"
+    Returns:
+        Figure: The plotly figure
+    """
+    # Convert the flanking region size, "2mb" to "10mb", into base pairs
+    flanking_region_size = flanking_region_size_to_bp(flanking_region_size)
+    gene_start = int(gene_start)
+    gene_end = int(gene_end)
 
-    return plots_as_html, plots_as_pdf
+    # Discrete colour scale, each category code is coloured by its own band of the scale
+    colorscale = []
+    for code, category in enumerate(embryo_matrix_categories):
+        colorscale += [
+            [code / len(embryo_matrix_categories), risk_category_colours[category]],
+            [
+                (code + 1) / len(embryo_matrix_categories),
+                risk_category_colours[category],
+            ],
+        ]
+    category_names = np.array(embryo_matrix_categories + ["missing"])
+
+    fig = go.Figure()
+    # Each row is plotted at a numbered position on the y axis, labelled with the embryo. For AR each embryo has a row
+    # for the SNPs inherited from each partner, grouped by partner
+    row_labels = []
+    for group, (positions, category_codes) in category_matrix.items():
+        group_labels = [
+            embryo if group is None else f"{embryo} {group.split('_')[0]}"
+            for embryo in embryo_ids
+        ]
+        fig.add_trace(
+            go.Heatmap(
+                x=positions,
+                y0=len(row_labels),
+                dy=1,
+                z=[
+                    [int(code) if code >= 0 else None for code in embryo_codes]
+                    for embryo_codes in category_codes
+                ],
+                text=np.char.add(
+                    np.char.add(np.array(group_labels)[:, None], ": "),
+                    category_names[category_codes],
+                ).tolist(),
+                zmin=-0.5,
+                zmax=len(embryo_matrix_categories) - 0.5,
+                colorscale=colorscale,
+                showscale=False,
+                hovertemplate="%{text}<br>Position=%{x:,}<extra></extra>",
+            )
+        )
+        row_labels += group_labels
+    # The heatmap has no legend, so an empty trace is added for each category to provide one
+    for category in embryo_matrix_categories:
+        fig.add_trace(
+            go.Scatter(
+                x=[None],
+                y=[None],
+                mode="markers",
+                marker={
+                    "symbol": "square",
+                    "size": 12,
+                    "color": risk_category_colours[category],
+                },
+                name=category,
+            )
+        )
+
+    fig.add_vrect(
+        x0=gene_start,
+        x1=gene_end,
+        annotation_text="Gene",
+        annotation_position="outside top",
+        fillcolor="blue",
+        opacity=0.25,
+        line_width=0,
+    )
+    for x, label in [
+        (gene_start - flanking_region_size, "from Gene Start"),
+        (gene_end + flanking_region_size, "from Gene End"),
+    ]:
+        fig.add_vline(
+            x=x,
+            line_width=3,
+            line_dash="dash",
+            line_color="green",
+            annotation_text=f"{flanking_region_size // 1000000}Mb {label}",
+            annotation_position="top",
+        )
+    fig.update_xaxes(
+        range=[
+            gene_start - (flanking_region_size + 100000),
+            gene_end + (flanking_region_size + 100000),
+        ],
+        exponentformat="none",
+        title_text="Genomic coordinates",
+    )
+    # The first row is shown at the top
+    fig.update_yaxes(
+        tickvals=list(range(len(row_labels))),
+        ticktext=row_labels,
+        autorange="reversed",
+        showgrid=False,
+        zeroline=False,
+    )
+    fig.update_layout(
+        height=max(60 + 24 * len(row_labels) + 80, 250),
+        width=1700,
+        margin={"t": 60},
+        title_text="Overview of all embryos",
+        legend_title_text="risk_category",
+        plot_bgcolor="rgb(229, 236, 246)",
+    )
+    return fig
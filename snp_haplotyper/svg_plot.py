@@ -0,0 +1,665 @@
+from functools import reduce
+import math
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+from snp_haplotype import embryo_matrix_categories, flanking_region_size_to_bp
+import progress
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Writes the static (PDF) embryo plots directly as SVG, reproducing the layout of the Plotly figures produced by
+# snp_plot.plot_results without exporting them through Kaleido's headless browser. The coordinates of every SNP in a
+# category are calculated in a single numpy operation and written as one SVG path per category.
+
+# Figure layout, matching the Plotly defaults used by snp_plot.plot_results
+figure_width = 1700
+figure_height = 540
+margin_left = 80
+margin_top = 60
+margin_bottom = 80
+facet_spacing = 0.07  # Fraction of the plot height between AR facets
+y_range = (-4, 4)
+
+font_family = "'Open Sans', verdana, arial, sans-serif"
+text_colour = "rgb(42,63,95)"
+plot_background = "rgb(229,236,246)"
+
+# Position, colour & marker size (in pixels) for each risk category
+risk_category_y = {
+    "high_risk": 2,
+    "low_risk": -2,
+    "NoCall": -1,
+    "uninformative": 0,
+    "miscall": 1,
+    "ADO": 1,
+}
+risk_category_colours = {
+    "high_risk": "#e60e0e",
+    "low_risk": "#0ee60e",
+    "NoCall": "#0818a6",
+    "miscall": "#f0690a",
+    "uninformative": "#52555e",
+    "ADO": "#00ccff",
+}
+risk_category_marker_size = {
+    "high_risk": 14,
+    "low_risk": 14,
+    "NoCall": 10,
+    "miscall": 5,
+    "ADO": 5,
+    "uninformative": 5,
+}
+# Order of the categories in the legend, any other categories follow in the order they appear in the data
+risk_category_order = ["high_risk", "low_risk", "miscall", "ADO", "NoCall"]
+
+# AR plots are faceted by the partner the SNP was inherited from, listed from the top facet to the bottom facet
+ar_facets = ["male_partner", "uninformative", "female_partner"]
+high_risk_count_colour = "#e60e0e"
+low_risk_count_colour = "#0ee60e"
+
+
+def text_width(text, font_size):
+    """Approximate width in pixels of a string of text, used to size the legend
+    Args:
+        text (string): The text
+        font_size (int): Font size in pixels
+    Returns:
+        float: Approximate width of the text in pixels
+    """
+    return len(text) * font_size * 0.52
+
+
+def svg_text(x, y, text, font_size=12, colour=text_colour, anchor="middle", rotate=0):
+    """Returns an SVG text element in the report font"""
+    transform = f' transform="rotate({rotate},{x:.1f},{y:.1f})"' if rotate else ""
+    return (
+        f'<text x="{x:.1f}" y="{y:.1f}" text-anchor="{anchor}"{transform} '
+        f'style="font-family:{font_family};font-size:{font_size}px;fill:{colour};white-space:pre">'
+        f"{escape(str(text))}</text>"
+    )
+
+
+def nice_tick_step(span, max_ticks=10):
+    """Returns a 'nice' spacing (1, 2, 2.5 or 5 x 10^n) giving at most max_ticks ticks across the span"""
+    rough_step = span / max_ticks
+    magnitude = 10 ** math.floor(math.log10(rough_step))
+    for multiple in [1, 2, 2.5, 5, 10]:
+        if multiple * magnitude >= rough_step:
+            return multiple * magnitude
+
+
+def x_tick_values(x_min, x_max):
+    """Returns the positions of the ticks on the genomic coordinate axis"""
+    tick_step = nice_tick_step(x_max - x_min)
+    return np.arange(math.ceil(x_min / tick_step) * tick_step, x_max, tick_step)
+
+
+def marker_path(x_px, y_px, category):
+    """Returns a single SVG path drawing a marker at every x coordinate for a category
+    Args:
+        x_px (numpy array): x coordinates in pixels of the SNPs in the category
+        y_px (float): y coordinate in pixels of the category
+        category (string): The risk category, NoCall is drawn as a cross, every other category as a vertical tick
+    Returns:
+        string: SVG path element
+    """
+    colour = risk_category_colours.get(category, "#52555e")
+    size = risk_category_marker_size.get(category, 5)
+    # SNPs closer than a tenth of a pixel would be drawn on top of each other, so only one is drawn
+    x_coordinates = np.char.mod("%.1f", np.unique(np.round(x_px, 1)))
+    if category == "NoCall":
+        arm = size * 0.3
+        cross = (
+            f"l{arm:.2f},{arm:.2f}l{arm:.2f},-{arm:.2f}l-{arm:.2f},-{arm:.2f}l{arm:.2f},-{arm:.2f}"
+            f"l-{arm:.2f},-{arm:.2f}l-{arm:.2f},{arm:.2f}l-{arm:.2f},-{arm:.2f}l-{arm:.2f},{arm:.2f}"
+            f"l{arm:.2f},{arm:.2f}l-{arm:.2f},{arm:.2f}l{arm:.2f},{arm:.2f}Z"
+        )
+        segment = f",{y_px + arm:.1f}{cross}"
+        style = f"fill:{colour};stroke:#ffffff;stroke-width:0.5px;opacity:0.7"
+    else:
+        segment = f",{y_px - size:.1f}v{2 * size}"
+        style = f"fill:none;stroke:{colour};stroke-width:1.5px;opacity:0.9"
+    d = "M" + ("M").join(np.char.add(x_coordinates, segment))
+    return f'<path class="{escape(category)}" d="{d}" style="{style}"/>'
+
+
+def legend_marker(x, y, category):
+    """Returns the legend symbol for a risk category"""
+    colour = risk_category_colours.get(category, "#52555e")
+    if category == "NoCall":
+        return marker_path(np.array([x]), y, category)
+    return (
+        f'<path d="M{x:.1f},{y + 8.4:.1f}V{y - 8.4:.1f}" '
+        f'style="fill:none;stroke:{colour};stroke-width:2px;opacity:0.7"/>'
+    )
+
+
+def snp_counts(embryo_count_data_df, embryo, mode_of_inheritance):
+    """The number of high & low risk SNPs upstream, within & downstream of the gene for an embryo
+    Args:
+        embryo_count_data_df (dataframe): SNP counts per embryo
+        embryo (string): The embryo ID
+        mode_of_inheritance (string): The mode of inheritance
+    Returns:
+        dict: For each annotated facet (None for AD/XL) a tuple of the legend suffix, the high risk counts and the low
+        risk counts
+    """
+    snp_positions = ["upstream", "within_gene", "downstream"]
+    if mode_of_inheritance == "autosomal_recessive":
+        summary_df = embryo_count_data_df.groupby(
+            ["risk_category", "snp_position", "snp_inherited_from"]
+        ).sum()
+        return {
+            partner: (
+                f" {partner.split('_')[0]}",
+                [
+                    summary_df.at[("high_risk", position, partner), embryo]
+                    for position in snp_positions
+                ],
+                [
+                    summary_df.at[("low_risk", position, partner), embryo]
+                    for position in snp_positions
+                ],
+            )
+            for partner in ["male_partner", "female_partner"]
+        }
+    summary_df = embryo_count_data_df.groupby(["risk_category", "snp_position"]).sum()
+    return {
+        None: (
+            "",
+            [
+                summary_df.at[("high_risk", position), embryo]
+                for position in snp_positions
+            ],
+            [
+                summary_df.at[("low_risk", position), embryo]
+                for position in snp_positions
+            ],
+        )
+    }
+
+
+def plot_embryo(
+    df,
+    embryo,
+    embryo_sex,
+    gene_start,
+    gene_end,
+    mode_of_inheritance,
+    embryo_count_data_df,
+    flanking_region_size,
+):
+    """Writes the static plot of the gene & flanking region for a single embryo as SVG
+
+    Args:
+        df (dataframe): Categorised SNPs with a Position & {embryo}_risk_category column, and snp_inherited_from for AR
+        embryo (string): The embryo ID
+        embryo_sex (string): The sex of the embryo, shown in the title
+        gene_start (int): Start of the gene of interest
+        gene_end (int): End of the gene of interest
+        mode_of_inheritance (string): The mode of inheritance, AR plots are faceted by the partner the SNP was
+            inherited from
+        embryo_count_data_df (dataframe): SNP counts per embryo, annotated above & below the SNPs
+        flanking_region_size (int): Size of the flanking region in base pairs
+    Returns:
+        string: The plot as an SVG document
+    """
+    risk_category = f"{embryo}_risk_category"
+    counts = snp_counts(embryo_count_data_df, embryo, mode_of_inheritance)
+
+    # The legend lists the categories in the data followed by the count annotations
+    present_categories = list(df[risk_category].dropna().unique())
+    legend_categories = [
+        category for category in risk_category_order if category in present_categories
+    ] + [
+        category
+        for category in present_categories
+        if category not in risk_category_order
+    ]
+    legend_counts = []
+    for suffix, _, _ in counts.values():
+        legend_counts += [
+            (f"High_risk count{suffix}", high_risk_count_colour),
+            (f"Low_risk count{suffix}", low_risk_count_colour),
+        ]
+    legend_title = risk_category
+    legend_width = max(
+        [text_width(legend_title, 14) + 4]
+        + [
+            text_width(label, 12) + 46
+            for label in legend_categories + [label for label, _ in legend_counts]
+        ]
+    )
+    # The right margin is widened to fit the legend, which is placed just to the right of the plot
+    plot_width = (figure_width - margin_left - legend_width - 12) / 1.02
+    plot_right = margin_left + plot_width
+    plot_bottom = figure_height - margin_bottom
+    plot_height = plot_bottom - margin_top
+
+    x_min = gene_start - (flanking_region_size + 100000)
+    x_max = gene_end + (flanking_region_size + 100000)
+
+    def x_to_px(x):
+        return (
+            margin_left
+            + (np.asarray(x, dtype=float) - x_min) / (x_max - x_min) * plot_width
+        )
+
+    if mode_of_inheritance == "autosomal_recessive":
+        facets = ar_facets
+        facet_height = (
+            plot_height * (1 - (len(facets) - 1) * facet_spacing) / len(facets)
+        )
+    else:
+        facets = [None]
+        facet_height = plot_height
+
+    elements = [
+        f'<rect x="0" y="0" width="{figure_width}" height="{figure_height}" style="fill:#ffffff"/>'
+    ]
+    tick_values = x_tick_values(x_min, x_max)
+    tick_px = x_to_px(tick_values)
+    gene_px = x_to_px([gene_start, gene_end])
+    flank_px = x_to_px(
+        [gene_start - flanking_region_size, gene_end + flanking_region_size]
+    )
+    count_px = x_to_px(
+        [
+            gene_start - (flanking_region_size - 100000),
+            (gene_start + gene_end) / 2,
+            gene_end + (flanking_region_size - 100000),
+        ]
+    )
+    flank_label = f"{flanking_region_size // 1000000}Mb"
+
+    for facet_index, facet in enumerate(facets):
+        facet_top = margin_top + facet_index * (
+            facet_height + facet_spacing * plot_height
+        )
+        facet_bottom = facet_top + facet_height
+
+        def y_to_px(y):
+            return (
+                facet_top + (y_range[1] - y) / (y_range[1] - y_range[0]) * facet_height
+            )
+
+        # Plot background & grid
+        elements.append(
+            f'<rect x="{margin_left}" y="{facet_top:.2f}" width="{plot_width:.2f}" height="{facet_height:.2f}" '
+            f'style="fill:{plot_background}"/>'
+        )
+        grid = "".join(
+            f"M{x:.2f},{facet_top:.2f}V{facet_bottom:.2f}" for x in tick_px
+        ) + "".join(
+            f"M{margin_left},{y_to_px(y):.2f}H{plot_right:.2f}"
+            for y in range(y_range[0] + 1, y_range[1])
+            if y != 0
+        )
+        elements.append(
+            f'<path d="{grid}" style="fill:none;stroke:#ffffff;stroke-width:1px"/>'
+        )
+        elements.append(
+            f'<path d="M{margin_left},{y_to_px(0):.2f}H{plot_right:.2f}" style="stroke:#ffffff;stroke-width:2px"/>'
+        )
+        elements.append(
+            svg_text(
+                55.2, (facet_top + facet_bottom) / 2, "SNP Category", 14, rotate=-90
+            )
+        )
+        if facet is not None:
+            elements.append(
+                svg_text(margin_left + plot_width / 2 - 680, facet_top - 4.5, facet)
+            )
+
+        # Gene region, drawn under the SNPs
+        elements.append(
+            f'<rect x="{gene_px[0]:.2f}" y="{facet_top:.2f}" width="{gene_px[1] - gene_px[0]:.2f}" '
+            f'height="{facet_height:.2f}" style="fill:blue;opacity:0.25"/>'
+        )
+
+        # SNPs, one path per risk category
+        facet_df = df if facet is None else df[df["snp_inherited_from"] == facet]
+        positions = facet_df["Position"].to_numpy(dtype=float)
+        in_range = (positions >= x_min) & (positions <= x_max)
+        categories = facet_df[risk_category].to_numpy()
+        for category in legend_categories:
+            category_mask = in_range & (categories == category)
+            if category_mask.any():
+                elements.append(
+                    marker_path(
+                        x_to_px(positions[category_mask]),
+                        y_to_px(risk_category_y.get(category, 0)),
+                        category,
+                    )
+                )
+
+        elements.append(svg_text(gene_px.mean(), facet_top - 4.5, "Gene"))
+
+        # Flanking region boundaries, drawn over the SNPs
+        elements.append(
+            f'<path d="M{flank_px[0]:.2f},{facet_top:.2f}V{facet_bottom:.2f}M{flank_px[1]:.2f},{facet_top:.2f}'
+            f'V{facet_bottom:.2f}" style="fill:none;stroke:green;stroke-width:3px;stroke-dasharray:9px,9px"/>'
+        )
+        elements.append(
+            svg_text(
+                flank_px[0] - 13.5,
+                facet_top + 2,
+                f"{flank_label} from Gene Start",
+                anchor="start",
+                rotate=90,
+            )
+        )
+        elements.append(
+            svg_text(
+                flank_px[1] + 4.5,
+                facet_top + 2,
+                f"{flank_label} from Gene End",
+                anchor="start",
+                rotate=90,
+            )
+        )
+
+        # SNP counts above & below the SNPs
+        if facet in counts:
+            _, high_risk_counts, low_risk_counts = counts[facet]
+            for x, high_risk_count, low_risk_count in zip(
+                count_px, high_risk_counts, low_risk_counts
+            ):
+                elements.append(
+                    svg_text(
+                        x,
+                        y_to_px(3) - 3,
+                        high_risk_count,
+                        colour=high_risk_count_colour,
+                    )
+                )
+                elements.append(
+                    svg_text(
+                        x,
+                        y_to_px(-3) + 12,
+                        low_risk_count,
+                        colour=low_risk_count_colour,
+                    )
+                )
+
+    # Axes, labels are only shown under the bottom facet
+    elements += [
+        svg_text(x, plot_bottom + 13, f"{int(value):,}")
+        for x, value in zip(tick_px, tick_values)
+    ]
+    elements.append(
+        svg_text(
+            margin_left + plot_width / 2, plot_bottom + 40.8, "Genomic coordinates", 14
+        )
+    )
+    elements.append(
+        svg_text(
+            85,
+            30,
+            f"Results for {embryo} (Embryo Sex: {embryo_sex})",
+            17,
+            anchor="start",
+        )
+    )
+
+    # Legend
+    legend_x = plot_right + 0.02 * plot_width
+    elements.append(
+        svg_text(legend_x + 2, margin_top + 18.2, legend_title, 14, anchor="start")
+    )
+    legend_y = margin_top + 32.7
+    for category in legend_categories:
+        elements.append(legend_marker(legend_x + 20, legend_y, category))
+        elements.append(
+            svg_text(legend_x + 40, legend_y + 4.7, category, anchor="start")
+        )
+        legend_y += 19
+    for label, colour in legend_counts:
+        # The high & low risk counts are written above & below their position respectively
+        offset = 2 if label.startswith("High") else 12
+        elements.append(svg_text(legend_x + 20, legend_y + offset, "Aa", 10, colour))
+        elements.append(svg_text(legend_x + 40, legend_y + 4.7, label, anchor="start"))
+        legend_y += 19
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{figure_width}" height="{figure_height}" '
+        f'viewBox="0 0 {figure_width} {figure_height}">' + "".join(elements) + "</svg>"
+    )
+
+
+def plot_results(
+    df,
+    embryo_ids,
+    embryo_sex,
+    gene_start,
+    gene_end,
+    mode_of_inheritance,
+    embryo_count_data_df,
+    flanking_region_size,
+):
+    """Writes the static plots used in the PDF report, without Plotly or Kaleido
+
+    Takes the same arguments as snp_plot.plot_results and produces the same figures.
+
+    Args:
+        df (dataframe): Categorised SNPs
+        embryo_ids (list): The embryo IDs
+        embryo_sex (list): The sex of each embryo
+        gene_start (int): Start of the gene of interest
+        gene_end (int): End of the gene of interest
+        mode_of_inheritance (string): The mode of inheritance
+        embryo_count_data_df (dataframe): SNP counts per embryo
+        flanking_region_size (string): Size of the flanking region, "2mb" to "10mb"
+    Returns:
+        list: An SVG document for each embryo
+    """
+    # Convert the flanking region size, "2mb" to "10mb", into base pairs
+    flanking_region_size = flanking_region_size_to_bp(flanking_region_size)
+    return [
+        plot_embryo(
+            df,
+            embryo,
+            sex,
+            int(gene_start),
+            int(gene_end),
+            mode_of_inheritance,
+            embryo_count_data_df,
+            flanking_region_size,
+        )
+        for embryo, sex in progress.counted(
+            zip(embryo_ids, embryo_sex),
+            "plotting",
+            "Drew embryo {done} of {total} for the PDF report",
+            len(embryo_ids),
+        )
+    ]
+
+
+def rectangles_path(start_px, end_px, top, height):
+    """Returns SVG path data drawing a rectangle from each start to end x coordinate
+    Args:
+        start_px (numpy array): x coordinates in pixels of the left of each rectangle
+        end_px (numpy array): x coordinates in pixels of the right of each rectangle
+        top (float): y coordinate in pixels of the top of the rectangles
+        height (float): Height of the rectangles in pixels
+    Returns:
+        string: SVG path data
+    """
+    start = np.char.mod("%.1f", start_px)
+    end = np.char.mod("%.1f", end_px)
+    return "".join(
+        reduce(
+            np.char.add, ["M", start, f",{top:.1f}H", end, f"v{height}H", start, "Z"]
+        )
+    )
+
+
+def category_runs(positions, category_codes):
+    """Splits a row of the embryo category matrix into runs of consecutive SNPs with the same category
+
+    Each SNP covers the region from half way to the previous SNP to half way to the next SNP.
+
+    Args:
+        positions (numpy array): The SNP positions, in increasing order
+        category_codes (numpy array): The category code of each SNP
+    Returns:
+        tuple: The start, end & category code of each run
+    """
+    edges = np.concatenate(
+        [positions[:1], (positions[1:] + positions[:-1]) / 2, positions[-1:]]
+    )
+    changes = np.flatnonzero(category_codes[1:] != category_codes[:-1]) + 1
+    starts = np.concatenate([[0], changes])
+    ends = np.concatenate([changes, [len(category_codes)]])
+    return edges[starts], edges[ends], category_codes[starts]
+
+
+def plot_overview(
+    category_matrix, embryo_ids, gene_start, gene_end, flanking_region_size
+):
+    """Writes the overview plot of every embryo as SVG, a strip per embryo coloured by the risk category of each SNP
+
+    Args:
+        category_matrix (dict): The matrix returned by snp_haplotype.embryo_category_matrix()
+        embryo_ids (list): The embryo IDs
+        gene_start (int): Start of the gene of interest
+        gene_end (int): End of the gene of interest
+        flanking_region_size (string): Size of the flanking region, "2mb" to "10mb"
+    Returns:
+        string: The plot as an SVG document
+    """
+    # Convert the flanking region size, "2mb" to "10mb", into base pairs
+    flanking_region_size = flanking_region_size_to_bp(flanking_region_size)
+    gene_start = int(gene_start)
+    gene_end = int(gene_end)
+    row_height = 24
+    # For AR each embryo has a row for the SNPs inherited from each partner, grouped by partner
+    rows = [
+        (
+            embryo_index,
+            group,
+            embryo if group is None else f"{embryo} {group.split('_')[0]}",
+        )
+        for group in category_matrix
+        for embryo_index, embryo in enumerate(embryo_ids)
+    ]
+    left = max([margin_left] + [text_width(label, 12) + 16 for _, _, label in rows])
+    legend_width = max(
+        text_width(category, 12) + 46 for category in embryo_matrix_categories
+    )
+    plot_width = (figure_width - left - legend_width - 12) / 1.02
+    plot_right = left + plot_width
+    plot_bottom = margin_top + len(rows) * row_height
+    height = max(
+        plot_bottom + margin_bottom,
+        margin_top + 32.7 + len(embryo_matrix_categories) * 19,
+    )
+
+    x_min = gene_start - (flanking_region_size + 100000)
+    x_max = gene_end + (flanking_region_size + 100000)
+
+    def x_to_px(x):
+        return (
+            left
+            + (np.clip(np.asarray(x, dtype=float), x_min, x_max) - x_min)
+            / (x_max - x_min)
+            * plot_width
+        )
+
+    tick_values = x_tick_values(x_min, x_max)
+    tick_px = x_to_px(tick_values)
+    gene_px = x_to_px([gene_start, gene_end])
+    flank_px = x_to_px(
+        [gene_start - flanking_region_size, gene_end + flanking_region_size]
+    )
+
+    elements = [
+        f'<rect x="0" y="0" width="{figure_width}" height="{height}" style="fill:#ffffff"/>',
+        f'<rect x="{left:.2f}" y="{margin_top}" width="{plot_width:.2f}" height="{plot_bottom - margin_top}" '
+        f'style="fill:{plot_background}"/>',
+        '<path d="'
+        + "".join(f"M{x:.2f},{margin_top}V{plot_bottom}" for x in tick_px)
+        + '" style="fill:none;stroke:#ffffff;stroke-width:1px"/>',
+        f'<rect x="{gene_px[0]:.2f}" y="{margin_top}" width="{gene_px[1] - gene_px[0]:.2f}" '
+        f'height="{plot_bottom - margin_top}" style="fill:blue;opacity:0.25"/>',
+    ]
+
+    # The runs of every row are collected by category so that each category is drawn as a single path
+    category_runs_by_code = {code: [] for code in range(len(embryo_matrix_categories))}
+    for row_index, (embryo_index, group, label) in enumerate(rows):
+        row_top = margin_top + row_index * row_height
+        elements.append(
+            svg_text(left - 8, row_top + row_height / 2 + 4, label, anchor="end")
+        )
+        positions, category_codes = category_matrix[group]
+        if len(positions) == 0:
+            continue
+        starts, ends, codes = category_runs(positions, category_codes[embryo_index])
+        start_px = x_to_px(starts)
+        # Runs are drawn at least a pixel wide so that single SNPs remain visible
+        end_px = np.maximum(x_to_px(ends), start_px + 1)
+        for code in category_runs_by_code:
+            run = codes == code
+            if run.any():
+                category_runs_by_code[code].append(
+                    (start_px[run], end_px[run], row_top + 2)
+                )
+    for code, runs in category_runs_by_code.items():
+        if not runs:
+            continue
+        d = "".join(
+            rectangles_path(start_px, end_px, row_top, row_height - 4)
+            for start_px, end_px, row_top in runs
+        )
+        elements.append(
+            f'<path class="{embryo_matrix_categories[code]}" d="{d}" '
+            f'style="fill:{risk_category_colours[embryo_matrix_categories[code]]}"/>'
+        )
+
+    # Flanking region boundaries & labels
+    elements.append(
+        f'<path d="M{flank_px[0]:.2f},{margin_top}V{plot_bottom}M{flank_px[1]:.2f},{margin_top}V{plot_bottom}" '
+        'style="fill:none;stroke:green;stroke-width:3px;stroke-dasharray:9px,9px"/>'
+    )
+    flank_label = f"{flanking_region_size // 1000000}Mb"
+    elements.append(svg_text(gene_px.mean(), margin_top - 4.5, "Gene"))
+    elements.append(
+        svg_text(flank_px[0], margin_top - 4.5, f"{flank_label} from Gene Start")
+    )
+    elements.append(
+        svg_text(flank_px[1], margin_top - 4.5, f"{flank_label} from Gene End")
+    )
+
+    # Axes & title
+    elements += [
+        svg_text(x, plot_bottom + 13, f"{int(value):,}")
+        for x, value in zip(tick_px, tick_values)
+    ]
+    elements.append(
+        svg_text(left + plot_width / 2, plot_bottom + 40.8, "Genomic coordinates", 14)
+    )
+    elements.append(svg_text(85, 30, "Overview of all embryos", 17, anchor="start"))
+
+    # Legend
+    legend_x = plot_right + 0.02 * plot_width
+    elements.append(
+        svg_text(legend_x + 2, margin_top + 18.2, "risk_category", 14, anchor="start")
+    )
+    for index, category in enumerate(embryo_matrix_categories):
+        legend_y = margin_top + 32.7 + index * 19
+        elements.append(
+            f'<rect x="{legend_x + 14:.1f}" y="{legend_y - 6:.1f}" width="12" height="12" '
+            f'style="fill:{risk_category_colours[category]}"/>'
+        )
+        elements.append(
+            svg_text(legend_x + 40, legend_y + 4.7, category, anchor="start")
+        )
+
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{figure_width}" height="{height}" '
+        f'viewBox="0 0 {figure_width} {height}">' + "".join(elements) + "</svg>"
+    )
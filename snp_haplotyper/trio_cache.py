@@ -0,0 +1,287 @@
+import hashlib
+import json
+import os
+import pandas as pd
+import sys
+import tempfile
+import time
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import config as config
+
+# Trio classifications are cached per SNP array, trio & analysis parameters so that embryos biopsied later in a
+# cycle can be added to a case without repeating the trio analysis. The folder can be set in the environment.
+trio_cache_folder = os.getenv("TRIO_CACHE_FOLDER", config.trio_cache_folder)
+
+# The columns of the trio results which are cached along with the trio genotypes, embryo genotype columns are
+# added back when the case is rerun. Only the columns present for the mode of inheritance are kept.
+trio_result_columns = [
+    "probeset_id",
+    "rsID",
+    "Chr",
+    "Position",
+    "gene_distance",
+    "snp_risk_category",
+    "snp_inherited_from",
+    "female_AB_snp_risk_category",
+    "male_AA_snp_risk_category",
+    "male_BB_snp_risk_category",
+]
+
+# The analysis parameters which change the trio classification or the embryo results
+trio_parameters = [
+    "mode_of_inheritance",
+    "male_partner",
+    "male_partner_status",
+    "female_partner",
+    "female_partner_status",
+    "reference",
+    "reference_status",
+    "reference_relationship",
+    "consanguineous",
+    "chr",
+    "gene_start",
+    "gene_end",
+    "flanking_region_size",
+    "flank_sensitivity",
+]
+
+
+def trio_cache_key(df, args):
+    """Calculate the key a trio classification is cached under
+    The key is a hash of the trio genotypes in the SNP array, the analysis parameters and the BASHer version, so a
+    cached result is never reused if the array, the trio or the version of the analysis changes. Embryo columns are
+    not part of the key.
+    Args:
+        df (dataframe): The imported SNP array data
+        args (Namespace): The arguments passed to snp_haplotype.main()
+    Returns:
+        string: A hex digest identifying the trio classification
+    """
+    trio_df = df[
+        [
+            "probeset_id",
+            "Position",
+            args.male_partner,
+            args.female_partner,
+            args.reference,
+        ]
+    ]
+    parameters = {
+        parameter: str(getattr(args, parameter, None)) for parameter in trio_parameters
+    }
+    parameters["basher_version"] = config.basher_version
+
+    key = hashlib.sha256()
+    key.update(pd.util.hash_pandas_object(trio_df, index=False).to_numpy().tobytes())
+    key.update(json.dumps(parameters, sort_keys=True).encode())
+    return key.hexdigest()
+
+
+def embryo_hashes(df, embryo_ids, embryo_sex):
+    """Calculate a hash of the genotypes & sex of each embryo
+    An embryo is only taken from the cached case if its hash matches the one cached, so an embryo whose genotypes or
+    sex have changed, e.g. after a re-biopsy or a corrected sample sheet, is analysed again.
+    Args:
+        df (dataframe): The imported SNP array data
+        embryo_ids (list): The embryo columns in df
+        embryo_sex (list): The sex of each embryo in embryo_ids
+    Returns:
+        dict: A hex digest for each embryo
+    """
+    hashes = {}
+    for embryo_id, sex in zip(embryo_ids, embryo_sex):
+        embryo_hash = hashlib.sha256()
+        embryo_hash.update(
+            pd.util.hash_pandas_object(df[["probeset_id", embryo_id]], index=False)
+            .to_numpy()
+            .tobytes()
+        )
+        embryo_hash.update(str(sex).encode())
+        hashes[embryo_id] = embryo_hash.hexdigest()
+    return hashes
+
+
+def load_cached_case(key):
+    """Load a cached trio classification and the embryo results calculated with it
+    Args:
+        key (string): A key produced by trio_cache_key()
+    Returns:
+        dict: The cached case produced by save_cached_case() or None if the case has not been cached
+    """
+    cache_path = os.path.join(trio_cache_folder, f"{key}.pkl")
+    if not os.path.exists(cache_path):
+        return None
+    logger.info(f"Using cached trio classification {key}")
+    try:
+        # Using a case keeps it in the cache for another retention period, see purge_expired_cases()
+        os.utime(cache_path)
+    except OSError:
+        pass
+    return pd.read_pickle(cache_path)
+
+
+def save_cached_case(
+    key,
+    results_df,
+    trio_ids,
+    embryo_category_df,
+    embryo_count_data_df,
+    embryo_ids,
+    embryo_sex,
+    embryo_hashes,
+):
+    """Cache a trio classification and the embryo results calculated with it
+    The case is written to a temporary file and then moved into place so that a partially written case is never
+    read by another process.
+    Args:
+        key (string): A key produced by trio_cache_key()
+        results_df (dataframe): A dataframe produced by classify_trio()
+        trio_ids (list): The male partner, female partner & reference columns in results_df
+        embryo_category_df (dataframe): A dataframe produced by categorise_embryo_alleles(), None for trio_only
+        embryo_count_data_df (dataframe): A dataframe produced by summarise_snps_per_embryo_pretty(), None for trio_only
+        embryo_ids (list): The embryos included in embryo_category_df
+        embryo_sex (list): The sex of each embryo in embryo_ids
+        embryo_hashes (dict): The hash of each embryo in embryo_ids calculated by embryo_hashes()
+    """
+    os.makedirs(trio_cache_folder, exist_ok=True)
+    case = {
+        "results_df": results_df[
+            [
+                column
+                for column in results_df.columns
+                if column in trio_result_columns or column in trio_ids
+            ]
+        ],
+        "embryo_category_df": embryo_category_df,
+        "embryo_count_data_df": embryo_count_data_df,
+        "embryo_ids": list(embryo_ids),
+        "embryo_sex": list(embryo_sex),
+        "embryo_hashes": dict(embryo_hashes),
+    }
+    file_descriptor, temp_path = tempfile.mkstemp(dir=trio_cache_folder, suffix=".tmp")
+    os.close(file_descriptor)
+    pd.to_pickle(case, temp_path)
+    os.replace(temp_path, os.path.join(trio_cache_folder, f"{key}.pkl"))
+    logger.info(f"Cached trio classification {key}")
+
+
+def purge_expired_cases(retention_days):
+    """Delete the cached cases which have not been saved or used for the retention period, run by the janitor
+    Args:
+        retention_days (float): The number of days to keep cached cases for
+    Returns:
+        int: The bytes reclaimed
+    """
+    if not os.path.isdir(trio_cache_folder):
+        return 0
+    cutoff = time.time() - retention_days * 24 * 60 * 60
+    reclaimed_bytes = 0
+    with os.scandir(trio_cache_folder) as entries:
+        for entry in entries:
+            try:
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime >= cutoff:
+                    continue
+                os.remove(entry.path)
+            except FileNotFoundError:
+                # Already purged by another worker
+                continue
+            reclaimed_bytes += stat.st_size
+    return reclaimed_bytes
+
+
+def add_embryo_genotypes(cached_results_df, df, embryo_ids):
+    """Add the genotypes of embryos to a cached trio classification
+    Args:
+        cached_results_df (dataframe): The results_df of a case loaded by load_cached_case()
+        df (dataframe): The SNP array data for the embryos
+        embryo_ids (list): The embryo columns in df to add
+    Returns:
+        dataframe: The trio classification with a genotype column for each embryo
+    """
+    return cached_results_df.merge(
+        df[["probeset_id"] + list(embryo_ids)], on="probeset_id", how="left"
+    )
+
+
+def merge_embryo_categories(cached_embryo_category_df, embryo_category_df, embryo_ids):
+    """Merge the categories of new embryos into those cached for a case
+    Both dataframes are calculated from the same cached trio classification so have the same SNPs in the same order.
+    Cached embryos which were analysed again are replaced, keeping their place in the case.
+    Args:
+        cached_embryo_category_df (dataframe): The embryo_category_df of a case loaded by load_cached_case()
+        embryo_category_df (dataframe): A dataframe produced by categorise_embryo_alleles() for the new embryos
+        embryo_ids (list): The new or changed embryos in embryo_category_df
+    Returns:
+        dataframe: The embryo categories of all the embryos in the case
+    """
+    cached_embryo_category_df = cached_embryo_category_df.reset_index(drop=True)
+    embryo_category_df = embryo_category_df.reset_index(drop=True)
+    if not cached_embryo_category_df["probeset_id"].equals(
+        embryo_category_df["probeset_id"]
+    ):
+        raise ValueError(
+            "The SNPs of the new embryos do not match the cached trio classification"
+        )
+    new_columns = [
+        column
+        for embryo in embryo_ids
+        for column in [embryo, f"{embryo}_risk_category"]
+    ]
+    columns = list(cached_embryo_category_df.columns) + [
+        column
+        for column in new_columns
+        if column not in cached_embryo_category_df.columns
+    ]
+    return pd.concat(
+        [
+            cached_embryo_category_df.drop(
+                columns=cached_embryo_category_df.columns.intersection(new_columns)
+            ),
+            embryo_category_df[new_columns],
+        ],
+        axis=1,
+    )[columns]
+
+
+def merge_embryo_counts(cached_embryo_count_data_df, embryo_count_data_df, embryo_ids):
+    """Merge the SNP counts of new embryos into those cached for a case
+    Cached embryos which were analysed again are replaced, keeping their place in the case.
+    Args:
+        cached_embryo_count_data_df (dataframe): The embryo_count_data_df of a case loaded by load_cached_case()
+        embryo_count_data_df (dataframe): A dataframe produced by summarise_snps_per_embryo_pretty() for the new embryos
+        embryo_ids (list): The new or changed embryos in embryo_count_data_df
+    Returns:
+        dataframe: The SNP counts of all the embryos in the case
+    """
+    key_columns = [
+        column
+        for column in [
+            "gene_distance",
+            "snp_inherited_from",
+            "risk_category",
+            "snp_position",
+        ]
+        if column in cached_embryo_count_data_df.columns
+    ]
+    columns = list(cached_embryo_count_data_df.columns) + [
+        embryo_id
+        for embryo_id in embryo_ids
+        if embryo_id not in cached_embryo_count_data_df.columns
+    ]
+    merged_df = cached_embryo_count_data_df.drop(
+        columns=cached_embryo_count_data_df.columns.intersection(embryo_ids)
+    ).merge(
+        embryo_count_data_df[key_columns + list(embryo_ids)],
+        on=key_columns,
+        how="left",
+    )
+    merged_df[embryo_ids] = merged_df[embryo_ids].fillna(0).astype(int)
+    return merged_df[columns]
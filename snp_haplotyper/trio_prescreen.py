@@ -0,0 +1,325 @@
+import argparse
+import numpy as np
+import os
+import pandas as pd
+import sys
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+import array_io
+from snp_haplotype import (
+    check_analysis_allowed,
+    classify_trio,
+    filter_out_nocalls,
+    informative_snp_indicators,
+)
+
+# The regions reported for each gene, in the same order as the report tables.  The SNPs in each region
+# are those with start < Position <= end, matching annotate_distance_from_gene().
+region_bins = [
+    "1-2MB_from_start",
+    "0-1MB_from_start",
+    "within_gene",
+    "0-1MB_from_end",
+    "1-2MB_from_end",
+]
+
+# Import command line arguments
+parser = argparse.ArgumentParser(
+    description="Pre-screen a trio for informative SNPs across a panel of candidate genes"
+)
+
+parser.add_argument(
+    "-i",
+    "--input_file",
+    type=str,
+    required=True,
+    help="Input txt file containing SNP Array output",
+)
+
+parser.add_argument(
+    "-g",
+    "--gene_file",
+    type=str,
+    required=True,
+    help="BED file (chrom, 0-based start, end, name) or TSV file with the columns gene_symbol, chr, gene_start & gene_end (1-based)",
+)
+
+parser.add_argument(
+    "-o",
+    "--output_file",
+    type=str,
+    help="Path to the output TSV file, if not provided the table is printed",
+)
+
+parser.add_argument(
+    "-m",
+    "--mode_of_inheritance",
+    type=str,
+    required=True,
+    choices=["autosomal_dominant", "autosomal_recessive", "x_linked"],
+    help="The mode of inheritance",
+)
+
+parser.add_argument(
+    "-mp",
+    "--male_partner",
+    type=str,
+    required=True,
+    help="ID in input table for male_partner",
+)
+
+parser.add_argument(
+    "-mps",
+    "--male_partner_status",
+    type=str,
+    choices=["affected", "unaffected", "carrier"],
+    help="Status of male_partner",
+)
+
+parser.add_argument(
+    "-fp",
+    "--female_partner",
+    type=str,
+    required=True,
+    help="ID in input table for female_partner",
+)
+
+parser.add_argument(
+    "-fps",
+    "--female_partner_status",
+    type=str,
+    choices=["affected", "unaffected", "carrier"],
+    help="Status of female_partner",
+)
+
+parser.add_argument(
+    "-consang",
+    "--consanguineous",
+    action=argparse.BooleanOptionalAction,
+    default=False,
+    help="Flag to indicate that partners are consanguineous",
+)
+
+parser.add_argument(
+    "-r",
+    "--reference",
+    type=str,
+    required=True,
+    help="ID in input table for reference sample",
+)
+
+parser.add_argument(
+    "-rs",
+    "--reference_status",
+    type=str,
+    choices=["affected", "unaffected", "carrier"],
+    help="Status of Reference",
+)
+
+parser.add_argument(
+    "-rr",
+    "--reference_relationship",
+    type=str,
+    choices=["grandparent", "child"],
+    help="Reference relationship to pro-band",
+)
+
+
+def normalise_chromosome(chromosomes):
+    """Normalise chromosome names so that "chr13", "13" and 13 all compare equal
+    Args:
+        chromosomes (series): Chromosome names or numbers
+    Returns:
+        series: Lower case chromosome names without a "chr" prefix
+    """
+    return (
+        chromosomes.astype(str)
+        .str.strip()
+        .str.lower()
+        .str.replace(r"^chr", "", regex=True)
+    )
+
+
+def read_gene_intervals(gene_file):
+    """Import the gene intervals to be pre-screened
+    Accepts either a BED file (chrom, start, end, name - 0-based half open co-ordinates) or a tab separated file
+    with a header containing the columns gene_symbol, chr, gene_start & gene_end (1-based co-ordinates, as used
+    by snp_haplotype.py).
+    Args:
+        gene_file (string): Path to the BED or TSV file
+    Returns:
+        dataframe: Dataframe with the columns gene_symbol, chr, gene_start & gene_end (1-based)
+    """
+    with open(gene_file, "r") as f:
+        first_line = f.readline().rstrip("\n").split("\t")
+
+    if {"gene_symbol", "chr", "gene_start", "gene_end"}.issubset(first_line):
+        genes_df = pd.read_csv(gene_file, sep="\t")
+    else:
+        genes_df = pd.read_csv(
+            gene_file,
+            sep="\t",
+            header=None,
+            comment="#",
+            usecols=[0, 1, 2, 3],
+            names=["chr", "gene_start", "gene_end", "gene_symbol"],
+        )
+        # BED files are 0-based so convert the start to the 1-based co-ordinates used by BASHer
+        genes_df["gene_start"] = genes_df["gene_start"] + 1
+
+    genes_df = genes_df[["gene_symbol", "chr", "gene_start", "gene_end"]].copy()
+    genes_df["chr"] = normalise_chromosome(genes_df["chr"])
+    genes_df["gene_start"] = genes_df["gene_start"].astype(np.int64)
+    genes_df["gene_end"] = genes_df["gene_end"].astype(np.int64)
+    return genes_df
+
+
+def count_snps_by_gene_region(positions, indicators, gene_starts, gene_ends):
+    """Count flagged SNPs in each region around many genes using prefix sums
+    The SNPs are sorted by position once and a prefix (cumulative) sum taken of each indicator column. The count in
+    any region start < Position <= end is then the difference of the prefix sums at the two region boundaries, so
+    every gene is counted with two binary searches per boundary rather than by filtering the SNP table.
+    Args:
+        positions (array): SNP positions
+        indicators (array): 2D array (SNPs x counts) of 0/1 flags in the same order as positions
+        gene_starts (array): Gene start co-ordinates (1-based)
+        gene_ends (array): Gene end co-ordinates (1-based)
+    Returns:
+        array: 3D array of counts with the shape (genes x region_bins x counts)
+    """
+    order = np.argsort(positions, kind="stable")
+    sorted_positions = np.asarray(positions)[order]
+    prefix_sums = np.zeros((len(sorted_positions) + 1, indicators.shape[1]), np.int64)
+    np.cumsum(np.asarray(indicators)[order], axis=0, out=prefix_sums[1:])
+
+    # Boundaries of the region bins for each gene (genes x 6)
+    gene_starts = np.asarray(gene_starts, dtype=np.int64)
+    gene_ends = np.asarray(gene_ends, dtype=np.int64)
+    boundaries = np.column_stack(
+        [
+            gene_starts - 2000000,
+            gene_starts - 1000000,
+            gene_starts,
+            gene_ends,
+            gene_ends + 1000000,
+            gene_ends + 2000000,
+        ]
+    )
+    # Number of SNPs with a position <= each boundary
+    cut_points = np.searchsorted(sorted_positions, boundaries, side="right")
+    return prefix_sums[cut_points[:, 1:]] - prefix_sums[cut_points[:, :-1]]
+
+
+def prescreen_genes(results_df, genes_df, mode_of_inheritance):
+    """Summarise the informative SNPs around every gene in a panel for a classified trio
+    Args:
+        results_df (dataframe): A dataframe produced by classify_trio() for the whole SNP array
+        genes_df (dataframe): A dataframe produced by read_gene_intervals()
+        mode_of_inheritance (string): "autosomal_dominant", "autosomal_recessive", "x_linked"
+    Returns:
+        dataframe: One row per gene and region (plus a "total_snps" row per gene) with the informative SNP counts
+    """
+    indicators = informative_snp_indicators(results_df, mode_of_inheritance)
+    count_columns = list(indicators.columns)
+    positions = results_df["Position"].to_numpy()
+
+    # Only compare genes with the SNPs on the same chromosome if the array file records the chromosome
+    if "Chr" in results_df.columns:
+        snp_chromosomes = normalise_chromosome(results_df["Chr"]).to_numpy()
+    else:
+        snp_chromosomes = None
+
+    summaries = []
+    for chromosome, chromosome_genes_df in genes_df.groupby("chr", sort=False):
+        if snp_chromosomes is None:
+            on_chromosome = np.ones(len(positions), dtype=bool)
+        else:
+            on_chromosome = snp_chromosomes == chromosome
+            if not on_chromosome.any():
+                logger.warning(
+                    f"No SNPs on chromosome {chromosome} in the SNP array file, genes {', '.join(chromosome_genes_df['gene_symbol'])} will have no informative SNPs"
+                )
+        counts = count_snps_by_gene_region(
+            positions[on_chromosome],
+            indicators.to_numpy()[on_chromosome],
+            chromosome_genes_df["gene_start"],
+            chromosome_genes_df["gene_end"],
+        )
+        # Append a total over all regions for each gene
+        counts = np.concatenate([counts, counts.sum(axis=1, keepdims=True)], axis=1)
+        number_of_rows = len(region_bins) + 1
+        summary_df = chromosome_genes_df.loc[
+            chromosome_genes_df.index.repeat(number_of_rows)
+        ].reset_index(drop=True)
+        summary_df["gene_distance"] = (region_bins + ["total_snps"]) * len(
+            chromosome_genes_df
+        )
+        summary_df[count_columns] = counts.reshape(-1, len(count_columns))
+        summaries.append(summary_df)
+
+    if summaries == []:
+        return pd.DataFrame(
+            columns=["gene_symbol", "chr", "gene_start", "gene_end", "gene_distance"]
+            + count_columns
+        )
+    # Restore the order the genes were provided in
+    prescreen_df = pd.concat(summaries)
+    prescreen_df["gene_symbol"] = pd.Categorical(
+        prescreen_df["gene_symbol"], genes_df["gene_symbol"].unique()
+    )
+    prescreen_df = prescreen_df.sort_values("gene_symbol", kind="stable").reset_index(
+        drop=True
+    )
+    prescreen_df["gene_symbol"] = prescreen_df["gene_symbol"].astype(str)
+    return prescreen_df
+
+
+def main(args):
+    genes_df = read_gene_intervals(args.gene_file)
+    # Every gene must be on a chromosome which is valid for the mode of inheritance
+    for chromosome in genes_df["chr"].unique():
+        check_analysis_allowed(
+            args.mode_of_inheritance, chromosome, args.consanguineous, True
+        )
+
+    # Import the whole SNP array once, the trio is classified for every probeset
+    df = array_io.read_array_file(
+        args.input_file,
+        columns=array_io.probeset_id_columns
+        + ["Chr", "Position", args.male_partner, args.female_partner, args.reference],
+    )
+    df = df.rename(columns={"Probeset ID": "probeset_id"})
+    logger.info(f"Number of SNPs imported from SNP Array File = {df.shape[0]}.")
+
+    filtered_df = filter_out_nocalls(
+        df, args.male_partner, args.female_partner, args.reference
+    )
+    results_df = classify_trio(
+        filtered_df,
+        args.mode_of_inheritance,
+        args.male_partner,
+        args.male_partner_status,
+        args.female_partner,
+        args.female_partner_status,
+        args.reference,
+        args.reference_status,
+        args.reference_relationship,
+        args.consanguineous,
+    )
+    return prescreen_genes(results_df, genes_df, args.mode_of_inheritance)
+
+
+# run the script
+if __name__ == "__main__":
+    args = parser.parse_args()
+    prescreen_df = main(args)
+    if args.output_file is None:
+        print(prescreen_df.to_string(index=False))
+    else:
+        prescreen_df.to_csv(args.output_file, sep="\t", index=False)
@@ -1,3 +1,32 @@
+import itertools
+import re
+
+import pandas as pd
+
+# The results of the validation cases are compared to the expected results in test_data/*_validation.json. Each
+# expected result is a metric, the sum of a column of one of the summary tables over the rows matching some lookup
+# values. The observed tables are summed for every combination of lookup values at once and joined to the expected
+# metrics, so all of a case's metrics are compared together and every mismatch is reported.
+
+# How each column is matched to its lookup value, other columns are matched if they contain the lookup value
+startswith_columns = ["snp_inherited_from"]
+
+# The lookup values of the regions in each table, in the same order as the regions in the validation data
+summary_regions = {
+    "upstream_2mb": "start",
+    "in_gene": "within_gene",
+    "downstream_2mb": "end",
+}
+embryo_regions = {
+    "upstream_2mb": "upstream",
+    "within_gene": "within_gene",
+    "downstream_2mb": "downstream",
+}
+
+# The partner each SNP was inherited from in AR cases, and the suffix of its validation metrics
+partners = {"female_partner": "female", "male_partner": "male"}
+
+
 def lookup_df_result(df, value_column, **lookup_values):
     """
     Filters a given DataFrame based on the criteria provided and sums up the values of a specified column for the filtered rows.  These summarised results can be used
@@ -11,16 +40,218 @@ def lookup_df_result(df, value_column, **lookup_values):
     Returns:
     total (float): The sum of the values in the specified column, value_column, for the rows that meet the filter criteria.
     """
-    filter_criteria = []
-    for lookup_colname, lookup_value in lookup_values.items():
-        if lookup_colname == "snp_inherited_from":
-            filter_criteria.append(f'{lookup_colname}.str.startswith("{lookup_value}")')
+    metric = pd.DataFrame(
+        [{"value_column": value_column, **lookup_values, "expected": None}]
+    )
+    return observed_metrics(df, metric)["observed"].iloc[0]
+
+
+def lookup_pattern(column, lookup_values):
+    """The regular expression which extracts the lookup value matched by each row of a column"""
+    alternatives = "|".join(
+        re.escape(value) for value in sorted(lookup_values, key=len, reverse=True)
+    )
+    if column in startswith_columns:
+        return f"^({alternatives})"
+    return f"({alternatives})"
+
+
+def observed_metrics(df, metrics):
+    """Sum a table for each of the expected metrics
+    Args:
+        df (dataframe): The observed table
+        metrics (dataframe): A row for each metric, with the value_column to sum, a column for each column of df which
+            is filtered holding its lookup value (NaN if the metric is not filtered by that column) & the expected value
+    Returns:
+        dataframe: The metrics with the observed value of each, 0 if no rows match
+    """
+    filter_columns = [column for column in metrics.columns if column in df.columns]
+    observed = []
+    # Metrics filtered by the same columns are summed with a single groupby
+    filtered_by = (
+        metrics[filter_columns]
+        .notna()
+        .apply(
+            lambda row: tuple(column for column in filter_columns if row[column]),
+            axis=1,
+        )
+    )
+    for group_columns, group in metrics.groupby(filtered_by, sort=False):
+        group_columns = list(group_columns)
+        value_columns = list(group["value_column"].unique())
+        if group_columns:
+            keys = [
+                df[column]
+                .astype(str)
+                .str.extract(
+                    lookup_pattern(column, group[column].unique()), expand=False
+                )
+                for column in group_columns
+            ]
+            sums = (
+                df[value_columns]
+                .groupby(keys, dropna=True)
+                .sum()
+                .rename_axis(group_columns)
+                .melt(
+                    var_name="value_column", value_name="observed", ignore_index=False
+                )
+                .reset_index()
+            )
         else:
-            filter_criteria.append(f'{lookup_colname}.str.contains("{lookup_value}")')
-    filter_string = " and ".join(filter_criteria)
-    print(filter_string)
-    total = df.query(filter_string, engine="python")[value_column].sum()
-    return total
+            sums = (
+                df[value_columns]
+                .sum()
+                .rename_axis("value_column")
+                .reset_index(name="observed")
+            )
+        observed.append(
+            group.merge(sums, on=group_columns + ["value_column"], how="left")
+        )
+    observed = pd.concat(observed, ignore_index=True)
+    observed["observed"] = observed["observed"].fillna(0).astype(int)
+    return observed
+
+
+def snp_metrics(mode, validation):
+    """The expected metrics of the summary & informative SNP tables of a validation case
+    Args:
+        mode (str): The mode of inheritance
+        validation (dict): The case's expected results
+    Returns:
+        dict: A dataframe of metrics for each table, see observed_metrics()
+    """
+    summary = []
+    informative = []
+    if mode in ["autosomal_dominant", "autosomal_recessive"]:
+        summary = [
+            {
+                "metric": f"info_snps_{region}",
+                "value_column": "snp_count",
+                "gene_distance": gene_distance,
+                "expected": validation[f"info_snps_{region}"],
+            }
+            for region, gene_distance in summary_regions.items()
+        ]
+    if mode == "autosomal_dominant":
+        summary.append(
+            {
+                "metric": "total_info_snps",
+                "value_column": "snp_count",
+                "gene_distance": "total_snps",
+                "expected": validation["total_info_snps"],
+            }
+        )
+        for risk, (region, gene_distance) in itertools.product(
+            ["high_risk", "low_risk"], summary_regions.items()
+        ):
+            metric = {
+                "upstream_2mb": f"{risk}_snps_upstream_2mb",
+                "in_gene": f"{risk}_within_gene",
+                "downstream_2mb": f"{risk}_snps_downstream_2mb",
+            }[region]
+            informative.append(
+                {
+                    "metric": metric,
+                    "value_column": "snp_count",
+                    "gene_distance": gene_distance,
+                    "snp_risk_category": risk,
+                    "expected": validation[metric],
+                }
+            )
+    elif mode == "autosomal_recessive":
+        # The AR summary table has no total row, so the whole table is summed
+        summary.append(
+            {
+                "metric": "total_info_snps",
+                "value_column": "snp_count",
+                "expected": sum(
+                    validation[f"info_snps_{region}"] for region in summary_regions
+                ),
+            }
+        )
+        for (partner, suffix), risk, (region, gene_distance) in itertools.product(
+            partners.items(), ["high_risk", "low_risk"], summary_regions.items()
+        ):
+            metric = {
+                "upstream_2mb": f"{risk}_snps_upstream_2mb_from_{suffix}",
+                "in_gene": f"{risk}_within_gene_from_{suffix}",
+                "downstream_2mb": f"{risk}_snps_downstream_2mb_from_{suffix}",
+            }[region]
+            informative.append(
+                {
+                    "metric": metric,
+                    "value_column": "snp_count",
+                    "gene_distance": gene_distance,
+                    "snp_risk_category": risk,
+                    "snp_inherited_from": partner,
+                    "expected": validation[metric],
+                }
+            )
+    return {
+        "summary_snps_by_region": pd.DataFrame(summary),
+        "informative_snps_by_region": pd.DataFrame(informative),
+    }
+
+
+def embryo_metrics(mode, embryo_validations):
+    """The expected metrics of the embryo count table for the embryos of a validation case
+    Args:
+        mode (str): The mode of inheritance
+        embryo_validations (dict): The expected results of each embryo, keyed by embryo ID
+    Returns:
+        dataframe: The metrics, see observed_metrics()
+    """
+    if mode == "autosomal_recessive":
+        combinations = [
+            (partner, suffix, risk, region, position)
+            for (partner, suffix), risk, (region, position) in itertools.product(
+                partners.items(), ["high_risk", "low_risk"], embryo_regions.items()
+            )
+        ]
+    else:
+        combinations = [
+            (None, None, risk, region, position)
+            for risk, (region, position) in itertools.product(
+                ["high_risk", "low_risk"], embryo_regions.items()
+            )
+        ]
+    metrics = []
+    for embryo_id, validation in embryo_validations.items():
+        for partner, suffix, risk, region, position in combinations:
+            if partner is None:
+                metric = f"{risk}_{region}"
+            else:
+                metric = (
+                    f"{risk}_within_gene_from_{suffix}"
+                    if region == "within_gene"
+                    else f"{risk}_snps_{region}_from_{suffix}"
+                )
+            metrics.append(
+                {
+                    "embryo_id": embryo_id,
+                    "metric": metric,
+                    "value_column": embryo_id + ".rhchp",
+                    "snp_position": position,
+                    "risk_category": risk,
+                    "snp_inherited_from": partner,
+                    "expected": validation[metric],
+                }
+            )
+    metrics = pd.DataFrame(metrics)
+    if mode != "autosomal_recessive":
+        metrics = metrics.drop(columns="snp_inherited_from")
+    return metrics
+
+
+def assert_metrics_match(observed, case):
+    """Raise an AssertionError listing every metric which does not match its expected value"""
+    mismatches = observed[observed["observed"] != observed["expected"]]
+    if not mismatches.empty:
+        raise AssertionError(
+            f"{len(mismatches)} of {len(observed)} metrics of {case} do not match the expected results:\n"
+            + mismatches.to_string(index=False)
+        )
 
 
 def validate_snp_results(
@@ -46,420 +277,63 @@ def validate_snp_results(
         None
 
     Raises:
-        AssertionError: If any test fails to validate the results.
+        AssertionError: Listing every result which does not match the expected results.
     """
     validation = all_validation[sample_id]
     assert mode == validation["mode"]
     assert sample_id == validation["sample_id"]
-    assert number_snps_imported == validation["num_snps"]
-
-    if mode == "autosomal_dominant":
-        # Test contents of summary_snps_by_region dataframe which is used to make the summary_snps_table in the report
-        # These tests are the same for all modes of inheritance
-        # 'within_gene' is within the genomic region of the gene, 'start' is 2MB or 3Mb upstream of the gene, 'end' is 2MB or 3MB downstream of the gene
-        assert (
-            lookup_df_result(summary_snps_by_region, "snp_count", gene_distance="start")
-            == validation["info_snps_upstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                summary_snps_by_region, "snp_count", gene_distance="within_gene"
-            )
-            == validation["info_snps_in_gene"]
-        )
-        assert (
-            lookup_df_result(summary_snps_by_region, "snp_count", gene_distance="end")
-            == validation["info_snps_downstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                summary_snps_by_region, "snp_count", gene_distance="total_snps"
-            )
-            == validation["total_info_snps"]
-        )
-
-        # Test contents of informative_snps_by_region dataframe which is used to make the informative_snps_table in the report
-        # These tests are different depending on the mode of inheritance
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="start",
-                snp_risk_category="high_risk",
-            )
-            == validation["high_risk_snps_upstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="within_gene",
-                snp_risk_category="high_risk",
-            )
-            == validation["high_risk_within_gene"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="end",
-                snp_risk_category="high_risk",
-            )
-            == validation["high_risk_snps_downstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="start",
-                snp_risk_category="low_risk",
-            )
-            == validation["low_risk_snps_upstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="within_gene",
-                snp_risk_category="low_risk",
-            )
-            == validation["low_risk_within_gene"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="end",
-                snp_risk_category="low_risk",
-            )
-            == validation["low_risk_snps_downstream_2mb"]
-        )
-    elif mode == "autosomal_recessive":
-        # Test contents of summary_snps_by_region dataframe which is used to make the summary_snps_table in the report
-        # These tests are the same for all modes of inheritance
-        assert (
-            lookup_df_result(summary_snps_by_region, "snp_count", gene_distance="start")
-            == validation["info_snps_upstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                summary_snps_by_region, "snp_count", gene_distance="within_gene"
-            )
-            == validation["info_snps_in_gene"]
-        )
-        assert (
-            lookup_df_result(summary_snps_by_region, "snp_count", gene_distance="end")
-            == validation["info_snps_downstream_2mb"]
-        )
-        assert (
-            summary_snps_by_region["snp_count"].sum()
-            == validation["info_snps_upstream_2mb"]
-            + validation["info_snps_in_gene"]
-            + validation["info_snps_downstream_2mb"]
-        )
 
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="start",
-                snp_risk_category="high_risk",
-                snp_inherited_from="female_partner",
-            )
-            == validation["high_risk_snps_upstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="within_gene",
-                snp_risk_category="high_risk",
-                snp_inherited_from="female_partner",
-            )
-            == validation["high_risk_within_gene_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="end",
-                snp_risk_category="high_risk",
-                snp_inherited_from="female_partner",
-            )
-            == validation["high_risk_snps_downstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="start",
-                snp_risk_category="low_risk",
-                snp_inherited_from="female_partner",
-            )
-            == validation["low_risk_snps_upstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="within_gene",
-                snp_risk_category="low_risk",
-                snp_inherited_from="female_partner",
-            )
-            == validation["low_risk_within_gene_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="end",
-                snp_risk_category="low_risk",
-                snp_inherited_from="female_partner",
-            )
-            == validation["low_risk_snps_downstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="start",
-                snp_risk_category="high_risk",
-                snp_inherited_from="male_partner",
-            )
-            == validation["high_risk_snps_upstream_2mb_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="within_gene",
-                snp_risk_category="high_risk",
-                snp_inherited_from="male_partner",
-            )
-            == validation["high_risk_within_gene_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="end",
-                snp_risk_category="high_risk",
-                snp_inherited_from="male_partner",
-            )
-            == validation["high_risk_snps_downstream_2mb_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="start",
-                snp_risk_category="low_risk",
-                snp_inherited_from="male_partner",
-            )
-            == validation["low_risk_snps_upstream_2mb_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="within_gene",
-                snp_risk_category="low_risk",
-                snp_inherited_from="male_partner",
-            )
-            == validation["low_risk_within_gene_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                informative_snps_by_region,
-                "snp_count",
-                gene_distance="end",
-                snp_risk_category="low_risk",
-                snp_inherited_from="male_partner",
-            )
-            == validation["low_risk_snps_downstream_2mb_from_male"]
-        )
+    tables = {
+        "summary_snps_by_region": summary_snps_by_region,
+        "informative_snps_by_region": informative_snps_by_region,
+    }
+    observed = [
+        pd.DataFrame(
+            [
+                {
+                    "metric": "num_snps",
+                    "expected": validation["num_snps"],
+                    "observed": number_snps_imported,
+                }
+            ]
+        )
+    ] + [
+        observed_metrics(tables[table_name], metrics)
+        for table_name, metrics in snp_metrics(mode, validation).items()
+        if not metrics.empty
+    ]
+    assert_metrics_match(pd.concat(observed, ignore_index=True), sample_id)
 
 
 def validate_embryo_results(
     mode, sample_id, embryo_id, embryo_count_data_df, all_validation
 ):
-    validation = all_validation[sample_id + "_" + embryo_id]
-    assert mode == validation["mode"]
-    assert sample_id == validation["sample_id"]
+    """
+    Validates the high & low risk SNP counts of an embryo.  Compares the produced results to the expected results as imported from the launch.json.
 
-    if mode == "autosomal_dominant" or mode == "x_linked":
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="upstream",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_upstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="within_gene",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_within_gene"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="downstream",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_downstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="upstream",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_upstream_2mb"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="within_gene",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_within_gene"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="downstream",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_downstream_2mb"]
-        )
-    elif mode == "autosomal_recessive":
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="upstream",
-                snp_inherited_from="female_partner",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_snps_upstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="within_gene",
-                snp_inherited_from="female_partner",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_within_gene_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="downstream",
-                snp_inherited_from="female_partner",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_snps_downstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="upstream",
-                snp_inherited_from="female_partner",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_snps_upstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="within_gene",
-                snp_inherited_from="female_partner",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_within_gene_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="downstream",
-                snp_inherited_from="female_partner",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_snps_downstream_2mb_from_female"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="upstream",
-                snp_inherited_from="male_partner",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_snps_upstream_2mb_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="within_gene",
-                snp_inherited_from="male_partner",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_within_gene_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="downstream",
-                snp_inherited_from="male_partner",
-                risk_category="high_risk",
-            )
-            == validation["high_risk_snps_downstream_2mb_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="upstream",
-                snp_inherited_from="male_partner",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_snps_upstream_2mb_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="within_gene",
-                snp_inherited_from="male_partner",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_within_gene_from_male"]
-        )
-        assert (
-            lookup_df_result(
-                embryo_count_data_df,
-                embryo_id + ".rhchp",
-                snp_position="downstream",
-                snp_inherited_from="male_partner",
-                risk_category="low_risk",
-            )
-            == validation["low_risk_snps_downstream_2mb_from_male"]
-        )
+    Arguments:
+        mode (str): The mode of inheritance being tested.
+        sample_id (str): The unique identifier for the sample.
+        embryo_id (str or list): The embryo, or a list of the embryos of the case which are all validated at once.
+        embryo_count_data_df (DataFrame): DataFrame containing the SNP counts of each embryo by gene region.
+        all_validation (dict): A dictionary containing validation results, keyed by sample_id + "_" + embryo_id.
+
+    Returns:
+        None
+
+    Raises:
+        AssertionError: Listing every result which does not match the expected results.
+    """
+    embryo_ids = [embryo_id] if isinstance(embryo_id, str) else embryo_id
+    embryo_validations = {
+        embryo_id: all_validation[sample_id + "_" + embryo_id]
+        for embryo_id in embryo_ids
+    }
+    for validation in embryo_validations.values():
+        assert mode == validation["mode"]
+        assert sample_id == validation["sample_id"]
+
+    observed = observed_metrics(
+        embryo_count_data_df, embryo_metrics(mode, embryo_validations)
+    )
+    assert_metrics_match(observed, f"{sample_id} {', '.join(embryo_ids)}")
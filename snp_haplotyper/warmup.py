@@ -0,0 +1,57 @@
+import os
+import sys
+import time
+
+import logging
+
+logger = logging.getLogger("BASHer_logger")
+
+# Add the directory containing this script to the PYTHOPATH
+sys.path.append(os.path.dirname(__file__))
+
+# The warm-up steps completed by this process, reported by the /basher/ready endpoint
+warmup_status = {
+    "reference_data": False,
+    "kaleido": False,
+}
+
+
+def warm_up_reference_data():
+    """Load the reference data & libraries shared by every case
+    Called in the gunicorn master before the workers are forked so that the workers share the rsID table, compiled
+    report template and imported plotting libraries copy-on-write rather than loading them on their first request.
+    """
+    start = time.perf_counter()
+    import snp_haplotype
+    import snp_plot
+
+    snp_haplotype.read_rsid_table()
+    snp_haplotype.report_template()
+    warmup_status["reference_data"] = True
+    logger.info(
+        f"Loaded BASHer reference data in {time.perf_counter() - start:.1f} seconds"
+    )
+
+
+def warm_up_kaleido():
+    """Export a dummy plot so that Kaleido's renderer is started before the first request
+    Kaleido runs its renderer in a subprocess which cannot be shared between processes, so this is called in each
+    worker after it has been forked.
+    """
+    import config
+
+    if config.static_plot_renderer != "kaleido":
+        # The static plots are written without Kaleido so there is nothing to start
+        warmup_status["kaleido"] = True
+        return
+    start = time.perf_counter()
+    import plotly.graph_objects as go
+
+    go.Figure(go.Scatter(x=[0, 1], y=[0, 1])).to_image(format="svg")
+    warmup_status["kaleido"] = True
+    logger.info(f"Started Kaleido in {time.perf_counter() - start:.1f} seconds")
+
+
+def is_ready():
+    """True once every warm-up step has been completed in this process"""
+    return all(warmup_status.values())
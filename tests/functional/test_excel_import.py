@@ -97,6 +97,8 @@ def test_informative_snps_excel_v1(name):
     basher_input_namespace, error_dictionary, input_ok_flag = excel_parser_main(
         test_args[name]
     )
+    # Only the summary tables are validated
+    basher_input_namespace.formats = ["json"]
 
     (
         mode_of_inheritance,
@@ -147,6 +149,8 @@ def test_informative_snps_excel_v2(name):
     basher_input_namespace, error_dictionary, input_ok_flag = excel_parser_main(
         test_args[name]
     )
+    # Only the summary tables are validated
+    basher_input_namespace.formats = ["json"]
 
     (
         mode_of_inheritance,
@@ -199,6 +203,8 @@ def test_embryo_categorization_excel_v1(name):
     (basher_input_namespace, error_dictionary, input_ok_flag) = excel_parser_main(
         test_args[sample_id]
     )
+    # Only the summary tables are validated
+    basher_input_namespace.formats = ["json"]
 
     (
         mode_of_inheritance,
@@ -250,6 +256,8 @@ def test_embryo_categorization_excel_v2(name):
     (basher_input_namespace, error_dictionary, input_ok_flag) = excel_parser_main(
         test_args[sample_id]
     )
+    # Only the summary tables are validated
+    basher_input_namespace.formats = ["json"]
 
     (
         mode_of_inheritance,
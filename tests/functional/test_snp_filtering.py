@@ -73,6 +73,7 @@ def setup_test_data(split_by_embryo=False):
                 flanking_region_size=arg_dictionary["flanking_region_size"],
                 consanguineous=True if "consanguineous" in arg_dictionary else False,
                 testing=True,
+                formats=["json"],  # Only the summary tables are validated
                 trio_only=True,
                 header_info=header_to_dict(arg_dictionary["header_info"]),
             )
@@ -108,6 +109,7 @@ def setup_test_data(split_by_embryo=False):
                 flanking_region_size=arg_dictionary["flanking_region_size"],
                 consanguineous=True if "consanguineous" in arg_dictionary else False,
                 testing=True,
+                formats=["json"],  # Only the summary tables are validated
                 trio_only=False,
                 header_info=header_to_dict(arg_dictionary["header_info"]),
             )
@@ -4,8 +4,62 @@ from pandas import testing as tm
 from autosomal_dominant_logic import autosomal_dominant_analysis
 from autosomal_recessive_logic import autosomal_recessive_analysis
 from snp_haplotype import annotate_distance_from_gene
-from exceptions import ArgumentInputError
+from exceptions import ArgumentInputError, ArrayUploadError
+from exceptions import ChunkChecksumError, ChunkOffsetError
 from merge_array_files import main as merge_array_files_main
+from trio_prescreen import prescreen_genes
+from snp_haplotype import classify_trio, filter_dataframe, flank_sensitivity_table
+from snp_haplotype import categorise_embryo_alleles, summarise_snps_per_embryo_pretty
+from snp_haplotype import BasherCase, embryo_category_matrix, embryo_matrix_categories
+import trio_cache
+import report_archive
+import chunked_upload
+import array_io
+import result_bundle
+from exceptions import ResultBundleError
+import job_manager
+import case_api
+import replay_cases
+import validate_output
+import logging_setup
+import artefact_store
+import janitor
+import blob_store
+import merge_array_files
+import cost_model
+import job_scheduler
+import progress
+import profiling
+import memory_limit
+from flask import Flask, session
+import logging
+from check_inputs import check_input
+import threading
+import signal
+import socket
+import subprocess
+import sys
+from exceptions import CaseBudgetError, CaseParameterError, JobNotFoundError
+from exceptions import CaseMemoryError, CaseProcessError
+import svg_plot
+import snp_plot
+from argparse import Namespace
+import numpy as np
+import json
+import xml.etree.ElementTree as ET
+import io
+import os
+import time
+import zipfile
+import gzip
+import hashlib
+import shutil
+
+try:
+    import pyarrow
+except ImportError:
+    # Parquet & Feather SNP array files are only tested if pyarrow can be imported
+    pyarrow = None
 
 # Test Autosomal_dominant logic
 
@@ -647,3 +701,1581 @@ def test_multifile_input_probesets_are_identical():
                 "test_data/autosomal_dominant/F5_COL1A1_AD.txt",
             ]
         )
+
+
+@pytest.fixture
+def setup_random_trio():
+    # A trio with random genotypes at 5000 SNPs spread over 20Mb of chromosome 1
+    rng = np.random.default_rng(0)
+    genotypes = ["AA", "BB", "AB"]
+    d = {
+        "probeset_id": list(range(5000)),
+        "Chr": ["1"] * 5000,
+        "Position": rng.integers(1, 20000000, 5000),
+        "male_partner": rng.choice(genotypes, 5000),
+        "female_partner": rng.choice(genotypes, 5000),
+        "reference": rng.choice(genotypes, 5000),
+    }
+    return d
+
+
+@pytest.mark.trio_prescreen
+def test_prescreen_matches_single_gene_counts(setup_random_trio):
+    results_df = classify_trio(
+        pd.DataFrame(data=setup_random_trio),
+        "autosomal_dominant",
+        "male_partner",
+        "affected",
+        "female_partner",
+        "unaffected",
+        "reference",
+        "affected",
+        "grandparent",
+        False,
+    )
+    genes_df = pd.DataFrame(
+        data={
+            "gene_symbol": ["GENE1", "GENE2"],
+            "chr": ["1", "1"],
+            "gene_start": [5000000, 12000000],
+            "gene_end": [5100000, 12500000],
+        }
+    )
+    prescreen_df = prescreen_genes(results_df, genes_df, "autosomal_dominant")
+
+    # Compare against the per gene annotation used by snp_haplotype.py
+    for gene in genes_df.itertuples():
+        annotated_df = annotate_distance_from_gene(
+            results_df.copy(), gene.chr, gene.gene_start, gene.gene_end
+        )
+        expected = (
+            annotated_df[annotated_df["snp_risk_category"] == "high_risk"]
+            .value_counts("gene_distance", sort=False)
+            .to_dict()
+        )
+        gene_df = prescreen_df[
+            (prescreen_df["gene_symbol"] == gene.gene_symbol)
+            & (prescreen_df["gene_distance"] != "total_snps")
+        ]
+        assert dict(zip(gene_df["gene_distance"], gene_df["high_risk"])) == expected
+
+
+@pytest.mark.flank_sensitivity
+def test_flank_sensitivity_matches_filtered_counts(setup_random_trio):
+    results_df = classify_trio(
+        pd.DataFrame(data=setup_random_trio),
+        "autosomal_dominant",
+        "male_partner",
+        "affected",
+        "female_partner",
+        "unaffected",
+        "reference",
+        "affected",
+        "grandparent",
+        False,
+    )
+    gene_start = 9000000
+    gene_end = 9200000
+    sensitivity_df = flank_sensitivity_table(
+        results_df, None, gene_start, gene_end, "autosomal_dominant"
+    ).set_index("flanking_region_size")
+
+    # Compare against filtering the SNPs for each flanking region size
+    for flanking_region_size in ["2mb", "3mb", "5mb", "10mb"]:
+        filtered_df = filter_dataframe(
+            results_df, gene_start, gene_end, flanking_region_size
+        )
+        assert (
+            sensitivity_df.at[flanking_region_size, "informative_snps"]
+            == (filtered_df["snp_risk_category"] != "uninformative").sum()
+        )
+
+
+@pytest.mark.incremental
+def test_incremental_embryos_match_single_run(setup_random_trio):
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(data=setup_random_trio)
+    df["rsID"] = "rs" + df["probeset_id"].astype(str)
+    for embryo in ["embryo_1", "embryo_2"]:
+        df[embryo] = rng.choice(["AA", "BB", "AB", "NoCall"], len(df))
+    df = filter_dataframe(df, 9000000, 9200000, "2mb")
+    df = annotate_distance_from_gene(df, "1", 9000000, 9200000)
+    results_df = classify_trio(
+        df,
+        "autosomal_recessive",
+        "male_partner",
+        "carrier",
+        "female_partner",
+        "carrier",
+        "reference",
+        "affected",
+        "child",
+        False,
+    )
+
+    def categorise(embryo_ids):
+        return categorise_embryo_alleles(
+            results_df,
+            "male_partner",
+            "female_partner",
+            embryo_ids,
+            ["unknown"] * len(embryo_ids),
+            "autosomal_recessive",
+            False,
+        )
+
+    # Both embryos analysed together
+    single_run_df = categorise(["embryo_1", "embryo_2"])
+    single_run_counts_df = summarise_snps_per_embryo_pretty(
+        single_run_df, ["embryo_1", "embryo_2"]
+    )
+
+    # embryo_2 added to the results of a case with only embryo_1
+    cached_df = categorise(["embryo_1"])
+    new_df = categorise(["embryo_2"])
+    merged_df = trio_cache.merge_embryo_categories(cached_df, new_df, ["embryo_2"])
+    merged_counts_df = trio_cache.merge_embryo_counts(
+        summarise_snps_per_embryo_pretty(cached_df, ["embryo_1"]),
+        summarise_snps_per_embryo_pretty(new_df, ["embryo_2"]),
+        ["embryo_2"],
+    )
+
+    tm.assert_frame_equal(
+        merged_df[single_run_df.columns],
+        single_run_df.reset_index(drop=True),
+    )
+    tm.assert_frame_equal(
+        merged_counts_df[single_run_counts_df.columns],
+        single_run_counts_df,
+        check_dtype=False,
+    )
+
+
+@pytest.mark.incremental
+def test_trio_cache_key_ignores_embryos(setup_random_trio):
+    df = pd.DataFrame(data=setup_random_trio)
+    args = Namespace(
+        mode_of_inheritance="autosomal_dominant",
+        male_partner="male_partner",
+        female_partner="female_partner",
+        reference="reference",
+        embryo_ids=["embryo_1"],
+    )
+    key = trio_cache.trio_cache_key(df, args)
+
+    # Adding an embryo does not change the key, changing the trio does
+    assert trio_cache.trio_cache_key(df.assign(embryo_1="AB"), args) == key
+    df.loc[0, "reference"] = "NoCall"
+    assert trio_cache.trio_cache_key(df, args) != key
+
+
+@pytest.fixture
+def setup_basher_case(setup_random_trio):
+    df = pd.DataFrame(data=setup_random_trio)
+    df["rsID"] = "rs" + df["probeset_id"].astype(str)
+    df["embryo_1"] = "AB"
+    args = Namespace(
+        mode_of_inheritance="autosomal_dominant",
+        output_prefix="test_case",
+        male_partner="male_partner",
+        male_partner_status="affected",
+        female_partner="female_partner",
+        female_partner_status="unaffected",
+        reference="reference",
+        reference_status="affected",
+        reference_relationship="grandparent",
+        embryo_ids=["embryo_1"],
+        embryo_sex=["unknown"],
+        chr="1",
+        gene_start=9000000,
+        gene_end=9200000,
+        flanking_region_size="2mb",
+        consanguineous=False,
+        trio_only=False,
+    )
+    # The annotated SNP array data, provided directly rather than importing it from a file
+    window_df = annotate_distance_from_gene(
+        filter_dataframe(df, 9000000, 9200000, "2mb"), "1", 9000000, 9200000
+    )
+    return args, window_df
+
+
+@pytest.mark.incremental
+def test_incremental_run_reanalyses_changed_embryos(
+    setup_basher_case, tmp_path, monkeypatch
+):
+    monkeypatch.setattr(trio_cache, "trio_cache_folder", str(tmp_path))
+    args, window_df = setup_basher_case
+    args.incremental = True
+
+    def run(df):
+        case = BasherCase(args)
+        case.imported_df = df
+        case.window_df = df
+        embryo_count_data_df = case.embryo_count_data_df
+        case.update_trio_cache()
+        return case, embryo_count_data_df
+
+    first_case, first_counts_df = run(window_df)
+    assert first_case.cached_case is None
+    # embryo_1 is biopsied again, so its results are recalculated rather than taken from the cache
+    rebiopsied_df = window_df.assign(embryo_1="AA")
+    case, counts_df = run(rebiopsied_df)
+    assert case.cached_case is not None
+    assert case.input_embryo_ids == ["embryo_1"]
+    assert case.embryo_ids == ["embryo_1"]
+    single_run_case = BasherCase(Namespace(**vars(args) | {"incremental": False}))
+    single_run_case.window_df = rebiopsied_df
+    tm.assert_frame_equal(
+        counts_df, single_run_case.embryo_count_data_df, check_dtype=False
+    )
+    assert not counts_df.equals(first_counts_df)
+    # An unchanged embryo is taken from the cache, and one whose sex is corrected is analysed again
+    case, cached_counts_df = run(rebiopsied_df)
+    assert case.input_embryo_ids == []
+    tm.assert_frame_equal(cached_counts_df, counts_df)
+    args.embryo_sex = ["male"]
+    case, counts_df = run(rebiopsied_df)
+    assert case.input_embryo_ids == ["embryo_1"]
+    assert case.embryo_sex == ["male"]
+
+
+@pytest.mark.basher_case
+def test_basher_case_only_computes_accessed_stages(setup_basher_case):
+    args, window_df = setup_basher_case
+    case = BasherCase(args)
+    case.window_df = window_df
+
+    summary_snps_by_region = case.summary_snps_by_region
+    assert summary_snps_by_region is case.summary_snps_by_region
+    assert "results_df" in vars(case)
+    for stage in ["window_embryo_category_df", "embryo_count_data_df", "plots"]:
+        assert stage not in vars(case)
+
+
+@pytest.mark.basher_case
+def test_basher_case_json_format_skips_reports(setup_basher_case):
+    args, window_df = setup_basher_case
+    args.formats = ["json"]
+    case = BasherCase(args)
+    case.window_df = window_df
+    case.number_snps_imported = len(window_df)
+
+    assert case.html_string is None
+    assert case.pdf_string is None
+    assert case.plots == ([], [])
+    results = json.loads(case.json_string)
+    assert results["sample_id"] == "test_case"
+    assert sum(row["snp_count"] for row in results["summary_snps_by_region"]) == (
+        case.summary_snps_by_region["snp_count"].sum()
+    )
+    assert len(results["embryo_count_data"]) == len(case.embryo_count_data_df)
+
+
+@pytest.mark.svg_plot
+def test_svg_plot_draws_each_category_once(setup_basher_case):
+    args, window_df = setup_basher_case
+    args.formats = ["pdf"]
+    case = BasherCase(args)
+    case.window_df = window_df
+
+    svg = svg_plot.plot_results(
+        case.embryo_category_df,
+        case.embryo_ids,
+        case.embryo_sex,
+        case.gene_start,
+        case.gene_end,
+        args.mode_of_inheritance,
+        case.embryo_count_data_df,
+        args.flanking_region_size,
+    )[0]
+    # The SVG must be well formed XML to be embedded in the PDF report
+    root = ET.fromstring(svg)
+    paths = root.findall("{http://www.w3.org/2000/svg}path[@class]")
+    categories = case.embryo_category_df["embryo_1_risk_category"].dropna().unique()
+    assert sorted(path.get("class") for path in paths) == sorted(categories)
+    for path in paths:
+        if path.get("class") == "NoCall":
+            continue
+        # One vertical tick per distinct SNP position, as ticks within a tenth of a pixel are merged
+        category_df = case.embryo_category_df[
+            case.embryo_category_df["embryo_1_risk_category"] == path.get("class")
+        ]
+        assert 0 < path.get("d").count("M") <= category_df["Position"].nunique()
+    assert case.plots[1] == [svg]
+
+
+@pytest.mark.scalable_plot
+def test_scalable_plot_keeps_informative_snps(setup_basher_case):
+    args, window_df = setup_basher_case
+    case = BasherCase(args)
+    case.window_df = window_df
+    df = case.embryo_category_df
+
+    fig = snp_plot.embryo_figure(
+        df,
+        "embryo_1",
+        "unknown",
+        case.gene_start,
+        case.gene_end,
+        args.mode_of_inheritance,
+        case.embryo_count_data_df,
+        2000000,
+        plot_mode="scalable",
+    )
+    category_counts = df["embryo_1_risk_category"].value_counts()
+    for trace in fig.data:
+        if trace.type == "scattergl":
+            # Informative SNPs are plotted individually so they can be hovered over
+            assert len(trace.x) == category_counts[trace.name]
+        elif trace.type == "heatmap":
+            assert trace.name in snp_plot.density_categories
+            assert sum(count for count in trace.z[0] if count is not None) == (
+                category_counts[trace.name]
+            )
+
+
+@pytest.mark.overview_plot
+def test_embryo_category_matrix_omits_uninformative_snps(setup_basher_case):
+    args, window_df = setup_basher_case
+    case = BasherCase(args)
+    case.window_df = window_df
+    df = case.embryo_category_df
+
+    positions, codes = embryo_category_matrix(
+        df, case.embryo_ids, args.mode_of_inheritance
+    )[None]
+    informative_df = df[df["embryo_1_risk_category"] != "uninformative"]
+    assert codes.shape == (1, len(informative_df))
+    assert (positions == np.sort(informative_df["Position"].to_numpy())).all()
+    assert sorted(
+        (embryo_matrix_categories[code] if code >= 0 else None for code in codes[0]),
+        key=str,
+    ) == sorted(informative_df["embryo_1_risk_category"], key=str)
+
+
+@pytest.mark.overview_plot
+def test_overview_plot_without_embryo_plots(setup_basher_case):
+    args, window_df = setup_basher_case
+    args.formats = ["pdf"]
+    args.embryo_plots = False
+    case = BasherCase(args)
+    case.window_df = window_df
+
+    assert case.plots == ([], [])
+    overview_as_html, overview_as_pdf = case.overview_plots
+    assert overview_as_html is None
+    # One path per category drawn in the overview, which must be well formed XML to be embedded in the PDF report
+    root = ET.fromstring(overview_as_pdf)
+    paths = root.findall("{http://www.w3.org/2000/svg}path[@class]")
+    categories = case.embryo_category_df["embryo_1_risk_category"].dropna().unique()
+    assert sorted(path.get("class") for path in paths) == sorted(
+        category for category in categories if category != "uninformative"
+    )
+
+
+@pytest.mark.report_archive
+def test_stream_zip_matches_reports(tmp_path, monkeypatch):
+    # A small chunk size so the reports are streamed over several chunks
+    monkeypatch.setattr(report_archive, "zip_chunk_size", 1024)
+    reports = {
+        "case.html": "<html>" + "SNP " * 10000 + "</html>",
+        "case.json": json.dumps({"embryo_count_data": list(range(1000))}),
+    }
+    for name, content in reports.items():
+        (tmp_path / name).write_text(content)
+
+    chunks = list(
+        report_archive.stream_zip(
+            [(str(tmp_path / name), f"reports/{name}") for name in reports]
+        )
+    )
+    assert len(chunks) > len(reports)
+    with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zip_file:
+        assert zip_file.testzip() is None
+        assert {name: zip_file.read(name).decode() for name in zip_file.namelist()} == {
+            f"reports/{name}": content for name, content in reports.items()
+        }
+
+
+@pytest.mark.report_archive
+def test_purge_expired_reports_keeps_recent_reports(tmp_path):
+    expired_time = time.time() - 31 * 24 * 60 * 60
+    (tmp_path / "20230101-120000").mkdir()
+    (tmp_path / "20230101-120000" / "array.txt").write_text("probeset_id")
+    (tmp_path / "case_20230101-120000.html").write_text("<html></html>")
+    (tmp_path / "case_20230102-120000.html").write_text("<html></html>")
+    for name in ["20230101-120000", "case_20230101-120000.html"]:
+        os.utime(tmp_path / name, (expired_time, expired_time))
+
+    purged = report_archive.purge_expired_reports(str(tmp_path), retention_days=30)
+    assert sorted(os.path.basename(path) for path in purged) == [
+        "20230101-120000",
+        "case_20230101-120000.html",
+    ]
+    assert os.listdir(tmp_path) == ["case_20230102-120000.html"]
+
+
+@pytest.mark.chunked_upload
+def test_chunked_upload_resumes_gzip_upload(tmp_path, monkeypatch):
+    monkeypatch.setattr(chunked_upload, "upload_chunk_size", 1000)
+    array_text = "Probeset ID\tChr\tPosition\tmale_partner\n" + "".join(
+        f"AX-{i}\t1\t{i * 100}\tAB\n" for i in range(2000)
+    )
+    compressed = gzip.compress(array_text.encode())
+    upload = chunked_upload.ChunkedUpload.start(
+        str(tmp_path), "array.txt.gz", len(compressed)
+    )
+
+    def send(offset, checksum=None):
+        chunk = compressed[offset : offset + 1000]
+        upload.write_chunk(offset, chunk, checksum or hashlib.sha256(chunk).hexdigest())
+
+    with pytest.raises(ChunkChecksumError):
+        send(0, checksum="0" * 64)
+    assert upload.offset == 0
+    send(0)
+    # The header is parsed from the first chunk
+    assert upload.status()["columns"][0] == "Probeset ID"
+    with pytest.raises(ChunkOffsetError) as error:
+        send(0)
+    assert error.value.offset == 1000
+    # Resume as another worker process, which rebuilds the scanner from the chunks on disk
+    chunked_upload.evict_scanners(max_idle_seconds=0)
+    upload = chunked_upload.ChunkedUpload(str(tmp_path), upload.upload_id)
+    for offset in range(upload.offset, len(compressed), 1000):
+        send(offset)
+
+    status = chunked_upload.ChunkedUpload(str(tmp_path), upload.upload_id).status()
+    assert status["complete"] and status["probe_rows"] == 2000
+    case_folder = tmp_path / "case"
+    case_folder.mkdir()
+    path = upload.move_to(str(case_folder))
+    assert os.path.basename(path) == "array.txt"
+    assert open(path).read() == array_text
+    with pytest.raises(ArrayUploadError):
+        chunked_upload.ChunkedUpload(str(tmp_path), upload.upload_id)
+
+
+@pytest.mark.chunked_upload
+def test_chunked_upload_saves_a_resent_chunk_once(tmp_path, monkeypatch):
+    array_text = b"Probeset ID\tChr\n" + b"".join(b"AX-%d\t1\n" % i for i in range(100))
+    upload = chunked_upload.ChunkedUpload.start(
+        str(tmp_path), "array.txt", len(array_text)
+    )
+    feed = chunked_upload.ArrayFileScanner.feed
+
+    def slow_feed(scanner, chunk):
+        time.sleep(0.05)
+        feed(scanner, chunk)
+
+    monkeypatch.setattr(chunked_upload.ArrayFileScanner, "feed", slow_feed)
+    errors = []
+
+    def send():
+        try:
+            chunked_upload.ChunkedUpload(str(tmp_path), upload.upload_id).write_chunk(
+                0, array_text, hashlib.sha256(array_text).hexdigest()
+            )
+        except ChunkOffsetError as error:
+            errors.append(error)
+
+    # The same chunk is received by several threads at once, it is saved by the first & rejected by the others
+    threads = [threading.Thread(target=send) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 3
+    status = chunked_upload.ChunkedUpload(str(tmp_path), upload.upload_id).status()
+    assert status["complete"] and status["probe_rows"] == 100
+    assert open(upload.path, "rb").read() == array_text
+
+
+@pytest.mark.chunked_upload
+def test_chunked_upload_scanners_are_closed_when_idle_or_purged(tmp_path):
+    chunk = b"Probeset ID\tChr\nAX-1\t1\n"
+    abandoned, purged = [
+        chunked_upload.ChunkedUpload.start(str(tmp_path), "array.txt", 1000)
+        for i in range(2)
+    ]
+    for upload in [abandoned, purged]:
+        upload.write_chunk(0, chunk, hashlib.sha256(chunk).hexdigest())
+    scanners = {
+        upload.upload_id: chunked_upload._scanners[upload.upload_id]
+        for upload in [abandoned, purged]
+    }
+    # The janitor removes the folder of an upload received by this worker
+    shutil.rmtree(purged.folder)
+    assert chunked_upload.evict_scanners() == 1
+    assert scanners[purged.upload_id].output.closed
+    assert not scanners[abandoned.upload_id].output.closed
+    assert chunked_upload.evict_scanners(max_idle_seconds=0) == 1
+    assert scanners[abandoned.upload_id].output.closed
+    assert chunked_upload._scanners == {}
+    # An upload resumed after its scanner was closed is rebuilt from the data on disk
+    status = chunked_upload.ChunkedUpload(str(tmp_path), abandoned.upload_id).status()
+    assert status["probe_rows"] == 1 and status["offset"] == len(chunk)
+    abandoned.delete()
+
+
+@pytest.mark.chunked_upload
+def test_chunked_upload_rejects_files_which_are_not_snp_arrays(tmp_path):
+    with pytest.raises(ArrayUploadError):
+        chunked_upload.ChunkedUpload.start(str(tmp_path), "sample_sheet.xlsm", 100)
+    chunk = b"Sample\tGenotype\nE1\tAB\n"
+    upload = chunked_upload.ChunkedUpload.start(str(tmp_path), "array.txt", 1000)
+    with pytest.raises(ArrayUploadError):
+        upload.write_chunk(0, chunk, hashlib.sha256(chunk).hexdigest())
+    # The upload is deleted as it cannot be resumed
+    assert os.listdir(tmp_path) == []
+
+
+@pytest.fixture
+def setup_array_file(setup_random_trio):
+    df = pd.DataFrame(data=setup_random_trio).rename(
+        columns={"probeset_id": "Probeset ID"}
+    )
+    df["Chr"] = 1
+    df["embryo_1"] = "AB"
+    df["other_sample"] = "BB"
+    return df
+
+
+@pytest.mark.array_io
+@pytest.mark.parametrize("compression", [None, "gzip", "zstd"])
+def test_read_array_file_detects_compressed_text(
+    setup_array_file, tmp_path, compression
+):
+    if compression == "zstd":
+        pytest.importorskip("zstandard")
+    # The extension does not say the file is compressed, the format is detected from the file
+    path = tmp_path / "array.txt"
+    setup_array_file.to_csv(path, sep="\t", index=False, compression=compression)
+    assert array_io.array_file_format(str(path)) == (compression or "text")
+    tm.assert_frame_equal(
+        array_io.read_array_file(str(path)), setup_array_file, check_dtype=False
+    )
+
+
+@pytest.mark.array_io
+@pytest.mark.skipif(pyarrow is None, reason="pyarrow cannot be imported")
+@pytest.mark.parametrize("array_format", ["parquet", "feather"])
+def test_read_array_file_projects_columnar_files(
+    setup_array_file, tmp_path, array_format
+):
+    path = tmp_path / f"array.{array_format}"
+    getattr(setup_array_file, f"to_{array_format}")(path)
+    assert array_io.array_file_format(str(path)) == array_format
+    args = Namespace(
+        male_partner="male_partner",
+        female_partner="female_partner",
+        reference="reference",
+        embryo_ids=["embryo_1"],
+    )
+    df = array_io.read_array_file(str(path), columns=array_io.case_columns(args))
+    # Only the case's samples are imported
+    assert "other_sample" not in df.columns
+    tm.assert_frame_equal(
+        df, setup_array_file.drop(columns=["other_sample"]), check_dtype=False
+    )
+
+
+@pytest.mark.result_bundle
+@pytest.mark.skipif(pyarrow is None, reason="pyarrow cannot be imported")
+def test_result_bundle_round_trip(setup_basher_case, tmp_path):
+    args, window_df = setup_basher_case
+    args.input_file = str(tmp_path / "array.txt")
+    window_df.to_csv(args.input_file, sep="\t", index=False)
+    case = BasherCase(args)
+    case.window_df = window_df
+    case.timed_stage("embryo_category_df")
+
+    bundle_path = str(tmp_path / "test_case_bundle")
+    result_bundle.write_result_bundle(case, bundle_path, case.stage_seconds)
+    manifest, tables = result_bundle.load_result_bundle(bundle_path)
+    assert manifest["parameters"]["output_prefix"] == "test_case"
+    assert manifest["input_file"]["sha256"] == result_bundle.file_sha256(
+        args.input_file
+    )
+    assert "embryo_category_df" in manifest["stage_seconds"]
+    # The flank sensitivity table was not requested so is not saved
+    assert "flank_sensitivity" not in tables
+    tm.assert_frame_equal(tables["embryo_categories"], case.embryo_category_df)
+    tm.assert_frame_equal(tables["qc"], case.qc_df)
+
+    # A table which has been changed since the bundle was written is not loaded
+    tables["qc"].iloc[:1].to_parquet(os.path.join(bundle_path, "qc.parquet"))
+    with pytest.raises(ResultBundleError):
+        result_bundle.load_result_bundle(bundle_path)
+
+    # Running the case again replaces the existing bundle, leaving no temporary folders behind
+    result_bundle.write_result_bundle(case, bundle_path, case.stage_seconds)
+    manifest, tables = result_bundle.load_result_bundle(bundle_path)
+    tm.assert_frame_equal(tables["qc"], case.qc_df)
+    assert sorted(os.listdir(tmp_path)) == ["array.txt", "test_case_bundle"]
+
+
+@pytest.fixture
+def setup_api_parameters():
+    # The parameters of a case submitted to the API, named as the snp_haplotype.py command line options
+    return {
+        "mode_of_inheritance": "autosomal_dominant",
+        "output_prefix": "test_case",
+        "male_partner": "male_partner",
+        "male_partner_status": "affected",
+        "female_partner": "female_partner",
+        "female_partner_status": "unaffected",
+        "reference": "reference",
+        "reference_status": "affected",
+        "reference_relationship": "grandparent",
+        "embryo_ids": ["embryo_1", "embryo_2"],
+        "embryo_sex": ["male", "female"],
+        "gene_symbol": "BRCA2",
+        "chr": "13",
+        "gene_start": 32315086,
+        "gene_end": 32400268,
+        "flanking_region_size": "2mb",
+        "consanguineous": False,
+        "embryo_plots": False,
+        "header_info": "PRU=1;Hospital No=2;Biopsy No=3",
+    }
+
+
+@pytest.mark.rest_api
+def test_parameters_to_args_matches_command_line(setup_api_parameters):
+    args = job_manager.parameters_to_args(setup_api_parameters, "array.txt")
+    assert args.input_file == "array.txt"
+    assert args.embryo_ids == ["embryo_1", "embryo_2"]
+    assert args.gene_start == 32315086
+    assert args.embryo_plots is False
+    # Options which are not given take the command line defaults
+    assert args.plot_mode == "standard"
+    assert args.result_bundle is True
+
+    with pytest.raises(CaseParameterError, match="invalid choice"):
+        job_manager.parameters_to_args(
+            setup_api_parameters | {"chr": "99"}, "array.txt"
+        )
+    with pytest.raises(CaseParameterError, match="set by the API"):
+        job_manager.parameters_to_args(
+            setup_api_parameters | {"output_folder": "/"}, "array.txt"
+        )
+
+
+@pytest.mark.rest_api
+def test_job_manager_records_failed_case(setup_api_parameters, tmp_path):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    upload_folder = tmp_path / "uploads"
+    upload_folder.mkdir()
+    jobs = job_manager.JobManager(str(upload_folder), store)
+    case_id, case_folder = jobs.create_job()
+    # The SNP array file is missing, so the case fails when it is run
+    args = job_manager.parameters_to_args(
+        setup_api_parameters, os.path.join(case_folder, "array.txt")
+    )
+    args.formats = []
+    assert jobs.submit(case_id, args)["status"] == "queued"
+    jobs.scheduler.shutdown(wait=True)
+
+    job = jobs.status(case_id)
+    assert job["status"] == "failed"
+    assert "FileNotFoundError" in job["error"]
+    assert job["parameters"]["output_folder"] == case_folder
+    with pytest.raises(JobNotFoundError):
+        jobs.table(case_id, "qc")
+    with pytest.raises(JobNotFoundError):
+        jobs.status("0" * 32)
+    # IDs which are not job IDs are never used as paths
+    with pytest.raises(JobNotFoundError):
+        jobs.status("../" + os.path.basename(case_folder))
+
+
+@pytest.mark.case_api
+def test_case_spec_round_trips_arguments(setup_basher_case):
+    args, window_df = setup_basher_case
+    args.gene_symbol = "GENE1"
+    spec = case_api.CaseSpec.from_args(args)
+    assert spec.sample_id == "test_case"
+    assert spec.embryo_ids == ("embryo_1",)
+    case_args = spec.to_args("array.txt", ["json"])
+    for parameter, value in vars(args).items():
+        assert getattr(case_args, parameter) == value
+    assert case_api.CaseSpec.from_args(case_args) == spec
+
+    # A trio only case has no embryos
+    trio_spec = case_api.CaseSpec.from_args(
+        Namespace(**vars(args) | {"trio_only": True})
+    )
+    assert trio_spec.trio_only and trio_spec.to_args("array.txt").trio_only
+
+    with pytest.raises(CaseParameterError):
+        case_api.run_case(
+            case_api.CaseSpec.from_args(Namespace(**vars(args) | {"chr": "99"})),
+            "array.txt",
+        )
+    with pytest.raises(CaseParameterError):
+        case_api.run_case(spec, "array.txt", formats=["docx"])
+
+
+@pytest.mark.case_api
+def test_basher_case_stages_run_in_parallel(setup_basher_case):
+    args, window_df = setup_basher_case
+    both_started = threading.Barrier(2, timeout=10)
+
+    class BlockingCase(BasherCase):
+        # Each case waits in the same stage for the other, which deadlocks if the stage holds a lock for every case
+        @property
+        def imported_df(self):
+            both_started.wait()
+            return window_df
+
+    cases = [BlockingCase(args), BlockingCase(args)]
+    threads = [
+        threading.Thread(target=lambda case=case: case.number_snps_imported)
+        for case in cases
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not both_started.broken
+    assert [case.number_snps_imported for case in cases] == [len(window_df)] * 2
+
+
+@pytest.mark.replay
+def test_diff_table_classifies_differences():
+    old_df = pd.DataFrame(
+        {
+            "gene_distance": ["within_gene", "0-1MB_from_end", "1-2MB_from_end"],
+            "snp_count": [10, 20, 30],
+            "percentage": [0.1, 0.2, 0.3],
+        }
+    )
+    diff_table = replay_cases.diff_table
+    assert diff_table(old_df, old_df.copy())["classification"] == "identical"
+    assert (
+        diff_table(old_df, old_df.astype({"snp_count": float}))["classification"]
+        == "dtype"
+    )
+    assert diff_table(old_df, old_df.iloc[::-1])["classification"] == "row_order"
+    rounded_df = old_df.assign(percentage=old_df["percentage"] * (1 + 1e-12))
+    assert diff_table(old_df, rounded_df)["classification"] == "tolerance"
+    assert diff_table(old_df, old_df.iloc[:2])["classification"] == "shape"
+    assert diff_table(None, old_df)["classification"] == "added"
+    assert diff_table(old_df, None)["classification"] == "missing"
+
+    changed_df = old_df.copy()
+    changed_df.loc[1, "snp_count"] = 21
+    diff = diff_table(old_df, changed_df)
+    assert diff["classification"] == "changed"
+    assert diff["differing_cells"] == 1
+    assert diff["examples"] == [{"row": 1, "column": "snp_count", "old": 20, "new": 21}]
+    # Every example can be saved in the JSON report
+    json.dumps(diff)
+
+    assert (
+        replay_cases.case_status(
+            {"qc": {"classification": "identical"}, "x": {"classification": "dtype"}}
+        )
+        == "equivalent"
+    )
+
+
+@pytest.mark.validate_output
+def test_validate_output_reports_every_mismatch():
+    embryo_count_data_df = pd.DataFrame(
+        {
+            "snp_position": ["upstream", "upstream", "within_gene", "downstream"] * 2,
+            "risk_category": ["high_risk"] * 4 + ["low_risk"] * 4,
+            "snp_inherited_from": ["female_partner"] * 8,
+            "E1.rhchp": [1, 2, 3, 4, 5, 6, 7, 8],
+            "E2.rhchp": [0, 1, 0, 1, 0, 1, 0, 1],
+        }
+    )
+    # The vectorised lookup matches filtering & summing each metric separately
+    assert validate_output.lookup_df_result(
+        embryo_count_data_df,
+        "E1.rhchp",
+        snp_position="upstream",
+        risk_category="high_risk",
+        snp_inherited_from="female",
+    ) == (1 + 2)
+    assert (
+        validate_output.lookup_df_result(
+            embryo_count_data_df, "E1.rhchp", snp_inherited_from="male"
+        )
+        == 0
+    )
+
+    def expected(embryo_column):
+        counts = embryo_count_data_df.groupby(["risk_category", "snp_position"])[
+            embryo_column
+        ].sum()
+        return {
+            "mode": "autosomal_dominant",
+            "sample_id": "case",
+            **{
+                f"{risk}_{region}": int(counts[(risk, position)])
+                for risk in ["high_risk", "low_risk"]
+                for region, position in validate_output.embryo_regions.items()
+            },
+        }
+
+    all_validation = {"case_E1": expected("E1.rhchp"), "case_E2": expected("E2.rhchp")}
+    validate_output.validate_embryo_results(
+        "autosomal_dominant", "case", ["E1", "E2"], embryo_count_data_df, all_validation
+    )
+    validate_output.validate_embryo_results(
+        "autosomal_dominant", "case", "E2", embryo_count_data_df, all_validation
+    )
+
+    all_validation["case_E1"]["high_risk_upstream_2mb"] += 1
+    all_validation["case_E2"]["low_risk_downstream_2mb"] += 1
+    with pytest.raises(AssertionError) as error:
+        validate_output.validate_embryo_results(
+            "autosomal_dominant",
+            "case",
+            ["E1", "E2"],
+            embryo_count_data_df,
+            all_validation,
+        )
+    # Both mismatches are reported by the one comparison
+    assert str(error.value).startswith("2 of 12 metrics")
+    assert "high_risk_upstream_2mb" in str(error.value)
+    assert "low_risk_downstream_2mb" in str(error.value)
+
+
+@pytest.mark.validate_output
+def test_validate_snp_results_autosomal_recessive():
+    summary_snps_by_region = pd.DataFrame(
+        {
+            "gene_distance": ["1-2MB_from_start", "within_gene", "0-1MB_from_end"],
+            "snp_count": [4, 5, 6],
+        }
+    )
+    informative_snps_by_region = pd.DataFrame(
+        {
+            "gene_distance": ["0-1MB_from_start", "within_gene", "1-2MB_from_end"] * 2,
+            "snp_risk_category": ["high_risk"] * 3 + ["low_risk"] * 3,
+            "snp_inherited_from": ["female_partner"] * 3 + ["male_partner"] * 3,
+            "snp_count": [1, 2, 3, 4, 5, 6],
+        }
+    )
+    validation = {
+        "mode": "autosomal_recessive",
+        "sample_id": "case",
+        "num_snps": 100,
+        "info_snps_upstream_2mb": 4,
+        "info_snps_in_gene": 5,
+        "info_snps_downstream_2mb": 6,
+    }
+    for partner, suffix in validate_output.partners.items():
+        for risk in ["high_risk", "low_risk"]:
+            matches = (informative_snps_by_region["snp_inherited_from"] == partner) & (
+                informative_snps_by_region["snp_risk_category"] == risk
+            )
+            counts = (
+                informative_snps_by_region[matches]["snp_count"].tolist() or [0] * 3
+            )
+            validation[f"{risk}_snps_upstream_2mb_from_{suffix}"] = counts[0]
+            validation[f"{risk}_within_gene_from_{suffix}"] = counts[1]
+            validation[f"{risk}_snps_downstream_2mb_from_{suffix}"] = counts[2]
+    validate_output.validate_snp_results(
+        "autosomal_recessive",
+        "case",
+        100,
+        summary_snps_by_region,
+        informative_snps_by_region,
+        {"case": validation},
+    )
+    with pytest.raises(AssertionError, match="num_snps") as error:
+        validate_output.validate_snp_results(
+            "autosomal_recessive",
+            "case",
+            99,
+            summary_snps_by_region,
+            informative_snps_by_region,
+            {"case": validation | {"high_risk_within_gene_from_male": 1}},
+        )
+    assert str(error.value).startswith("2 of 17 metrics")
+
+
+@pytest.mark.logging_setup
+def test_errors_are_collected_per_request(setup_api_parameters):
+    logger = logging.getLogger("BASHer_logger")
+    collected = {}
+
+    def request(name, errors):
+        with logging_setup.collect_errors() as error_dict:
+            for error in errors:
+                logger.error(error)
+            collected[name] = error_dict
+
+    threads = [
+        threading.Thread(target=request, args=("first", ["first error"] * 2)),
+        threading.Thread(target=request, args=("second", ["second error"])),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert collected == {"first": {"first error": 2}, "second": {"second error": 1}}
+
+    # Errors of nested blocks are also added to the outer block, errors outside any block are not collected
+    logger.error("not collected")
+    with logging_setup.collect_errors() as outer_errors:
+        with logging_setup.collect_errors() as inner_errors:
+            logger.error("inner error")
+    assert inner_errors == outer_errors == {"inner error": 1}
+
+    # Errors from a previous check are not returned by the next one
+    args = job_manager.parameters_to_args(setup_api_parameters, "array.txt")
+    args.consanguineous = "maybe"
+    error_dictionary, input_ok_flag = check_input(args, "array.txt")
+    assert not input_ok_flag
+    assert error_dictionary
+    args.consanguineous = False
+    assert check_input(args, "array.txt") == ({}, True)
+
+
+@pytest.mark.logging_setup
+def test_configure_logging_queues_records_once_per_process(tmp_path):
+    logger = logging.getLogger("BASHer_logger")
+    saved_level = logger.level
+    saved_queue_logging = dict(logging_setup.queue_logging)
+    # Configure the logging of a fresh process
+    logging_setup.queue_logging.update(pid=None, handler=None, listener=None)
+    log_file = tmp_path / "basher_error.log"
+    try:
+        logging_setup.configure_logging(str(log_file))
+        handler = logging_setup.queue_logging["handler"]
+        logging_setup.configure_logging(str(log_file))
+        assert logging_setup.queue_logging["handler"] is handler
+        assert logger.handlers.count(handler) == 1
+        with logging_setup.case_context("job123"):
+            logger.info("case record")
+        logger.info("service record")
+    finally:
+        logging_setup.stop_logging()
+        logging_setup.queue_logging.update(saved_queue_logging)
+        logger.setLevel(saved_level)
+    lines = log_file.read_text().splitlines()
+    assert lines[0].endswith(" - INFO - job123 - case record")
+    assert lines[1].endswith(" - INFO - - - service record")
+
+
+@pytest.mark.artefact_store
+def test_artefact_store_expires_sessions_and_jobs(tmp_path):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    assert store.connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    store.save_session("current", "{}", time.time() + 60)
+    store.save_session("expired", "{}", time.time() - 1)
+    assert store.load_session("current") == "{}"
+    assert store.load_session("expired") is None
+    assert store.count_sessions() == 1
+    assert store.delete_expired_sessions() == 1
+
+    store.update_job("old", time.time() - 1, status="complete")
+    job = store.update_job("new", time.time() + 60, status="queued")
+    assert store.update_job("new", time.time() + 60, status="running") == job | {
+        "status": "running"
+    }
+    assert store.expired_jobs() == ["old"]
+    assert store.active_jobs() == ["new"]
+    assert store.job_counts() == {"complete": 1, "running": 1}
+
+    store.add_metrics(janitor_reclaimed_bytes=10)
+    store.add_metrics(janitor_reclaimed_bytes=5)
+    store.set_metrics(upload_folder_bytes=3)
+    store.set_metrics(upload_folder_bytes=2)
+    assert store.metrics() == {"janitor_reclaimed_bytes": 15, "upload_folder_bytes": 2}
+
+    # A lease is only held by one worker until it expires
+    assert store.acquire_lease("janitor", "worker_1", 60)
+    assert store.acquire_lease("janitor", "worker_1", 60)
+    assert not store.acquire_lease("janitor", "worker_2", 60)
+    assert store.acquire_lease("expiring", "worker_1", -1)
+    assert store.acquire_lease("expiring", "worker_2", 60)
+
+
+@pytest.mark.artefact_store
+def test_store_session_interface_only_saves_changed_sessions(tmp_path):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    app = Flask(__name__)
+    app.config["SECRET_KEY"] = "test"
+    app.session_interface = artefact_store.StoreSessionInterface(store)
+
+    @app.route("/read")
+    def read():
+        return session.get("report_formats", [])
+
+    @app.route("/write")
+    def write():
+        session["report_formats"] = ["html", "json"]
+        return ""
+
+    client = app.test_client()
+    assert client.get("/read").json == []
+    assert store.count_sessions() == 0
+    response = client.get("/write")
+    assert store.count_sessions() == 1
+    assert "Expires" in response.headers["Set-Cookie"]
+    assert client.get("/read").json == ["html", "json"]
+
+
+@pytest.mark.artefact_store
+def test_janitor_enforces_retention_and_quota(tmp_path, monkeypatch):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    upload_folder = tmp_path / "uploads"
+    upload_folder.mkdir()
+    now = time.time()
+
+    def add_case(name, size, age_days):
+        folder = upload_folder / name
+        folder.mkdir()
+        (folder / "array.txt").write_bytes(b"x" * size)
+        os.utime(folder, (now - age_days * 86400,) * 2)
+
+    add_case("20230101-000000", 1000, 40)
+    add_case("20230301-000000", 300, 10)
+    add_case("20230302-000000", 300, 9)
+    add_case("job-running", 300, 8)
+    add_case("20230304-000000", 300, 0)
+    store.update_job("running", now + 60, status="running")
+    store.update_job("expired", now - 1, status="complete")
+    store.save_session("expired", "{}", now - 1)
+    cache_folder = tmp_path / "trio_cache"
+    cache_folder.mkdir()
+    (cache_folder / "expired.pkl").write_bytes(b"x" * 50)
+    os.utime(cache_folder / "expired.pkl", (now - 40 * 86400,) * 2)
+    (cache_folder / "recent.pkl").write_bytes(b"x" * 50)
+    monkeypatch.setattr(trio_cache, "trio_cache_folder", str(cache_folder))
+    # The blob store is not purged with the cases, even when its folder has not changed for the retention period
+    store_of_blobs = blob_store.BlobStore(str(upload_folder))
+    sha256 = store_of_blobs.add_stream(io.BytesIO(b"x" * 10))
+    os.utime(upload_folder / "blobs", (now - 40 * 86400,) * 2)
+
+    result = janitor.Janitor(
+        str(upload_folder), store, retention_days=30, quota_bytes=700
+    ).clean()
+    # The case past the retention period is removed, then the oldest cases until the folder is within its quota. The
+    # running job & the case uploaded in the grace period are kept even though the quota is still exceeded
+    assert sorted(os.listdir(upload_folder)) == [
+        "20230304-000000",
+        "blobs",
+        "job-running",
+    ]
+    assert result["reclaimed_bytes"] == {
+        "age": 1000,
+        "quota": 600,
+        "blobs": 0,
+        "trio_cache": 50,
+    }
+    # The stored file counts towards the quota & is kept in its grace period
+    assert os.path.exists(store_of_blobs.object_path(sha256))
+    assert result["upload_folder_bytes"] == 610
+    # Cached trio classifications are removed once they have not been used for the retention period
+    assert os.listdir(cache_folder) == ["recent.pkl"]
+    assert store.expired_jobs() == []
+    metrics = store.metrics()
+    assert metrics["janitor_reclaimed_bytes"] == 1650
+    assert metrics["janitor_expired_sessions"] == 1
+    assert metrics["upload_folder_bytes"] == 610
+
+    # Stored files shared by cases are charged to the case holding their last link, so the quota is met once both
+    # cases linking to the first file are removed rather than by removing every case
+    shared = [
+        store_of_blobs.add_stream(io.BytesIO(bytes([i]) * 1000)) for i in range(2)
+    ]
+    for i, name in enumerate(
+        ["20230401-000000", "20230402-000000", "20230403-000000", "20230404-000000"]
+    ):
+        folder = upload_folder / name
+        folder.mkdir()
+        store_of_blobs.link(shared[i // 2], str(folder / "array.txt"))
+        os.utime(folder, (now - (7 - i) * 86400,) * 2)
+    for sha256 in shared:
+        os.utime(store_of_blobs.object_path(sha256), (now - 2 * 86400,) * 2)
+    result = janitor.Janitor(
+        str(upload_folder), store, retention_days=30, quota_bytes=2000
+    ).clean()
+    assert sorted(os.listdir(upload_folder)) == [
+        "20230304-000000",
+        "20230403-000000",
+        "20230404-000000",
+        "blobs",
+        "job-running",
+    ]
+    assert result["reclaimed_bytes"]["blobs"] == 1000
+    assert not os.path.exists(store_of_blobs.object_path(shared[0]))
+    assert result["upload_folder_bytes"] == 1610
+
+
+@pytest.mark.blob_store
+def test_blob_store_stores_uploads_once_and_reuses_merges(tmp_path, monkeypatch):
+    store = blob_store.BlobStore(str(tmp_path))
+    array_text = b"Probeset ID\tChr\tPosition\tmale_partner\nAX-1\t1\t100\tAB\n"
+    case_folders = [tmp_path / "case1", tmp_path / "case2"]
+    for case_folder in case_folders:
+        case_folder.mkdir()
+        sha256 = store.add_stream(io.BytesIO(array_text))
+        store.link(sha256, str(case_folder / "array.txt"))
+    assert sha256 == hashlib.sha256(array_text).hexdigest()
+    # Both cases link to the one stored file
+    assert os.stat(store.object_path(sha256)).st_nlink == 3
+    assert os.listdir(os.path.join(store.folder, "tmp")) == []
+
+    merges = []
+
+    def merge(input_files):
+        merges.append(input_files)
+        return pd.DataFrame({"probeset_id": ["AX-1"]}).set_index("probeset_id")
+
+    monkeypatch.setattr(merge_array_files, "main", merge)
+    for case_folder in case_folders:
+        (case_folder / "other.txt").write_bytes(array_text + b"AX-2\t1\t200\tBB\n")
+        store.merge(
+            [str(case_folder / "array.txt"), str(case_folder / "other.txt")],
+            str(case_folder / "merged.txt"),
+        )
+    # The second case has the same files, so reuses the first case's merge
+    assert len(merges) == 1
+    assert (case_folders[1] / "merged.txt").read_text() == "probeset_id\nAX-1\n"
+
+    # Stored files are removed once no case links to them & merged files once they are past the retention period
+    for case_folder in case_folders:
+        shutil.rmtree(case_folder)
+    monkeypatch.setattr(blob_store, "blob_grace_seconds", -1)
+    assert store.collect_garbage(retention_days=30) == len(array_text)
+    assert os.path.exists(store.object_path(sha256)) is False
+    assert store.size() > 0
+    store.collect_garbage(retention_days=-1)
+    assert store.size() == 0
+
+
+@pytest.mark.blob_store
+@pytest.mark.skipif(pyarrow is None, reason="pyarrow cannot be imported")
+def test_read_array_file_caches_parsed_tables(tmp_path, monkeypatch):
+    array_text = (
+        "Probeset ID\tChr\tPosition\tmale_partner\nAX-1\t1\t100\tAB\nAX-2\t1\t200\tBB\n"
+    )
+    # The case's file is linked to a file stored by another process, so its hash is not yet known by this process
+    store = blob_store.BlobStore(str(tmp_path))
+    sha256 = store.add_stream(io.BytesIO(array_text.encode()))
+    monkeypatch.setattr(blob_store.BlobStore, "known_hashes", {})
+    (tmp_path / "case").mkdir()
+    array_path = store.link(sha256, str(tmp_path / "case" / "array.txt"))
+    parsed_folder = store.derived_folder("parsed")
+    monkeypatch.setattr(array_io, "parsed_array_cache_folder", parsed_folder)
+
+    def hash_file(path):
+        raise AssertionError("The stored SNP array file was hashed again")
+
+    monkeypatch.setattr(array_io, "file_sha256", hash_file)
+    df = array_io.read_array_file(array_path)
+    # The table is cached under the name of the stored file
+    assert os.listdir(parsed_folder) == [array_io.parsed_table_name(sha256)]
+
+    def parse(*args, **kwargs):
+        raise AssertionError("The cached SNP array file was parsed again")
+
+    monkeypatch.setattr(array_io.pd, "read_csv", parse)
+    tm.assert_frame_equal(array_io.read_array_file(array_path), df)
+    assert list(
+        array_io.read_array_file(array_path, columns=["Probeset ID", "Chr", "x"])
+    ) == ["Probeset ID", "Chr"]
+
+
+@pytest.mark.job_scheduler
+def test_cost_model_fits_recorded_runtimes():
+    def features(probes, embryos, formats):
+        return cost_model.CaseFeatures(
+            probes=probes,
+            embryos=embryos,
+            flank_mb=2.0,
+            mode_of_inheritance="autosomal_dominant",
+            formats=formats,
+        )
+
+    # Without recorded cases the prior is used, more embryos & reports take longer
+    prior = cost_model.CostModel()
+    assert (
+        prior.predict(features(800000, 0, ["json"])).seconds
+        < prior.predict(features(800000, 12, ["html", "pdf"])).seconds
+    )
+    assert prior.summary()["mean_absolute_error_seconds"] is None
+
+    # Runtimes of 2s + 40s per million probe embryos are learnt from the recorded cases
+    cases = [
+        (features(probes, embryos, ["json"]), 2 + 40 * probes * embryos / 1e6)
+        for probes in [500000, 800000, 1000000]
+        for embryos in [0, 2, 6, 12]
+    ] * 10
+    model = cost_model.CostModel(cases)
+    assert model.predict(features(900000, 8, ["json"])).seconds == pytest.approx(
+        2 + 40 * 0.9 * 8, rel=0.05
+    )
+    assert model.summary()["cases"] == 120
+
+    large_case = cost_model.CostPrediction(seconds=1, memory_bytes=10**15)
+    assert "memory" in cost_model.budget_errors(large_case)[0]
+    assert cost_model.budget_errors(cost_model.CostPrediction(1, 1)) == []
+
+
+@pytest.mark.job_scheduler
+def test_job_scheduler_runs_shortest_job_first_within_memory_budget():
+    scheduler = job_scheduler.JobScheduler(
+        max_workers=1, memory_budget_bytes=100, aging_factor=0
+    )
+    started = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def blocker():
+        started.set()
+        release.wait(5)
+
+    # The queue is filled while the first job is running
+    scheduler.submit(cost_model.CostPrediction(1, 1), blocker)
+    started.wait(5)
+    for name, seconds in [("long", 100), ("short", 1), ("medium", 10)]:
+        scheduler.submit(cost_model.CostPrediction(seconds, 1), order.append, name)
+    assert scheduler.queued_seconds() == 112
+    release.set()
+    scheduler.shutdown(wait=True)
+    assert order == ["short", "medium", "long"]
+
+    # With two workers, a job which does not fit in the memory left waits for the running job
+    scheduler = job_scheduler.JobScheduler(
+        max_workers=2, memory_budget_bytes=100, aging_factor=0
+    )
+    started.clear()
+    release.clear()
+    order.clear()
+    scheduler.submit(cost_model.CostPrediction(1, 60), blocker)
+    started.wait(5)
+    scheduler.submit(cost_model.CostPrediction(1, 60), order.append, "large")
+    scheduler.submit(cost_model.CostPrediction(5, 30), order.append, "small")
+    time.sleep(0.2)
+    # The small job runs alongside the running job although it is expected to take longer than the large job
+    assert order == ["small"]
+    release.set()
+    scheduler.shutdown(wait=True)
+    assert order == ["small", "large"]
+
+    # Waiting jobs age, so a long job queued long enough runs before a new short job
+    old_job = job_scheduler.QueuedJob(cost_model.CostPrediction(100, 1), None, ())
+    old_job.queued -= 200
+    new_job = job_scheduler.QueuedJob(cost_model.CostPrediction(1, 1), None, ())
+    now = time.monotonic()
+    assert old_job.priority(now, 1.0) < new_job.priority(now, 1.0)
+
+
+@pytest.mark.job_scheduler
+def test_job_manager_rejects_cases_over_budget(
+    setup_api_parameters, tmp_path, monkeypatch
+):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    jobs = job_manager.JobManager(str(tmp_path), store)
+    array_path = tmp_path / "array.txt"
+    array_path.write_text(
+        "Probeset ID\tChr\n" + "".join(f"AX-{i}\t1\n" for i in range(1000))
+    )
+    args = job_manager.parameters_to_args(setup_api_parameters, str(array_path))
+    args.formats = ["json"]
+    features, prediction = jobs.admit(args, [str(array_path)])
+    assert features.probes == 1000
+    assert features.embryos == len(args.embryo_ids)
+
+    monkeypatch.setattr(cost_model, "job_time_budget_seconds", 0)
+    with pytest.raises(CaseBudgetError) as error:
+        jobs.admit(args, [str(array_path)])
+    assert error.value.prediction == prediction.to_dict()
+    jobs.scheduler.shutdown()
+
+
+@pytest.mark.progress
+def test_progress_is_recorded_and_streamed(tmp_path, monkeypatch):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    # Progress is only reported inside a progress context
+    progress.report("imported", "Parsed 10 probes")
+    with progress.progress_context(progress.store_reporter(store, "case1")):
+        progress.report("imported", "Parsed 10 probes", probes=10)
+        assert list(
+            progress.counted(
+                ["E1", "E2"], "plotting", "Plotted embryo {done} of {total}", 2
+            )
+        ) == ["E1", "E2"]
+    events = [event for event_id, event in store.progress_events("case1")]
+    assert [event["message"] for event in events] == [
+        "Parsed 10 probes",
+        "Plotted embryo 1 of 2",
+        "Plotted embryo 2 of 2",
+    ]
+    assert events[2]["done"] == 2 and events[2]["total"] == 2
+    assert progress.is_running(store, "case1")
+    assert not progress.is_running(store, "case2")
+
+    # A stream which is not finished is closed after progress_stream_seconds, the browser resumes from the last event
+    monkeypatch.setattr(progress, "progress_stream_seconds", 0)
+    stream = list(progress.event_stream(store, "case1", last_event_id=1))
+    assert stream[0] == "retry: 1000\n\n"
+    assert [message.split("\n")[0] for message in stream[1:]] == ["id: 2", "id: 3"]
+    assert json.loads(stream[-1].split("data: ")[1])["stage"] == "plotting"
+
+    progress.store_reporter(store, "case1")({"stage": "complete", "message": "Done"})
+    assert list(progress.event_stream(store, "case1", 3))[-1].startswith("id: 4\n")
+    assert progress.is_finished(store, "case1") and not progress.is_running(
+        store, "case1"
+    )
+    assert not progress.is_finished(store, "case1", last_event_id=3)
+
+
+@pytest.mark.progress
+def test_cases_of_stopped_workers_are_failed(tmp_path):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    stopped_process = subprocess.Popen([sys.executable, "-c", ""])
+    stopped_process.wait()
+    stopped_owner = f"{socket.gethostname()}:{stopped_process.pid}:1"
+    expires = time.time() + 60
+    # A running API job & a queued form case of a stopped worker, a complete job with a report queued by the
+    # stopped worker, a running job of this worker & a job of a worker on another host which renews its heartbeat
+    store.update_job("running_job", expires, status="running", reports={})
+    store.update_job(
+        "complete_job", expires, status="complete", reports={"pdf": "queued"}
+    )
+    store.update_job("live_job", expires, status="running", reports={})
+    store.update_job("remote_job", expires, status="running", reports={})
+    for case_id in ["running_job", "form_case", "live_job", "remote_job"]:
+        progress.store_reporter(store, case_id)({"stage": "queued", "message": ""})
+    progress.store_reporter(store, "complete_job")({"stage": "complete", "message": ""})
+    for case_id in ["running_job", "form_case", "complete_job"]:
+        store.set_case_owner(case_id, stopped_owner)
+    progress.claim_case(store, "live_job")
+    remote_owner = "another-host:1:1"
+    store.set_case_owner("remote_job", remote_owner)
+    store.acquire_lease(f"worker:{remote_owner}", remote_owner, 60)
+    assert not progress.is_running(store, "form_case")
+
+    assert sorted(job_manager.fail_orphaned_cases(store)) == [
+        "form_case",
+        "running_job",
+    ]
+    running_job = store.load_job("running_job")
+    assert running_job["status"] == "failed" and "stopped" in running_job["error"]
+    assert progress.is_finished(store, "form_case")
+    assert store.load_job("complete_job")["reports"] == {"pdf": "failed"}
+    assert store.load_job("live_job")["status"] == "running"
+    assert sorted(store.case_owners()) == ["live_job", "remote_job"]
+    # The worker on the other host is stopped once its heartbeat expires
+    store.acquire_lease(f"worker:{remote_owner}", remote_owner, -1)
+    assert job_manager.fail_orphaned_cases(store) == ["remote_job"]
+    assert store.delete_expired_leases() == 1
+
+
+@pytest.mark.progress
+def test_job_manager_records_progress_of_failed_case(setup_api_parameters, tmp_path):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    jobs = job_manager.JobManager(str(tmp_path), store)
+    case_id, case_folder = jobs.create_job()
+    args = job_manager.parameters_to_args(
+        setup_api_parameters, os.path.join(case_folder, "array.txt")
+    )
+    args.formats = []
+    jobs.submit(case_id, args)
+    jobs.scheduler.shutdown(wait=True)
+    stages = [event["stage"] for event_id, event in store.progress_events(case_id)]
+    assert stages == ["queued", "running", "failed"]
+
+
+@pytest.mark.profiling
+@pytest.mark.skipif(pyarrow is None, reason="pyarrow cannot be imported")
+def test_profiled_case_saves_profile_in_bundle(setup_basher_case, tmp_path):
+    args, window_df = setup_basher_case
+    args.input_file = str(tmp_path / "array.txt")
+    window_df.to_csv(args.input_file, sep="\t", index=False)
+    args.profile = True
+    args.result_bundle = False
+    case = BasherCase(args)
+    # A profiled case is always saved with a result bundle
+    assert case.result_bundle
+    case.window_df = window_df
+    case.timed_stage("results_df")
+    case.timed_stage("embryo_category_df")
+    case.profiler.stop()
+
+    bundle_path = str(tmp_path / "test_case_bundle")
+    manifest = result_bundle.write_result_bundle(case, bundle_path, case.stage_seconds)
+    assert sorted(manifest["profile"]) == [
+        "collapsed_stacks.txt",
+        "flamegraph.svg",
+        "stages.json",
+        "top_functions.txt",
+    ]
+    with open(os.path.join(bundle_path, "profile", "stages.json")) as f:
+        stages = json.load(f)
+    assert list(stages) == ["results_df", "embryo_category_df"]
+    assert any(
+        "categorise_embryo_alleles" in function["function"]
+        for function in stages["embryo_category_df"]["functions"]
+    )
+    assert stages["results_df"]["peak_traced_bytes"] > 0
+    assert (
+        "embryo_category_df\n"
+        in open(os.path.join(bundle_path, "profile", "top_functions.txt")).read()
+    )
+    assert (
+        open(os.path.join(bundle_path, "profile", "flamegraph.svg"))
+        .read()
+        .startswith("<svg")
+    )
+
+
+@pytest.mark.profiling
+def test_profiler_collapses_sampled_stacks():
+    profiler = profiling.CaseProfiler()
+
+    def busy():
+        start = time.perf_counter()
+        while time.perf_counter() - start < 0.1:
+            pass
+
+    with profiler.stage("busy_stage"):
+        # Nested stages are part of the outer stage's profile
+        with profiler.stage("inner_stage"):
+            busy()
+    profiler.stop()
+    assert list(profiler.stages) == ["busy_stage"]
+    lines = profiler.collapsed_stacks().splitlines()
+    assert lines and all(line.startswith("busy_stage;") for line in lines)
+    assert any("busy (test_functions.py" in line for line in lines)
+    assert "<title>busy_stage" in profiler.flamegraph()
+
+
+@pytest.mark.profiling
+def test_only_admins_can_profile_cases(setup_api_parameters, tmp_path, monkeypatch):
+    # Profiling is requested alongside the parameters, not as one of them
+    with pytest.raises(CaseParameterError):
+        job_manager.parameters_to_args(
+            setup_api_parameters | {"profile": True}, str(tmp_path / "array.txt")
+        )
+    monkeypatch.setattr(job_manager, "admin_token", None)
+    assert not job_manager.is_admin(None) and not job_manager.is_admin("")
+    monkeypatch.setattr(job_manager, "admin_token", "secret")
+    assert job_manager.is_admin("secret")
+    assert not job_manager.is_admin("wrong") and not job_manager.is_admin(None)
+
+
+@pytest.mark.memory_limit
+def test_low_memory_mode_imports_only_analysed_region(
+    setup_random_trio, setup_basher_case, tmp_path
+):
+    args, window_df = setup_basher_case
+    array_df = pd.DataFrame(data=setup_random_trio)
+    array_df["embryo_1"] = "AB"
+    args.input_file = str(tmp_path / "array.txt")
+    array_df.to_csv(args.input_file, sep="\t", index=False)
+    # The chunks of a file are indexed by the position of their probes in the file
+    chunks = list(array_io.iter_array_file(args.input_file, chunk_probes=1000))
+    assert len(chunks) == 5
+    tm.assert_frame_equal(pd.concat(chunks), array_io.read_array_file(args.input_file))
+
+    case = BasherCase(args)
+    low_memory_case = BasherCase(Namespace(**vars(args) | {"low_memory": True}))
+    tm.assert_frame_equal(
+        low_memory_case.imported_df,
+        filter_dataframe(case.imported_df, args.gene_start, args.gene_end, "2mb"),
+    )
+    # The SNPs outside the analysed region are counted but not kept
+    assert low_memory_case.number_snps_imported == case.number_snps_imported == 5000
+
+    # The HTML report has the static plots
+    low_memory_case.formats = ["html", "pdf"]
+    low_memory_case.window_df = window_df
+    plots_as_html, plots_as_pdf = low_memory_case.plots
+    assert plots_as_html == plots_as_pdf and plots_as_html[0].startswith("<svg")
+    assert low_memory_case.overview_plots[0].startswith("<svg")
+    low_memory_case.timed_stage("embryo_category_df")
+    assert low_memory_case.stage_peak_memory_bytes["embryo_category_df"] > 0
+
+
+@pytest.mark.memory_limit
+def test_run_in_process_applies_memory_ceiling():
+    assert memory_limit.run_in_process(sum, [1, 2]) == 3
+    with pytest.raises(CaseProcessError) as error:
+        memory_limit.run_in_process(int, "x")
+    assert error.value.error_type == "ValueError"
+    with pytest.raises(CaseMemoryError, match="memory ceiling of 0.2GB"):
+        memory_limit.run_in_process(
+            bytearray, 512 * 1024 * 1024, ceiling_bytes=256 * 1024 * 1024
+        )
+    # A process killed by SIGKILL, as by the kernel when out of memory, is rerun in low memory mode, a process which
+    # stops for any other reason is failed
+    with pytest.raises(CaseMemoryError, match="killed"):
+        memory_limit.run_in_process(signal.raise_signal, signal.SIGKILL)
+    with pytest.raises(CaseProcessError, match="exit code 3"):
+        memory_limit.run_in_process(os._exit, 3)
+    # The case's process is forked with the reference data already loaded, but with its own memory ceiling
+    assert memory_limit.run_in_process(
+        eval, "__import__('warmup').warmup_status['reference_data']"
+    )
+    assert (
+        memory_limit.run_in_process(
+            eval,
+            "__import__('resource').getrlimit(__import__('resource').RLIMIT_DATA)[0]",
+            ceiling_bytes=2 * 1024**3,
+        )
+        == 2 * 1024**3
+    )
+
+
+@pytest.mark.memory_limit
+@pytest.mark.skipif(
+    memory_limit.resident_memory_bytes() is None,
+    reason="The resident memory cannot be sampled on this platform",
+)
+def test_stage_peak_memory_is_measured_per_stage():
+    with memory_limit.stage_peak_memory() as large_stage:
+        data = b"x" * 256 * 1024 * 1024
+        del data
+    with memory_limit.stage_peak_memory() as small_stage:
+        pass
+    # A stage after the one which needed the most memory records its own peak, not the peak of the process so far
+    assert large_stage["peak_bytes"] >= 256 * 1024 * 1024
+    assert small_stage["peak_bytes"] < large_stage["peak_bytes"] - 128 * 1024 * 1024
+
+
+@pytest.mark.memory_limit
+def test_job_manager_reruns_case_in_low_memory_mode(
+    setup_api_parameters, tmp_path, monkeypatch
+):
+    store = artefact_store.ArtefactStore(str(tmp_path / "store.sqlite3"))
+    jobs = job_manager.JobManager(str(tmp_path), store)
+    args = job_manager.parameters_to_args(
+        setup_api_parameters, str(tmp_path / "array.txt")
+    )
+    runs = []
+
+    def run_in_process(function, case_id, case_args, *process_args, ceiling_bytes):
+        runs.append(case_args.low_memory)
+        if not case_args.low_memory or len(runs) > 2:
+            raise CaseMemoryError("The case needed more than the memory ceiling.")
+        return {"output_paths": {}, "low_memory": case_args.low_memory}
+
+    monkeypatch.setattr(memory_limit, "run_in_process", run_in_process)
+    with progress.progress_context(progress.store_reporter(store, "case1")):
+        assert jobs.run_case_process("case1", args, str(tmp_path / "case"))[
+            "low_memory"
+        ]
+    assert runs == [False, True] and not args.low_memory
+    assert store.metrics()["low_memory_reruns"] == 1
+    assert [event["stage"] for event_id, event in store.progress_events("case1")] == [
+        "low_memory"
+    ]
+
+    # The case only fails if it also runs out of memory in low memory mode
+    with pytest.raises(CaseMemoryError, match="Even in low memory mode"):
+        jobs.run_case_process("case1", args, str(tmp_path / "case"))
+    assert runs == [False, True, False, True]
+    jobs.scheduler.shutdown()
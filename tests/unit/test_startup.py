@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Time allowed for importing snp_haplotype once pandas has been imported, generous to allow for slow test machines
+import_time_budget = 1.0
+
+# Libraries which should only be imported when a report is produced
+report_modules = ["plotly", "kaleido", "pdfkit", "jinja2"]
+
+snp_haplotyper_path = os.path.join(
+    os.path.dirname(__file__), os.pardir, os.pardir, "snp_haplotyper"
+)
+
+
+def imported_modules(statement):
+    """Run a statement in a fresh python process and return the time it took and the modules it imported"""
+    code = (
+        "import json, sys, time\n"
+        "import pandas\n"
+        "start = time.perf_counter()\n"
+        f"{statement}\n"
+        "duration = time.perf_counter() - start\n"
+        "print(json.dumps({'duration': duration, 'modules': list(sys.modules)}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=snp_haplotyper_path,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+@pytest.mark.startup
+def test_snp_haplotype_import_is_lazy():
+    result = imported_modules("import snp_haplotype")
+    for module in report_modules:
+        assert module not in result["modules"]
+    assert result["duration"] < import_time_budget
+
+
+@pytest.mark.startup
+def test_snp_haplotype_parser_is_lazy():
+    result = imported_modules(
+        "import snp_haplotype\n"
+        "assert 'parser' not in vars(snp_haplotype)\n"
+        "snp_haplotype.parser.parse_args(['--header_info', 'PRU=1'])"
+    )
+    for module in report_modules:
+        assert module not in result["modules"]
+
+
+@pytest.mark.startup
+def test_excel_parser_and_cli_do_not_import_snp_haplotype():
+    result = imported_modules("import excel_parser, cli")
+    assert "snp_haplotype" not in result["modules"]
+    for module in report_modules:
+        assert module not in result["modules"]